@@ -142,6 +142,9 @@ class CertificationCommand(CliCommand):
         parser.add_argument(
             '--not-interactive', action='store_true',
             help="Skip tests that require interactivity")
+        parser.add_argument(
+            '-j', '--jobs', type=int, default=1, metavar='N',
+            help="Run up to N automated jobs at the same time")
         group = parser.add_argument_group("certification-specific options")
         # Set defaults from based on values from the config file
         group.set_defaults(c3_url=self.config.c3_url)
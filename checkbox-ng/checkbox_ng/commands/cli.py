@@ -50,12 +50,15 @@ from plainbox.impl.result import DiskJobResult, MemoryJobResult
 from plainbox.impl.runner import JobRunner
 from plainbox.impl.runner import authenticate_warmup
 from plainbox.impl.runner import slugify
+from plainbox.impl.scheduler import ParallelJobScheduler
+from plainbox.impl.scheduler import ResourceJobScheduler
 from plainbox.impl.secure.config import Unset
 from plainbox.impl.secure.qualifiers import CompositeQualifier
 from plainbox.impl.secure.qualifiers import NonLocalJobQualifier
 from plainbox.impl.secure.qualifiers import WhiteList
 from plainbox.impl.secure.qualifiers import select_jobs
 from plainbox.impl.session import SessionManager, SessionStorageRepository
+from plainbox.impl.session.codec import get_codec
 from plainbox.vendor.textland import DrawingContext
 from plainbox.vendor.textland import EVENT_KEYBOARD
 from plainbox.vendor.textland import EVENT_RESIZE
@@ -530,6 +533,14 @@ class CliInvocation(CheckBoxInvocationMixIn):
                     get_whitelist_by_name(
                         self.provider_list,
                         self.settings['default_whitelist']))
+        # Checkpoints can be coalesced, journaled and saved in the background
+        # if the configuration asks for it. Checkpoints taken just before
+        # running a job are always saved synchronously.
+        manager.set_checkpoint_policy(
+            coalesce_interval=self.config.checkpoint_coalesce_interval,
+            background=self.config.checkpoint_background,
+            journal=self.config.checkpoint_journal,
+            codec=get_codec(self.config.checkpoint_codec))
         manager.checkpoint()
 
         if self.is_interactive and not resume_in_progress:
@@ -641,7 +652,11 @@ class CliInvocation(CheckBoxInvocationMixIn):
             manager.storage.location, self.provider_list,
             os.path.join(manager.storage.location, 'io-logs'),
             command_io_delegate=self)
-        self._run_jobs_with_session(ns, manager, runner)
+        try:
+            self._run_jobs_with_session(ns, manager, runner)
+        finally:
+            runner.close()
+        manager.flush()
         if not self._local_only:
             self.save_results(manager)
 
@@ -744,7 +759,6 @@ class CliInvocation(CheckBoxInvocationMixIn):
             print("Problematic jobs will not be considered")
 
     def _run_jobs_with_session(self, ns, manager, runner):
-        # TODO: run all resource jobs concurrently with multiprocessing
         # TODO: make local job discovery nicer, it would be best if
         # desired_jobs could be managed entirely internally by SesionState. In
         # such case the list of jobs to run would be changed during iteration
@@ -756,6 +770,18 @@ class CliInvocation(CheckBoxInvocationMixIn):
         again = True
         while again:
             again = False
+            if ns.jobs > 1:
+                again = self._run_parallel_jobs_with_session(
+                    ns, manager, runner)
+                continue
+            # Run all the resource jobs that can be started right away
+            # concurrently (if enabled), anything left is handled by the loop
+            # below
+            if self.config.resource_jobs > 1:
+                scheduler = ResourceJobScheduler(
+                    manager.state, runner, self.config,
+                    self.config.resource_jobs)
+                scheduler.run(checkpoint_callback=manager.checkpoint)
             for job in manager.state.run_list:
                 # Skip jobs that already have result, this is only needed when
                 # we run over the list of jobs again, after discovering new
@@ -778,6 +804,34 @@ class CliInvocation(CheckBoxInvocationMixIn):
                     again = True
                     break
 
+    def _run_parallel_jobs_with_session(self, ns, manager, runner):
+        def serial_callback(job):
+            self._run_single_job_with_session(ns, manager, runner, job)
+            manager.checkpoint()
+            if job.plugin == "local":
+                # After each local job runs rebuild the list of matching
+                # jobs and run everything again
+                desired_job_list = select_jobs(manager.state.job_list,
+                                               self.whitelists)
+                if self._local_only:
+                    desired_job_list = [
+                        job for job in desired_job_list
+                        if job.plugin == 'local']
+                self._update_desired_job_list(manager, desired_job_list)
+                return True
+            return False
+
+        def result_callback(job, job_result):
+            if job.plugin not in ['local', 'resource']:
+                print("[ {} ]".format(job.tr_summary()).center(80, '-'))
+                print("Outcome: {}".format(job_result.outcome))
+                if job_result.comments is not None:
+                    print("Comments: {}".format(job_result.comments))
+        scheduler = ParallelJobScheduler(
+            manager.state, runner, self.config, ns.jobs)
+        return scheduler.run(
+            serial_callback, result_callback, manager.checkpoint)
+
     def _run_single_job_with_session(self, ns, manager, runner, job):
         if job.plugin not in ['local', 'resource']:
             print("[ {} ]".format(job.tr_summary()).center(80, '-'))
@@ -799,8 +853,10 @@ class CliInvocation(CheckBoxInvocationMixIn):
                     print()
                 print("Running... (output in {}.*)".format(
                     join(manager.storage.location, slugify(job.id))))
+            # The job may crash or reboot the machine, the checkpoint must be
+            # on disk before it starts
             manager.state.metadata.running_job_name = job.id
-            manager.checkpoint()
+            manager.checkpoint(sync=True)
             # TODO: get a confirmation from the user for certain types of
             # job.plugin
             job_result = runner.run_job(job, self.config)
@@ -854,5 +910,8 @@ class CliCommand(PlainBoxCommand, CheckBoxCommandMixIn):
         parser.add_argument(
             '--not-interactive', action='store_true',
             help="Skip tests that require interactivity")
+        parser.add_argument(
+            '-j', '--jobs', type=int, default=1, metavar='N',
+            help="Run up to N automated jobs at the same time")
         # Call enhance_parser from CheckBoxCommandMixIn
         self.enhance_parser(parser)
@@ -99,7 +99,10 @@ class _SRUInvocation(CheckBoxInvocationMixIn):
                 self.session.session_dir, self.provider_list,
                 self.session.jobs_io_log_dir, command_io_delegate=self,
                 dry_run=self.ns.dry_run)
-            self._run_all_jobs()
+            try:
+                self._run_all_jobs()
+            finally:
+                self.runner.close()
             if self.config.fallback_file is not Unset:
                 self._save_results()
             self._submit_results()
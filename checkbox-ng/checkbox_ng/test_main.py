@@ -118,7 +118,7 @@ class TestCertServer(TestCase):
         self.maxDiff = None
         expected = """
         usage: checkbox certification-server [-h] [--check-config] [--not-interactive]
-                                             [--secure-id SECURE-ID]
+                                             [-j N] [--secure-id SECURE-ID]
                                              [--destination URL] [--staging]
                                              [-i PATTERN] [-x PATTERN] [-w WHITELIST]
 
@@ -126,6 +126,7 @@ class TestCertServer(TestCase):
           -h, --help            show this help message and exit
           --check-config        Run check-config
           --not-interactive     Skip tests that require interactivity
+          -j N, --jobs N        Run up to N automated jobs at the same time
 
         certification-specific options:
           --secure-id SECURE-ID
@@ -222,10 +222,13 @@ class IJobResult(metaclass=ABCMeta):
         """
 
     @abstractmethod
-    def get_io_log(self):
+    def get_io_log(self, stream_name=None):
         """
         Compute and return the sequence of IOLogRecord objects.
 
+        :param stream_name:
+            If not None, only records from this stream ('stdout' or 'stderr')
+            are returned. The delay of the remaining records is not adjusted.
         :returns:
             A sequence of tuples (delay, stream-name, data) where delay is the
             delay since the previous message seconds (typically a fractional
@@ -112,6 +112,77 @@ class PlainBoxConfig(config.Config):
         validator_list=[config.ChoiceValidator(['all', 'stub'])],
         default="all")
 
+    checkpoint_codec = config.Variable(
+        section="common",
+        help_text=_("Encoding of session checkpoints (gzip, gzip:LEVEL,"
+                    " json or binary)"),
+        validator_list=[
+            config.PatternValidator(r"^(gzip(:[0-9])?|json|binary)$")],
+        default="gzip")
+
+    checkpoint_coalesce_interval = config.Variable(
+        section="common",
+        kind=float,
+        help_text=_("Minimum number of seconds between two session"
+                    " checkpoints (0 saves every checkpoint)"),
+        default=0.0)
+
+    checkpoint_background = config.Variable(
+        section="common",
+        kind=bool,
+        help_text=_("Save session checkpoints on a background thread"),
+        default=False)
+
+    checkpoint_journal = config.Variable(
+        section="common",
+        kind=bool,
+        help_text=_("Save session checkpoints as a snapshot followed by a"
+                    " journal of changes"),
+        default=False)
+
+    job_loader_processes = config.Variable(
+        section="common",
+        kind=int,
+        help_text=_("Number of processes used to load job definitions"
+                    " (1 loads them sequentially)"),
+        default=1)
+
+    resource_jobs = config.Variable(
+        section="common",
+        kind=int,
+        help_text=_("Number of resource jobs run at the same time before"
+                    " other jobs (1 runs them one at a time, in order)"),
+        default=1)
+
+    job_output_limit = config.Variable(
+        section="common",
+        kind=int,
+        help_text=_("Maximum number of bytes of output kept for each job"
+                    " (0 keeps everything)"),
+        default=0)
+
+    session_output_limit = config.Variable(
+        section="common",
+        kind=int,
+        help_text=_("Maximum number of bytes of output kept for all jobs"
+                    " (0 keeps everything)"),
+        default=0)
+
+    trusted_launcher_session = config.Variable(
+        section="common",
+        kind=bool,
+        help_text=_("Run all jobs that need root privileges through one"
+                    " instance of plainbox-trusted-launcher-1"),
+        default=False)
+
+    output_truncation = config.Variable(
+        section="common",
+        help_text=_("Part of the output kept when it exceeds the limit"
+                    " (head, tail or head-tail)"),
+        validator_list=[
+            config.ChoiceValidator(['head', 'tail', 'head-tail'])],
+        default="head-tail")
+
     class Meta:
 
         # TODO: properly depend on xdg and use real code that also handles
@@ -26,6 +26,7 @@
     THIS MODULE DOES NOT HAVE STABLE PUBLIC API
 """
 
+from concurrent.futures import ProcessPoolExecutor
 import abc
 import logging
 
@@ -134,8 +135,27 @@ class PlainBoxToolBase(ToolBase):
         # Load all normal providers
         all_providers.load()
         provider_list.extend(all_providers.get_all_plugin_objects())
+        processes = self._config.job_loader_processes
+        if processes > 1:
+            self._load_jobs_concurrently(provider_list, processes)
         return provider_list
 
+    def _load_jobs_concurrently(self, provider_list, processes):
+        """
+        Load job definitions of all providers using a pool of processes
+
+        Files from all of the providers are parsed concurrently. Results are
+        collected in the same order as if each provider loaded them on its
+        own so the list of jobs (and problems) of each provider is the same.
+        """
+        logger.debug(
+            _("Loading job definitions using %d processes"), processes)
+        with ProcessPoolExecutor(processes) as executor:
+            for provider in provider_list:
+                provider.prefetch_jobs(executor)
+            for provider in provider_list:
+                provider.load_all_jobs()
+
     def _load_stub_provider_only(self):
         return [Provider1.from_definition(get_stubbox_def(), secure=False)]
 
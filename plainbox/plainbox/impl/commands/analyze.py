@@ -93,6 +93,7 @@ class AnalyzeInvocation(CheckBoxInvocationMixIn):
     def _run_local_jobs(self):
         print(_("[Running Local Jobs]").center(80, '='))
         manager = SessionManager.create_with_state(self.session)
+        runner = None
         try:
             manager.state.metadata.title = "plainbox dev analyze session"
             manager.state.metadata.flags = [SessionMetaData.FLAG_INCOMPLETE]
@@ -113,6 +114,8 @@ class AnalyzeInvocation(CheckBoxInvocationMixIn):
             manager.state.metadata.flags = []
             manager.checkpoint()
         finally:
+            if runner is not None:
+                runner.close()
             manager.destroy()
 
     def _run_local_job(self, manager, runner, job):
@@ -47,6 +47,8 @@ from plainbox.impl.result import DiskJobResult, MemoryJobResult
 from plainbox.impl.runner import JobRunner
 from plainbox.impl.runner import authenticate_warmup
 from plainbox.impl.runner import slugify
+from plainbox.impl.scheduler import ParallelJobScheduler
+from plainbox.impl.scheduler import ResourceJobScheduler
 from plainbox.impl.session import SessionStateLegacyAPI as SessionState
 from plainbox.impl.transport import get_all_transports
 
@@ -200,7 +202,10 @@ class RunInvocation(CheckBoxInvocationMixIn):
             runner = JobRunner(
                 session.session_dir, self.provider_list,
                 session.jobs_io_log_dir, dry_run=ns.dry_run)
-            self._run_jobs_with_session(ns, session, runner)
+            try:
+                self._run_jobs_with_session(ns, session, runner)
+            finally:
+                runner.close()
             # Get a stream with exported session data.
             exported_stream = io.BytesIO()
             data_subset = exporter.get_session_data_subset(session)
@@ -306,7 +311,6 @@ class RunInvocation(CheckBoxInvocationMixIn):
                 "Estimated duration cannot be determined for manual jobs."))
 
     def _run_jobs_with_session(self, ns, session, runner):
-        # TODO: run all resource jobs concurrently with multiprocessing
         # TODO: make local job discovery nicer, it would be best if
         # desired_jobs could be managed entirely internally by SesionState. In
         # such case the list of jobs to run would be changed during iteration
@@ -315,6 +319,14 @@ class RunInvocation(CheckBoxInvocationMixIn):
         again = True
         while again:
             again = False
+            if ns.jobs > 1:
+                again = self._run_parallel_jobs_with_session(
+                    ns, session, runner)
+                continue
+            # Run all the resource jobs that can be started right away
+            # concurrently (if enabled), anything left is handled by the loop
+            # below
+            self._run_resource_jobs_with_session(session, runner)
             for job in session.run_list:
                 # Skip jobs that already have result, this is only needed when
                 # we run over the list of jobs again, after discovering new
@@ -333,6 +345,39 @@ class RunInvocation(CheckBoxInvocationMixIn):
                     again = True
                     break
 
+    def _run_parallel_jobs_with_session(self, ns, session, runner):
+        def serial_callback(job):
+            self._run_single_job_with_session(ns, session, runner, job)
+            session.persistent_save()
+            if job.plugin == "local":
+                # After each local job runs rebuild the list of matching
+                # jobs and run everything again
+                new_matching_job_list = self._get_matching_job_list(
+                    ns, session.job_list)
+                self._update_desired_job_list(session, new_matching_job_list)
+                return True
+            return False
+
+        def result_callback(job, job_result):
+            print("[ {} ]".format(job.id).center(80, '-'))
+            print(_("Outcome: {}").format(job_result.outcome))
+            if job_result.comments is not None:
+                print(_("Comments: {}").format(job_result.comments))
+        scheduler = ParallelJobScheduler(session, runner, self.config, ns.jobs)
+        return scheduler.run(
+            serial_callback, result_callback, session.persistent_save)
+
+    def _run_resource_jobs_with_session(self, session, runner):
+        if self.config.resource_jobs <= 1:
+            return
+
+        def result_callback(job, job_result):
+            print("[ {} ]".format(job.id).center(80, '-'))
+            print(_("Outcome: {}").format(job_result.outcome))
+        scheduler = ResourceJobScheduler(
+            session, runner, self.config, self.config.resource_jobs)
+        scheduler.run(result_callback, session.persistent_save)
+
     def _run_single_job_with_session(self, ns, session, runner, job):
         print("[ {} ]".format(job.id).center(80, '-'))
         if job.description is not None:
@@ -393,6 +438,9 @@ class RunCommand(PlainBoxCommand, CheckBoxCommandMixIn):
         group.add_argument(
             '-n', '--dry-run', action='store_true',
             help=_("don't really run most jobs"))
+        group.add_argument(
+            '-j', '--jobs', type=int, default=1, metavar=_('N'),
+            help=_("run up to N automated jobs at the same time"))
         group = parser.add_argument_group(_("output options"))
         assert 'text' in get_all_exporters()
         group.add_argument(
@@ -68,8 +68,11 @@ class ScriptInvocation(CheckBoxInvocationMixIn):
             bait_dir = os.path.join(scratch, 'files-created-in-current-dir')
             os.mkdir(bait_dir)
             with TestCwd(bait_dir):
-                return_code, record_path = runner._run_command(
-                    job, self.config)
+                try:
+                    return_code, record_path = runner._run_command(
+                        job, self.config)
+                finally:
+                    runner.close()
             self._display_side_effects(scratch)
             self._display_script_outcome(job, return_code)
         return return_code
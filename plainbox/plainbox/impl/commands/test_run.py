@@ -34,12 +34,13 @@ from inspect import cleandoc
 from unittest import TestCase
 
 from plainbox.impl.box import main
+from plainbox.impl.commands.run import RunInvocation
 from plainbox.impl.exporter.json import JSONSessionStateExporter
 from plainbox.impl.exporter.rfc822 import RFC822SessionStateExporter
 from plainbox.impl.exporter.text import TextSessionStateExporter
 from plainbox.impl.exporter.xml import XMLSessionStateExporter
 from plainbox.testing_utils.io import TestIO
-from plainbox.vendor.mock import patch, Mock
+from plainbox.vendor.mock import ANY, patch, Mock
 
 
 class TestRun(TestCase):
@@ -66,10 +67,10 @@ class TestRun(TestCase):
             self.assertEqual(call.exception.args, (0,))
         self.maxDiff = None
         expected = """
-        usage: plainbox run [-h] [--not-interactive] [-n] [-f FORMAT] [-p OPTIONS]
-                            [-o FILE] [-t TRANSPORT] [--transport-where WHERE]
-                            [--transport-options OPTIONS] [-i PATTERN] [-x PATTERN]
-                            [-w WHITELIST]
+        usage: plainbox run [-h] [--not-interactive] [-n] [-j N] [-f FORMAT]
+                            [-p OPTIONS] [-o FILE] [-t TRANSPORT]
+                            [--transport-where WHERE] [--transport-options OPTIONS]
+                            [-i PATTERN] [-x PATTERN] [-w WHITELIST]
 
         optional arguments:
           -h, --help            show this help message and exit
@@ -77,6 +78,7 @@ class TestRun(TestCase):
         user interface options:
           --not-interactive     skip tests that require interactivity
           -n, --dry-run         don't really run most jobs
+          -j N, --jobs N        run up to N automated jobs at the same time
 
         output options:
           -f FORMAT, --output-format FORMAT
@@ -165,3 +167,29 @@ class TestRun(TestCase):
     def tearDown(self):
         shutil.rmtree(self._sandbox)
         os.environ = self._env
+
+
+class RunInvocationTests(TestCase):
+
+    def setUp(self):
+        self.config = Mock(name='config')
+        self.session = Mock(name='session')
+        self.runner = Mock(name='runner')
+        self.invocation = RunInvocation([], self.config, Mock(name='ns'))
+
+    @patch('plainbox.impl.commands.run.ResourceJobScheduler')
+    def test_resource_jobs_run_serially_by_default(self, mock_scheduler):
+        self.config.resource_jobs = 1
+        self.invocation._run_resource_jobs_with_session(
+            self.session, self.runner)
+        self.assertEqual(mock_scheduler.call_count, 0)
+
+    @patch('plainbox.impl.commands.run.ResourceJobScheduler')
+    def test_resource_jobs_run_concurrently(self, mock_scheduler):
+        self.config.resource_jobs = 4
+        self.invocation._run_resource_jobs_with_session(
+            self.session, self.runner)
+        mock_scheduler.assert_called_once_with(
+            self.session, self.runner, self.config, 4)
+        mock_scheduler().run.assert_called_once_with(
+            ANY, self.session.persistent_save)
@@ -35,12 +35,19 @@ circumstances.
 
 import abc
 import contextlib
+import errno
 import grp
+import hashlib
 import itertools
+import json
 import logging
 import os
 import posix
+import shutil
+import signal
+import subprocess
 import tempfile
+import threading
 from subprocess import check_output, CalledProcessError, STDOUT
 
 from plainbox.abc import IExecutionController
@@ -55,6 +62,13 @@ from plainbox.impl.resource import ExpressionCannotEvaluateError
 from plainbox.impl.resource import ExpressionFailedError
 from plainbox.impl.resource import Resource
 from plainbox.impl.secure.config import Unset
+from plainbox.impl.secure.launcher1 import FRAME_EXIT
+from plainbox.impl.secure.launcher1 import FRAME_RUN
+from plainbox.impl.secure.launcher1 import FRAME_STDERR
+from plainbox.impl.secure.launcher1 import FRAME_STDOUT
+from plainbox.impl.secure.launcher1 import decode_return_code
+from plainbox.impl.secure.launcher1 import read_frame
+from plainbox.impl.secure.launcher1 import write_frame
 from plainbox.impl.secure.providers.v1 import Provider1
 from plainbox.impl.secure.rfc822 import RFC822SyntaxError
 from plainbox.impl.secure.rfc822 import gen_rfc822_records
@@ -134,7 +148,10 @@ class CheckBoxSessionStateController(ISessionStateController):
         inhibitors = []
         if prog is not None:
             try:
-                prog.evaluate_or_raise(session_state.resource_map)
+                prog.evaluate_or_raise(
+                    session_state.resource_map,
+                    session_state.resource_index_map,
+                    session_state.resource_expression_cache)
             except ExpressionCannotEvaluateError as exc:
                 # Lookup the related job (the job that provides the
                 # resources needed by the expression that cannot be
@@ -297,8 +314,7 @@ def gen_rfc822_records_from_io_log(job, result):
     logger.debug(_("processing output from a job: %r"), job)
     # Select all stdout lines from the io log
     line_gen = (record[2].decode('UTF-8', errors='replace')
-                for record in result.get_io_log()
-                if record[1] == 'stdout')
+                for record in result.get_io_log(stream_name='stdout'))
     # Allow the generated records to be traced back to the job that defined
     # the command which produced (printed) them.
     source = JobOutputTextSource(job)
@@ -373,6 +389,9 @@ class CheckBoxExecutionController(IExecutionController):
         """
         self._session_dir = session_dir
         self._provider_list = provider_list
+        # Base execution environment of each provider, see
+        # get_base_execution_environment()
+        self._base_env_map = {}
 
     def execute_job(self, job, config, extcmd_popen):
         """
@@ -392,9 +411,10 @@ class CheckBoxExecutionController(IExecutionController):
             The return code of the command, as returned by subprocess.call()
         """
         # CHECKBOX_DATA is where jobs can share output.
-        # It has to be an directory that scripts can assume exists.
+        # It has to be an directory that scripts can assume exists. Jobs may
+        # be started concurrently so tolerate someone else creating it first.
         if not os.path.isdir(self.CHECKBOX_DATA):
-            os.makedirs(self.CHECKBOX_DATA)
+            os.makedirs(self.CHECKBOX_DATA, exist_ok=True)
         # Setup the executable nest directory
         with self.configured_filesystem(job, config) as nest_dir:
             # Get the command and the environment.
@@ -421,19 +441,81 @@ class CheckBoxExecutionController(IExecutionController):
             file).
         :returns:
             Pathname of the executable symlink nest directory.
+
+        The nest is shared by all the jobs that run in this session and come
+        from the same set of providers, see :meth:`get_nest_dir()`.
+        """
+        nest_dir = self.get_nest_dir(job)
+        logger.debug(_("Symlink nest for executables: %s"), nest_dir)
+        yield nest_dir
+
+    def get_nest_dir(self, job):
+        """
+        Get the executable symlink nest directory for the specified job
+
+        :param job:
+            The JobDefinition to execute
+        :returns:
+            Pathname of the executable symlink nest directory.
+
+        The nest contains symlinks to the executables of all the providers
+        sharing the namespace with the job. Nests are kept in the session
+        directory and are built just once. The name of each nest is derived
+        from the providers and from the modification time of their bin
+        directories so that a new nest is built when executables are added
+        or removed.
+        """
+        provider_list = [
+            provider for provider in self._provider_list
+            if provider.namespace == job.provider.namespace]
+        nest_dir = os.path.join(
+            self._session_dir, "nest", self._get_nest_key(provider_list))
+        if not os.path.isdir(nest_dir):
+            self._build_nest(nest_dir, provider_list)
+        return nest_dir
+
+    def _get_nest_key(self, provider_list):
+        """
+        Compute the name of the nest of executables of the given providers
         """
-        # Create a nest for all the private executables needed for execution
-        prefix = 'nest-'
-        suffix = '.{}'.format(job.checksum)
-        with tempfile.TemporaryDirectory(suffix, prefix) as nest_dir:
-            logger.debug(_("Symlink nest for executables: %s"), nest_dir)
-            nest = SymLinkNest(nest_dir)
-            # Add all providers sharing namespace with the current job to PATH
-            for provider in self._provider_list:
-                if job.provider.namespace == provider.namespace:
-                    nest.add_provider(provider)
-            logger.debug(_("Symlink nest for executables: %s"), nest_dir)
-            yield nest_dir
+        state = []
+        for provider in provider_list:
+            mtime = None
+            if provider.bin_dir is not None:
+                try:
+                    bin_stat = os.stat(provider.bin_dir)
+                except OSError:
+                    pass
+                else:
+                    mtime = getattr(
+                        bin_stat, 'st_mtime_ns', bin_stat.st_mtime)
+            state.append([provider.name, provider.bin_dir, mtime])
+        return hashlib.sha1(json.dumps(state).encode("UTF-8")).hexdigest()
+
+    def _build_nest(self, nest_dir, provider_list):
+        """
+        Build the nest of executables of the given providers
+
+        The nest is built in a temporary directory and renamed into place so
+        that concurrent jobs never see an incomplete nest.
+        """
+        nest_parent = os.path.dirname(nest_dir)
+        os.makedirs(nest_parent, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(prefix='.tmp-', dir=nest_parent)
+        try:
+            nest = SymLinkNest(tmp_dir)
+            for provider in provider_list:
+                nest.add_provider(provider)
+            os.rename(tmp_dir, nest_dir)
+        except OSError:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            # Someone else might have built the same nest first
+            if not os.path.isdir(nest_dir):
+                raise
+        except:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        logger.debug(_("Built symlink nest for executables: %s"), nest_dir)
 
     def get_score(self, job):
         """
@@ -508,7 +590,46 @@ class CheckBoxExecutionController(IExecutionController):
         also uses fixed LANG so that scripts behave as expected.  Lastly it
         sets CHECKBOX_SHARE and CHECKBOX_DATA that may be required by some
         scripts.
+
+        Everything except for the nest directory and the configuration is
+        computed just once for each provider, see
+        :meth:`get_base_execution_environment()`.
+        """
+        env = dict(self.get_base_execution_environment(job.provider))
+        # Inject nest_dir into PATH
+        env['PATH'] = os.pathsep.join([nest_dir, env['PATH']])
+        # Inject additional variables that are requested in the config
+        if config is not None and config.environment is not Unset:
+            for env_var in config.environment:
+                # Don't override anything that is already present in the
+                # current environment. This will allow users to customize
+                # variables without editing any config files.
+                if env_var in env:
+                    continue
+                # If the environment section of the configuration file has a
+                # particular variable then copy it over.
+                env[env_var] = config.environment[env_var]
+        return env
+
+    def get_base_execution_environment(self, provider):
+        """
+        Get the part of the execution environment shared by all jobs of a
+        provider
+
+        :param provider:
+            The provider of the job
+        :returns:
+            dictionary with the environment, it must not be modified.
+
+        The environment is computed from the environment of this process
+        when the first job of the provider is executed. It contains PATH
+        without the nest directory (PATH is always defined) and does not
+        contain any variables from the configuration.
         """
+        try:
+            return self._base_env_map[provider]
+        except KeyError:
+            pass
         # Get a proper environment
         env = dict(os.environ)
         # Use non-internationalized environment
@@ -519,34 +640,21 @@ class CheckBoxExecutionController(IExecutionController):
             if name.startswith("LC_"):
                 del env[name]
         # Use PATH that can lookup checkbox scripts
-        if job.provider.extra_PYTHONPATH:
+        if provider.extra_PYTHONPATH:
             env['PYTHONPATH'] = os.pathsep.join(
-                [job.provider.extra_PYTHONPATH]
+                [provider.extra_PYTHONPATH]
                 + env.get("PYTHONPATH", "").split(os.pathsep))
-        # Inject nest_dir into PATH
-        env['PATH'] = os.pathsep.join(
-            [nest_dir]
-            + env.get("PATH", "").split(os.pathsep))
+        env['PATH'] = env.get("PATH", "")
         # Add CHECKBOX_SHARE that is needed by one script
-        if job.provider.CHECKBOX_SHARE is not None:
-            env['CHECKBOX_SHARE'] = job.provider.CHECKBOX_SHARE
+        if provider.CHECKBOX_SHARE is not None:
+            env['CHECKBOX_SHARE'] = provider.CHECKBOX_SHARE
         # Add CHECKBOX_DATA (temporary checkbox data)
         env['CHECKBOX_DATA'] = self.CHECKBOX_DATA
         # Add plainbox equivalents of the two above
-        if job.provider.data_dir is not None:
-            env['PLAINBOX_PROVIDER_DATA'] = job.provider.data_dir
+        if provider.data_dir is not None:
+            env['PLAINBOX_PROVIDER_DATA'] = provider.data_dir
         env['PLAINBOX_SESSION_SHARE'] = self.CHECKBOX_DATA
-        # Inject additional variables that are requested in the config
-        if config is not None and config.environment is not Unset:
-            for env_var in config.environment:
-                # Don't override anything that is already present in the
-                # current environment. This will allow users to customize
-                # variables without editing any config files.
-                if env_var in env:
-                    continue
-                # If the environment section of the configuration file has a
-                # particular variable then copy it over.
-                env[env_var] = config.environment[env_var]
+        self._base_env_map[provider] = env
         return env
 
     @property
@@ -559,6 +667,14 @@ class CheckBoxExecutionController(IExecutionController):
         """
         return os.path.join(self._session_dir, "CHECKBOX_DATA")
 
+    def close(self):
+        """
+        Release any resources held by this controller
+
+        This should be called when no more jobs are going to be executed.
+        The base implementation does nothing.
+        """
+
 
 class UserJobExecutionController(CheckBoxExecutionController):
     """
@@ -610,6 +726,21 @@ class CheckBoxDifferentialExecutionController(CheckBoxExecutionController):
     difference between the target environment and the current environment.
     """
 
+    def __init__(self, session_dir, provider_list):
+        """
+        Initialize a new CheckBoxDifferentialExecutionController
+
+        :param session_dir:
+            Base directory of the session this job will execute in.
+        :param provider_list:
+            A list of Provider1 objects that will be available for script
+            dependency resolutions.
+        """
+        super().__init__(session_dir, provider_list)
+        # Differential base execution environment of each provider, see
+        # get_base_differential_execution_environment()
+        self._base_diff_env_map = {}
+
     def get_differential_execution_environment(self, job, config, nest_dir):
         """
         Get the environment required to execute the specified job:
@@ -635,15 +766,52 @@ class CheckBoxDifferentialExecutionController(CheckBoxExecutionController):
         that are mentioned in
         :meth:`plainbox.impl.job.JobDefinition.get_environ_settings()` which
         are always retained.
+
+        The difference of the environment shared by all jobs of a provider is
+        computed just once, see
+        :meth:`get_base_differential_execution_environment()`.
         """
-        base_env = os.environ
+        base_env = self.get_base_execution_environment(job.provider)
         target_env = super().get_execution_environment(job, config, nest_dir)
-        return {
+        environ_settings = job.get_environ_settings()
+        env = dict(self.get_base_differential_execution_environment(
+            job.provider))
+        # Only PATH and variables from the configuration are different from
+        # the base environment of the provider
+        for key in itertools.chain(
+                ['PATH'], environ_settings,
+                target_env.keys() - base_env.keys()):
+            if key not in target_env:
+                continue
+            value = target_env[key]
+            if (key not in os.environ or os.environ[key] != value
+                    or key in environ_settings):
+                env[key] = value
+        return env
+
+    def get_base_differential_execution_environment(self, provider):
+        """
+        Get the difference between the base execution environment of a
+        provider and the current environment
+
+        :param provider:
+            The provider of the job
+        :returns:
+            dictionary with the differential environment, it must not be
+            modified.
+        """
+        try:
+            return self._base_diff_env_map[provider]
+        except KeyError:
+            pass
+        base_env = self.get_base_execution_environment(provider)
+        env = {
             key: value
-            for key, value in target_env.items()
-            if key not in base_env or base_env[key] != value
-            or key in job.get_environ_settings()
+            for key, value in base_env.items()
+            if key not in os.environ or os.environ[key] != value
         }
+        self._base_diff_env_map[provider] = env
+        return env
 
     def get_execution_environment(self, job, config, nest_dir):
         """
@@ -667,9 +835,150 @@ class CheckBoxDifferentialExecutionController(CheckBoxExecutionController):
         return None
 
 
+class TrustedLauncherSession:
+    """
+    Client of a long-lived plainbox-trusted-launcher-1 process
+
+    The launcher is started with the --session argument when the first job is
+    executed. Each job is then requested over the stdin pipe of the launcher
+    and its output is received over the stdout pipe. See
+    :meth:`plainbox.impl.secure.launcher1.TrustedLauncher.run_session()` for
+    details.
+
+    The launcher exits when its stdin is closed, either by :meth:`close()` or
+    when this process exits.
+    """
+
+    # Return codes of pkexec(1) when the user could not be authorized
+    PKEXEC_AUTH_FAILURES = (126, 127)
+
+    def __init__(self, cmd):
+        """
+        Initialize a new session
+
+        :param cmd:
+            the command that starts the launcher in session mode
+        """
+        self._cmd = cmd
+        self._proc = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "<{} cmd:{!r}>".format(self.__class__.__name__, self._cmd)
+
+    def run(self, request, delegate, args=()):
+        """
+        Run one job in the session
+
+        :param request:
+            dictionary with the request, see
+            :data:`plainbox.impl.secure.launcher1.FRAME_RUN`
+        :param delegate:
+            extcmd delegate that gets the output of the job
+        :param args:
+            arguments passed to ``delegate.on_begin()``
+        :returns:
+            The return code of the job or None if the launcher does not
+            support sessions (it exited without running the first job).
+
+        If the launcher exits unexpectedly then the job gets the return code
+        of the launcher and a new launcher is started for the next job.
+        """
+        with self._lock:
+            is_new = self._proc is None
+            if is_new:
+                logger.debug(_("Starting trusted launcher session: %r"),
+                             self._cmd)
+                self._proc = subprocess.Popen(
+                    self._cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            has_begun = False
+            return_code = None
+            if self._send_request(request):
+                while return_code is None:
+                    try:
+                        frame = self._receive_frame()
+                        if frame is None:
+                            break
+                        if not has_begun:
+                            has_begun = True
+                            delegate.on_begin(args, {})
+                        kind, payload = frame
+                        if kind == FRAME_STDOUT:
+                            delegate.on_line('stdout', payload)
+                        elif kind == FRAME_STDERR:
+                            delegate.on_line('stderr', payload)
+                        elif kind == FRAME_EXIT:
+                            return_code = decode_return_code(payload)
+                    except KeyboardInterrupt:
+                        # The launcher kills the job on SIGINT (just as
+                        # extcmd does) and reports the return code as usual
+                        self._interrupt()
+                        delegate.on_interrupt()
+            if return_code is None:
+                # The launcher is gone
+                return_code = self._close()
+                if (is_new and not has_begun
+                        and return_code not in self.PKEXEC_AUTH_FAILURES):
+                    return None
+            if not has_begun:
+                delegate.on_begin(args, {})
+            delegate.on_end(return_code)
+            return return_code
+
+    def close(self):
+        """
+        Close the session, letting the launcher exit
+        """
+        with self._lock:
+            if self._proc is not None:
+                self._close()
+
+    def _send_request(self, request):
+        try:
+            write_frame(self._proc.stdin, FRAME_RUN,
+                        json.dumps(request).encode('UTF-8'))
+            self._proc.stdin.flush()
+        except (IOError, OSError) as exc:
+            if exc.errno != errno.EPIPE:
+                raise
+            return False
+        return True
+
+    def _receive_frame(self):
+        try:
+            return read_frame(self._proc.stdout)
+        except ValueError as exc:
+            logger.warning(_("Broken trusted launcher session: %s"), exc)
+            return None
+
+    def _interrupt(self):
+        try:
+            self._proc.send_signal(signal.SIGINT)
+        except OSError as exc:
+            if exc.errno != errno.ESRCH:
+                raise
+
+    def _close(self):
+        proc, self._proc = self._proc, None
+        try:
+            proc.stdin.close()
+        except (IOError, OSError) as exc:
+            if exc.errno != errno.EPIPE:
+                raise
+        return_code = proc.wait()
+        proc.stdout.close()
+        logger.debug(_("Trusted launcher session exited with code %d"),
+                     return_code)
+        return return_code
+
+
 class RootViaPTL1ExecutionController(CheckBoxDifferentialExecutionController):
     """
     Execution controller that gains root using plainbox-trusted-launcher-1
+
+    When the ``trusted_launcher_session`` configuration variable is set, all
+    jobs that run as a particular user are executed by a single, long-lived
+    trusted launcher (see :class:`TrustedLauncherSession`).
     """
 
     def __init__(self, session_dir, provider_list):
@@ -677,6 +986,9 @@ class RootViaPTL1ExecutionController(CheckBoxDifferentialExecutionController):
         Initialize a new RootViaPTL1ExecutionController
         """
         super().__init__(session_dir, provider_list)
+        # Sessions with the trusted launcher, one for each user
+        self._launcher_session_map = {}
+        self._launcher_session_supported = True
         # Ask pkaction(1) if the "run-plainbox-job" policykit action is
         # registered on this machine.
         action_id = b"org.freedesktop.policykit.pkexec.run-plainbox-job"
@@ -690,6 +1002,97 @@ class RootViaPTL1ExecutionController(CheckBoxDifferentialExecutionController):
             result = exc.output
         self.is_supported = True if result.strip() == action_id else False
 
+    def execute_job(self, job, config, extcmd_popen):
+        """
+        Execute the specified job using the specified subprocess-like object
+
+        :param job:
+            The JobDefinition to execute
+        :param config:
+            A PlainBoxConfig instance. Apart from the environment definitions
+            it also tells if a long-lived trusted launcher should be used (the
+            trusted_launcher_session variable).
+        :param extcmd_popen:
+            A extcmd.ExternalCommandWithDelegate instance. Without a trusted
+            launcher session it runs the trusted launcher, otherwise just its
+            delegate is used.
+        :returns:
+            The return code of the command
+        """
+        if (not self._launcher_session_supported
+                or getattr(config, 'trusted_launcher_session', False)
+                is not True):
+            return super().execute_job(job, config, extcmd_popen)
+        if not os.path.isdir(self.CHECKBOX_DATA):
+            os.makedirs(self.CHECKBOX_DATA, exist_ok=True)
+        with self.configured_filesystem(job, config) as nest_dir:
+            request = self.get_execution_request(job, config, nest_dir)
+            cmd = self._get_command_for_request(job.user, request)
+            logger.debug(_("job[%s] requesting %r from the trusted launcher"),
+                         job.id, request)
+            return_code = self._get_launcher_session(job.user).run(
+                request, extcmd_popen.delegate, (cmd,))
+        if return_code is None:
+            logger.warning(
+                _("plainbox-trusted-launcher-1 does not support sessions,"
+                  " each job will be run by a separate launcher"))
+            self._launcher_session_supported = False
+            return super().execute_job(job, config, extcmd_popen)
+        return return_code
+
+    def close(self):
+        """
+        Close all the trusted launcher sessions, letting the launchers exit
+
+        New sessions are started if more jobs are executed afterwards.
+        """
+        session_list = list(self._launcher_session_map.values())
+        self._launcher_session_map.clear()
+        for session in session_list:
+            session.close()
+
+    def _get_launcher_session(self, user):
+        try:
+            return self._launcher_session_map[user]
+        except KeyError:
+            session = TrustedLauncherSession([
+                'pkexec', '--user', user, 'plainbox-trusted-launcher-1',
+                '--session'])
+            self._launcher_session_map[user] = session
+            return session
+
+    def get_execution_request(self, job, config, nest_dir):
+        """
+        Get the request for the trusted launcher to run the specified job
+
+        :param job:
+            job definition with the command and environment definitions
+        :param config:
+            A PlainBoxConfig instance which can be used to load missing
+            environment definitions that apply to all jobs. Passed to
+            :meth:`get_differential_execution_environment()`.
+        :param nest_dir:
+            A directory with a nest of symlinks to all executables required to
+            execute the specified job. Passed to
+            :meth:`get_differential_execution_environment()`.
+        :returns:
+            A dictionary with the checksum and the environment of the target
+            job and (for generated jobs) of the generator job
+        """
+        request = {
+            'target': job.checksum,
+            'target_env': self.get_differential_execution_environment(
+                job, config, nest_dir),
+            'generator': None,
+            'generator_env': None,
+        }
+        if job.via is not None:
+            request['generator'] = job.via
+            request['generator_env'] = (
+                self.get_differential_execution_environment(
+                    job.origin.source.job, config, nest_dir))
+        return request
+
     def get_execution_command(self, job, config, nest_dir):
         """
         Get the command to invoke.
@@ -713,20 +1116,20 @@ class RootViaPTL1ExecutionController(CheckBoxDifferentialExecutionController):
         the trusted launcher discover the generated job. Currently it supports
         at most one-level of generated jobs.
         """
+        return self._get_command_for_request(
+            job.user, self.get_execution_request(job, config, nest_dir))
+
+    def _get_command_for_request(self, user, request):
         # Run plainbox-trusted-launcher-1 as the required user
-        cmd = ['pkexec', '--user', job.user, 'plainbox-trusted-launcher-1']
+        cmd = ['pkexec', '--user', user, 'plainbox-trusted-launcher-1']
         # Run the specified generator job in the specified environment
-        if job.via is not None:
-            cmd += ['--generator', job.via]
-            parent_env = self.get_differential_execution_environment(
-                job.origin.source.job, config, nest_dir)
-            for key, value in sorted(parent_env.items()):
+        if request['generator'] is not None:
+            cmd += ['--generator', request['generator']]
+            for key, value in sorted(request['generator_env'].items()):
                 cmd += ['-G', '{}={}'.format(key, value)]
         # Run the specified target job in the specified environment
-        cmd += ['--target', job.checksum]
-        env = self.get_differential_execution_environment(
-            job, config, nest_dir)
-        for key, value in sorted(env.items()):
+        cmd += ['--target', request['target']]
+        for key, value in sorted(request['target_env'].items()):
             cmd += ['-T', '{}={}'.format(key, value)]
         return cmd
 
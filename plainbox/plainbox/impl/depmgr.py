@@ -183,6 +183,12 @@ class DependencySolver:
 
     Uses a simple depth-first search to discover the sequence of jobs that can
     run. Use the resolve_dependencies() class method to get the solution.
+
+    Instances of the solver can also be kept around and used to repeatedly
+    solve the dependency graph with :meth:`incremental_solve()`. In that case
+    the map of known jobs can be updated with :meth:`add_job()` and
+    :meth:`remove_job()` and as much of the previous solution is reused as
+    possible.
     """
 
     # Node colors:
@@ -224,12 +230,136 @@ class DependencySolver:
         self._job_list = job_list
         # Build a map of jobs (by id)
         self._job_map = self._get_job_map(job_list)
-        # Job colors, maps from job.id to COLOR_xxx
-        self._job_color_map = {job.id: self.COLOR_WHITE for job in job_list}
+        # Job colors, maps from job.id to COLOR_xxx. Jobs that are not in the
+        # map are white.
+        self._job_color_map = {}
+        # Stack of (job, dependency iterator) pairs of the jobs that are
+        # currently being visited (gray jobs), in the order they were visited
+        self._visit_stack = []
         # The computed solution, made out of job instances. This is not
         # necessarily the only solution but the algorithm computes the same
         # value each time, given the same input.
         self._solution = []
+        # Cache of dependencies of each job, maps from job.id to a list of
+        # (dep_type, job_id) pairs, as computed by the job controller.
+        self._dep_map = {}
+        # The visit_list used by the previous call to incremental_solve()
+        # and a list of (solution_length, problem) pairs that describe the
+        # state of the solver after each of the jobs on that list was
+        # visited.
+        self._prev_visit_list = []
+        self._checkpoint_list = []
+
+    def add_job(self, job):
+        """
+        Add a new job to the set of jobs known to the solver.
+
+        :param job:
+            A job definition to add
+        :raises DependencyDuplicateError:
+            if a different job with the same id is already known
+
+        The part of the previous solution that was computed without any
+        problems is retained as new jobs cannot affect it.
+        """
+        try:
+            existing_job = self._job_map[job.id]
+        except KeyError:
+            self._job_map[job.id] = job
+        else:
+            if existing_job != job:
+                raise DependencyDuplicateError(existing_job, job)
+            return
+        # Discard any state computed after the first problem, as the new job
+        # may be the one that was missing.
+        for index, (length, problem) in enumerate(self._checkpoint_list):
+            if problem is not None:
+                del self._checkpoint_list[index:]
+                break
+
+    def remove_job(self, job):
+        """
+        Remove a job from the set of jobs known to the solver.
+
+        :param job:
+            A job definition to remove
+
+        Since any part of the previous solution may depend on the removed job
+        the previous solution is discarded entirely.
+        """
+        del self._job_map[job.id]
+        self._dep_map.pop(job.id, None)
+        self._checkpoint_list = []
+
+    def incremental_solve(self, visit_list):
+        """
+        Solve the dependency graph for the specified jobs, collecting problems
+
+        :param list visit_list:
+            list of jobs to solve
+        :returns:
+            A tuple (solution, accepted_list, problem_list). The solution is
+            the list of jobs to execute in order. The accepted_list is the
+            subset of visit_list that could be solved. The problem_list is a
+            list of DependencyError instances, one for each job in visit_list
+            that could not be solved, in the same order.
+
+        Unlike :meth:`resolve_dependencies()` this method does not stop on
+        the first problem. Each job from the visit list that cannot be solved
+        is skipped, the partial changes done while visiting it are undone and
+        solving continues with the next job. This gives the same result as
+        repeatedly removing the problematic job from the visit list and
+        starting over, in a single pass.
+
+        The part of visit_list that is identical to the visit list used the
+        previous time this method was called is not visited again. Instead the
+        matching part of the previous solution is reused.
+        """
+        # Find out how much of the previous state can be reused
+        reuse_count = 0
+        for prev_job, job in zip(
+                self._prev_visit_list[:len(self._checkpoint_list)],
+                visit_list):
+            if prev_job is not job:
+                break
+            reuse_count += 1
+        if reuse_count > 0:
+            solution_length = self._checkpoint_list[reuse_count - 1][0]
+        else:
+            solution_length = 0
+        del self._checkpoint_list[reuse_count:]
+        self._solution = self._solution[:solution_length]
+        self._job_color_map = {
+            job.id: self.COLOR_BLACK for job in self._solution}
+        # Visit the rest of the visit list
+        logger.debug(
+            _("Starting incremental solve (reusing %d jobs)"), reuse_count)
+        for job in visit_list[reuse_count:]:
+            solution_length = len(self._solution)
+            try:
+                self._visit(job)
+            except DependencyError as exc:
+                # Undo everything that was done since we've started visiting
+                # this job and remember the problem.
+                for gray_job, dep_iter in self._visit_stack:
+                    del self._job_color_map[gray_job.id]
+                del self._visit_stack[:]
+                for stale_job in self._solution[solution_length:]:
+                    del self._job_color_map[stale_job.id]
+                del self._solution[solution_length:]
+                self._checkpoint_list.append((solution_length, exc))
+            else:
+                self._checkpoint_list.append((len(self._solution), None))
+        logger.debug(_("Done solving"))
+        self._prev_visit_list = list(visit_list)
+        accepted_list = [
+            job for job, (length, problem) in zip(
+                visit_list, self._checkpoint_list)
+            if problem is None]
+        problem_list = [
+            problem for length, problem in self._checkpoint_list
+            if problem is not None]
+        return self._solution[:], accepted_list, problem_list
 
     def _solve(self, visit_list=None):
         """
@@ -249,25 +379,31 @@ class DependencySolver:
         # Return the solution
         return self._solution
 
-    def _visit(self, job, trail=None):
+    def _visit(self, job):
         """
         Internal method of DependencySolver
 
         Called each time a node is visited. Nodes already seen in _visited are
         skipped. Attempts to enumerate all dependencies (both direct and
         resource) and resolve them. Missing jobs cause DependencyMissingError
-        to be raised. Calls _visit recursively on all dependencies.
-        """
-        color = self._job_color_map[job.id]
-        logger.debug(_("Visiting job %s (color %s)"), job, color)
-        if color == self.COLOR_WHITE:
-            # This node has not been visited yet. Let's mark it as GRAY (being
-            # visited) and iterate through the list of dependencies
-            self._job_color_map[job.id] = self.COLOR_GRAY
-            # If the trail was not specified start a trail for this node
-            if trail is None:
-                trail = [job]
-            for dep_type, job_id in job.controller.get_dependency_set(job):
+        to be raised.
+
+        The graph is traversed depth-first, using an explicit stack instead
+        of recursion so that very long chains of dependencies can be solved
+        regardless of the recursion limit. The stack is kept in _visit_stack
+        so that it can be inspected after an exception.
+        """
+        if self._job_color_map.get(job.id) == self.COLOR_BLACK:
+            # This node has been visited and is fully traced.
+            # We can just skip it and go back
+            return
+        # This node has not been visited yet. Let's mark it as GRAY (being
+        # visited) and start iterating through the list of dependencies.
+        self._push(job)
+        stack = self._visit_stack
+        while stack:
+            job, dep_iter = stack[-1]
+            for dep_type, job_id in dep_iter:
                 # Dependency is just an id, we need to resolve it
                 # to a job instance. This can fail (missing dependencies)
                 # so let's guard against that.
@@ -275,29 +411,52 @@ class DependencySolver:
                     next_job = self._job_map[job_id]
                 except KeyError:
                     raise DependencyMissingError(job, job_id, dep_type)
-                else:
-                    # For each dependency that we visit let's reuse the trail
-                    # to give proper error messages if a dependency loop exists
-                    logger.debug(_("Visiting dependency: %r"), next_job)
-                    # Update the trail as we visit that node
+                color = self._job_color_map.get(job_id, self.COLOR_WHITE)
+                if color == self.COLOR_WHITE:
+                    # Descend into the dependency, we'll come back to the
+                    # rest of the dependencies of this job afterwards.
+                    self._push(next_job)
+                    break
+                elif color == self.COLOR_GRAY:
+                    # This node is not fully traced yet but has been visited
+                    # already so we've found a dependency loop. The trail is
+                    # the list of jobs on the stack, followed by the job we
+                    # just tried to visit. We need to cut the initial part of
+                    # the trail so that we only report the part that
+                    # actually forms a loop
+                    trail = [frame[0] for frame in stack]
                     trail.append(next_job)
-                    self._visit(next_job, trail)
-                    trail.pop()
-            # We've visited (recursively) all dependencies of this node,
-            # let's color it black and append it to the solution list.
-            logger.debug(_("Appending %r to solution"), job)
-            self._job_color_map[job.id] = self.COLOR_BLACK
-            self._solution.append(job)
-        elif color == self.COLOR_GRAY:
-            # This node is not fully traced yet but has been visited already
-            # so we've found a dependency loop. We need to cut the initial
-            # part of the trail so that we only report the part that actually
-            # forms a loop
-            raise DependencyCycleError(trail[trail.index(job):])
-        else:
-            assert color == self.COLOR_BLACK
-            # This node has been visited and is fully traced.
-            # We can just skip it and go back
+                    raise DependencyCycleError(trail[trail.index(next_job):])
+            else:
+                # We've visited all dependencies of this node, let's color it
+                # black and append it to the solution list.
+                stack.pop()
+                self._job_color_map[job.id] = self.COLOR_BLACK
+                self._solution.append(job)
+
+    def _push(self, job):
+        """
+        Internal method of DependencySolver
+
+        Color the specified job gray and push it onto the visit stack
+        """
+        self._job_color_map[job.id] = self.COLOR_GRAY
+        self._visit_stack.append((job, iter(self._get_dependency_list(job))))
+
+    def _get_dependency_list(self, job):
+        """
+        Internal method of DependencySolver
+
+        Get the list of (dep_type, job_id) pairs that describe the
+        dependencies of the specified job. The list is computed once per job
+        and cached for subsequent calls.
+        """
+        try:
+            return self._dep_map[job.id]
+        except KeyError:
+            dep_list = list(job.controller.get_dependency_set(job))
+            self._dep_map[job.id] = dep_list
+            return dep_list
 
     @staticmethod
     def _get_job_map(job_list):
@@ -182,8 +182,7 @@ class SessionStateExporterBase(metaclass=ABCMeta):
                 if self.OPTION_WITH_ATTACHMENTS in self._option_list:
                     raw_bytes = b''.join(
                         (record[2] for record in
-                         job_state.result.get_io_log()
-                         if record[1] == 'stdout'))
+                         job_state.result.get_io_log(stream_name='stdout')))
                     data['attachment_map'][job_id] = \
                         base64.standard_b64encode(raw_bytes).decode('ASCII')
                 continue  # Don't add attachments IO logs to the result_map
@@ -397,8 +397,12 @@ class PrimedJob:
         Runs a job with run_job_if_possible() and returns the result
         """
         # Run the job if possible
-        job_state, job_result = run_job_if_possible(
-            self._session, self._runner, self._service._config, self._job,
-            # Don't call update on your own please
-            update=False)
+        try:
+            job_state, job_result = run_job_if_possible(
+                self._session, self._runner, self._service._config,
+                self._job,
+                # Don't call update on your own please
+                update=False)
+        finally:
+            self._runner.close()
         return job_result
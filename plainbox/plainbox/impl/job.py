@@ -218,6 +218,8 @@ class JobDefinition(BaseJob, IJobDefinition):
         estimated_duration = 'estimated_duration'
         depends = 'depends'
         requires = 'requires'
+        flags = 'flags'
+        output_limit = 'output_limit'
 
     class _PluginValues(SymbolDef):
         """
@@ -286,6 +288,19 @@ class JobDefinition(BaseJob, IJobDefinition):
     def depends(self):
         return self.get_record_value('depends')
 
+    @property
+    def flags(self):
+        return self.get_record_value('flags')
+
+    def get_flag_set(self):
+        """
+        Return a set of flags associated with this job
+        """
+        if self.flags is not None:
+            return {flag for flag in re.split('[\s,]+', self.flags) if flag}
+        else:
+            return set()
+
     @property
     def estimated_duration(self):
         """
@@ -306,6 +321,28 @@ class JobDefinition(BaseJob, IJobDefinition):
                 _("Incorrect value of 'estimated_duration' in job"
                   " %s read from %s"), self.id, self.origin)
 
+    @property
+    def output_limit(self):
+        """
+        maximum number of bytes of output that is kept for this job.
+
+        The value may be None, which indicates that the limit from the
+        configuration (if any) applies.
+        """
+        value = self.get_record_value('output_limit')
+        if value is None:
+            return
+        try:
+            value = int(value)
+        except ValueError:
+            value = -1
+        if value >= 0:
+            return value
+        # TRANSLATORS: keep "output_limit" untranslated.
+        logger.warning(
+            _("Incorrect value of 'output_limit' in job %s read from %s"),
+            self.id, self.origin)
+
     @property
     def automated(self):
         """
@@ -404,7 +441,12 @@ class JobDefinition(BaseJob, IJobDefinition):
             # XXX: moved here because of cyclic imports
             from plainbox.impl.ctrl import checkbox_session_state_ctrl
             controller = checkbox_session_state_ctrl
-        self._resource_program = None
+        # Cached dependencies, as tuples (namespace, value). The namespace is
+        # the provider namespace used to compute the value so that the cache
+        # is invalidated if the provider (namespace) changes.
+        self._resource_program_cache = None
+        self._direct_dependencies_cache = None
+        self._resource_dependencies_cache = None
         self._origin = origin
         self._provider = provider
         self._controller = controller
@@ -434,19 +476,21 @@ class JobDefinition(BaseJob, IJobDefinition):
         Return a ResourceProgram based on the 'requires' expression.
 
         The program instance is cached in the JobDefinition and is not
-        compiled or validated on subsequent calls.
+        compiled or validated on subsequent calls (unless the provider
+        namespace changes).
 
         Returns ResourceProgram or None
         Raises ResourceProgramError or SyntaxError
         """
-        if self.requires is not None and self._resource_program is None:
-            if self._provider is not None:
-                implicit_namespace = self._provider.namespace
-            else:
-                implicit_namespace = None
-            self._resource_program = ResourceProgram(
-                self.requires, implicit_namespace)
-        return self._resource_program
+        if self.requires is None:
+            return None
+        implicit_namespace = self._get_provider_namespace()
+        cache = self._resource_program_cache
+        if cache is None or cache[0] != implicit_namespace:
+            cache = (implicit_namespace, ResourceProgram(
+                self.requires, implicit_namespace))
+            self._resource_program_cache = cache
+        return cache[1]
 
     def get_direct_dependencies(self):
         """
@@ -454,10 +498,28 @@ class JobDefinition(BaseJob, IJobDefinition):
 
         To combat a simple mistake where the jobs are space-delimited any
         mixture of white-space (including newlines) and commas are allowed.
+
+        The set is computed once and cached (unless the provider namespace
+        changes). It is returned as a frozenset.
+        """
+        namespace = self._get_provider_namespace()
+        cache = self._direct_dependencies_cache
+        if cache is None or cache[0] != namespace:
+            cache = (namespace, frozenset(
+                self._compute_direct_dependencies(namespace)))
+            self._direct_dependencies_cache = cache
+        return cache[1]
+
+    def _compute_direct_dependencies(self, namespace):
+        """
+        Internal method of JobDefinition
+
+        Compute the set of direct dependencies (with partial identifiers
+        transformed to use the specified namespace)
         """
         def transform_id(some_id):
-            if "::" not in some_id and self._provider is not None:
-                return "{}::{}".format(self._provider.namespace, some_id)
+            if "::" not in some_id and namespace is not None:
+                return "{}::{}".format(namespace, some_id)
             else:
                 return some_id
         if self.depends:
@@ -471,12 +533,30 @@ class JobDefinition(BaseJob, IJobDefinition):
     def get_resource_dependencies(self):
         """
         Compute and return a set of resource dependencies
+
+        The set is computed once and cached (unless the provider namespace
+        changes). It is returned as a frozenset.
         """
-        program = self.get_resource_program()
-        if program:
-            return program.required_resources
-        else:
-            return set()
+        namespace = self._get_provider_namespace()
+        cache = self._resource_dependencies_cache
+        if cache is None or cache[0] != namespace:
+            program = self.get_resource_program()
+            if program:
+                value = frozenset(program.required_resources)
+            else:
+                value = frozenset()
+            cache = (namespace, value)
+            self._resource_dependencies_cache = cache
+        return cache[1]
+
+    def _get_provider_namespace(self):
+        """
+        Internal method of JobDefinition
+
+        Get the namespace of the provider of this job or None
+        """
+        if self._provider is not None:
+            return self._provider.namespace
 
     @classmethod
     def from_rfc822_record(cls, record):
@@ -494,9 +574,13 @@ class JobDefinition(BaseJob, IJobDefinition):
         # Strip the trailing newlines form all the raw values coming from the
         # RFC822 parser. We don't need them and they don't match gettext keys
         # (xgettext strips out those newlines)
-        return cls(record.data, record.origin, raw_data={
+        job = cls(record.data, record.origin, raw_data={
             key: value.rstrip('\n')
             for key, value in record.raw_data.items()})
+        # Don't compute the checksum again if it is already known
+        if record.data_checksum is not None:
+            job._checksum = record.data_checksum
+        return job
 
     def validate(self, validator_cls=CheckBoxJobValidator):
         """
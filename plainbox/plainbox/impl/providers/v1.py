@@ -32,6 +32,7 @@ import logging
 import os
 
 from plainbox.abc import IProvider1, IProviderBackend1
+from plainbox.impl.secure.cache import RFC822RecordCache
 from plainbox.impl.secure.plugins import FsPlugInCollection
 from plainbox.impl.secure.providers.v1 import Provider1
 from plainbox.impl.secure.providers.v1 import Provider1PlugIn
@@ -179,7 +180,10 @@ class InsecureProvider1PlugInCollection(FsPlugInCollection):
             dir_list = get_insecure_PROVIDERPATH_list()
         else:
             dir_list = PROVIDERPATH.split(os.path.pathsep)
-        super().__init__(dir_list, '.provider', wrapper=Provider1PlugIn)
+        record_cache = RFC822RecordCache(
+            RFC822RecordCache.get_default_location())
+        super().__init__(dir_list, '.provider', wrapper=Provider1PlugIn,
+                         record_cache=record_cache)
 
 
 # Collection of all providers
@@ -129,6 +129,129 @@ class Resource:
             != object.__getattribute__(other, '_data'))
 
 
+class ResourceIndex:
+    """
+    A lazily-built hash index of a list of resources
+
+    The index allows some simple resource expressions (see
+    :attr:`ResourceExpression.index_query`) to be evaluated without having to
+    run the expression against each resource in the list. For each attribute
+    that is looked up, a set of all of the values of that attribute is
+    computed once and kept for subsequent lookups.
+
+    The index is only valid for as long as the list of resources (and the
+    resources themselves) are not modified. It is meant to be re-created each
+    time a new list of resources is produced.
+
+    Each index can be given a version number. Versions are used as a part of
+    the key of the cache of expression results (see
+    :meth:`ResourceProgram.evaluate_or_raise()`) so each list of resources
+    should get a different version.
+    """
+
+    # Types of values that can be indexed. Those are the only types that can
+    # be produced by resource jobs and that can be compared with constants
+    # in resource expressions so that hashing is consistent with equality.
+    _indexable_types = (str, int, float)
+
+    def __init__(self, resource_list, version=None):
+        self._resource_list = resource_list
+        self._version = version
+        # Map from attribute name to a set of values or None (if the values
+        # cannot be indexed)
+        self._attr_index_map = {}
+
+    @property
+    def resource_list(self):
+        """
+        The list of resources this index was built for
+        """
+        return self._resource_list
+
+    @property
+    def version(self):
+        """
+        Version of the list of resources, may be None
+        """
+        return self._version
+
+    def lookup(self, attr, value_list):
+        """
+        Check if any resource has an attribute equal to any of the values
+
+        :param attr:
+            Name of the attribute to look at
+        :param value_list:
+            A sequence of constant values to look for
+        :returns:
+            True if any of the resources has the specified attribute equal to
+            any of the values, False if there are no such resources or None if
+            the index cannot be used to answer the question (in which case the
+            caller needs to scan all the resources).
+        """
+        try:
+            value_set = self._attr_index_map[attr]
+        except KeyError:
+            value_set = self._attr_index_map[attr] = self._build(attr)
+        if value_set is None:
+            return None
+        for value in value_list:
+            if value in value_set:
+                return True
+        return False
+
+    def _build(self, attr):
+        """
+        Internal method of ResourceIndex
+
+        Build the set of values of the specified attribute or return None if
+        this cannot be done.
+        """
+        value_set = set()
+        for resource in self._resource_list:
+            if not isinstance(resource, Resource):
+                return None
+            data = object.__getattribute__(resource, '_data')
+            try:
+                value = data[attr]
+            except KeyError:
+                continue
+            if not isinstance(value, self._indexable_types):
+                return None
+            value_set.add(value)
+        return value_set
+
+
+class _ResourceProgramSplicer(ast.NodeTransformer):
+    """
+    Internal helper of :meth:`ResourceProgram._compile()`
+
+    Replaces the placeholders of the generated code with the expressions
+    and renames the resource id of each expression to the loop variable.
+    """
+
+    def __init__(self, prefix, expression_list, tree_list):
+        self._prefix = prefix
+        self._expression_list = expression_list
+        self._tree_list = tree_list
+        self._index = None
+
+    def visit_Name(self, node):
+        placeholder = "{}_expr".format(self._prefix)
+        if self._index is None and node.id.startswith(placeholder):
+            self._index = int(node.id[len(placeholder):])
+            try:
+                tree = self.visit(self._tree_list[self._index])
+            finally:
+                self._index = None
+            return ast.copy_location(tree, node)
+        if (self._index is not None and node.id ==
+                self._expression_list[self._index]._resource_id):
+            return ast.copy_location(ast.Name(
+                id="{}_item".format(self._prefix), ctx=node.ctx), node)
+        return node
+
+
 class ResourceProgram:
     """
     Class for storing and executing resource programs.
@@ -136,13 +259,27 @@ class ResourceProgram:
     This is used by job requirement expressions
     """
 
-    def __init__(self, program_text, implicit_namespace=None):
+    # Cache of functions compiled by _compile(), keyed by a tuple of texts of
+    # all the expressions of a program
+    _compiled_function_cache = {}
+
+    def __init__(self, program_text, implicit_namespace=None,
+                 compile_program=False):
         """
         Analyze the requirement program and prepare it for execution
 
         The requirement program must be a string (of possibly many lines), each
         of which must be a valid ResourceExpression. Empty lines are ignored.
 
+        Identical expressions are shared by all programs (see
+        :meth:`ResourceExpression.get_interned()`).
+
+        If compile_program is True then the whole program is also compiled
+        into a single python function that evaluates all the expressions, in
+        order, and stops at the first one that fails. The function is used
+        by :meth:`evaluate_or_raise()` when neither resource indices nor a
+        result cache are available.
+
         May raise ResourceProgramError (including CodeNotAllowed) or a
         SyntaxError
         """
@@ -150,7 +287,91 @@ class ResourceProgram:
         for line in program_text.splitlines():
             if line.strip() != "":
                 self._expression_list.append(
-                    ResourceExpression(line, implicit_namespace))
+                    ResourceExpression.get_interned(line, implicit_namespace))
+        if compile_program:
+            self._compiled_function = self._compile(self._expression_list)
+        else:
+            self._compiled_function = None
+
+    @classmethod
+    def _compile(cls, expression_list):
+        """
+        Internal method of ResourceProgram
+
+        Compile a list of expressions into a single function. The function
+        takes one list of resources for each expression and returns the index
+        of the first expression that failed or None.
+
+        The generated code mirrors :meth:`ResourceExpression.evaluate()` for
+        each expression in turn. This is safe as each expression has already
+        been validated by :class:`ResourceNodeVisitor`. The expressions are
+        spliced into the function as syntax trees, with their resource ids
+        renamed, so that no resource id can change the meaning of the rest
+        of the code.
+        """
+        key = tuple(expression.text for expression in expression_list)
+        try:
+            return cls._compiled_function_cache[key]
+        except KeyError:
+            pass
+        tree_list = [
+            ast.parse(expression.text, mode='eval').body
+            for expression in expression_list]
+        # All the names used by the generated code start with a prefix that
+        # no name in any of the expressions starts with. This way neither
+        # the resource ids nor anything else in the expressions can shadow
+        # the parameters, the helpers or each other.
+        used_name_set = set(
+            node.id for tree in tree_list for node in ast.walk(tree)
+            if isinstance(node, ast.Name))
+        prefix = "_rp"
+        while any(name.startswith(prefix) for name in used_name_set):
+            prefix = "_" + prefix
+        param_list = ["{}_list{}".format(prefix, index)
+                      for index in range(len(expression_list))]
+        helper_list = ["{0}_{1}={0}_{1}".format(prefix, name) for name in (
+            'Resource', 'isinstance', 'TypeError', 'Exception', 'log')]
+        line_list = ["def program({}):".format(
+            ", ".join(param_list + ["*"] + helper_list))]
+        for index in range(len(expression_list)):
+            # Each expression is spliced into the placeholder below, with
+            # its resource id renamed to the loop variable.
+            line_list.extend(line.format(prefix, index) for line in [
+                "    for {0}_item in {0}_list{1}:",
+                "        if not {0}_isinstance({0}_item, {0}_Resource):",
+                "            raise {0}_TypeError(",
+                "                'Each resource must be a Resource instance')",
+                "        try:",
+                "            if {0}_expr{1}:",
+                "                break",
+                "        except {0}_Exception as {0}_exc:",
+                "            {0}_log({1}, {0}_item, {0}_exc)",
+                "    else:",
+                "        return {1}",
+            ])
+        line_list.append("    return None")
+        module = ast.parse("\n".join(line_list))
+        module = _ResourceProgramSplicer(
+            prefix, expression_list, tree_list).visit(module)
+        ast.fix_missing_locations(module)
+        expression_text_list = list(key)
+
+        def _log_exception(index, resource, exc):
+            logger.debug(
+                _("Exception in requirement expression %r (with %s=%r):"
+                  " %r"), expression_text_list[index],
+                expression_list[index]._resource_id, resource, exc)
+        namespace = {
+            prefix + '_Resource': Resource,
+            prefix + '_isinstance': isinstance,
+            prefix + '_TypeError': TypeError,
+            prefix + '_Exception': Exception,
+            prefix + '_log': _log_exception,
+        }
+        exec(compile(module, "<resource program>", "exec"), namespace)
+        function = namespace['program']
+        cls._compiled_function_cache[key] = function
+        return function
 
     @property
     def expression_list(self):
@@ -167,7 +388,8 @@ class ResourceProgram:
         return set((expression.resource_id
                     for expression in self._expression_list))
 
-    def evaluate_or_raise(self, resource_map):
+    def evaluate_or_raise(self, resource_map, resource_index_map=None,
+                          result_cache=None):
         """
         Evaluate the program with the given map of resources.
 
@@ -178,16 +400,52 @@ class ResourceProgram:
         Returns True
 
         Resources must be a dictionary of mapping resource id to a list of
-        Resource objects.
+        Resource objects. The optional resource_index_map is a dictionary
+        mapping resource id to a ResourceIndex of the corresponding list of
+        resources. If available, the index is used to speed up evaluation.
+
+        The optional result_cache is a dictionary that is used to remember the
+        result of each expression. It is keyed by (expression text, implicit
+        namespace, version of the resource index) and is only used for
+        resources that have a versioned index. The same dictionary can be
+        shared by all the programs evaluated against the same resources.
         """
         # First check if we have all required resources
         for expression in self._expression_list:
             if expression.resource_id not in resource_map:
                 raise ExpressionCannotEvaluateError(expression)
+        # Use the compiled program if we have nothing better
+        if (self._compiled_function is not None
+                and resource_index_map is None and result_cache is None):
+            failed_index = self._compiled_function(*[
+                resource_map[expression.resource_id]
+                for expression in self._expression_list])
+            if failed_index is not None:
+                raise ExpressionFailedError(
+                    self._expression_list[failed_index])
+            return True
         # Then evaluate all expressions
         for expression in self._expression_list:
-            result = expression.evaluate(
-                resource_map[expression.resource_id])
+            resource_list = resource_map[expression.resource_id]
+            resource_index = None
+            if resource_index_map is not None:
+                resource_index = resource_index_map.get(
+                    expression.resource_id)
+                # Don't use an index built for a different list
+                if (resource_index is not None
+                        and resource_index.resource_list is not resource_list):
+                    resource_index = None
+            if (result_cache is not None and resource_index is not None
+                    and resource_index.version is not None):
+                key = (expression.text, expression.implicit_namespace,
+                       resource_index.version)
+                try:
+                    result = result_cache[key]
+                except KeyError:
+                    result = result_cache[key] = expression.evaluate(
+                        resource_list, resource_index)
+            else:
+                result = expression.evaluate(resource_list, resource_index)
             if not result:
                 raise ExpressionFailedError(expression)
         return True
@@ -433,6 +691,14 @@ class ResourceExpression:
     evaluated against a single variable which references a Resource object.
     """
 
+    # Cache of the results of analyzing and compiling each expression, keyed
+    # by the text of the expression. Analysis does not depend on the
+    # namespace so this is shared by all the expressions with the same text.
+    _compiled_cache = {}
+
+    # Cache of interned expressions, keyed by (text, implicit_namespace)
+    _interned_cache = {}
+
     def __init__(self, text, implicit_namespace=None):
         """
         Analyze the text and prepare it for execution
@@ -440,10 +706,34 @@ class ResourceExpression:
         May raise ResourceProgramError
         """
         self._implicit_namespace = implicit_namespace
-        self._resource_id = self._analyze(text)
+        try:
+            compiled = self._compiled_cache[text]
+        except KeyError:
+            resource_id, index_query = self._analyze(text)
+            compiled = (resource_id, index_query, eval(
+                "lambda {}: {}".format(resource_id, text)))
+            self._compiled_cache[text] = compiled
+        self._resource_id, self._index_query, self._lambda = compiled
         self._text = text
-        self._lambda = eval("lambda {}: {}".format(
-            self._resource_id, self._text))
+
+    @classmethod
+    def get_interned(cls, text, implicit_namespace=None):
+        """
+        Get a shared ResourceExpression with the specified text and namespace
+
+        Expressions are immutable so all the users of identical expressions
+        can share one instance. This saves both time and memory when many
+        jobs use the same requirements.
+
+        May raise ResourceProgramError
+        """
+        key = (text, implicit_namespace)
+        try:
+            return cls._interned_cache[key]
+        except KeyError:
+            expression = cls._interned_cache[key] = cls(
+                text, implicit_namespace)
+            return expression
 
     def __str__(self):
         return self._text
@@ -485,14 +775,37 @@ class ResourceExpression:
         """
         return self._implicit_namespace
 
-    def evaluate(self, resource_list):
+    @property
+    def index_query(self):
+        """
+        The (attr, value_list) pair describing this expression or None
+
+        Expressions that just compare one attribute of the resource to a
+        constant (``package.name == 'foo'``) or check if an attribute is in a
+        list of constants (``device.category in ['WIRELESS', 'NETWORK']``)
+        can be evaluated by looking up the value(s) in a
+        :class:`ResourceIndex`. For all other expressions this is None.
+        """
+        return self._index_query
+
+    def evaluate(self, resource_list, resource_index=None):
         """
         Evaluate the expression against a list of resources
 
         Each subsequent resource from the list will be bound to the resource
         id in the expression. The return value is True if any of the attempts
         return a true value, otherwise the result is False.
+
+        If a ResourceIndex of the resource list is provided and this
+        expression has an :attr:`index_query` then the index is used instead
+        of evaluating the expression against each resource. The result is
+        the same either way.
         """
+        # Use the index if we can
+        if resource_index is not None and self._index_query is not None:
+            result = resource_index.lookup(*self._index_query)
+            if result is not None:
+                return result
         # Try each resource in sequence.
         for resource in resource_list:
             if not isinstance(resource, Resource):
@@ -520,7 +833,10 @@ class ResourceExpression:
     @classmethod
     def _analyze(cls, text):
         """
-        Analyze the expression and return the id of the required resource
+        Analyze the expression and return a tuple (resource_id, index_query)
+
+        The resource_id is the id of the required resource, index_query is
+        described in :attr:`index_query`.
 
         May raise SyntaxError or a ResourceProgramError subclass
         """
@@ -535,6 +851,49 @@ class ResourceExpression:
         if len(visitor.ids_seen) == 0:
             raise NoResourcesReferenced()
         elif len(visitor.ids_seen) == 1:
-            return list(visitor.ids_seen)[0]
+            resource_id = list(visitor.ids_seen)[0]
+            return resource_id, cls._analyze_index_query(node, resource_id)
         else:
             raise MultipleResourcesReferenced()
+
+    @classmethod
+    def _analyze_index_query(cls, node, resource_id):
+        """
+        Analyze the (already validated) expression and return the index query
+
+        Only two forms of expressions are recognized: ``R.attr == const``
+        (or ``const == R.attr``) and ``R.attr in [const, ...]`` (a list or a
+        tuple) where const is a string or a number. None is returned for
+        everything else.
+        """
+        if len(node.body) != 1:
+            return None
+        expr = node.body[0].value
+        if (not isinstance(expr, ast.Compare) or len(expr.ops) != 1
+                or len(expr.comparators) != 1):
+            return None
+        left, op, right = expr.left, expr.ops[0], expr.comparators[0]
+        if isinstance(op, ast.Eq):
+            if not cls._is_resource_attr(left, resource_id):
+                left, right = right, left
+            if (cls._is_resource_attr(left, resource_id)
+                    and isinstance(right, (ast.Str, ast.Num))):
+                return left.attr, (ast.literal_eval(right),)
+        elif isinstance(op, ast.In):
+            if (cls._is_resource_attr(left, resource_id)
+                    and isinstance(right, (ast.List, ast.Tuple))
+                    and all(isinstance(elt, (ast.Str, ast.Num))
+                            for elt in right.elts)):
+                return left.attr, tuple(
+                    ast.literal_eval(elt) for elt in right.elts)
+        return None
+
+    @staticmethod
+    def _is_resource_attr(node, resource_id):
+        """
+        Check if the node is a (public) attribute of the resource
+        """
+        return (isinstance(node, ast.Attribute)
+                and isinstance(node.value, ast.Name)
+                and node.value.id == resource_id
+                and not node.attr.startswith("_"))
@@ -23,15 +23,25 @@
 
 This module has two basic implementation of :class:`IJobResult`:
 :class:`MemoryJobResult` and :class:`DiskJobResult`.
+
+IO logs of :class:`DiskJobResult` are stored in one of two formats. The legacy
+format is a gzip-compressed text file with one JSON array (with base64-encoded
+data) per line, see :class:`IOLogRecordWriter`. The binary format is a plain
+sequence of length-prefixed frames that can be read without any copies, see
+:class:`BinaryIOLogRecordWriter`.
 """
 
 from collections import namedtuple
 import base64
+import collections
+import contextlib
 import gzip
 import io
 import json
 import logging
 import inspect
+import mmap
+import struct
 
 from plainbox.abc import IJobResult
 from plainbox.i18n import gettext as _
@@ -52,6 +62,50 @@ logger = logging.getLogger("plainbox.result")
 #   data - the actual IO seen (bytes)
 IOLogRecord = namedtuple("IOLogRecord", "delay stream_name data".split())
 
+# Magic string at the start of binary IO log files. It is followed by the
+# version of the format (as ASCII digits) and a newline.
+BINARY_IO_LOG_MAGIC = b"\x00PBIOLOG "
+
+# Version of the binary IO log format written by BinaryIOLogRecordWriter
+BINARY_IO_LOG_VERSION = 1
+
+# Header of each frame in the binary IO log format: the delay, the stream id
+# and the size of the data that follows the header.
+_BINARY_IO_LOG_FRAME = struct.Struct("<dBI")
+
+# Names of streams indexed by their id in the binary IO log format
+_BINARY_IO_LOG_STREAMS = ('stdout', 'stderr')
+
+# Magic string at the start of index files of binary IO logs. It is followed
+# by the version of the format (as ASCII digits) and a newline. The index is
+# stored next to the log, in a file with the extra ".index" suffix.
+BINARY_IO_LOG_INDEX_MAGIC = b"\x00PBIOIDX "
+
+# Entry of the index of binary IO log: the offset of the frame, the stream id
+# and the size of the data.
+_BINARY_IO_LOG_INDEX_ENTRY = struct.Struct("<QBI")
+
+
+def _parse_binary_header(view, magic, version):
+    """
+    Parse the header of a binary IO log (or its index)
+
+    :returns:
+        offset of the first byte after the header
+    :raises ValueError:
+        if the header is not correct
+    """
+    magic_len = len(magic)
+    header = bytes(view[:magic_len + 16])
+    end = header.find(b"\n", magic_len)
+    if not header.startswith(magic) or end == -1:
+        raise ValueError(_("Not a binary IO log"))
+    if header[magic_len:end] != str(version).encode("ASCII"):
+        raise ValueError(
+            _("Unsupported version of binary IO log: {!r}").format(
+                header[magic_len:end]))
+    return end + 1
+
 
 class _JobResultBase(IJobResult):
     """
@@ -153,6 +207,32 @@ class _JobResultBase(IJobResult):
     def io_log(self):
         return tuple(self.get_io_log())
 
+    def get_io_log_tail(self, count, stream_name=None):
+        """
+        Get the last records of the IO log
+
+        :param count:
+            maximum number of records to return
+        :param stream_name:
+            if not None, only records of this stream are considered
+        :returns:
+            a list of (at most) count last :class:`IOLogRecord` objects
+        """
+        if count <= 0:
+            return []
+        return list(collections.deque(self.get_io_log(stream_name), count))
+
+    def get_io_log_size(self, stream_name=None):
+        """
+        Get the total size of the data in the IO log
+
+        :param stream_name:
+            if not None, only records of this stream are considered
+        :returns:
+            number of bytes
+        """
+        return sum(len(record[2]) for record in self.get_io_log(stream_name))
+
 
 class MemoryJobResult(_JobResultBase):
     """
@@ -162,17 +242,19 @@ class MemoryJobResult(_JobResultBase):
     of going through the filesystem would make them needlessly complicated.
     """
 
-    def get_io_log(self):
+    def get_io_log(self, stream_name=None):
         io_log_data = self._data.get('io_log', ())
         for entry in io_log_data:
             if isinstance(entry, IOLogRecord):
-                yield entry
+                record = entry
             elif isinstance(entry, tuple):
-                yield IOLogRecord(*entry)
+                record = IOLogRecord(*entry)
             else:
                 raise TypeError(
                     "each item in io_log must be either a tuple"
                     " or special the IOLogRecord tuple")
+            if stream_name is None or record.stream_name == stream_name:
+                yield record
 
 
 class GzipFile(gzip.GzipFile):
@@ -204,13 +286,150 @@ class DiskJobResult(_JobResultBase):
         """
         return self._data.get("io_log_filename")
 
-    def get_io_log(self):
+    @property
+    def io_log_index_filename(self):
+        """
+        pathname of the file with the index of the binary IO log
+
+        The index is optional, it may be missing even if the log exists.
+        """
+        if self.io_log_filename:
+            return self.io_log_filename + ".index"
+
+    def get_io_log(self, stream_name=None):
         record_path = self.io_log_filename
         if record_path:
-            with GzipFile(record_path, mode='rb') as gzip_stream, \
-                    io.TextIOWrapper(gzip_stream, encoding='UTF-8') as stream:
-                for record in IOLogRecordReader(stream):
+            with open(record_path, mode='rb') as stream:
+                is_binary = (stream.read(len(BINARY_IO_LOG_MAGIC))
+                             == BINARY_IO_LOG_MAGIC)
+                if is_binary:
+                    for record in self._get_binary_io_log(
+                            stream, stream_name):
+                        yield record
+            if not is_binary:
+                for record in self._get_legacy_io_log(record_path):
+                    if stream_name is None or record[1] == stream_name:
+                        yield record
+
+    def get_io_log_tail(self, count, stream_name=None):
+        if count <= 0:
+            return []
+        with self._map_binary_io_log() as buf:
+            if buf is None:
+                return super().get_io_log_tail(count, stream_name)
+            entry_list = self._get_binary_io_log_index(buf, stream_name)
+            return [_read_binary_frame(buf, entry)
+                    for entry in entry_list[-count:]]
+
+    def get_io_log_size(self, stream_name=None):
+        with self._map_binary_io_log() as buf:
+            if buf is None:
+                return super().get_io_log_size(stream_name)
+            return sum(
+                entry[2] for entry in self._get_binary_io_log_index(
+                    buf, stream_name))
+
+    @contextlib.contextmanager
+    def _map_binary_io_log(self):
+        """
+        Map the binary IO log into memory
+
+        This context manager yields the memory-mapped file or None if there is
+        no IO log or if it uses the legacy format.
+        """
+        record_path = self.io_log_filename
+        if not record_path:
+            yield None
+            return
+        with open(record_path, mode='rb') as stream:
+            if (stream.read(len(BINARY_IO_LOG_MAGIC))
+                    != BINARY_IO_LOG_MAGIC):
+                yield None
+                return
+            with mmap.mmap(
+                    stream.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                yield buf
+
+    def _get_binary_io_log(self, stream, stream_name=None):
+        """
+        Read records from a file using the binary IO log format
+
+        The file is mapped into memory so the only copy of each record is
+        made when slicing its data. Records of other streams are skipped
+        using the index, without looking at their data.
+        """
+        with mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            if stream_name is not None:
+                for entry in self._get_binary_io_log_index(buf, stream_name):
+                    yield _read_binary_frame(buf, entry)
+                return
+            reader = BinaryIOLogRecordReader(buf, copy=True)
+            try:
+                for record in reader:
                     yield record
+            finally:
+                reader.close()
+
+    def _get_binary_io_log_index(self, buf, stream_name=None):
+        """
+        Get the index of a binary IO log
+
+        :param buf:
+            the memory-mapped IO log
+        :param stream_name:
+            if not None, only entries of this stream are returned
+        :returns:
+            a list of tuples (offset, stream_id, size) describing subsequent
+            frames of the log
+
+        The index is loaded from the sidecar index file. Frames that are not
+        covered by the index (or all frames, if the index is missing or
+        doesn't match the log) are found by walking over frame headers.
+        """
+        header_size = _parse_binary_header(
+            buf, BINARY_IO_LOG_MAGIC, BINARY_IO_LOG_VERSION)
+        try:
+            with open(self.io_log_index_filename, 'rb') as stream:
+                entry_list = _parse_binary_io_log_index(stream.read())
+        except (OSError, IOError):
+            entry_list = []
+        except ValueError as exc:
+            logger.warning(
+                _("Ignoring index of IO log %r: %s"), self.io_log_filename,
+                exc)
+            entry_list = []
+        # Drop entries that point past the end of the log (the index may be
+        # written before the log is flushed)
+        while entry_list and _binary_frame_end(entry_list[-1]) > len(buf):
+            entry_list.pop()
+        if entry_list and not _is_binary_io_log_index_valid(
+                buf, header_size, entry_list):
+            logger.warning(
+                _("Ignoring index of IO log %r: %s"), self.io_log_filename,
+                _("index doesn't match the log"))
+            entry_list = []
+        if entry_list:
+            offset = _binary_frame_end(entry_list[-1])
+        else:
+            offset = header_size
+        entry_list.extend(_scan_binary_frames(buf, offset))
+        if stream_name is not None:
+            try:
+                stream_id = _BINARY_IO_LOG_STREAMS.index(stream_name)
+            except ValueError:
+                return []
+            entry_list = [
+                entry for entry in entry_list if entry[1] == stream_id]
+        return entry_list
+
+    def _get_legacy_io_log(self, record_path):
+        """
+        Read records from a file using the gzip-compressed text format
+        """
+        with GzipFile(record_path, mode='rb') as gzip_stream, \
+                io.TextIOWrapper(gzip_stream, encoding='UTF-8') as stream:
+            for record in IOLogRecordReader(stream):
+                yield record
 
     @property
     def io_log(self):
@@ -284,3 +503,225 @@ class IOLogRecordReader:
             if record is None:
                 break
             yield record
+
+
+class BinaryIOLogRecordWriter:
+    """
+    Class for writing :class:`IOLogRecord` instances to a binary stream
+
+    The stream starts with a small header that identifies the format and its
+    version. Each record is stored as a frame with a fixed-size header (the
+    delay, the stream id and the size of the data) followed by the raw data.
+    Unlike :class:`IOLogRecordWriter` nothing is encoded or compressed.
+    """
+
+    def __init__(self, stream, index_stream=None):
+        """
+        Initialize a writer
+
+        :param stream:
+            binary stream to write the records to
+        :param index_stream:
+            optional binary stream to write the index of the records to. The
+            index allows readers to find records of a particular stream (or
+            the last few records) without reading all of the log.
+        """
+        self.stream = stream
+        self.index_stream = index_stream
+        version = "{}\n".format(BINARY_IO_LOG_VERSION).encode("ASCII")
+        self.stream.write(BINARY_IO_LOG_MAGIC)
+        self.stream.write(version)
+        self.offset = len(BINARY_IO_LOG_MAGIC) + len(version)
+        if self.index_stream is not None:
+            self.index_stream.write(BINARY_IO_LOG_INDEX_MAGIC)
+            self.index_stream.write(version)
+
+    def close(self):
+        self.stream.close()
+        if self.index_stream is not None:
+            self.index_stream.close()
+
+    def write_record(self, record):
+        """
+        Write an :class:`IOLogRecord` to the stream.
+
+        :raises ValueError:
+            if the stream name is not supported by the format
+        """
+        try:
+            stream_id = _BINARY_IO_LOG_STREAMS.index(record[1])
+        except ValueError:
+            raise ValueError(
+                _("Unsupported IO log stream: {!r}").format(record[1]))
+        size = len(record[2])
+        self.stream.write(
+            _BINARY_IO_LOG_FRAME.pack(record[0], stream_id, size))
+        self.stream.write(record[2])
+        if self.index_stream is not None:
+            self.index_stream.write(
+                _BINARY_IO_LOG_INDEX_ENTRY.pack(self.offset, stream_id, size))
+        self.offset += _BINARY_IO_LOG_FRAME.size + size
+
+
+class BinaryIOLogRecordReader:
+    """
+    Class for reading :class:`IOLogRecord` instances from a binary buffer
+
+    The buffer is typically a memory-mapped file written by
+    :class:`BinaryIOLogRecordWriter`. By default the data of each record is a
+    ``memoryview`` slice of the buffer. Such views must be released (or
+    dropped) before the underlying buffer can be closed.
+    """
+
+    def __init__(self, buf, copy=False):
+        """
+        Initialize a reader of the specified buffer
+
+        :param buf:
+            any object supporting the buffer protocol
+        :param copy:
+            if True, the data of each record is a slice of the buffer itself
+            (for example, bytes for a bytes object or a memory-mapped file)
+            instead of a memoryview.
+        :raises ValueError:
+            if the buffer does not start with the header of a supported
+            version of the binary IO log format
+        """
+        self.view = memoryview(buf)
+        self._data_source = buf if copy else self.view
+        self.offset = _parse_binary_header(
+            self.view, BINARY_IO_LOG_MAGIC, BINARY_IO_LOG_VERSION)
+
+    def close(self):
+        self.view.release()
+
+    def read_record(self):
+        """
+        Read the next record from the buffer.
+
+        :returns: None if there are no more records
+        :returns: next :class:`IOLogRecord` as found in the buffer.
+
+        A record that was truncated (for example, because the process writing
+        it was killed) is treated as the end of the log.
+        """
+        frame_size = _BINARY_IO_LOG_FRAME.size
+        start = self.offset + frame_size
+        if start > len(self.view):
+            if self.offset < len(self.view):
+                logger.warning(_("Ignoring truncated IO log record"))
+            return
+        delay, stream_id, size = _BINARY_IO_LOG_FRAME.unpack_from(
+            self.view, self.offset)
+        end = start + size
+        if end > len(self.view):
+            logger.warning(_("Ignoring truncated IO log record"))
+            return
+        try:
+            stream_name = _BINARY_IO_LOG_STREAMS[stream_id]
+        except IndexError:
+            raise ValueError(
+                _("Unsupported IO log stream id: {}").format(stream_id))
+        self.offset = end
+        return IOLogRecord(delay, stream_name, self._data_source[start:end])
+
+    def __iter__(self):
+        """
+        Iterate over the entire buffer generating subsequent
+        :class:`IOLogRecord` entries.
+        """
+        while True:
+            record = self.read_record()
+            if record is None:
+                break
+            yield record
+
+
+def _binary_frame_end(entry):
+    """
+    Compute the offset of the end of a frame described by an index entry
+    """
+    return entry[0] + _BINARY_IO_LOG_FRAME.size + entry[2]
+
+
+def _read_binary_frame(buf, entry):
+    """
+    Read the record from the frame described by an index entry
+    """
+    offset, stream_id, size = entry
+    delay = _BINARY_IO_LOG_FRAME.unpack_from(buf, offset)[0]
+    start = offset + _BINARY_IO_LOG_FRAME.size
+    return IOLogRecord(
+        delay, _BINARY_IO_LOG_STREAMS[stream_id], buf[start:start + size])
+
+
+def _is_binary_io_log_index_valid(buf, offset, entry_list):
+    """
+    Check if index entries describe the frames of a binary IO log
+
+    :param buf:
+        the binary IO log
+    :param offset:
+        offset of the first frame
+    :param entry_list:
+        a non-empty list of index entries (offset, stream_id, size)
+
+    Frames described by the index must be contiguous and the last one must
+    match the header of the frame it points to.
+    """
+    for entry in entry_list:
+        if entry[0] != offset:
+            return False
+        offset = _binary_frame_end(entry)
+    last_offset, stream_id, size = entry_list[-1]
+    return _BINARY_IO_LOG_FRAME.unpack_from(buf, last_offset)[1:] == (
+        stream_id, size)
+
+
+def _scan_binary_frames(buf, offset):
+    """
+    Compute index entries by walking over frame headers
+
+    :param buf:
+        the binary IO log
+    :param offset:
+        offset of the first frame to look at
+    :returns:
+        a list of index entries (offset, stream_id, size)
+    """
+    entry_list = []
+    frame_size = _BINARY_IO_LOG_FRAME.size
+    buf_size = len(buf)
+    while offset + frame_size <= buf_size:
+        delay, stream_id, size = _BINARY_IO_LOG_FRAME.unpack_from(buf, offset)
+        if (offset + frame_size + size > buf_size
+                or stream_id >= len(_BINARY_IO_LOG_STREAMS)):
+            break
+        entry_list.append((offset, stream_id, size))
+        offset += frame_size + size
+    return entry_list
+
+
+def _parse_binary_io_log_index(data):
+    """
+    Parse the index of a binary IO log
+
+    :param data:
+        contents of the index file
+    :returns:
+        a list of index entries (offset, stream_id, size)
+    :raises ValueError:
+        if the index is corrupted
+    """
+    offset = _parse_binary_header(
+        data, BINARY_IO_LOG_INDEX_MAGIC, BINARY_IO_LOG_VERSION)
+    entry_size = _BINARY_IO_LOG_INDEX_ENTRY.size
+    entry_list = [
+        _BINARY_IO_LOG_INDEX_ENTRY.unpack_from(data, entry_offset)
+        for entry_offset in range(
+            offset, len(data) - entry_size + 1, entry_size)]
+    for entry in entry_list:
+        if entry[1] >= len(_BINARY_IO_LOG_STREAMS):
+            raise ValueError(
+                _("Unsupported IO log stream id: {}").format(entry[1]))
+    return entry_list
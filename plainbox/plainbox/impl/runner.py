@@ -27,12 +27,10 @@
 """
 
 import collections
-import datetime
-import gzip
-import io
 import logging
 import os
 import string
+import threading
 import time
 
 from plainbox.vendor import extcmd
@@ -43,9 +41,9 @@ from plainbox.impl.ctrl import RootViaPTL1ExecutionController
 from plainbox.impl.ctrl import RootViaPkexecExecutionController
 from plainbox.impl.ctrl import RootViaSudoExecutionController
 from plainbox.impl.ctrl import UserJobExecutionController
+from plainbox.impl.result import BinaryIOLogRecordWriter
 from plainbox.impl.result import DiskJobResult
 from plainbox.impl.result import IOLogRecord
-from plainbox.impl.result import IOLogRecordWriter
 from plainbox.impl.result import MemoryJobResult
 from plainbox.impl.signal import Signal
 
@@ -88,7 +86,7 @@ class IOLogRecordGenerator(extcmd.DelegateBase):
 
         Begins tracking time (relative time entries)
         """
-        self.last_msg = datetime.datetime.utcnow()
+        self.last_msg = time.time()
 
     def on_line(self, stream_name, line):
         """
@@ -98,10 +96,10 @@ class IOLogRecordGenerator(extcmd.DelegateBase):
         Maintains a timestamp of the last message so that approximate delay
         between each piece of output can be recorded as well.
         """
-        now = datetime.datetime.utcnow()
+        now = time.time()
         delay = now - self.last_msg
         self.last_msg = now
-        record = IOLogRecord(delay.total_seconds(), stream_name, line)
+        record = IOLogRecord(delay, stream_name, line)
         self.on_new_record(record)
 
     @Signal.define
@@ -111,8 +109,9 @@ class IOLogRecordGenerator(extcmd.DelegateBase):
 
         Called when a new record is generated and needs to be processed.
         """
-        # TRANSLATORS: io means input-output
-        logger.debug(_("io log generated %r"), record)
+        if logger.isEnabledFor(logging.DEBUG):
+            # TRANSLATORS: io means input-output
+            logger.debug(_("io log generated %r"), record)
 
 
 class CommandOutputWriter(extcmd.DelegateBase):
@@ -163,6 +162,206 @@ class CommandOutputWriter(extcmd.DelegateBase):
             self.stderr.write(line)
 
 
+class OutputLimiter(extcmd.DelegateBase):
+    """
+    Delegate for extcmd that passes on a limited amount of output
+
+    At most ``limit`` bytes of output (lines from both streams are counted
+    together) are passed to the wrapped delegate. Lines are never split.
+    Depending on the policy, the limiter keeps:
+
+    ``head``
+        the beginning of the output
+    ``tail``
+        the end of the output
+    ``head-tail``
+        the beginning and the end of the output, each taking (up to) half of
+        the limit
+
+    The beginning of the output is passed on as it arrives. The end is kept
+    in a ring buffer and passed on when the command finishes. Nothing is
+    added to the output itself, the amount of output that was discarded is
+    available as :attr:`truncated_size` and :attr:`truncated_lines` (see also
+    :meth:`get_truncation_message()`). Memory usage is bounded by the limit
+    (plus the longest line).
+    """
+
+    POLICIES = ('head', 'tail', 'head-tail')
+
+    def __init__(self, delegate, limit, policy='head-tail'):
+        """
+        Initialize new limiter
+
+        :param delegate:
+            delegate that gets the retained output
+        :param limit:
+            maximum number of bytes passed to the delegate
+        :param policy:
+            one of :attr:`POLICIES`
+        """
+        if policy not in self.POLICIES:
+            raise ValueError(_("Unsupported policy: {!r}").format(policy))
+        if limit < 0:
+            raise ValueError(_("The limit cannot be negative"))
+        self._delegate = extcmd.SafeDelegate.wrap_if_needed(delegate)
+        self._limit = limit
+        self._policy = policy
+        if policy == 'head':
+            self._head_limit = limit
+        elif policy == 'tail':
+            self._head_limit = 0
+        else:
+            self._head_limit = limit // 2
+        self._reset()
+
+    def __repr__(self):
+        return "<{} limit:{!r} policy:{!r} delegate:{!r}>".format(
+            self.__class__.__name__, self._limit, self._policy,
+            self._delegate)
+
+    def _reset(self):
+        self._head_left = self._head_limit
+        self._tail_limit = None
+        self._tail = collections.deque()
+        self._tail_size = 0
+        self.size = 0
+        self.truncated_size = 0
+        self.truncated_lines = 0
+
+    @property
+    def truncated(self):
+        """
+        flag indicating that some output was discarded
+        """
+        return self.truncated_lines > 0
+
+    def get_truncation_message(self):
+        """
+        Get a message describing the discarded output
+        """
+        return _("{} bytes of output ({} lines) were discarded").format(
+            self.truncated_size, self.truncated_lines)
+
+    def on_begin(self, args, kwargs):
+        """
+        Internal method of extcmd.DelegateBase
+
+        Called when a command is being invoked
+        """
+        self._reset()
+        self._delegate.on_begin(args, kwargs)
+
+    def on_line(self, stream_name, line):
+        """
+        Internal method of extcmd.DelegateBase
+
+        Called for each line of output.
+        """
+        size = len(line)
+        if self._tail_limit is None:
+            if size <= self._head_left:
+                self._head_left -= size
+                self.size += size
+                self._delegate.on_line(stream_name, line)
+                return
+            # Once a line does not fit in the head everything else goes
+            # through the tail (so that lines are never reordered), which
+            # gets whatever is left of the limit.
+            self._tail_limit = self._limit - self.size
+        self._tail.append((stream_name, line))
+        self._tail_size += size
+        while self._tail_size > self._tail_limit:
+            old_stream_name, old_line = self._tail.popleft()
+            self._tail_size -= len(old_line)
+            self.truncated_size += len(old_line)
+            self.truncated_lines += 1
+
+    def on_end(self, returncode):
+        """
+        Internal method of extcmd.DelegateBase
+
+        Called when a command finishes running
+        """
+        while self._tail:
+            stream_name, line = self._tail.popleft()
+            self.size += len(line)
+            self._delegate.on_line(stream_name, line)
+        self._tail_size = 0
+        self._delegate.on_end(returncode)
+
+    def on_interrupt(self):
+        """
+        Internal method of extcmd.DelegateBase
+
+        Called when a command gets interrupted
+        """
+        self._delegate.on_interrupt()
+
+
+class BufferedDelegate(extcmd.DelegateBase):
+    """
+    Delegate for extcmd that passes everything to another delegate at once
+
+    All the calls are recorded and replayed on the wrapped delegate, while
+    holding a lock, when the command finishes. This keeps the output of
+    commands that run at the same time apart.
+    """
+
+    def __init__(self, delegate, lock):
+        """
+        Initialize a new BufferedDelegate
+
+        :param delegate:
+            The delegate to pass everything to
+        :param lock:
+            A lock shared by all the delegates that pass everything to the
+            same delegate
+        """
+        self._delegate = extcmd.SafeDelegate.wrap_if_needed(delegate)
+        self._lock = lock
+        self._call_list = []
+
+    def __repr__(self):
+        return "<{} delegate:{!r}>".format(
+            self.__class__.__name__, self._delegate)
+
+    def on_begin(self, args, kwargs):
+        """
+        Internal method of extcmd.DelegateBase
+
+        Called when a command is being invoked
+        """
+        self._call_list.append((self._delegate.on_begin, (args, kwargs)))
+
+    def on_line(self, stream_name, line):
+        """
+        Internal method of extcmd.DelegateBase
+
+        Called for each line of output
+        """
+        self._call_list.append((self._delegate.on_line, (stream_name, line)))
+
+    def on_interrupt(self):
+        """
+        Internal method of extcmd.DelegateBase
+
+        Called when a command gets interrupted
+        """
+        self._call_list.append((self._delegate.on_interrupt, ()))
+
+    def on_end(self, returncode):
+        """
+        Internal method of extcmd.DelegateBase
+
+        Called when a command finishes running, passes everything on
+        """
+        self._call_list.append((self._delegate.on_end, (returncode,)))
+        call_list, self._call_list = self._call_list, []
+        with self._lock:
+            for func, args in call_list:
+                func(*args)
+
+
 class FallbackCommandOutputPrinter(extcmd.DelegateBase):
     """
     Delegate for extcmd that prints all output to stdout.
@@ -225,6 +424,17 @@ class JobRunner(IJobRunner):
         self._jobs_io_log_dir = jobs_io_log_dir
         self._command_io_delegate = command_io_delegate
         self._dry_run = dry_run
+        # Amount of output kept for all jobs so far, jobs can run
+        # concurrently so this is guarded with a lock
+        self._session_output_size = 0
+        self._session_output_lock = threading.Lock()
+        # State of jobs started with run_job_concurrently(): the per-thread
+        # flag, the commands that are running and the lock that keeps the
+        # output sent to the UI delegate apart
+        self._local = threading.local()
+        self._concurrent_cmd_set = set()
+        self._concurrent_lock = threading.Lock()
+        self._ui_io_lock = threading.Lock()
         self._execution_ctrl_list = [
             RootViaPTL1ExecutionController(session_dir, provider_list),
             RootViaPkexecExecutionController(session_dir, provider_list),
@@ -232,6 +442,9 @@ class JobRunner(IJobRunner):
             RootViaSudoExecutionController(session_dir, provider_list),
             UserJobExecutionController(session_dir, provider_list),
         ]
+        # Execution controller selected for each kind of job, see
+        # _get_ctrl_for_job()
+        self._ctrl_cache = {}
 
     def run_job(self, job, config=None):
         """
@@ -276,6 +489,52 @@ class JobRunner(IJobRunner):
             else:
                 return runner(job, config)
 
+    def run_job_concurrently(self, job, config=None):
+        """
+        Run the specified job, possibly at the same time as other jobs
+
+        :param job:
+            A JobDefinition to run
+        :param config:
+            A PlainBoxConfig that may influence how this job is executed
+        :returns:
+            A IJobResult subclass that describes the result
+
+        This method is just like :meth:`run_job()` but it is meant to be
+        called from worker threads. The output of the command is passed to
+        the UI delegate only when the command is finished, all at once, so
+        that the output of different jobs is not interleaved. The command
+        can be interrupted with :meth:`interrupt_concurrent_jobs()`.
+        """
+        self._local.concurrent = True
+        try:
+            return self.run_job(job, config)
+        finally:
+            self._local.concurrent = False
+
+    def interrupt_concurrent_jobs(self):
+        """
+        Interrupt the commands of all jobs started with
+        :meth:`run_job_concurrently()` that are still running
+
+        Worker threads never see KeyboardInterrupt so this has to be called
+        by the thread that got it.
+        """
+        with self._concurrent_lock:
+            cmd_list = list(self._concurrent_cmd_set)
+        for extcmd_popen in cmd_list:
+            extcmd_popen.interrupt()
+
+    def close(self):
+        """
+        Release any resources held by the execution controllers
+
+        This should be called when no more jobs are going to be executed, in
+        particular it lets any long-lived trusted launchers exit.
+        """
+        for ctrl in self._execution_ctrl_list:
+            ctrl.close()
+
     def run_shell_job(self, job, config):
         """
         Method called to run a job with plugin field equal to 'shell'
@@ -562,27 +821,63 @@ class JobRunner(IJobRunner):
         """
         # Run the embedded command
         start_time = time.time()
-        return_code, record_path = self._run_command(job, config)
+        return_code, record_path, limiter = self._run_limited_command(
+            job, config)
         execution_duration = time.time() - start_time
         # Convert the return of the command to the outcome of the job
         if return_code == 0:
             outcome = IJobResult.OUTCOME_PASS
         else:
             outcome = IJobResult.OUTCOME_FAIL
+        # Note that some of the output was discarded
+        if limiter is not None and limiter.truncated:
+            comments = limiter.get_truncation_message()
+        else:
+            comments = None
         # Create a result object and return it
         return DiskJobResult({
             'outcome': outcome,
             'return_code': return_code,
             'io_log_filename': record_path,
-            'execution_duration': execution_duration
+            'execution_duration': execution_duration,
+            'comments': comments,
         })
 
-    def _prepare_io_handling(self, job, config):
+    def _get_output_limit(self, job, config):
+        """
+        Internal method of JobRunner.
+
+        Computes the number of bytes of output that can be kept for the
+        specified job or None if there is no limit. The limit comes from the
+        job (the output_limit field) or the configuration (job_output_limit)
+        and is reduced to what is left of session_output_limit.
+
+        The output of local and resource jobs is never limited as it is
+        parsed by PlainBox itself. The output of attachment jobs is never
+        limited either, a part of the attached file would be useless.
+        """
+        if job.plugin in ('local', 'resource', 'attachment'):
+            return None
+        limit = job.output_limit
+        if limit is None:
+            limit = getattr(config, 'job_output_limit', 0) or None
+        session_limit = getattr(config, 'session_output_limit', 0)
+        if session_limit:
+            with self._session_output_lock:
+                left = max(0, session_limit - self._session_output_size)
+            if limit is None or limit > left:
+                limit = left
+        return limit
+
+    def _prepare_io_handling(self, job, config, output_limit=None):
         ui_io_delegate = self._command_io_delegate
         # If there is no UI delegate specified create a simple
         # delegate that logs all output to the console
         if ui_io_delegate is None:
             ui_io_delegate = FallbackCommandOutputPrinter(job.id)
+        # Keep the output of jobs that run concurrently apart
+        if getattr(self._local, 'concurrent', False):
+            ui_io_delegate = BufferedDelegate(ui_io_delegate, self._ui_io_lock)
         # Compute a shared base filename for all logging activity associated
         # with this job (aka: the slug)
         slug = slugify(job.id)
@@ -612,11 +907,23 @@ class JobRunner(IJobRunner):
         #
         # Send the third copy to the output writer that writes everything to
         # disk.
-        delegate = extcmd.Chain([ui_io_delegate, io_log_gen, output_writer])
+        #
+        # If the output is limited then an OutputLimiter sits in front of both
+        # the IOLogRecordGenerator and the output writer, the UI still sees
+        # all of the output.
+        if output_limit is None:
+            limiter = None
+            delegate = extcmd.Chain(
+                [ui_io_delegate, io_log_gen, output_writer])
+        else:
+            limiter = OutputLimiter(
+                extcmd.Chain([io_log_gen, output_writer]), output_limit,
+                getattr(config, 'output_truncation', 'head-tail'))
+            delegate = extcmd.Chain([ui_io_delegate, limiter])
         logger.debug(_("job[%s] extcmd delegate: %r"), job.id, delegate)
         # Attach listeners to io_log_gen (the IOLogRecordGenerator instance)
         # One listener appends each record to an array
-        return delegate, io_log_gen
+        return delegate, io_log_gen, limiter
 
     def _run_command(self, job, config):
         """
@@ -624,24 +931,37 @@ class JobRunner(IJobRunner):
 
         :returns: (return_code, record_path) where return_code is the number
         returned by the exiting child process while record_path is a pathname
-        of a gzipped content readable with :class:`IOLogRecordReader`
+        of a file readable with :class:`BinaryIOLogRecordReader`
+        """
+        return_code, record_path, limiter = self._run_limited_command(
+            job, config)
+        return return_code, record_path
+
+    def _run_limited_command(self, job, config):
+        """
+        Run the shell command associated with the specified job.
+
+        :returns: (return_code, record_path, limiter) where return_code and
+        record_path are just as in :meth:`_run_command()` while limiter is
+        the :class:`OutputLimiter` that was used or None if the output was
+        not limited.
         """
         # Bail early if there is nothing do do
         if job.command is None:
-            return None, ()
+            return None, (), None
         # Get an extcmd delegate for observing all the IO the way we need
-        delegate, io_log_gen = self._prepare_io_handling(job, config)
+        delegate, io_log_gen, limiter = self._prepare_io_handling(
+            job, config, self._get_output_limit(job, config))
         # Create a subprocess.Popen() like object that uses the delegate
         # system to observe all IO as it occurs in real time.
         extcmd_popen = extcmd.ExternalCommandWithDelegate(delegate)
         # Stream all IOLogRecord entries to disk
         record_path = os.path.join(
-            self._jobs_io_log_dir, "{}.record.gz".format(
+            self._jobs_io_log_dir, "{}.record.bin".format(
                 slugify(job.id)))
-        with gzip.open(record_path, mode='wb') as gzip_stream, \
-                io.TextIOWrapper(
-                    gzip_stream, encoding='UTF-8') as record_stream:
-            writer = IOLogRecordWriter(record_stream)
+        with open(record_path, mode='wb') as record_stream, \
+                open(record_path + ".index", mode='wb') as index_stream:
+            writer = BinaryIOLogRecordWriter(record_stream, index_stream)
             io_log_gen.on_new_record.connect(writer.write_record)
             # Start the process and wait for it to finish getting the
             # result code. This will actually call a number of callbacks
@@ -651,12 +971,46 @@ class JobRunner(IJobRunner):
             logger.debug(
                 _("job[%s] starting command: %s"), job.id, job.command)
             # Run the job command using extcmd
-            return_code = self._run_extcmd(job, config, extcmd_popen)
+            concurrent = getattr(self._local, 'concurrent', False)
+            if concurrent:
+                with self._concurrent_lock:
+                    self._concurrent_cmd_set.add(extcmd_popen)
+            try:
+                return_code = self._run_extcmd(job, config, extcmd_popen)
+            finally:
+                if concurrent:
+                    with self._concurrent_lock:
+                        self._concurrent_cmd_set.discard(extcmd_popen)
             logger.debug(
                 _("job[%s] command return code: %r"), job.id, return_code)
-        return return_code, record_path
+        if limiter is not None:
+            with self._session_output_lock:
+                self._session_output_size += limiter.size
+        return return_code, record_path, limiter
 
     def _run_extcmd(self, job, config, extcmd_popen):
+        ctrl = self._get_ctrl_for_job(job)
+        # Delegate and execute
+        return ctrl.execute_job(job, config, extcmd_popen)
+
+    def _get_ctrl_for_job(self, job):
+        """
+        Select the execution controller for the specified job
+
+        :returns:
+            the execution controller with the best score
+        :raises RuntimeError:
+            if no controller supports the job
+
+        The score only depends on the type, user, plugin and provider of the
+        job so the selection is cached for each combination of those.
+        """
+        key = (type(job), getattr(job, 'user', None),
+               getattr(job, 'plugin', None), getattr(job, 'provider', None))
+        try:
+            return self._ctrl_cache[key]
+        except KeyError:
+            pass
         # Compute the score of each controller
         ctrl_score = [
             (ctrl, ctrl.get_score(job))
@@ -672,5 +1026,5 @@ class JobRunner(IJobRunner):
         logger.debug(
             _("Selected execution controller %s (score %d) for job %r"),
             ctrl.__class__.__name__, score, job.id)
-        # Delegate and execute
-        return ctrl.execute_job(job, config, extcmd_popen)
+        self._ctrl_cache[key] = ctrl
+        return ctrl
@@ -0,0 +1,436 @@
+# This file is part of Checkbox.
+#
+# Copyright 2014 Canonical Ltd.
+#
+# Checkbox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3,
+# as published by the Free Software Foundation.
+
+#
+# Checkbox is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Checkbox.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+:mod:`plainbox.impl.scheduler` -- concurrent job scheduling
+===========================================================
+
+.. warning::
+
+    THIS MODULE DOES NOT HAVE STABLE PUBLIC API
+"""
+
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from logging import getLogger
+import time
+
+from plainbox.i18n import gettext as _
+
+
+logger = getLogger("plainbox.scheduler")
+
+
+def _interrupt(runner, future_list):
+    """
+    Stop running jobs after the calling thread got KeyboardInterrupt
+
+    Jobs that were not started yet are cancelled and commands of jobs that
+    are running are interrupted. Worker threads never see KeyboardInterrupt
+    so the commands would otherwise keep running.
+    """
+    logger.debug(_("Interrupting concurrently executed jobs"))
+    for future in future_list:
+        future.cancel()
+    runner.interrupt_concurrent_jobs()
+
+
+class ResourceJobScheduler:
+    """
+    Scheduler that runs independent resource jobs concurrently
+
+    Resource jobs are typically executed at the very start of a session and,
+    with a few exceptions, do not depend on one another. The scheduler looks
+    at the (topologically sorted) run list of a session and picks all the
+    resource jobs that don't have a result yet, that don't need to run as
+    another user and that can be started right away. Since a job cannot start
+    before all of its dependencies have a result, jobs picked this way cannot
+    depend on each other and are dispatched, as one batch, to a bounded pool
+    of worker threads that call :meth:`JobRunner.run_job_concurrently()`. The
+    results are stored in the session in the order of the run list,
+    regardless of which job finished first, and the whole process is repeated
+    for as long as new resource jobs become ready.
+
+    Resource jobs that cannot be started or that need to run as another user
+    (these could ask for authentication) are left alone, the caller is
+    expected to handle them (as any other job) later.
+    """
+
+    # Resource jobs mostly wait for external processes so the number of
+    # workers does not need to track the number of available CPUs.
+    DEFAULT_MAX_WORKERS = 8
+
+    def __init__(self, session, runner, config=None, max_workers=None):
+        """
+        Initialize a new scheduler
+
+        :param session:
+            A SessionState instance (or something with a compatible interface)
+            that describes the run list and stores the results.
+        :param runner:
+            A JobRunner instance used to run each job.
+        :param config:
+            A PlainBoxConfig instance passed to
+            :meth:`JobRunner.run_job_concurrently()`
+        :param max_workers:
+            Maximum number of jobs to run at the same time. If left out
+            :attr:`DEFAULT_MAX_WORKERS` is used instead.
+        """
+        if max_workers is None:
+            max_workers = self.DEFAULT_MAX_WORKERS
+        if max_workers < 1:
+            raise ValueError(_("max_workers must be greater than zero"))
+        self._session = session
+        self._runner = runner
+        self._config = config
+        self._max_workers = max_workers
+
+    @property
+    def max_workers(self):
+        """
+        maximum number of jobs that are executed at the same time
+        """
+        return self._max_workers
+
+    def get_ready_job_list(self):
+        """
+        Get a list of resource jobs that can be started right now
+
+        :returns:
+            A list of resource jobs from the run list, in the run list order,
+            that don't have a result yet, that don't need to run as another
+            user and that can be started.
+        """
+        job_state_map = self._session.job_state_map
+        return [
+            job for job in self._session.run_list
+            if job.plugin == 'resource'
+            and job.user is None
+            and job_state_map[job.id].result.outcome is None
+            and job_state_map[job.id].can_start()]
+
+    def run(self, result_callback=None, checkpoint_callback=None):
+        """
+        Run all the resource jobs that can be run
+
+        :param result_callback:
+            An optional callable, called with a job and its result, just after
+            the result of that job is stored in the session. It is always
+            called from the thread that called this method.
+        :param checkpoint_callback:
+            An optional callable, called without arguments, that saves the
+            session. It is called before each batch of jobs is started, with
+            :attr:`SessionMetaData.running_job_name` set to the first job of
+            the batch, and after the results of the batch are stored, with
+            running_job_name reset to None.
+        :returns:
+            A list of (job, result) pairs in the order the results were stored
+            in the session.
+        """
+        start_time = time.time()
+        done_list = []
+        # The set of jobs that were already started, this prevents us from
+        # looping forever if a job ends up without an outcome
+        started_set = set()
+        with ThreadPoolExecutor(self._max_workers) as executor:
+            while True:
+                job_list = [
+                    job for job in self.get_ready_job_list()
+                    if job not in started_set]
+                if not job_list:
+                    break
+                started_set.update(job_list)
+                logger.debug(
+                    _("Running %d resource job(s) concurrently: %s"),
+                    len(job_list), ', '.join(job.id for job in job_list))
+                # Any of the jobs can crash (or reboot) the machine. The
+                # session can only name one of them, the others simply
+                # don't have a result and will be started again.
+                self._session.metadata.running_job_name = job_list[0].id
+                if checkpoint_callback is not None:
+                    checkpoint_callback()
+                future_list = [
+                    executor.submit(
+                        self._runner.run_job_concurrently, job, self._config)
+                    for job in job_list]
+                try:
+                    result_list = [
+                        future.result() for future in future_list]
+                except KeyboardInterrupt:
+                    _interrupt(self._runner, future_list)
+                    raise
+                for job, result in zip(job_list, result_list):
+                    self._session.update_job_result(job, result)
+                    done_list.append((job, result))
+                    if result_callback is not None:
+                        result_callback(job, result)
+                self._session.metadata.running_job_name = None
+                if checkpoint_callback is not None:
+                    checkpoint_callback()
+        if done_list:
+            logger.info(
+                _("Ran %d resource job(s) in %.2f seconds"
+                  " (using up to %d workers)"),
+                len(done_list), time.time() - start_time, self._max_workers)
+        return done_list
+
+
+class ParallelJobScheduler:
+    """
+    Scheduler that runs independent automated jobs concurrently
+
+    The scheduler looks at the (topologically sorted) run list of a session
+    and builds a graph out of the same dependency sets that are used by the
+    :class:`~plainbox.impl.depmgr.DependencySolver`. A job is considered
+    once all of its dependencies are finished. Automated jobs (shell,
+    resource and attachment jobs) that don't need to run as another user and
+    that are not exclusive are dispatched to a bounded pool of worker
+    threads. Everything else (including jobs that cannot be started at all)
+    is handed back, one job at a time, to the caller, on the calling thread,
+    and only after all of the jobs that are running concurrently are
+    finished. This keeps interactive jobs (manual,
+    user-interact, user-verify, ...) serialized on the UI thread and ensures
+    that exclusive jobs, such as suspend, graphics or audio tests, run alone.
+
+    Jobs are considered in the run list order. Once an exclusive job is
+    ready no other jobs are dispatched until it is finished, so that jobs
+    further down the run list cannot starve it.
+    """
+
+    # Plugins of jobs that may be executed concurrently
+    CONCURRENT_PLUGINS = frozenset(['shell', 'resource', 'attachment'])
+
+    # Categories (the part of the partial job identifier before the first
+    # slash) of jobs that are exclusive, even without the 'exclusive' flag
+    EXCLUSIVE_CATEGORIES = frozenset(['suspend', 'graphics', 'audio'])
+
+    def __init__(self, session, runner, config=None, max_workers=1):
+        """
+        Initialize a new scheduler
+
+        :param session:
+            A SessionState instance (or something with a compatible interface)
+            that describes the run list and stores the results.
+        :param runner:
+            A JobRunner instance used to run each concurrent job.
+        :param config:
+            A PlainBoxConfig instance passed to
+            :meth:`JobRunner.run_job_concurrently()`
+        :param max_workers:
+            Maximum number of jobs to run at the same time.
+        """
+        if max_workers < 1:
+            raise ValueError(_("max_workers must be greater than zero"))
+        self._session = session
+        self._runner = runner
+        self._config = config
+        self._max_workers = max_workers
+        self._dep_id_map = {}
+        self._order_map = {}
+
+    @property
+    def max_workers(self):
+        """
+        maximum number of jobs that are executed at the same time
+        """
+        return self._max_workers
+
+    def is_exclusive(self, job):
+        """
+        Check if a job has to run alone
+
+        :param job:
+            A JobDefinition to check
+        :returns:
+            True if the job has the 'exclusive' flag or if it belongs to one
+            of the :attr:`EXCLUSIVE_CATEGORIES`.
+        """
+        if 'exclusive' in job.get_flag_set():
+            return True
+        category = job.partial_id.split('/', 1)[0]
+        return category in self.EXCLUSIVE_CATEGORIES
+
+    def can_run_concurrently(self, job):
+        """
+        Check if a job may be executed concurrently with other jobs
+
+        :param job:
+            A JobDefinition to check
+        :returns:
+            True if the job is an automated, non-exclusive job that does not
+            need to run as another user
+        """
+        return (job.plugin in self.CONCURRENT_PLUGINS
+                and job.user is None
+                and not self.is_exclusive(job))
+
+    def run(self, serial_callback, result_callback=None,
+            checkpoint_callback=None):
+        """
+        Run all the jobs from the run list that don't have a result yet
+
+        :param serial_callback:
+            A callable, called with a job, that is responsible for running
+            that job on the calling thread and for storing the result in the
+            session. It is also used for jobs that cannot be started at all.
+            If it returns True the scheduler stops, after all the running jobs
+            are finished. This is useful when the run list has changed (for
+            example, after running a local job).
+        :param result_callback:
+            An optional callable, called with a job and its result, just after
+            the result of a concurrently executed job is stored in the
+            session. It is always called from the thread that called this
+            method.
+        :param checkpoint_callback:
+            An optional callable, called without arguments, that saves the
+            session. It is called before each job is dispatched to a worker,
+            with :attr:`SessionMetaData.running_job_name` set to that job, and
+            after the results of finished jobs are stored, with
+            running_job_name set to one of the jobs that are still running
+            (or to None). The session can only name one job, if the machine
+            crashes the others simply don't have a result.
+        :returns:
+            True if the scheduler was stopped by serial_callback, False
+            otherwise.
+        """
+        job_state_map = self._session.job_state_map
+        pending_list = [
+            job for job in self._session.run_list
+            if job_state_map[job.id].result.outcome is None]
+        self._order_map = {
+            job.id: index for index, job in enumerate(pending_list)}
+        # Identifiers of jobs that are either pending or running
+        unfinished_id_set = {job.id for job in pending_list}
+        running_map = {}
+        with ThreadPoolExecutor(self._max_workers) as executor:
+            while pending_list or running_map:
+                job = self._get_next_job(
+                    pending_list, unfinished_id_set, running_map)
+                if job is None:
+                    self._wait(
+                        running_map, unfinished_id_set, result_callback,
+                        checkpoint_callback, FIRST_COMPLETED)
+                    continue
+                pending_list.remove(job)
+                if (self.can_run_concurrently(job)
+                        and job_state_map[job.id].can_start()):
+                    logger.debug(_("Running %s concurrently"), job.id)
+                    self._set_running_job(job, checkpoint_callback)
+                    future = executor.submit(
+                        self._runner.run_job_concurrently, job, self._config)
+                    running_map[future] = job
+                    continue
+                # Serial jobs can interact with the user and save the
+                # session so nothing else may be running at the same time
+                self._wait(
+                    running_map, unfinished_id_set, result_callback,
+                    checkpoint_callback)
+                unfinished_id_set.discard(job.id)
+                if serial_callback(job):
+                    return True
+        return False
+
+    def _set_running_job(self, job, checkpoint_callback):
+        """
+        Internal method of ParallelJobScheduler
+
+        Set the running job in the session meta-data and save the session.
+        """
+        self._session.metadata.running_job_name = (
+            job.id if job is not None else None)
+        if checkpoint_callback is not None:
+            checkpoint_callback()
+
+    def _get_next_job(self, pending_list, unfinished_id_set, running_map):
+        """
+        Internal method of ParallelJobScheduler
+
+        Get the first pending job (in the run list order) that can be handled
+        right now or None if the scheduler has to wait for some of the running
+        jobs to finish.
+        """
+        job_state_map = self._session.job_state_map
+        for job in pending_list:
+            if not unfinished_id_set.isdisjoint(self._get_dep_id_set(job)):
+                continue
+            if not job_state_map[job.id].can_start():
+                # The job won't run at all, let the caller deal with it
+                return job
+            if self.can_run_concurrently(job):
+                if len(running_map) < self._max_workers:
+                    return job
+            elif not running_map:
+                return job
+            # Either the pool is busy or this job has to run alone. Don't
+            # look any further so that jobs that come later in the run list
+            # cannot get ahead of this one.
+            return None
+        return None
+
+    def _get_dep_id_set(self, job):
+        """
+        Internal method of ParallelJobScheduler
+
+        Get the set of identifiers of jobs that the specified job depends on.
+        """
+        try:
+            return self._dep_id_map[job.id]
+        except KeyError:
+            dep_id_set = frozenset(
+                dep_id for dep_type, dep_id
+                in job.controller.get_dependency_set(job))
+            self._dep_id_map[job.id] = dep_id_set
+            return dep_id_set
+
+    def _wait(self, running_map, unfinished_id_set, result_callback,
+              checkpoint_callback=None, return_when=None):
+        """
+        Internal method of ParallelJobScheduler
+
+        Wait for some (or all, the default) running jobs to finish and store
+        their results in the session, in the run list order.
+        """
+        if not running_map:
+            return
+        try:
+            if return_when is None:
+                done_set = set(running_map)
+                wait(done_set)
+            else:
+                done_set, not_done_set = wait(
+                    running_map, return_when=return_when)
+        except KeyboardInterrupt:
+            _interrupt(self._runner, list(running_map))
+            raise
+        done_list = sorted(
+            done_set, key=lambda f: self._order_map[running_map[f].id])
+        job_list = [running_map.pop(future) for future in done_list]
+        # Name one of the jobs that are still running, if any
+        running_id_list = sorted(
+            (job.id for job in running_map.values()),
+            key=self._order_map.__getitem__)
+        self._session.metadata.running_job_name = (
+            running_id_list[0] if running_id_list else None)
+        for job, future in zip(job_list, done_list):
+            result = future.result()
+            unfinished_id_set.discard(job.id)
+            self._session.update_job_result(job, result)
+            if result_callback is not None:
+                result_callback(job, result)
+        if checkpoint_callback is not None:
+            checkpoint_callback()
@@ -0,0 +1,383 @@
+# This file is part of Checkbox.
+#
+# Copyright 2014 Canonical Ltd.
+#
+# Checkbox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3,
+# as published by the Free Software Foundation.
+
+#
+# Checkbox is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Checkbox.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+:mod:`plainbox.impl.secure.cache` -- persistent caches
+======================================================
+
+Each invocation of plainbox, checkbox or the trusted launcher loads all of the
+job definitions from all of the providers. Parsing those files (and
+normalizing all of the values) takes a considerable amount of time, even
+though the files almost never change. This module implements a persistent,
+on-disk cache of the records parsed from such files.
+
+Each file has a separate cache entry, keyed by the path, modification time and
+size of the file and by the version of PlainBox. Entries also keep the checksum
+of each record so that job definitions created from cached records don't have
+to compute it (the trusted launcher looks up jobs by checksum). Entries are
+only trusted if they are owned by the current (effective) user and if they
+cannot be modified by anyone else. This matters as the trusted launcher uses
+the cache as well.
+
+The trusted launcher also caches the output of generator (local) jobs, see
+:class:`GeneratorOutputCache`.
+
+.. warning::
+
+    THIS MODULE DOES NOT HAVE STABLE PUBLIC API
+"""
+
+import hashlib
+import json
+import logging
+import os
+import stat
+import tempfile
+import time
+
+from plainbox import __version__ as plainbox_version
+from plainbox.i18n import gettext as _
+from plainbox.impl.secure.job import compute_checksum
+from plainbox.impl.secure.rfc822 import Origin
+from plainbox.impl.secure.rfc822 import RFC822Record
+from plainbox.impl.secure.rfc822 import load_rfc822_records
+
+
+logger = logging.getLogger("plainbox.secure.cache")
+
+
+def _get_cache_home():
+    """
+    Get the base directory for user-specific caches
+
+    :returns: ${XDG_CACHE_HOME:-$HOME/.cache}
+    """
+    xdg_cache_home = os.environ.get('XDG_CACHE_HOME')
+    if not xdg_cache_home:
+        xdg_cache_home = os.path.join(os.path.expanduser('~'), '.cache')
+    return xdg_cache_home
+
+
+def _is_trusted(file_stat):
+    """
+    Check if a file (or directory) can be trusted by the current user
+
+    Trusted files are owned by the current (effective) user and cannot be
+    modified by anyone else.
+    """
+    return (file_stat.st_uid == os.geteuid()
+            and not file_stat.st_mode & (stat.S_IWGRP | stat.S_IWOTH))
+
+
+def _store_file(location, pathname, text):
+    """
+    Atomically store text in a file that only the current user can access
+    """
+    os.makedirs(location, 0o700, exist_ok=True)
+    # mkstemp() creates files that only we can read and write
+    fd, tmp_pathname = tempfile.mkstemp(suffix='.tmp', dir=location)
+    try:
+        with open(fd, 'wt', encoding='UTF-8') as stream:
+            stream.write(text)
+        os.rename(tmp_pathname, pathname)
+    except:
+        os.unlink(tmp_pathname)
+        raise
+
+
+class RFC822RecordCache:
+    """
+    Persistent cache of RFC822 records parsed from text files
+    """
+
+    # Version of the format of cache entries
+    FORMAT_VERSION = 2
+
+    # Files modified this many seconds (or less) before they were loaded are
+    # not cached. They could be modified again without a visible change of the
+    # modification time.
+    RACY_INTERVAL = 2
+
+    def __init__(self, location):
+        """
+        Initialize a cache stored at the specified location
+
+        :param location:
+            pathname of the directory with cache entries. The directory is
+            created when the first entry is stored.
+        """
+        self._location = location
+        self._version = "{}/{}".format(
+            ".".join(str(part) for part in plainbox_version),
+            self.FORMAT_VERSION)
+
+    def __repr__(self):
+        return "<{} location:{!r}>".format(
+            self.__class__.__name__, self._location)
+
+    @property
+    def location(self):
+        """
+        pathname of the directory with cache entries
+        """
+        return self._location
+
+    @classmethod
+    def get_default_location(cls):
+        """
+        Compute the default location of the cache
+
+        :returns: ${XDG_CACHE_HOME:-$HOME/.cache}/plainbox/rfc822
+        """
+        return os.path.join(_get_cache_home(), 'plainbox', 'rfc822')
+
+    def load_rfc822_records(self, filename, text, source=None):
+        """
+        Load RFC822 records from a file, using the cache if possible
+
+        :param filename:
+            pathname of the file the text was read from
+        :param text:
+            the text that was read
+        :param source:
+            source of the text, passed to
+            :func:`~plainbox.impl.secure.rfc822.load_rfc822_records()` and
+            used as the source of the origin of each record
+        :returns:
+            a list of :class:`~plainbox.impl.secure.rfc822.RFC822Record`
+        :raises RFC822SyntaxError:
+            if the text is not valid RFC822. Such files are never cached.
+        """
+        try:
+            file_stat = os.stat(filename)
+        except OSError:
+            file_stat = None
+        if file_stat is not None:
+            key = self._get_key(filename, file_stat)
+            record_list = self._load_entry(key, source)
+            if record_list is not None:
+                logger.debug(_("Loaded %r from cache"), filename)
+                return record_list
+        record_list = load_rfc822_records(text, source=source)
+        if (file_stat is not None
+                and time.time() - file_stat.st_mtime > self.RACY_INTERVAL):
+            self._store_entry(key, record_list)
+        return record_list
+
+    def _get_key(self, filename, file_stat):
+        """
+        Compute the key (a dictionary) that identifies the cache entry
+        """
+        return {
+            "filename": os.path.abspath(filename),
+            "mtime": getattr(file_stat, 'st_mtime_ns', file_stat.st_mtime),
+            "size": file_stat.st_size,
+            "version": self._version,
+        }
+
+    def _get_entry_pathname(self, key):
+        digest = hashlib.sha1(key['filename'].encode("UTF-8")).hexdigest()
+        return os.path.join(self._location, digest + ".json")
+
+    def _load_entry(self, key, source):
+        """
+        Load records from the cache entry identified by key
+
+        :returns:
+            a list of records or None if there is no (valid) entry
+        """
+        pathname = self._get_entry_pathname(key)
+        try:
+            if not _is_trusted(os.stat(self._location)):
+                logger.warning(
+                    _("Ignoring untrusted cache directory %r"),
+                    self._location)
+                return None
+            with open(pathname, 'rt', encoding='UTF-8') as stream:
+                if not _is_trusted(os.fstat(stream.fileno())):
+                    logger.warning(
+                        _("Ignoring untrusted cache entry %r"), pathname)
+                    return None
+                entry = json.load(stream)
+            if entry['key'] != key:
+                return None
+            return [
+                RFC822Record(data, Origin(source, line_start, line_end),
+                             raw_data, data_checksum)
+                for data, raw_data, line_start, line_end, data_checksum
+                in entry['records']]
+        except (OSError, IOError):
+            return None
+        except (ValueError, KeyError, TypeError) as exc:
+            logger.warning(
+                _("Ignoring corrupted cache entry %r: %s"), pathname, exc)
+            return None
+
+    def _store_entry(self, key, record_list):
+        """
+        Store records in the cache entry identified by key
+
+        Problems with storing the entry are logged and otherwise ignored.
+        """
+        pathname = self._get_entry_pathname(key)
+        entry = {
+            "key": key,
+            "records": [
+                [record.data, record.raw_data,
+                 record.origin.line_start, record.origin.line_end,
+                 compute_checksum(record.data)]
+                for record in record_list],
+        }
+        try:
+            _store_file(self._location, pathname,
+                        json.dumps(entry, ensure_ascii=False))
+        except (OSError, IOError) as exc:
+            logger.debug(_("Cannot store cache entry %r: %s"), pathname, exc)
+
+
+class GeneratorOutputCache:
+    """
+    Persistent cache of the output of generator (local) jobs
+
+    The trusted launcher runs the generator of each generated job it is asked
+    to run. A generator that generates many jobs would run once for each of
+    those jobs. This cache keeps the output of generators so that each one
+    runs just once.
+
+    Entries are keyed by the checksum of the generator job and by the
+    environment it runs in. The environment includes the location of the
+    session directory so entries are never shared between sessions. Entries
+    older than :attr:`MAX_AGE` seconds are not used and are eventually
+    removed.
+
+    The output is interpreted as job definitions that the launcher will run
+    (typically as root) so both the cache directory and the entries must be
+    owned by the current (effective) user and cannot be writable by anyone
+    else.
+    """
+
+    MAX_AGE = 24 * 60 * 60
+
+    def __init__(self, location):
+        """
+        Initialize a cache stored at the specified location
+
+        :param location:
+            pathname of the directory with cache entries. The directory is
+            created when the first entry is stored.
+        """
+        self._location = location
+
+    def __repr__(self):
+        return "<{} location:{!r}>".format(
+            self.__class__.__name__, self._location)
+
+    @property
+    def location(self):
+        """
+        pathname of the directory with cache entries
+        """
+        return self._location
+
+    @classmethod
+    def get_default_location(cls):
+        """
+        Compute the default location of the cache
+
+        :returns: ${XDG_CACHE_HOME:-$HOME/.cache}/plainbox/generators
+        """
+        return os.path.join(_get_cache_home(), 'plainbox', 'generators')
+
+    def get_key(self, checksum, env):
+        """
+        Compute the key of the output of a generator
+
+        :param checksum:
+            checksum of the generator job
+        :param env:
+            dictionary with the (additional) environment of the generator
+            or None
+        :returns:
+            a string that identifies the entry
+        """
+        data = json.dumps([checksum, env or {}], sort_keys=True)
+        return hashlib.sha256(data.encode('UTF-8')).hexdigest()
+
+    def _get_entry_pathname(self, key):
+        return os.path.join(self._location, key + ".txt")
+
+    def load(self, key):
+        """
+        Load the output of a generator
+
+        :param key:
+            key computed with :meth:`get_key()`
+        :returns:
+            the output or None if there is no (valid) entry
+        """
+        pathname = self._get_entry_pathname(key)
+        try:
+            if not _is_trusted(os.stat(self._location)):
+                logger.warning(
+                    _("Ignoring untrusted cache directory %r"),
+                    self._location)
+                return None
+            with open(pathname, 'rt', encoding='UTF-8') as stream:
+                entry_stat = os.fstat(stream.fileno())
+                if not _is_trusted(entry_stat):
+                    logger.warning(
+                        _("Ignoring untrusted cache entry %r"), pathname)
+                    return None
+                if time.time() - entry_stat.st_mtime > self.MAX_AGE:
+                    return None
+                return stream.read()
+        except (OSError, IOError, UnicodeDecodeError):
+            return None
+
+    def store(self, key, output):
+        """
+        Store the output of a generator
+
+        :param key:
+            key computed with :meth:`get_key()`
+        :param output:
+            the output of the generator
+
+        Problems with storing the entry are logged and otherwise ignored.
+        Expired entries are removed at the same time.
+        """
+        pathname = self._get_entry_pathname(key)
+        try:
+            _store_file(self._location, pathname, output)
+        except (OSError, IOError) as exc:
+            logger.debug(_("Cannot store cache entry %r: %s"), pathname, exc)
+        else:
+            self._remove_expired_entries()
+
+    def _remove_expired_entries(self):
+        now = time.time()
+        try:
+            name_list = os.listdir(self._location)
+        except OSError:
+            return
+        for name in name_list:
+            pathname = os.path.join(self._location, name)
+            try:
+                if now - os.stat(pathname).st_mtime > self.MAX_AGE:
+                    os.unlink(pathname)
+            except OSError:
+                pass
@@ -32,6 +32,29 @@ import json
 import re
 
 
+def compute_checksum(data):
+    """
+    Compute the checksum of a job definition
+
+    :param data:
+        dictionary with the normalized data of the job definition
+    :returns:
+        the value of :attr:`BaseJob.checksum` of a job with that data
+    """
+    # Ideally we'd use simplejson.dumps() with sorted keys to get
+    # predictable serialization but that's another dependency. To get
+    # something simple that is equally reliable, just sort all the keys
+    # manually and ask standard json to serialize that..
+    sorted_data = collections.OrderedDict(sorted(data.items()))
+    # Compute the canonical form which is arbitrarily defined as sorted
+    # json text with default indent and separator settings.
+    canonical_form = json.dumps(
+        sorted_data, indent=None, separators=(',', ':'))
+    # Compute the sha256 hash of the UTF-8 encoding of the canonical form
+    # and return the hex digest as the checksum that can be displayed.
+    return hashlib.sha256(canonical_form.encode('UTF-8')).hexdigest()
+
+
 class BaseJob:
     """
     Base Job definition class.
@@ -123,18 +146,7 @@ class BaseJob:
         """
         Compute the value for :attr:`checksum`.
         """
-        # Ideally we'd use simplejson.dumps() with sorted keys to get
-        # predictable serialization but that's another dependency. To get
-        # something simple that is equally reliable, just sort all the keys
-        # manually and ask standard json to serialize that..
-        sorted_data = collections.OrderedDict(sorted(self.__data.items()))
-        # Compute the canonical form which is arbitrarily defined as sorted
-        # json text with default indent and separator settings.
-        canonical_form = json.dumps(
-            sorted_data, indent=None, separators=(',', ':'))
-        # Compute the sha256 hash of the UTF-8 encoding of the canonical form
-        # and return the hex digest as the checksum that can be displayed.
-        return hashlib.sha256(canonical_form.encode('UTF-8')).hexdigest()
+        return compute_checksum(self.__data)
 
     def get_environ_settings(self):
         """
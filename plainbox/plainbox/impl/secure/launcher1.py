@@ -24,15 +24,108 @@
 
 import argparse
 import copy
+import json
 import logging
 import os
+import struct
 import subprocess
 
 from plainbox.i18n import gettext as _
 from plainbox.impl.job import JobDefinition
 from plainbox.impl.job import JobOutputTextSource
+from plainbox.impl.secure.cache import GeneratorOutputCache
 from plainbox.impl.secure.providers.v1 import all_providers
 from plainbox.impl.secure.rfc822 import load_rfc822_records, RFC822SyntaxError
+from plainbox.vendor import extcmd
+
+
+# Frames used by the --session mode. Each frame is a header (the type of the
+# frame and the size of the payload) followed by the payload.
+_FRAME_HEADER = struct.Struct("<cI")
+
+# Request to run a job, sent to the launcher. The payload is a JSON object
+# with the following keys: "target" (checksum of the job to run),
+# "target_env" (environment of the job), "generator" (checksum of the
+# generator job or null) and "generator_env" (environment of the generator)
+FRAME_RUN = b'R'
+# Line of output of the job (payload) printed to stdout
+FRAME_STDOUT = b'O'
+# Line of output of the job (payload) printed to stderr
+FRAME_STDERR = b'E'
+# The job has finished, the payload is the return code (a signed 32 bit
+# little-endian integer)
+FRAME_EXIT = b'X'
+
+_RETURN_CODE = struct.Struct("<i")
+
+
+def write_frame(stream, kind, payload):
+    """
+    Write one frame to a binary stream
+
+    :param stream:
+        stream to write to
+    :param kind:
+        one of the FRAME_xxx constants
+    :param payload:
+        bytes to send
+    """
+    stream.write(_FRAME_HEADER.pack(kind, len(payload)))
+    stream.write(payload)
+
+
+def read_frame(stream):
+    """
+    Read one frame from a binary stream
+
+    :param stream:
+        stream to read from
+    :returns:
+        a tuple (kind, payload) or None if the stream ended
+    :raises ValueError:
+        if the stream ended in the middle of a frame
+    """
+    header = stream.read(_FRAME_HEADER.size)
+    if not header:
+        return None
+    if len(header) != _FRAME_HEADER.size:
+        raise ValueError(_("Truncated frame header"))
+    kind, size = _FRAME_HEADER.unpack(header)
+    payload = stream.read(size)
+    if len(payload) != size:
+        raise ValueError(_("Truncated frame payload"))
+    return kind, payload
+
+
+def encode_return_code(return_code):
+    """
+    Encode the return code of a job as payload of a FRAME_EXIT frame
+    """
+    return _RETURN_CODE.pack(return_code)
+
+
+def decode_return_code(payload):
+    """
+    Decode the payload of a FRAME_EXIT frame
+    """
+    return _RETURN_CODE.unpack(payload)[0]
+
+
+class _FrameWriter(extcmd.DelegateBase):
+    """
+    Delegate for extcmd that sends all output as frames
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def on_line(self, stream_name, line):
+        if stream_name == 'stdout':
+            kind = FRAME_STDOUT
+        else:
+            kind = FRAME_STDERR
+        write_frame(self._stream, kind, line)
+        self._stream.flush()
 
 
 class TrustedLauncher:
@@ -40,23 +133,41 @@ class TrustedLauncher:
     Trusted Launcher for v1 jobs.
     """
 
-    def __init__(self):
+    def __init__(self, generator_cache=None):
         """
         Initialize a new instance of the trusted launcher
+
+        :param generator_cache:
+            A GeneratorOutputCache that keeps the output of generator jobs or
+            None. Without the cache each generator job is executed each time
+            it is needed.
         """
         self._job_list = []
+        # Index of the jobs from _job_list, by checksum
+        self._job_map = {}
+        self._generator_cache = generator_cache
+        # Keys of generators whose jobs were already added
+        self._generated_set = set()
 
     def add_job_list(self, job_list):
         """
         Add jobs to the trusted launcher
         """
         self._job_list.extend(job_list)
+        for job in job_list:
+            # The first job with a particular checksum wins
+            self._job_map.setdefault(job.checksum, job)
 
     def find_job(self, checksum):
-        for job in self._job_list:
-            if job.checksum == checksum:
-                return job
-        else:
+        """
+        Find a job with the given checksum
+
+        :raises LookupError:
+            If the checksum does not match any known job
+        """
+        try:
+            return self._job_map[checksum]
+        except (KeyError, TypeError):
             raise LookupError(
                 _("Cannot find job with checksum {}").format(checksum))
 
@@ -92,6 +203,58 @@ class TrustedLauncher:
         cmd = ['bash', '-c', job.command]
         return subprocess.call(cmd, env=self.modify_execution_environment(env))
 
+    def run_session(self, input_stream, output_stream):
+        """
+        Run jobs requested over a pair of streams, until the input ends
+
+        :param input_stream:
+            binary stream with FRAME_RUN frames
+        :param output_stream:
+            binary stream where the output of each job is sent (as a sequence
+            of FRAME_STDOUT and FRAME_STDERR frames) followed by the return
+            code (as a FRAME_EXIT frame)
+        :raises ValueError:
+            if a frame is not a valid request
+
+        Each request is handled just like one invocation of the launcher.
+        Problems with finding a job are reported (on stderr) to the
+        requesting process and the job returns with return code one.
+        """
+        writer = _FrameWriter(output_stream)
+        while True:
+            frame = read_frame(input_stream)
+            if frame is None:
+                break
+            kind, payload = frame
+            if kind != FRAME_RUN:
+                raise ValueError(_("Unexpected frame: {!r}").format(kind))
+            request = json.loads(payload.decode('UTF-8'))
+            return_code = self._run_request(request, writer)
+            write_frame(
+                output_stream, FRAME_EXIT, encode_return_code(return_code))
+            output_stream.flush()
+
+    def _run_request(self, request, writer):
+        try:
+            if request.get('generator'):
+                self._add_generated_jobs(
+                    request['generator'], request.get('generator_env'))
+            job = self.find_job(request['target'])
+        except (LookupError, subprocess.CalledProcessError) as exc:
+            writer.on_line('stderr', "{}\n".format(exc).encode('UTF-8'))
+            return 1
+        cmd = ['bash', '-c', job.command]
+        return extcmd.ExternalCommandWithDelegate(writer).call(
+            cmd, env=self.modify_execution_environment(
+                request.get('target_env')))
+
+    def _add_generated_jobs(self, checksum, env):
+        # Each generator (with a particular environment) runs just once
+        key = (checksum, json.dumps(env or {}, sort_keys=True))
+        if key not in self._generated_set:
+            self.add_job_list(self.run_local_job(checksum, env))
+            self._generated_set.add(key)
+
     def run_local_job(self, checksum, env):
         """
         Run a job with and interpret the stdout as a job definition.
@@ -104,12 +267,24 @@ class TrustedLauncher:
             A list of job definitions that were parsed out of the output.
         :raises LookupError:
             If the checksum does not match any known job
+
+        If the launcher has a generator cache then the job is executed only if
+        its output (in this environment) is not in the cache yet.
         """
         job = self.find_job(checksum)
-        cmd = ['bash', '-c', job.command]
-        output = subprocess.check_output(
-            cmd, universal_newlines=True,
-            env=self.modify_execution_environment(env))
+        output = None
+        if self._generator_cache is not None:
+            key = self._generator_cache.get_key(checksum, env)
+            output = self._generator_cache.load(key)
+            if output is not None:
+                logging.debug(_("Using cached output of %s"), job)
+        if output is None:
+            cmd = ['bash', '-c', job.command]
+            output = subprocess.check_output(
+                cmd, universal_newlines=True,
+                env=self.modify_execution_environment(env))
+            if self._generator_cache is not None:
+                self._generator_cache.store(key, output)
         job_list = []
         source = JobOutputTextSource(job)
         try:
@@ -166,6 +341,27 @@ class UpdateAction(argparse.Action):
         setattr(namespace, self.dest, items)
 
 
+def serve_session(launcher):
+    """
+    Run jobs requested over stdin, sending the output over stdout
+
+    :param launcher:
+        the TrustedLauncher that runs the jobs
+
+    Before starting the session the protocol streams are moved away from file
+    descriptors zero and one. Jobs and anything else writing to stdout (or
+    reading from stdin) cannot interfere with the session that way. Stray
+    output goes to stderr instead.
+    """
+    input_stream = open(os.dup(0), 'rb')
+    output_stream = open(os.dup(1), 'wb')
+    with open(os.devnull, 'rb') as devnull:
+        os.dup2(devnull.fileno(), 0)
+    os.dup2(2, 1)
+    with input_stream, output_stream:
+        launcher.run_session(input_stream, output_stream)
+
+
 def main(argv=None):
     """
     Entry point for the plainbox-trusted-launcher-1
@@ -175,7 +371,7 @@ def main(argv=None):
         used instead.
     :returns:
         The return code of the job that was selected with the --target argument
-        or zero if the --warmup argument was specified.
+        or zero if the --warmup or --session argument was specified.
     :raises:
         SystemExit if --taget or --generator point to unknown jobs.
 
@@ -194,6 +390,12 @@ def main(argv=None):
     rule is the way --via argument is handled, where the trusted launcher needs
     to capture stdout to interpret that as job definitions.
 
+    With the --session argument the trusted launcher runs any number of jobs,
+    requested over stdin, and sends their output back over stdout (see
+    :meth:`TrustedLauncher.run_session()`). This way pkexec(1) has to
+    authenticate the user and the providers have to be loaded just once for
+    all of the jobs.
+
     Unlike sudo, the trusted launcher is not a setuid program and cannot grant
     root access in itself. Instead it relies on a policykit and specifically on
     pkexec(1) alongside with an appropriate policy file, to grant users a way
@@ -210,6 +412,10 @@ def main(argv=None):
         '-t', '--target',
         metavar=_('CHECKSUM'),
         help=_('run a job with this checksum'))
+    group.add_argument(
+        '-s', '--session',
+        action='store_true',
+        help=_('run jobs requested over stdin until it is closed'))
     group = parser.add_argument_group(_("target job specification"))
     group.add_argument(
         '-T', '--target-environment', metavar=_('NAME=VALUE'),
@@ -236,12 +442,17 @@ def main(argv=None):
     # Just quit if warming up
     if ns.warmup:
         return 0
-    launcher = TrustedLauncher()
+    launcher = TrustedLauncher(
+        GeneratorOutputCache(GeneratorOutputCache.get_default_location()))
     # Siphon all jobs from all secure providers otherwise
     all_providers.load()
     for plugin in all_providers.get_all_plugins():
         launcher.add_job_list(
             plugin.plugin_object.get_builtin_jobs())
+    # Run jobs requested by the other side of stdin/stdout
+    if ns.session:
+        serve_session(launcher)
+        return 0
     # Run the local job and feed the result back to the launcher
     if ns.generator:
         try:
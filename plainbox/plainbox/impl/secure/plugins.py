@@ -402,7 +402,7 @@ class FsPlugInCollection(PlugInCollectionBase):
     """
 
     def __init__(self, dir_list, ext, load=False, wrapper=PlugIn,
-                 *wrapper_args, **wrapper_kwargs):
+                 *wrapper_args, preprocess=None, **wrapper_kwargs):
         """
         Initialize a collection of plug-ins from the specified name-space.
 
@@ -416,6 +416,12 @@ class FsPlugInCollection(PlugInCollectionBase):
             wrapper class for all loaded objects, defaults to :class:`PlugIn`
         :param wrapper_args:
             additional arguments passed to each instantiated wrapper
+        :param preprocess:
+            an optional function, called with the name and the text of each
+            plugin file by :meth:`prefetch()`. The return value is passed to
+            the wrapper instead of the text. It may raise :class:`PlugInError`
+            to report a broken plug-in. As it may run in another process it
+            must be possible to pickle the function.
         :param wrapper_kwargs:
             additional keyword arguments passed to each instantiated wrapper
         """
@@ -424,8 +430,29 @@ class FsPlugInCollection(PlugInCollectionBase):
             raise TypeError("dir_list needs to be List[str]")
         self._dir_list = dir_list
         self._ext = ext
+        self._preprocess = preprocess
+        self._pending_list = None
         super().__init__(load, wrapper, *wrapper_args, **wrapper_kwargs)
 
+    def prefetch(self, executor):
+        """
+        Start loading all plug-ins in the background.
+
+        :param executor:
+            a :class:`concurrent.futures.Executor` used to read (and
+            preprocess) all of the plugin files
+
+        This method only submits the work to the executor. A subsequent call
+        to :meth:`load()` waits for the results and wraps them in the same
+        order (and with the same problems) as if they were loaded directly.
+        """
+        if self._loaded or self._pending_list is not None:
+            return
+        self._pending_list = [
+            (filename, executor.submit(
+                _read_plugin_file, filename, self._preprocess))
+            for filename in sorted(self._get_plugin_files())]
+
     def load(self):
         """
         Load all plug-ins.
@@ -436,6 +463,9 @@ class FsPlugInCollection(PlugInCollectionBase):
         if self._loaded:
             return
         self._loaded = True
+        if self._pending_list is not None:
+            self._load_prefetched()
+            return
         iterator = self._get_plugin_files()
         for filename in sorted(iterator):
             try:
@@ -447,6 +477,25 @@ class FsPlugInCollection(PlugInCollectionBase):
             else:
                 self.wrap_and_add_plugin(filename, text)
 
+    def _load_prefetched(self):
+        """
+        Wrap all of the plugin objects computed after :meth:`prefetch()`
+        """
+        pending_list = self._pending_list
+        self._pending_list = None
+        for filename, future in pending_list:
+            try:
+                obj = future.result()
+            except (OSError, IOError) as exc:
+                logger.error(_("Unable to load %r: %s"), filename, str(exc))
+                self._problem_list.append(exc)
+            except PlugInError as exc:
+                logger.warning(
+                    _("Unable to prepare plugin %s: %s"), filename, exc)
+                self._problem_list.append(exc)
+            else:
+                self.wrap_and_add_plugin(filename, obj)
+
     def _get_plugin_files(self):
         """
         Enumerate (generate) all plugin files according to 'path' and 'ext'
@@ -477,3 +526,17 @@ class FsPlugInCollection(PlugInCollectionBase):
                 if not os.path.isfile(info_file):
                     continue
                 yield info_file
+
+
+def _read_plugin_file(filename, preprocess):
+    """
+    Read (and optionally preprocess) one plugin file.
+
+    This is a helper for :meth:`FsPlugInCollection.prefetch()` that may run
+    in another process.
+    """
+    with open(filename, encoding='UTF-8') as stream:
+        text = stream.read()
+    if preprocess is not None:
+        return preprocess(filename, text)
+    return text
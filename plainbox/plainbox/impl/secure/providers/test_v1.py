@@ -26,6 +26,7 @@ Test definitions for plainbox.impl.secure.providers.v1 module
 
 from unittest import TestCase
 import os
+import pickle
 
 from plainbox.impl.job import JobDefinition
 from plainbox.impl.secure.config import Unset
@@ -40,6 +41,7 @@ from plainbox.impl.secure.providers.v1 import Provider1Definition
 from plainbox.impl.secure.providers.v1 import Provider1PlugIn
 from plainbox.impl.secure.providers.v1 import VersionValidator
 from plainbox.impl.secure.providers.v1 import WhiteListPlugIn
+from plainbox.impl.secure.providers.v1 import load_job_records
 from plainbox.impl.secure.qualifiers import WhiteList
 from plainbox.impl.secure.rfc822 import FileTextSource
 from plainbox.impl.secure.rfc822 import Origin
@@ -629,6 +631,35 @@ class JobDefintionPlugInTests(TestCase):
             ("Cannot load job definitions from '/path/to/jobs.txt': "
              "Unexpected non-empty line: 'broken' (line 1)"))
 
+    def test_init_with_records(self):
+        """
+        verify that JobDefinitionPlugIn() can be initialized with records
+        that were parsed (possibly in another process) by load_job_records()
+        """
+        records = pickle.loads(pickle.dumps(load_job_records(
+            "/path/to/jobs.txt", (
+                "id: test/job\n"
+                "plugin: shell\n"
+                "command: true\n"))))
+        plugin = JobDefinitionPlugIn(
+            "/path/to/jobs.txt", records, self.provider)
+        self.assertEqual(plugin.plugin_object, self.plugin.plugin_object)
+        self.assertEqual(
+            plugin.plugin_object[0].origin,
+            Origin(FileTextSource("/path/to/jobs.txt"), 1, 3))
+        self.assertIs(plugin.plugin_object[0].provider, self.provider)
+
+    def test_load_job_records_failing(self):
+        """
+        verify that load_job_records() raises PlugInError on broken files
+        """
+        with self.assertRaises(PlugInError) as boom:
+            load_job_records("/path/to/jobs.txt", "broken")
+        self.assertEqual(
+            str(boom.exception),
+            ("Cannot load job definitions from '/path/to/jobs.txt': "
+             "Unexpected non-empty line: 'broken' (line 1)"))
+
 
 class Provider1Tests(TestCase):
 
@@ -874,6 +905,17 @@ class Provider1Tests(TestCase):
         self.assertEqual(job_list[0].partial_id, "working")
         self.assertEqual(problem_list, fake_problems)
 
+    def test_prefetch_jobs(self):
+        """
+        verify that Provider1.prefetch_jobs() starts loading job definitions
+        with the specified executor
+        """
+        executor = mock.Mock(name='executor')
+        with mock.patch.object(
+                self.provider._job_collection, 'prefetch') as mock_prefetch:
+            self.provider.prefetch_jobs(executor)
+        mock_prefetch.assert_called_once_with(executor)
+
     def test_get_all_executables(self):
         self.skipTest("not implemented")
 
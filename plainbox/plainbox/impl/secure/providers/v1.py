@@ -23,6 +23,7 @@
 """
 
 import errno
+import functools
 import gettext
 import itertools
 import logging
@@ -31,6 +32,7 @@ import os
 from plainbox.abc import IProvider1, IProviderBackend1
 from plainbox.i18n import gettext as _
 from plainbox.impl.job import JobDefinition
+from plainbox.impl.secure.cache import RFC822RecordCache
 from plainbox.impl.secure.config import Config, Variable
 from plainbox.impl.secure.config import IValidator
 from plainbox.impl.secure.config import NotEmptyValidator
@@ -81,26 +83,61 @@ class WhiteListPlugIn(IPlugIn):
         return self._whitelist
 
 
+def load_job_records(filename, text, record_cache=None):
+    """
+    Load RFC822 records from the text of a job definition file
+
+    :param filename:
+        name of the file the text was read from
+    :param text:
+        text of the file
+    :param record_cache:
+        An optional :class:`~plainbox.impl.secure.cache.RFC822RecordCache`
+        used to avoid parsing files that were parsed before
+    :returns:
+        a list of :class:`~plainbox.impl.secure.rfc822.RFC822Record`
+    :raises PlugInError:
+        if the text cannot be parsed
+
+    This function is used as the preprocessing step of job definition files
+    so it may be called in another process.
+    """
+    try:
+        if record_cache is not None:
+            return record_cache.load_rfc822_records(
+                filename, text, source=FileTextSource(filename))
+        else:
+            return load_rfc822_records(text, source=FileTextSource(filename))
+    except RFC822SyntaxError as exc:
+        raise PlugInError(
+            _("Cannot load job definitions from {!r}: {}").format(
+                filename, exc))
+
+
 class JobDefinitionPlugIn(IPlugIn):
     """
     A specialized :class:`plainbox.impl.secure.plugins.IPlugIn` that loads a
     list of :class:`plainbox.impl.job.JobDefinition` instances from a file.
     """
 
-    def __init__(self, filename, text, provider):
+    def __init__(self, filename, text, provider, record_cache=None):
         """
         Initialize the plug-in with the specified name text
+
+        :param text:
+            The text of the file or a list of records that were already
+            parsed from it (see :func:`load_job_records()`)
+        :param record_cache:
+            An optional :class:`~plainbox.impl.secure.cache.RFC822RecordCache`
+            used to avoid parsing files that were parsed before
         """
         self._filename = filename
         self._job_list = []
         logger.debug(_("Loading jobs definitions from %r..."), filename)
-        try:
-            records = load_rfc822_records(
-                text, source=FileTextSource(filename))
-        except RFC822SyntaxError as exc:
-            raise PlugInError(
-                _("Cannot load job definitions from {!r}: {}").format(
-                    filename, exc))
+        if isinstance(text, str):
+            records = load_job_records(filename, text, record_cache)
+        else:
+            records = text
         for record in records:
             try:
                 job = JobDefinition.from_rfc822_record(record)
@@ -142,7 +179,7 @@ class Provider1(IProvider1, IProviderBackend1):
 
     def __init__(self, name, version, description, secure, gettext_domain,
                  jobs_dir, whitelists_dir, data_dir, bin_dir, locale_dir,
-                 base_dir):
+                 base_dir, record_cache=None):
         """
         Initialize a provider with a set of meta-data and directories.
 
@@ -187,6 +224,10 @@ class Provider1(IProvider1, IProviderBackend1):
             path of the directory with (perhaps) all of jobs_dir,
             whitelist_dir, data_dir, bin_dir, locale_dir. This may be None.
             This is also the effective value of $CHECKBOX_SHARE
+
+        :param record_cache:
+            An optional :class:`~plainbox.impl.secure.cache.RFC822RecordCache`
+            used to avoid parsing job definition files that were parsed before
         """
         # Meta-data
         self._name = name
@@ -215,13 +256,16 @@ class Provider1(IProvider1, IProviderBackend1):
             jobs_dir_list = []
         self._job_collection = FsPlugInCollection(
             jobs_dir_list, ext=(".txt", ".txt.in"),
-            wrapper=JobDefinitionPlugIn, provider=self)
+            wrapper=JobDefinitionPlugIn,
+            preprocess=functools.partial(
+                load_job_records, record_cache=record_cache),
+            provider=self, record_cache=record_cache)
         # Setup translations
         if gettext_domain and locale_dir:
             gettext.bindtextdomain(self._gettext_domain, self._locale_dir)
 
     @classmethod
-    def from_definition(cls, definition, secure):
+    def from_definition(cls, definition, secure, record_cache=None):
         """
         Initialize a provider from Provider1Definition object
 
@@ -232,6 +276,10 @@ class Provider1(IProvider1, IProviderBackend1):
             Value of the secure flag. This cannot be expressed by a definition
             object.
 
+        :param record_cache:
+            An optional :class:`~plainbox.impl.secure.cache.RFC822RecordCache`
+            passed to the provider
+
         This method simplifies initialization of a Provider1 object where the
         caller already has a Provider1Definition object. Depending on the value
         of ``definition.location`` all of the directories are either None or
@@ -248,7 +296,8 @@ class Provider1(IProvider1, IProviderBackend1):
             secure, definition.effective_gettext_domain,
             definition.effective_jobs_dir, definition.effective_whitelists_dir,
             definition.effective_data_dir, definition.effective_bin_dir,
-            definition.effective_locale_dir, definition.location or None)
+            definition.effective_locale_dir, definition.location or None,
+            record_cache)
 
     def __repr__(self):
         return "<{} name:{!r}>".format(self.__class__.__name__, self.name)
@@ -457,6 +506,21 @@ class Provider1(IProvider1, IProviderBackend1):
         problem_list = self._job_collection.problem_list
         return job_list, problem_list
 
+    def prefetch_jobs(self, executor):
+        """
+        Start loading all of the job definitions in the background.
+
+        :param executor:
+            A :class:`concurrent.futures.Executor` used to read and parse all
+            of the job definition files.
+
+        The results are collected by the next call to :meth:`load_all_jobs()`
+        which behaves exactly as if the files were loaded directly. Calling
+        this method on several providers before loading jobs from any of them
+        allows all of the files to be parsed concurrently.
+        """
+        self._job_collection.prefetch(executor)
+
     def get_all_executables(self):
         """
         Discover and return all executables offered by this provider
@@ -841,9 +905,13 @@ class Provider1PlugIn(IPlugIn):
     files
     """
 
-    def __init__(self, filename, definition_text):
+    def __init__(self, filename, definition_text, record_cache=None):
         """
         Initialize the plug-in with the specified name and external object
+
+        :param record_cache:
+            An optional :class:`~plainbox.impl.secure.cache.RFC822RecordCache`
+            passed to the provider
         """
         definition = Provider1Definition()
         # Load the provider definition
@@ -858,7 +926,8 @@ class Provider1PlugIn(IPlugIn):
         # Get the secure flag
         secure = os.path.dirname(filename) in get_secure_PROVIDERPATH_list()
         # Initialize the provider object
-        self._provider = Provider1.from_definition(definition, secure)
+        self._provider = Provider1.from_definition(
+            definition, secure, record_cache)
 
     def __repr__(self):
         return "<{!s} plugin_name:{!r}>".format(
@@ -913,7 +982,10 @@ class SecureProvider1PlugInCollection(FsPlugInCollection):
 
     def __init__(self):
         dir_list = get_secure_PROVIDERPATH_list()
-        super().__init__(dir_list, '.provider', wrapper=Provider1PlugIn)
+        record_cache = RFC822RecordCache(
+            RFC822RecordCache.get_default_location())
+        super().__init__(dir_list, '.provider', wrapper=Provider1PlugIn,
+                         record_cache=record_cache)
 
 
 # Collection of all providers
@@ -220,11 +220,23 @@ class Origin:
         return origin
 
 
+_DOT_MARKER_RE = re.compile('^(\\s*)\\.$', re.M)
+
+
 def normalize_rfc822_value(value):
+    # Single-line values only need to be stripped (and the multi-line dot
+    # marker on its own is an empty string)
+    if "\n" not in value:
+        if value.lstrip() == ".":
+            return ""
+        return value.strip()
     # Remove the multi-line dot marker
-    value = re.sub('^(\s*)\.$', '\\1', value, flags=re.M)
-    # Remove consistent indentation
-    value = textwrap.dedent(value)
+    if "." in value:
+        value = _DOT_MARKER_RE.sub('\\1', value)
+    # Remove consistent indentation. This is not needed if no line starts
+    # with whitespace as textwrap.dedent() would not change anything.
+    if value[:1] in (" ", "\t") or "\n " in value or "\n\t" in value:
+        value = textwrap.dedent(value)
     # Strip the remaining whitespace
     value = value.strip()
     return value
@@ -246,7 +258,7 @@ class RFC822Record:
     file/stream where it was parsed from).
     """
 
-    def __init__(self, data, origin=None, raw_data=None):
+    def __init__(self, data, origin=None, raw_data=None, data_checksum=None):
         """
         Initialize a new record.
 
@@ -258,6 +270,9 @@ class RFC822Record:
             An optional dictionary with raw record data. If omitted then it
             will default to normalized data (as the same object, without making
             a copy)
+        :param data_checksum:
+            An optional, precomputed checksum of the normalized data, see
+            :func:`plainbox.impl.secure.job.compute_checksum()`
         """
         self._data = data
         if raw_data is None:
@@ -266,6 +281,7 @@ class RFC822Record:
         if origin is None:
             origin = Origin.get_caller_origin()
         self._origin = origin
+        self._data_checksum = data_checksum
 
     def __repr__(self):
         return "<{} data:{!r} origin:{!r}>".format(
@@ -313,6 +329,16 @@ class RFC822Record:
         """
         return self._origin
 
+    @property
+    def data_checksum(self):
+        """
+        The precomputed checksum of the normalized data or None
+
+        This is only known for records loaded from
+        :class:`plainbox.impl.secure.cache.RFC822RecordCache`.
+        """
+        return self._data_checksum
+
     def dump(self, stream):
         """
         Dump this record to a stream
@@ -422,10 +448,6 @@ def gen_rfc822_records(stream, data_cls=dict, source=None):
     the optional data_cls argument is collections.OrderedDict then the values
     retain their original ordering.
     """
-    record = None
-    key = None
-    value_list = None
-    origin = None
     # If the source was not provided then try constructing a FileTextSource
     # from the name of the stream. If that fails, keep using None.
     if source is None:
@@ -433,6 +455,9 @@ def gen_rfc822_records(stream, data_cls=dict, source=None):
             source = FileTextSource(stream.name)
         except AttributeError:
             source = UnknownTextSource()
+    # Logging each line is expensive (even when the message is discarded) so
+    # only do it if someone is actually listening.
+    debug = logger.isEnabledFor(logging.DEBUG)
 
     def _syntax_error(msg):
         """
@@ -444,95 +469,60 @@ def gen_rfc822_records(stream, data_cls=dict, source=None):
             filename = None
         return RFC822SyntaxError(filename, lineno, msg)
 
-    def _new_record():
-        """
-        Reset local state to track new record
-        """
-        nonlocal key
-        nonlocal value_list
-        nonlocal record
-        nonlocal origin
-        key = None
-        value_list = None
-        if source is not None:
-            origin = Origin(source, None, None)
-        record = RFC822Record(data_cls(), origin, data_cls())
-
-    def _commit_key_value_if_needed():
-        """
-        Finalize the most recently seen key: value pair
-        """
-        nonlocal key
-        if key is not None:
-            raw_value = ''.join(value_list)
-            normalized_value = normalize_rfc822_value(raw_value)
-            record.raw_data[key] = raw_value
-            record.data[key] = normalized_value
-            logger.debug(_("Committed key/value %r=%r"), key, normalized_value)
-            key = None
-
-    def _set_start_lineno_if_needed():
-        """
-        Remember the line number of the record start unless already set
-        """
-        if origin and record.origin.line_start is None:
-            record.origin.line_start = lineno
-
-    def _update_end_lineno():
-        """
-        Update the line number of the record tail
-        """
-        if origin:
-            record.origin.line_end = lineno
-
     # Start with an empty record
-    _new_record()
+    origin = Origin(source, None, None)
+    data = data_cls()
+    raw_data = data_cls()
+    key = None
+    value_list = None
+    lineno = 0
     # Support simple text strings
     if isinstance(stream, str):
         # keepends=True (python3.2 has no keyword for this)
-        stream = iter(stream.splitlines(True))
+        stream = stream.splitlines(True)
     # Iterate over subsequent lines of the stream
     for lineno, line in enumerate(stream, start=1):
-        logger.debug(_("Looking at line %d:%r"), lineno, line)
-        # Treat # as comments
-        if line.startswith("#"):
-            pass
-        # Treat empty lines as record separators
-        elif line.strip() == "":
-            # Commit the current record so that the multi-line value of the
-            # last key, if any, is saved as a string
-            _commit_key_value_if_needed()
-            # If data is non-empty, yield the record, this allows us to safely
-            # use newlines for formatting
-            if record.data:
-                logger.debug(_("yielding record: %r"), record)
-                yield record
-            # Reset local state so that we can build a new record
-            _new_record()
+        if debug:
+            logger.debug(_("Looking at line %d:%r"), lineno, line)
         # Treat lines staring with whitespace as multi-line continuation of the
         # most recently seen key-value
-        elif line.startswith(" "):
-            if key is None:
+        if line.startswith(" "):
+            if line.strip() == "":
+                # This is actually an empty line, see below
+                pass
+            elif key is None:
                 # If we have not seen any keys yet then this is a syntax error
                 raise _syntax_error(_("Unexpected multi-line value"))
-            # Strip the initial space. This matches the behavior of xgettext
-            # scanning our job definitions with multi-line values.
-            line = line[1:]
-            # Append the current line to the list of values of the most recent
-            # key. This prevents quadratic complexity of string concatenation
-            value_list.append(line)
-            # Update the end line location of this record
-            _update_end_lineno()
+            else:
+                # Strip the initial space. This matches the behavior of
+                # xgettext scanning our job definitions with multi-line values.
+                # Append the current line to the list of values of the most
+                # recent key. This prevents quadratic complexity of string
+                # concatenation
+                value_list.append(line[1:])
+                # Update the end line location of this record
+                origin.line_end = lineno
+                continue
+        # Treat # as comments
+        elif line.startswith("#"):
+            continue
         # Treat lines with a colon as new key-value pairs
         elif ":" in line:
             # Since this is actual data let's try to remember where it came
             # from. This may be a no-operation if there were any preceding
             # key-value pairs.
-            _set_start_lineno_if_needed()
+            if origin.line_start is None:
+                origin.line_start = lineno
             # Since we have a new, key-value pair we need to commit any
             # previous key that we may have (regardless of multi-line or
             # single-line values).
-            _commit_key_value_if_needed()
+            if key is not None:
+                raw_value = ''.join(value_list)
+                raw_data[key] = raw_value
+                data[key] = normalize_rfc822_value(raw_value)
+                if debug:
+                    logger.debug(
+                        _("Committed key/value %r=%r"), key, data[key])
             # Parse the line by splitting on the colon, getting rid of
             # all surrounding whitespace from the key and getting rid of the
             # leading whitespace from the value.
@@ -540,11 +530,11 @@ def gen_rfc822_records(stream, data_cls=dict, source=None):
             key = key.strip()
             value = value.lstrip()
             # Check if the key already exist in this message
-            if key in record.data:
+            if key in data:
                 raise _syntax_error(_(
                     "Job has a duplicate key {!r} "
                     "with old value {!r} and new value {!r}"
-                ).format(key, record.raw_data[key], value))
+                ).format(key, raw_data[key], value))
             if value.strip() != "":
                 # Construct initial value list out of the (only) value that we
                 # have so far. Additional multi-line values will just append to
@@ -555,14 +545,43 @@ def gen_rfc822_records(stream, data_cls=dict, source=None):
                 # newlines there are discarded
                 value_list = []
             # Update the end-line location
-            _update_end_lineno()
+            origin.line_end = lineno
+            continue
         # Treat all other lines as syntax errors
-        else:
+        elif line.strip() != "":
             raise _syntax_error(
                 _("Unexpected non-empty line: {!r}").format(line))
+        # Treat empty lines as record separators. Commit the current record so
+        # that the multi-line value of the last key, if any, is saved as a
+        # string
+        if key is not None:
+            raw_value = ''.join(value_list)
+            raw_data[key] = raw_value
+            data[key] = normalize_rfc822_value(raw_value)
+            if debug:
+                logger.debug(_("Committed key/value %r=%r"), key, data[key])
+            key = None
+        # If data is non-empty, yield the record, this allows us to safely
+        # use newlines for formatting
+        if data:
+            record = RFC822Record(data, origin, raw_data)
+            if debug:
+                logger.debug(_("yielding record: %r"), record)
+            yield record
+            # Reset local state so that we can build a new record
+            origin = Origin(source, None, None)
+            data = data_cls()
+            raw_data = data_cls()
     # Make sure to commit the last key from the record
-    _commit_key_value_if_needed()
+    if key is not None:
+        raw_value = ''.join(value_list)
+        raw_data[key] = raw_value
+        data[key] = normalize_rfc822_value(raw_value)
+        if debug:
+            logger.debug(_("Committed key/value %r=%r"), key, data[key])
     # Once we've seen the whole file return the last record, if any
-    if record.data:
-        logger.debug(_("yielding record: %r"), record)
+    if data:
+        record = RFC822Record(data, origin, raw_data)
+        if debug:
+            logger.debug(_("yielding record: %r"), record)
         yield record
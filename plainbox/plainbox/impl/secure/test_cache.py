@@ -0,0 +1,306 @@
+# This file is part of Checkbox.
+#
+# Copyright 2014 Canonical Ltd.
+#
+# Checkbox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3,
+# as published by the Free Software Foundation.
+
+#
+# Checkbox is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Checkbox.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+plainbox.impl.secure.test_cache
+===============================
+
+Test definitions for plainbox.impl.secure.cache module
+"""
+
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+import os
+import time
+
+from plainbox.impl.secure.cache import GeneratorOutputCache
+from plainbox.impl.secure.cache import RFC822RecordCache
+from plainbox.impl.secure.job import compute_checksum
+from plainbox.impl.secure.providers.v1 import JobDefinitionPlugIn
+from plainbox.impl.secure.rfc822 import FileTextSource
+from plainbox.impl.secure.rfc822 import RFC822SyntaxError
+from plainbox.impl.secure.rfc822 import load_rfc822_records
+from plainbox.vendor import mock
+
+
+class RFC822RecordCacheTests(TestCase):
+
+    text = (
+        "id: foo\n"
+        "plugin: shell\n"
+        "command: echo foo\n"
+        "_description:\n"
+        " Foo\n"
+        " .\n"
+        " Foo foo\n"
+        "\n"
+        "id: bar\n"
+        "plugin: manual\n")
+
+    def setUp(self):
+        self.scratch_dir = TemporaryDirectory()
+        self.filename = os.path.join(self.scratch_dir.name, "jobs.txt")
+        self.cache = RFC822RecordCache(
+            os.path.join(self.scratch_dir.name, "cache"))
+        self.write(self.text)
+
+    def tearDown(self):
+        self.scratch_dir.cleanup()
+
+    def write(self, text, age=60):
+        with open(self.filename, "wt", encoding="UTF-8") as stream:
+            stream.write(text)
+        mtime = time.time() - age
+        os.utime(self.filename, (mtime, mtime))
+
+    def load(self):
+        with open(self.filename, "rt", encoding="UTF-8") as stream:
+            text = stream.read()
+        return self.cache.load_rfc822_records(
+            self.filename, text, source=FileTextSource(self.filename))
+
+    def assertRecordsEqual(self, record_list, other_list):
+        self.assertEqual(
+            [(record.data, record.raw_data, record.origin)
+             for record in record_list],
+            [(record.data, record.raw_data, record.origin)
+             for record in other_list])
+
+    @mock.patch('plainbox.impl.secure.cache.load_rfc822_records')
+    def test_hit(self, mock_load):
+        mock_load.side_effect = load_rfc822_records
+        first = self.load()
+        self.assertEqual(mock_load.call_count, 1)
+        second = self.load()
+        self.assertEqual(mock_load.call_count, 1)
+        self.assertRecordsEqual(first, second)
+        self.assertRecordsEqual(second, load_rfc822_records(
+            self.text, source=FileTextSource(self.filename)))
+
+    def test_checksums(self):
+        self.assertEqual(
+            [record.data_checksum for record in self.load()], [None, None])
+        record_list = self.load()
+        self.assertEqual(
+            [record.data_checksum for record in record_list],
+            [compute_checksum(record.data) for record in record_list])
+
+    @mock.patch('plainbox.impl.secure.cache.load_rfc822_records')
+    def test_invalidation(self, mock_load):
+        mock_load.side_effect = load_rfc822_records
+        self.load()
+        # Different modification time
+        self.write(self.text, age=120)
+        self.load()
+        self.assertEqual(mock_load.call_count, 2)
+        # Different size
+        self.write(self.text + "\nid: froz\n", age=120)
+        self.assertEqual(len(self.load()), 3)
+        self.assertEqual(mock_load.call_count, 3)
+
+    def test_version(self):
+        self.load()
+        cache = RFC822RecordCache(self.cache.location)
+        cache._version += "-other"
+        with mock.patch('plainbox.impl.secure.cache.load_rfc822_records',
+                        side_effect=load_rfc822_records) as mock_load:
+            cache.load_rfc822_records(self.filename, self.text)
+        self.assertEqual(mock_load.call_count, 1)
+
+    def test_racy_files_are_not_stored(self):
+        self.write(self.text, age=0)
+        self.load()
+        self.assertFalse(os.path.exists(self.cache.location))
+
+    def test_syntax_errors_are_not_stored(self):
+        self.write("broken\n")
+        with self.assertRaises(RFC822SyntaxError):
+            self.load()
+        self.assertFalse(os.path.exists(self.cache.location))
+
+    def test_entry_permissions(self):
+        self.load()
+        self.assertEqual(
+            os.stat(self.cache.location).st_mode & 0o777, 0o700)
+        for name in os.listdir(self.cache.location):
+            pathname = os.path.join(self.cache.location, name)
+            self.assertEqual(os.stat(pathname).st_mode & 0o777, 0o600)
+
+    @mock.patch('plainbox.impl.secure.cache.load_rfc822_records')
+    def test_untrusted_entries_are_ignored(self, mock_load):
+        mock_load.side_effect = load_rfc822_records
+        self.load()
+        for name in os.listdir(self.cache.location):
+            os.chmod(os.path.join(self.cache.location, name), 0o620)
+        self.load()
+        self.assertEqual(mock_load.call_count, 2)
+
+    @mock.patch('plainbox.impl.secure.cache.load_rfc822_records')
+    def test_untrusted_directories_are_ignored(self, mock_load):
+        mock_load.side_effect = load_rfc822_records
+        self.load()
+        os.chmod(self.cache.location, 0o720)
+        self.load()
+        self.assertEqual(mock_load.call_count, 2)
+
+    @mock.patch('plainbox.impl.secure.cache.load_rfc822_records')
+    def test_corrupted_entries_are_ignored(self, mock_load):
+        mock_load.side_effect = load_rfc822_records
+        self.load()
+        for name in os.listdir(self.cache.location):
+            with open(os.path.join(self.cache.location, name), "wt") as s:
+                s.write('{"key": ')
+        self.assertRecordsEqual(self.load(), load_rfc822_records(
+            self.text, source=FileTextSource(self.filename)))
+        self.assertEqual(mock_load.call_count, 2)
+
+    def test_unwritable_location(self):
+        with open(self.cache.location, "wt"):
+            pass
+        self.assertEqual(len(self.load()), 2)
+
+    def test_get_default_location(self):
+        with mock.patch.dict('os.environ', {'XDG_CACHE_HOME': '/cache'}):
+            self.assertEqual(
+                RFC822RecordCache.get_default_location(),
+                '/cache/plainbox/rfc822')
+
+
+class GeneratorOutputCacheTests(TestCase):
+
+    def setUp(self):
+        self.scratch_dir = TemporaryDirectory()
+        self.cache = GeneratorOutputCache(
+            os.path.join(self.scratch_dir.name, "cache"))
+        self.key = self.cache.get_key('1234', {'CHECKBOX_DATA': '/session'})
+
+    def tearDown(self):
+        self.scratch_dir.cleanup()
+
+    def test_get_key(self):
+        self.assertEqual(self.key, self.cache.get_key(
+            '1234', {'CHECKBOX_DATA': '/session'}))
+        self.assertNotEqual(self.key, self.cache.get_key(
+            '1234', {'CHECKBOX_DATA': '/other-session'}))
+        self.assertNotEqual(self.key, self.cache.get_key(
+            '5678', {'CHECKBOX_DATA': '/session'}))
+        self.assertEqual(self.cache.get_key('1234', None),
+                         self.cache.get_key('1234', {}))
+
+    def test_store_and_load(self):
+        self.assertIsNone(self.cache.load(self.key))
+        self.cache.store(self.key, "id: foo\n")
+        self.assertEqual(self.cache.load(self.key), "id: foo\n")
+        self.assertEqual(
+            os.stat(self.cache.location).st_mode & 0o777, 0o700)
+
+    def test_untrusted_entries_are_ignored(self):
+        self.cache.store(self.key, "id: foo\n")
+        os.chmod(self.cache._get_entry_pathname(self.key), 0o602)
+        self.assertIsNone(self.cache.load(self.key))
+
+    def test_untrusted_directories_are_ignored(self):
+        self.cache.store(self.key, "id: foo\n")
+        os.chmod(self.cache.location, 0o720)
+        self.assertIsNone(self.cache.load(self.key))
+
+    def test_expired_entries(self):
+        self.cache.store(self.key, "id: foo\n")
+        pathname = self.cache._get_entry_pathname(self.key)
+        mtime = time.time() - self.cache.MAX_AGE - 60
+        os.utime(pathname, (mtime, mtime))
+        self.assertIsNone(self.cache.load(self.key))
+        # Expired entries are removed when other entries are stored
+        self.cache.store(self.cache.get_key('5678', None), "id: bar\n")
+        self.assertFalse(os.path.exists(pathname))
+
+    def test_get_default_location(self):
+        with mock.patch.dict('os.environ', {'XDG_CACHE_HOME': '/cache'}):
+            self.assertEqual(
+                GeneratorOutputCache.get_default_location(),
+                '/cache/plainbox/generators')
+
+
+class ProviderLoadTests(TestCase):
+    """
+    Tests (and a crude benchmark) of loading a provider with the cache
+    """
+
+    JOB_FILES = 20
+    JOBS_PER_FILE = 50
+
+    def setUp(self):
+        self.scratch_dir = TemporaryDirectory()
+        self.jobs_dir = os.path.join(self.scratch_dir.name, "jobs")
+        os.mkdir(self.jobs_dir)
+        mtime = time.time() - 60
+        for i in range(self.JOB_FILES):
+            filename = os.path.join(self.jobs_dir, "{}.txt".format(i))
+            with open(filename, "wt", encoding="UTF-8") as stream:
+                for j in range(self.JOBS_PER_FILE):
+                    stream.write(
+                        "id: job-{0}-{1}\n"
+                        "plugin: shell\n"
+                        "command: echo {0} {1}\n"
+                        "_description:\n"
+                        " Job {0}/{1}\n"
+                        " .\n"
+                        " This is job {1} from file {0}\n"
+                        "\n".format(i, j))
+            os.utime(filename, (mtime, mtime))
+        self.cache = RFC822RecordCache(
+            os.path.join(self.scratch_dir.name, "cache"))
+        self.provider = mock.Mock(name='provider', namespace='com.example')
+
+    def tearDown(self):
+        self.scratch_dir.cleanup()
+
+    def load_jobs(self):
+        job_list = []
+        start = time.perf_counter()
+        for name in sorted(os.listdir(self.jobs_dir)):
+            filename = os.path.join(self.jobs_dir, name)
+            with open(filename, "rt", encoding="UTF-8") as stream:
+                text = stream.read()
+            job_list.extend(JobDefinitionPlugIn(
+                filename, text, self.provider, self.cache).plugin_object)
+        return job_list, time.perf_counter() - start
+
+    @mock.patch('plainbox.impl.secure.cache.load_rfc822_records')
+    def test_cold_and_warm_load(self, mock_load):
+        mock_load.side_effect = load_rfc822_records
+        cold_job_list, cold_time = self.load_jobs()
+        self.assertEqual(mock_load.call_count, self.JOB_FILES)
+        warm_job_list, warm_time = self.load_jobs()
+        self.assertEqual(mock_load.call_count, self.JOB_FILES)
+        self.assertEqual(
+            len(cold_job_list), self.JOB_FILES * self.JOBS_PER_FILE)
+        self.assertEqual(
+            [(job.id, job.command, job.description, job.origin)
+             for job in cold_job_list],
+            [(job.id, job.command, job.description, job.origin)
+             for job in warm_job_list])
+
+    def test_warm_load_checksums(self):
+        cold_job_list, cold_time = self.load_jobs()
+        warm_job_list, warm_time = self.load_jobs()
+        with mock.patch('plainbox.impl.secure.job.compute_checksum') as cc:
+            warm_checksum_list = [job.checksum for job in warm_job_list]
+        # Checksums of jobs loaded from the cache are not computed again
+        self.assertFalse(cc.called)
+        self.assertEqual(
+            [job.checksum for job in cold_job_list], warm_checksum_list)
@@ -27,6 +27,7 @@ Test definitions for plainbox.impl.secure.job module
 from unittest import TestCase
 
 from plainbox.impl.secure.job import BaseJob
+from plainbox.impl.secure.job import compute_checksum
 from plainbox.testing_utils.testcases import TestCaseWithParameters
 
 
@@ -92,6 +93,9 @@ class TestJobDefinition(TestCase):
         self.assertEqual(
             job1.checksum,
             "c47cc3719061e4df0010d061e6f20d3d046071fd467d02d093a03068d2f33400")
+        # And it can be computed without creating the job
+        self.assertEqual(job1.checksum, compute_checksum(
+            {'plugin': 'plugin', 'user': 'root'}))
 
     def test_get_environ_settings(self):
         job1 = BaseJob({})
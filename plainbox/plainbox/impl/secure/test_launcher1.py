@@ -26,12 +26,25 @@ Test definitions for plainbox.impl.secure.launcher1 module
 """
 
 from inspect import cleandoc
+from tempfile import TemporaryDirectory
 from unittest import TestCase
+import io
+import json
 import os
+import subprocess
 
 from plainbox.impl.job import JobDefinition, JobOutputTextSource
+from plainbox.impl.secure.cache import GeneratorOutputCache
+from plainbox.impl.secure.launcher1 import FRAME_EXIT
+from plainbox.impl.secure.launcher1 import FRAME_RUN
+from plainbox.impl.secure.launcher1 import FRAME_STDERR
+from plainbox.impl.secure.launcher1 import FRAME_STDOUT
 from plainbox.impl.secure.launcher1 import TrustedLauncher
+from plainbox.impl.secure.launcher1 import decode_return_code
+from plainbox.impl.secure.launcher1 import encode_return_code
 from plainbox.impl.secure.launcher1 import main
+from plainbox.impl.secure.launcher1 import read_frame
+from plainbox.impl.secure.launcher1 import write_frame
 from plainbox.impl.secure.providers.v1 import Provider1
 from plainbox.impl.secure.providers.v1 import Provider1PlugIn
 from plainbox.impl.secure.providers.v1 import all_providers
@@ -75,6 +88,16 @@ class TrustedLauncherTests(TestCase):
         # Ensure that the job was found correctly
         self.assertIs(self.launcher.find_job(job.checksum), job)
 
+    def test_find_job_with_duplicates(self):
+        job1 = mock.Mock(spec=JobDefinition, name='job1', checksum='1')
+        job2 = mock.Mock(spec=JobDefinition, name='job2', checksum='1')
+        job3 = mock.Mock(spec=JobDefinition, name='job3', checksum='3')
+        self.launcher.add_job_list([job1, job2])
+        self.launcher.add_job_list([job3])
+        # Ensure that the first job with a given checksum is found
+        self.assertIs(self.launcher.find_job('1'), job1)
+        self.assertIs(self.launcher.find_job('3'), job3)
+
     @mock.patch.dict('os.environ', clear=True)
     @mock.patch('subprocess.call')
     def test_run_shell_from_job(self, mock_call):
@@ -136,6 +159,150 @@ class TrustedLauncherTests(TestCase):
         self.assertEqual(job_list[1], mock_from_rfc822_record(record2))
 
 
+class GeneratorCacheTests(TestCase):
+    """
+    Tests for the TrustedLauncher with a GeneratorOutputCache
+    """
+
+    def setUp(self):
+        self.scratch_dir = TemporaryDirectory()
+        self.cache = GeneratorOutputCache(self.scratch_dir.name)
+        self.launcher = TrustedLauncher(self.cache)
+        self.generator = JobDefinition({
+            'id': 'generator', 'plugin': 'local',
+            'command': 'printf "id: generated-$N\nplugin: shell\n"'})
+        self.launcher.add_job_list([self.generator])
+
+    def tearDown(self):
+        self.scratch_dir.cleanup()
+
+    @mock.patch('subprocess.check_output', wraps=subprocess.check_output)
+    def test_run_local_job(self, mock_check_output):
+        job_list = self.launcher.run_local_job(
+            self.generator.checksum, {'N': '1'})
+        self.assertEqual(mock_check_output.call_count, 1)
+        self.assertEqual([job.id for job in job_list], ['generated-1'])
+        # The second time the output comes from the cache
+        cached_job_list = self.launcher.run_local_job(
+            self.generator.checksum, {'N': '1'})
+        self.assertEqual(mock_check_output.call_count, 1)
+        self.assertEqual([job.checksum for job in job_list],
+                         [job.checksum for job in cached_job_list])
+        # Another launcher (a separate invocation) uses the cache too
+        other_launcher = TrustedLauncher(self.cache)
+        other_launcher.add_job_list([self.generator])
+        other_launcher.run_local_job(self.generator.checksum, {'N': '1'})
+        self.assertEqual(mock_check_output.call_count, 1)
+        # But not for a different environment
+        job_list = self.launcher.run_local_job(
+            self.generator.checksum, {'N': '2'})
+        self.assertEqual(mock_check_output.call_count, 2)
+        self.assertEqual([job.id for job in job_list], ['generated-2'])
+
+    @mock.patch('subprocess.check_output')
+    def test_failures_are_not_cached(self, mock_check_output):
+        mock_check_output.side_effect = subprocess.CalledProcessError(1, '')
+        for i in range(2):
+            with self.assertRaises(subprocess.CalledProcessError):
+                self.launcher.run_local_job(self.generator.checksum, None)
+        self.assertEqual(mock_check_output.call_count, 2)
+
+
+class SessionTests(TestCase):
+    """
+    Tests for the --session mode of the trusted launcher
+    """
+
+    def setUp(self):
+        self.launcher = TrustedLauncher()
+        self.job = JobDefinition({
+            'id': 'job', 'plugin': 'shell',
+            'command': 'echo $GREETING; echo oops >&2; exit 3'})
+        self.launcher.add_job_list([self.job])
+
+    def run_session(self, *request_list):
+        input_stream = io.BytesIO()
+        for request in request_list:
+            write_frame(input_stream, FRAME_RUN,
+                        json.dumps(request).encode('UTF-8'))
+        input_stream.seek(0)
+        output_stream = io.BytesIO()
+        self.launcher.run_session(input_stream, output_stream)
+        output_stream.seek(0)
+        frame_list = []
+        while True:
+            frame = read_frame(output_stream)
+            if frame is None:
+                return frame_list
+            frame_list.append(frame)
+
+    def test_frames(self):
+        stream = io.BytesIO()
+        write_frame(stream, FRAME_STDOUT, b'data')
+        write_frame(stream, FRAME_EXIT, encode_return_code(-9))
+        data = stream.getvalue()
+        stream.seek(0)
+        self.assertEqual(read_frame(stream), (FRAME_STDOUT, b'data'))
+        kind, payload = read_frame(stream)
+        self.assertEqual(kind, FRAME_EXIT)
+        self.assertEqual(decode_return_code(payload), -9)
+        self.assertIsNone(read_frame(stream))
+        with self.assertRaises(ValueError):
+            read_frame(io.BytesIO(data[:3]))
+        with self.assertRaises(ValueError):
+            read_frame(io.BytesIO(data[:7]))
+
+    def test_run_session(self):
+        request = {'target': self.job.checksum,
+                   'target_env': {'GREETING': 'hello'}}
+        frame_list = self.run_session(request, request)
+        self.assertEqual(len(frame_list), 6)
+        self.assertEqual(sorted(frame_list[:2]), [
+            (FRAME_STDERR, b'oops\n'), (FRAME_STDOUT, b'hello\n')])
+        self.assertEqual(frame_list[2], (FRAME_EXIT, encode_return_code(3)))
+        self.assertEqual(frame_list[:3], frame_list[3:])
+
+    def test_run_session_unknown_job(self):
+        frame_list = self.run_session({'target': 'foo'})
+        self.assertEqual(frame_list, [
+            (FRAME_STDERR, b'Cannot find job with checksum foo\n'),
+            (FRAME_EXIT, encode_return_code(1))])
+
+    @mock.patch.object(TrustedLauncher, 'run_local_job')
+    def test_run_session_with_generator(self, mock_run_local_job):
+        generated_job = JobDefinition({
+            'id': 'generated', 'plugin': 'shell', 'command': 'true'})
+        mock_run_local_job.return_value = [generated_job]
+        frame_list = self.run_session({
+            'target': generated_job.checksum, 'target_env': {},
+            'generator': self.job.checksum, 'generator_env': {'A': 'B'}})
+        mock_run_local_job.assert_called_once_with(
+            self.job.checksum, {'A': 'B'})
+        self.assertEqual(frame_list, [(FRAME_EXIT, encode_return_code(0))])
+
+    @mock.patch.object(TrustedLauncher, 'run_local_job')
+    def test_run_session_runs_generators_once(self, mock_run_local_job):
+        generated_job_list = [
+            JobDefinition({'id': 'generated-{}'.format(i),
+                           'plugin': 'shell', 'command': 'true'})
+            for i in range(3)]
+        mock_run_local_job.return_value = generated_job_list
+        frame_list = self.run_session(*[
+            {'target': job.checksum, 'generator': self.job.checksum}
+            for job in generated_job_list])
+        self.assertEqual(mock_run_local_job.call_count, 1)
+        self.assertEqual(
+            frame_list, [(FRAME_EXIT, encode_return_code(0))] * 3)
+        self.assertEqual(len(self.launcher._job_list), 4)
+
+    def test_run_session_bad_frame(self):
+        input_stream = io.BytesIO()
+        write_frame(input_stream, FRAME_STDOUT, b'')
+        input_stream.seek(0)
+        with self.assertRaises(ValueError):
+            self.launcher.run_session(input_stream, io.BytesIO())
+
+
 class MainTests(TestCase):
     """
     Unit tests for the main() function that implements
@@ -164,7 +331,7 @@ class MainTests(TestCase):
         self.assertEqual(call.exception.args, (0,))
         self.maxDiff = None
         expected = """
-        usage: plainbox-trusted-launcher-1 [-h] (-w | -t CHECKSUM)
+        usage: plainbox-trusted-launcher-1 [-h] (-w | -t CHECKSUM | -s)
                                            [-T NAME=VALUE [NAME=VALUE ...]]
                                            [-g CHECKSUM]
                                            [-G NAME=VALUE [NAME=VALUE ...]]
@@ -175,6 +342,7 @@ class MainTests(TestCase):
                                 pkexec(1)
           -t CHECKSUM, --target CHECKSUM
                                 run a job with this checksum
+          -s, --session         run jobs requested over stdin until it is closed
 
         target job specification:
           -T NAME=VALUE [NAME=VALUE ...], --target-environment NAME=VALUE [NAME=VALUE ...]
@@ -211,11 +379,11 @@ class MainTests(TestCase):
                 main([])
             self.assertEqual(call.exception.args, (2,))
         expected = """
-        usage: plainbox-trusted-launcher-1 [-h] (-w | -t CHECKSUM)
+        usage: plainbox-trusted-launcher-1 [-h] (-w | -t CHECKSUM | -s)
                                            [-T NAME=VALUE [NAME=VALUE ...]]
                                            [-g CHECKSUM]
                                            [-G NAME=VALUE [NAME=VALUE ...]]
-        plainbox-trusted-launcher-1: error: one of the arguments -w/--warmup -t/--target is required
+        plainbox-trusted-launcher-1: error: one of the arguments -w/--warmup -t/--target -s/--session is required
         """
         self.assertEqual(io.combined, cleandoc(expected) + "\n")
 
@@ -324,7 +492,7 @@ class MainTests(TestCase):
         self.assertEqual(call.exception.args, (2,))
         # Ensure that we print a meaningful error message
         expected = """
-        usage: plainbox-trusted-launcher-1 [-h] (-w | -t CHECKSUM)
+        usage: plainbox-trusted-launcher-1 [-h] (-w | -t CHECKSUM | -s)
                                            [-T NAME=VALUE [NAME=VALUE ...]]
                                            [-g CHECKSUM]
                                            [-G NAME=VALUE [NAME=VALUE ...]]
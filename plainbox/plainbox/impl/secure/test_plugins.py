@@ -24,6 +24,9 @@ plainbox.impl.secure.test_plugins
 Test definitions for plainbox.impl.secure.plugins module
 """
 
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import TemporaryDirectory
 from unittest import TestCase
 import collections
 import os
@@ -508,3 +511,82 @@ class FsPlugInCollectionTests(TestCase):
             col.get_by_name(
                 os.path.join(self._P1, "bar.txt.in")
             ).plugin_object, "text")
+
+
+def _preprocess(filename, text):
+    # Module-level so that it can be used with a ProcessPoolExecutor
+    if text == "broken":
+        raise PlugInError("broken plugin {}".format(filename))
+    return text.upper()
+
+
+class FsPlugInCollectionPrefetchTests(TestCase):
+    """
+    Tests for FsPlugInCollection.prefetch()
+    """
+
+    def setUp(self):
+        self.scratch_dir = TemporaryDirectory()
+        for name, text in [("a.plugin", "a"), ("c.plugin", "broken"),
+                           ("b.plugin", "b"), ("d.plugin", "d")]:
+            pathname = os.path.join(self.scratch_dir.name, name)
+            with open(pathname, "wt", encoding="UTF-8") as stream:
+                stream.write(text)
+
+    def tearDown(self):
+        self.scratch_dir.cleanup()
+
+    def make_collection(self):
+        return FsPlugInCollection(
+            [self.scratch_dir.name], ".plugin", preprocess=_preprocess)
+
+    def get_items(self, col):
+        return [(os.path.basename(name), plugin.plugin_object)
+                for name, plugin in col.get_all_items()]
+
+    def test_load_without_prefetch(self):
+        # Without prefetching the preprocessing function is not used
+        col = self.make_collection()
+        col.load()
+        self.assertEqual(self.get_items(col), [
+            ("a.plugin", "a"), ("b.plugin", "b"), ("c.plugin", "broken"),
+            ("d.plugin", "d")])
+        self.assertEqual(col.problem_list, [])
+
+    def test_prefetch(self):
+        for executor_cls in (ThreadPoolExecutor, ProcessPoolExecutor):
+            col = self.make_collection()
+            with executor_cls(2) as executor:
+                col.prefetch(executor)
+                col.load()
+            self.assertEqual(self.get_items(col), [
+                ("a.plugin", "A"), ("b.plugin", "B"), ("d.plugin", "D")])
+            self.assertEqual(len(col.problem_list), 1)
+            self.assertIsInstance(col.problem_list[0], PlugInError)
+            self.assertEqual(
+                str(col.problem_list[0]), "broken plugin {}".format(
+                    os.path.join(self.scratch_dir.name, "c.plugin")))
+
+    @mock.patch('plainbox.impl.secure.plugins.logger')
+    def test_prefetch_io_errors(self, mock_logger):
+        col = self.make_collection()
+        executor = mock.Mock(name='executor')
+        future = mock.Mock(name='future')
+        future.result.side_effect = OSError("You cannot open this file")
+        executor.submit.return_value = future
+        col.prefetch(executor)
+        self.assertEqual(executor.submit.call_count, 4)
+        col.load()
+        self.assertEqual(col.get_all_items(), [])
+        self.assertEqual(len(col.problem_list), 4)
+        mock_logger.error.assert_called_with(
+            'Unable to load %r: %s',
+            os.path.join(self.scratch_dir.name, 'd.plugin'),
+            'You cannot open this file')
+
+    def test_prefetch_after_load(self):
+        col = self.make_collection()
+        col.load()
+        executor = mock.Mock(name='executor')
+        col.prefetch(executor)
+        self.assertEqual(executor.submit.call_count, 0)
@@ -26,7 +26,14 @@ Test definitions for plainbox.impl.secure.rfc822 module
 
 from io import StringIO
 from unittest import TestCase
+from unittest import skipUnless
+import glob
+import logging
 import os
+import re
+import sys
+import textwrap
+import time
 
 from plainbox.impl.secure.rfc822 import FileTextSource
 from plainbox.impl.secure.rfc822 import Origin
@@ -36,6 +43,7 @@ from plainbox.impl.secure.rfc822 import RFC822SyntaxError
 from plainbox.impl.secure.rfc822 import UnknownTextSource
 from plainbox.impl.secure.rfc822 import load_rfc822_records
 from plainbox.impl.secure.rfc822 import normalize_rfc822_value
+from plainbox.vendor import mock
 
 
 class UnknownTextSourceTests(TestCase):
@@ -352,6 +360,23 @@ class NormalizationTests(TestCase):
                           "..\n"
                           "bar"))
 
+    def test_fast_paths(self):
+        """
+        verify that shortcuts taken by normalize_rfc822_value() give the
+        same results as the full normalization
+        """
+        def slow_normalize(value):
+            value = re.sub('^(\\s*)\\.$', '\\1', value, flags=re.M)
+            return textwrap.dedent(value).strip()
+        for value in [
+                "", " ", ".", " . ", " .", ". ", "..", "\t.", "foo", " foo",
+                "foo\n", "foo\nbar\n", "foo\n.\nbar\n", "foo\n  \nbar",
+                "foo\n\tbar\n", "\tfoo\n\tbar", " foo\n .\n bar\n",
+                "foo.\nbar.\n", ".\n.\n", "foo\n .\n  bar\n"]:
+            self.assertEqual(
+                normalize_rfc822_value(value), slow_normalize(value),
+                "for {!r}".format(value))
+
 
 class RFC822RecordTests(TestCase):
 
@@ -807,6 +832,29 @@ class RFC822ParserTests(TestCase):
         self.assertEqual(records[0].origin, expected_origin)
 
 
+class RFC822ParserLoggingTests(TestCase):
+
+    text = ("key1: value1\n"
+            "key2:\n"
+            " value2\n"
+            "\n"
+            "key3: value3\n")
+
+    @mock.patch('plainbox.impl.secure.rfc822.logger')
+    def test_no_logging_by_default(self, mock_logger):
+        mock_logger.isEnabledFor.return_value = False
+        self.assertEqual(len(load_rfc822_records(self.text)), 2)
+        mock_logger.isEnabledFor.assert_called_once_with(logging.DEBUG)
+        self.assertEqual(mock_logger.debug.call_count, 0)
+
+    @mock.patch('plainbox.impl.secure.rfc822.logger')
+    def test_logging_when_debugging(self, mock_logger):
+        mock_logger.isEnabledFor.return_value = True
+        self.assertEqual(len(load_rfc822_records(self.text)), 2)
+        # One message for each line, key and record
+        self.assertEqual(mock_logger.debug.call_count, 5 + 3 + 2)
+
+
 class NamedStringIO(StringIO):
     """
      Subclass of StringIO with a name attribute.
@@ -890,3 +938,64 @@ class RFC822SyntaxErrorTests(TestCase):
         self.assertEqual(
             hash(RFC822SyntaxError("file.txt", 10, "msg")),
             hash(RFC822SyntaxError("file.txt", 10, "msg")))
+
+
+@skipUnless(
+    os.environ.get("PLAINBOX_BENCHMARK"),
+    "set PLAINBOX_BENCHMARK=1 to run benchmarks")
+class RFC822ParserBenchmark(TestCase):
+    """
+    Benchmark of the RFC822 parser on realistic data
+
+    This parses the job definitions of all the providers in the source tree
+    and the kind of output that the package resource job produces for a
+    system with five thousand packages installed.
+    """
+
+    repeat = 5
+
+    def setUp(self):
+        top_dir = os.path.normpath(os.path.join(
+            os.path.dirname(__file__), os.pardir, os.pardir, os.pardir,
+            os.pardir))
+        self.job_text_list = []
+        for filename in sorted(glob.glob(os.path.join(
+                top_dir, 'plainbox-provider-*', 'provider_jobs', '*.txt*'))):
+            with open(filename, 'rt', encoding='UTF-8') as stream:
+                self.job_text_list.append((filename, stream.read()))
+        self.dpkg_text = ''.join(
+            "name: package-{0}\n"
+            "version: 1.{0}-0ubuntu1\n"
+            "status: install ok installed\n"
+            "description:\n"
+            " This is package {0}\n"
+            " .\n"
+            "  It does things\n"
+            "\n".format(index)
+            for index in range(5000))
+
+    def benchmark(self, name, fn):
+        duration = min(self._time(fn) for i in range(self.repeat))
+        sys.stderr.write("\n{}: {:.3f}s ".format(name, duration))
+
+    @staticmethod
+    def _time(fn):
+        start = time.time()
+        fn()
+        return time.time() - start
+
+    def test_provider_jobs(self):
+        if not self.job_text_list:
+            self.skipTest("provider job definitions are not available")
+
+        def load_jobs():
+            for filename, text in self.job_text_list:
+                load_rfc822_records(text, source=FileTextSource(filename))
+        self.benchmark("{} job files".format(
+            len(self.job_text_list)), load_jobs)
+
+    def test_package_resources(self):
+        self.assertEqual(
+            len(load_rfc822_records(self.dpkg_text.splitlines(True))), 5000)
+        self.benchmark("5000 packages", lambda: load_rfc822_records(
+            iter(self.dpkg_text.splitlines(True))))
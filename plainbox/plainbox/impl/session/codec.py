@@ -0,0 +1,664 @@
+# This file is part of Checkbox.
+#
+# Copyright 2014 Canonical Ltd.
+#
+# Checkbox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3,
+# as published by the Free Software Foundation.
+
+#
+# Checkbox is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Checkbox.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+:mod:`plainbox.impl.session.codec` -- session checkpoint encoding
+=================================================================
+
+This module contains codecs that turn the JSON-friendly representation of a
+session (as computed by the suspend helpers) into bytes and back.
+
+There are three codecs available:
+
+``gzip`` (or ``gzip:LEVEL``)
+    Compact JSON text compressed with gzip, at level 9 unless specified
+    otherwise. This is the default and the only format understood by older
+    versions of PlainBox.
+
+``json``
+    Compact JSON text without any compression. This is the fastest codec and
+    the best choice when checkpoint size does not matter.
+
+``binary``
+    A simple binary encoding of the same representation, see
+    :class:`BinarySessionCodec`. It is much smaller than JSON text, without
+    any compression.
+
+Data encoded by the gzip codec is a bare gzip stream, identified by the gzip
+magic number. Data encoded by all the other codecs starts with a header that
+carries the name of the codec (:data:`CODEC_HEADER_PREFIX`, the name of the
+codec and a newline character). :func:`decode_session_data()` looks at the
+data and picks the right codec automatically.
+
+Codecs can also write to and read from streams (see
+:meth:`SessionCodec.write()` and :func:`read_session_stream()`). The JSON text
+is then encoded and decoded in pieces, so large sessions don't need to be kept
+in memory in their entirety, in more than one form, at the same time.
+
+.. warning::
+
+    THIS MODULE DOES NOT HAVE STABLE PUBLIC API
+"""
+
+import codecs
+import gzip
+import io
+import json
+import struct
+import sys
+
+from plainbox.i18n import gettext as _
+
+
+# Prefix of the header of all the data that is not a bare gzip stream. The
+# leading NUL byte ensures that it cannot be mistaken for JSON text.
+CODEC_HEADER_PREFIX = b"\x00PBSESSION "
+
+# On python3.7 and later dictionaries preserve insertion order. Since the
+# representation of a session is always built in the same order, there is no
+# need to sort keys to get deterministic data.
+SORT_KEYS = sys.version_info[0:2] < (3, 7)
+
+
+_json_encoder = json.JSONEncoder(
+    ensure_ascii=False,
+    sort_keys=SORT_KEYS,
+    indent=None,
+    separators=(',', ':'))
+
+
+def dump_json(json_repr):
+    """
+    Encode a JSON-friendly representation as compact JSON text
+
+    :returns:
+        UTF-8 encoded text, as bytes
+    """
+    return _json_encoder.encode(json_repr).encode("UTF-8")
+
+
+def iter_json(json_repr, depth=3):
+    """
+    Encode a JSON-friendly representation as compact JSON text, in pieces
+
+    :param depth:
+        Number of levels of nested dictionaries and lists that are split into
+        pieces. Values nested deeper than that are encoded in one piece.
+    :returns:
+        A generator of strings. Joined together they are exactly the same as
+        the text encoded by :func:`dump_json()`.
+
+    This is useful for encoding large representations without building all
+    of the text in memory at once. Each piece is encoded with the (fast)
+    one-shot encoder, so a session is split into roughly one piece per job.
+    """
+    if depth > 0 and isinstance(json_repr, dict):
+        if SORT_KEYS:
+            items = sorted(json_repr.items())
+        else:
+            items = json_repr.items()
+        sep = '{'
+        for key, value in items:
+            yield sep + _json_encoder.encode(key) + ':'
+            for piece in iter_json(value, depth - 1):
+                yield piece
+            sep = ','
+        yield '}' if sep == ',' else '{}'
+    elif depth > 0 and isinstance(json_repr, (list, tuple)):
+        sep = '['
+        for value in json_repr:
+            yield sep
+            for piece in iter_json(value, depth - 1):
+                yield piece
+            sep = ','
+        yield ']' if sep == ',' else '[]'
+    else:
+        yield _json_encoder.encode(json_repr)
+
+
+def write_json(json_repr, stream, chunk_size=64 * 1024):
+    """
+    Write compact JSON text, encoded as UTF-8, to a binary stream
+
+    The text is written in chunks of roughly ``chunk_size`` characters.
+    """
+    buf = []
+    buf_size = 0
+    for piece in iter_json(json_repr):
+        buf.append(piece)
+        buf_size += len(piece)
+        if buf_size >= chunk_size:
+            stream.write(''.join(buf).encode("UTF-8"))
+            buf = []
+            buf_size = 0
+    if buf:
+        stream.write(''.join(buf).encode("UTF-8"))
+
+
+def read_json(stream, depth=3, chunk_size=64 * 1024):
+    """
+    Read JSON text, encoded as UTF-8, from a binary stream
+
+    :param depth:
+        Number of levels of nested dictionaries and lists that are decoded
+        one item at a time. Values nested deeper than that are decoded in one
+        piece.
+    :returns:
+        The decoded value
+    :raises ValueError:
+        if the text is not valid JSON
+
+    This is the counterpart of :func:`write_json()`. The stream is read in
+    chunks of roughly ``chunk_size`` bytes and only the text of the item that
+    is being decoded is kept in memory, so a session is decoded roughly one
+    job at a time. The stream is not closed.
+    """
+    return _JSONStreamDecoder(stream, chunk_size).decode(depth)
+
+
+class _JSONStreamDecoder:
+    """
+    Helper for :func:`read_json()`
+
+    The outer dictionaries and lists are parsed here, all the other values
+    are decoded by :meth:`json.JSONDecoder.raw_decode()`. When a value cannot
+    be decoded from the text that was read so far, more text is read and the
+    value is decoded again. The amount of text that is read doubles each time
+    so large values are still decoded in linear time.
+    """
+
+    _decoder = json.JSONDecoder()
+
+    def __init__(self, stream, chunk_size):
+        self._stream = stream
+        self._chunk_size = chunk_size
+        self._utf8_decoder = codecs.getincrementaldecoder("UTF-8")()
+        self._text = ''
+        self._pos = 0
+        self._eof = False
+
+    def decode(self, depth):
+        value = self._decode_value(depth)
+        if self._peek() != '':
+            raise ValueError(
+                _("extra data at offset {}").format(self._pos))
+        return value
+
+    def _read_more(self, size):
+        """
+        Read at least ``size`` more bytes, unless the stream ends first
+        """
+        # Drop the text that was already decoded
+        self._text = self._text[self._pos:]
+        self._pos = 0
+        while size > 0 and not self._eof:
+            data = self._stream.read(max(size, self._chunk_size))
+            size -= len(data)
+            self._text += self._utf8_decoder.decode(data, final=not data)
+            self._eof = not data
+
+    def _peek(self):
+        """
+        Skip whitespace and return the next character or '' at the end
+        """
+        while True:
+            text = self._text
+            pos = self._pos
+            while pos < len(text) and text[pos] in ' \t\n\r':
+                pos += 1
+            self._pos = pos
+            if pos < len(text) or self._eof:
+                return text[pos:pos + 1]
+            self._read_more(self._chunk_size)
+
+    def _expect(self, allowed):
+        char = self._peek()
+        if char == '' or char not in allowed:
+            raise ValueError(
+                _("expected one of {!r} at offset {}").format(
+                    allowed, self._pos))
+        self._pos += 1
+        return char
+
+    def _decode_value(self, depth):
+        char = self._peek()
+        if depth > 0 and char == '{':
+            self._pos += 1
+            obj = {}
+            if self._peek() == '}':
+                self._pos += 1
+                return obj
+            while True:
+                if self._peek() != '"':
+                    raise ValueError(
+                        _("expected a string at offset {}").format(
+                            self._pos))
+                key = self._decode_value(0)
+                self._expect(':')
+                obj[key] = self._decode_value(depth - 1)
+                if self._expect(',}') == '}':
+                    return obj
+        elif depth > 0 and char == '[':
+            self._pos += 1
+            array = []
+            if self._peek() == ']':
+                self._pos += 1
+                return array
+            while True:
+                array.append(self._decode_value(depth - 1))
+                if self._expect(',]') == ']':
+                    return array
+        size = self._chunk_size
+        while True:
+            # A value that ends exactly at the end of the text may continue
+            # in the part of the stream that was not read yet (numbers do)
+            try:
+                value, end = self._decoder.raw_decode(self._text, self._pos)
+            except ValueError:
+                if self._eof:
+                    raise
+            else:
+                if end < len(self._text) or self._eof:
+                    self._pos = end
+                    return value
+            self._read_more(size)
+            size *= 2
+
+
+class _CountingWriter:
+    """
+    Wrapper for a writable stream that counts bytes written to it
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+        self.count = 0
+
+    def write(self, data):
+        self.count += len(data)
+        return self._stream.write(data)
+
+    def flush(self):
+        self._stream.flush()
+
+
+class SessionCodec:
+    """
+    Base class for session codecs
+    """
+
+    #: Name of the codec, as stored in the header
+    name = None
+
+    def encode(self, json_repr):
+        """
+        Encode the representation of a session
+
+        :param json_repr:
+            JSON-friendly representation of a session
+        :returns:
+            bytes, including the header that identifies this codec
+        """
+        stream = io.BytesIO()
+        self.write(json_repr, stream)
+        return stream.getvalue()
+
+    def write(self, json_repr, stream):
+        """
+        Encode the representation of a session and write it to a stream
+
+        :param json_repr:
+            JSON-friendly representation of a session
+        :param stream:
+            A writable binary stream
+        :returns:
+            Number of bytes written, including the header that identifies
+            this codec
+        """
+        stream = _CountingWriter(stream)
+        stream.write(CODEC_HEADER_PREFIX + self.name.encode("ASCII") + b"\n")
+        self.write_payload(json_repr, stream)
+        return stream.count
+
+    def encode_payload(self, json_repr):
+        """
+        Encode the representation of a session, without the header
+        """
+        stream = io.BytesIO()
+        self.write_payload(json_repr, stream)
+        return stream.getvalue()
+
+    def write_payload(self, json_repr, stream):
+        """
+        Encode the representation of a session, without the header, and
+        write it to a stream
+        """
+        raise NotImplementedError()
+
+    def decode_payload(self, payload):
+        """
+        Decode the representation of a session, without the header
+
+        :raises ValueError:
+            if the payload is malformed
+        """
+        return self.read_payload(io.BytesIO(payload))
+
+    def read_payload(self, stream):
+        """
+        Read the representation of a session, without the header, from a
+        stream
+
+        :raises ValueError:
+            if the payload is malformed
+        """
+        raise NotImplementedError()
+
+    def __repr__(self):
+        return "<{} name:{!r}>".format(self.__class__.__name__, self.name)
+
+
+class GzipSessionCodec(SessionCodec):
+    """
+    Codec that stores JSON text compressed with gzip
+    """
+
+    name = "gzip"
+
+    def __init__(self, level=9):
+        if not 0 <= level <= 9:
+            raise ValueError(_("gzip compression level must be in 0..9"))
+        self.level = level
+
+    def write(self, json_repr, stream):
+        # The gzip magic number identifies this codec, this keeps the data
+        # compatible with older versions of PlainBox.
+        stream = _CountingWriter(stream)
+        self.write_payload(json_repr, stream)
+        return stream.count
+
+    def write_payload(self, json_repr, stream):
+        # NOTE: gzip.compress is not deterministic on python3.2, it also
+        # stores the current time in the header. Use a fixed modification
+        # time so that identical sessions always produce identical data.
+        with gzip.GzipFile(fileobj=stream, mode='wb', mtime=0,
+                           compresslevel=self.level) as gzip_file:
+            write_json(json_repr, gzip_file)
+
+    def read_payload(self, stream):
+        with gzip.GzipFile(fileobj=stream, mode='rb') as gzip_file:
+            return read_json(gzip_file)
+
+    def __repr__(self):
+        return "<{} name:{!r} level:{!r}>".format(
+            self.__class__.__name__, self.name, self.level)
+
+
+class JSONSessionCodec(SessionCodec):
+    """
+    Codec that stores JSON text without any compression
+    """
+
+    name = "json"
+
+    def write_payload(self, json_repr, stream):
+        write_json(json_repr, stream)
+
+    def read_payload(self, stream):
+        return read_json(stream)
+
+
+class BinarySessionCodec(SessionCodec):
+    """
+    Codec that stores a compact binary encoding of the representation
+
+    Each value starts with a one byte tag, followed by tag-specific data.
+    Integers (and all the lengths) are stored as variable length integers.
+    Each distinct string is stored only once, subsequent occurrences (such as
+    dictionary keys that are repeated for each job result) are stored as a
+    reference to the first one.
+
+    ======= ================================================================
+    Tag     Value
+    ======= ================================================================
+    ``N``   None
+    ``T``   True
+    ``F``   False
+    ``i``   integer, zig-zag encoded variable length integer
+    ``f``   float, eight bytes (IEEE 754, big endian)
+    ``s``   string, length in bytes followed by UTF-8 encoded text
+    ``r``   string, index of a string that was stored before
+    ``l``   list, number of items followed by each item
+    ``d``   dictionary, number of items followed by each key and value
+    ======= ================================================================
+    """
+
+    name = "binary"
+
+    _FLOAT = struct.Struct(">d")
+
+    def encode_payload(self, json_repr):
+        out = bytearray()
+        self._encode(json_repr, out, {})
+        return bytes(out)
+
+    def write_payload(self, json_repr, stream):
+        stream.write(self.encode_payload(json_repr))
+
+    def read_payload(self, stream):
+        return self.decode_payload(stream.read())
+
+    def decode_payload(self, payload):
+        try:
+            value, offset = self._decode(memoryview(payload), 0, [])
+        except (IndexError, struct.error):
+            raise ValueError(_("truncated binary session data"))
+        if offset != len(payload):
+            raise ValueError(_("trailing garbage after binary session data"))
+        return value
+
+    @staticmethod
+    def _encode_varint(value, out):
+        while value > 0x7F:
+            out.append((value & 0x7F) | 0x80)
+            value >>= 7
+        out.append(value)
+
+    def _encode(self, value, out, string_map):
+        # NOTE: bool is a subclass of int so it has to be checked first
+        if value is None:
+            out += b'N'
+        elif value is True:
+            out += b'T'
+        elif value is False:
+            out += b'F'
+        elif isinstance(value, int):
+            out += b'i'
+            self._encode_varint(
+                value * 2 if value >= 0 else -value * 2 - 1, out)
+        elif isinstance(value, float):
+            out += b'f'
+            out += self._FLOAT.pack(value)
+        elif isinstance(value, str):
+            self._encode_str(value, out, string_map)
+        elif isinstance(value, (list, tuple)):
+            out += b'l'
+            self._encode_varint(len(value), out)
+            for item in value:
+                self._encode(item, out, string_map)
+        elif isinstance(value, dict):
+            out += b'd'
+            self._encode_varint(len(value), out)
+            items = sorted(value.items()) if SORT_KEYS else value.items()
+            for key, item in items:
+                if not isinstance(key, str):
+                    raise TypeError(_("keys must be strings"))
+                self._encode_str(key, out, string_map)
+                self._encode(item, out, string_map)
+        else:
+            raise TypeError(
+                _("cannot encode {!r}").format(type(value).__name__))
+
+    def _encode_str(self, value, out, string_map):
+        try:
+            index = string_map[value]
+        except KeyError:
+            string_map[value] = len(string_map)
+            data = value.encode("UTF-8")
+            out += b's'
+            self._encode_varint(len(data), out)
+            out += data
+        else:
+            out += b'r'
+            self._encode_varint(index, out)
+
+    @staticmethod
+    def _decode_varint(data, offset):
+        value = 0
+        shift = 0
+        while True:
+            byte = data[offset]
+            offset += 1
+            value |= (byte & 0x7F) << shift
+            if not byte & 0x80:
+                return value, offset
+            shift += 7
+
+    def _decode(self, data, offset, string_list):
+        tag = data[offset]
+        offset += 1
+        if tag == 0x4E:  # N
+            return None, offset
+        elif tag == 0x54:  # T
+            return True, offset
+        elif tag == 0x46:  # F
+            return False, offset
+        elif tag == 0x69:  # i
+            value, offset = self._decode_varint(data, offset)
+            return (value >> 1 if not value & 1 else -(value >> 1) - 1,
+                    offset)
+        elif tag == 0x66:  # f
+            return (self._FLOAT.unpack_from(data, offset)[0],
+                    offset + self._FLOAT.size)
+        elif tag == 0x73 or tag == 0x72:  # s, r
+            return self._decode_str(data, offset - 1, string_list)
+        elif tag == 0x6C:  # l
+            count, offset = self._decode_varint(data, offset)
+            value = []
+            for index in range(count):
+                item, offset = self._decode(data, offset, string_list)
+                value.append(item)
+            return value, offset
+        elif tag == 0x64:  # d
+            count, offset = self._decode_varint(data, offset)
+            value = {}
+            for index in range(count):
+                key, offset = self._decode_str(data, offset, string_list)
+                value[key], offset = self._decode(data, offset, string_list)
+            return value, offset
+        else:
+            raise ValueError(_("unknown tag {!r}").format(chr(tag)))
+
+    def _decode_str(self, data, offset, string_list):
+        tag = data[offset]
+        offset += 1
+        if tag == 0x73:  # s
+            size, offset = self._decode_varint(data, offset)
+            if offset + size > len(data):
+                raise IndexError(offset + size)
+            value = bytes(data[offset:offset + size]).decode("UTF-8")
+            string_list.append(value)
+            return value, offset + size
+        elif tag == 0x72:  # r
+            index, offset = self._decode_varint(data, offset)
+            try:
+                return string_list[index], offset
+            except IndexError:
+                raise ValueError(_("invalid string reference"))
+        else:
+            raise ValueError(_("expected a string"))
+
+
+# All the known codecs, by name
+_CODEC_MAP = {
+    codec_cls.name: codec_cls
+    for codec_cls in (GzipSessionCodec, JSONSessionCodec, BinarySessionCodec)
+}
+
+
+def get_codec(spec):
+    """
+    Get a codec by name
+
+    :param spec:
+        Name of the codec, optionally followed by a colon and the compression
+        level (for example ``gzip:1``).
+    :returns:
+        A :class:`SessionCodec` instance
+    :raises ValueError:
+        if the codec is unknown or the compression level is invalid
+    """
+    name, sep, level = spec.partition(':')
+    if name not in _CODEC_MAP:
+        raise ValueError(_("unknown session codec: {!r}").format(name))
+    if not sep:
+        return _CODEC_MAP[name]()
+    if name != GzipSessionCodec.name or not level.isdigit():
+        raise ValueError(_("invalid session codec: {!r}").format(spec))
+    return GzipSessionCodec(int(level))
+
+
+def decode_session_data(data):
+    """
+    Decode the representation of a session, picking the right codec
+
+    :param data:
+        bytes, as returned by :meth:`SessionCodec.encode()`
+    :returns:
+        JSON-friendly representation of a session
+    :raises IOError, EOFError:
+        if the data is not gzip-compressed and not marked with any other codec
+    :raises UnicodeDecodeError:
+        if JSON text cannot be decoded
+    :raises ValueError:
+        if the data is malformed or the codec is unknown
+    """
+    return read_session_stream(io.BytesIO(data))
+
+
+def read_session_stream(stream):
+    """
+    Read the representation of a session from a stream, picking the right
+    codec
+
+    :param stream:
+        A seekable binary stream, with data written by
+        :meth:`SessionCodec.write()`. The stream is not closed.
+    :returns:
+        JSON-friendly representation of a session
+    :raises:
+        The same exceptions as :func:`decode_session_data()`
+    """
+    prefix = stream.read(len(CODEC_HEADER_PREFIX))
+    if prefix != CODEC_HEADER_PREFIX:
+        stream.seek(-len(prefix), io.SEEK_CUR)
+        return GzipSessionCodec().read_payload(stream)
+    header = stream.readline()
+    name = header.rstrip(b"\n").decode("ASCII", "replace")
+    if not header.endswith(b"\n") or name not in _CODEC_MAP:
+        raise ValueError(_("unknown session codec: {!r}").format(name))
+    return _CODEC_MAP[name]().read_payload(stream)
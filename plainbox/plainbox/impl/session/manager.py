@@ -33,14 +33,17 @@ and :class:`~plainbox.impl.session.suspend.SessionResumeHelper`.
 import errno
 import logging
 import os
+import threading
+import time
 
-from plainbox.i18n import gettext as _, ngettext
+from plainbox.i18n import gettext as _
 from plainbox.impl.session.resume import SessionResumeHelper
 from plainbox.impl.session.state import SessionState
 from plainbox.impl.session.storage import LockedStorageError
 from plainbox.impl.session.storage import SessionStorage
 from plainbox.impl.session.storage import SessionStorageRepository
 from plainbox.impl.session.suspend import SessionSuspendHelper
+from plainbox.impl.session.suspend import SessionSuspendHelper4
 
 logger = logging.getLogger("plainbox.session.manager")
 
@@ -90,6 +93,89 @@ class WellKnownDirsHelper:
         return os.path.join(self.storage.location, "io-logs")
 
 
+class _CheckpointWriter:
+    """
+    Helper class for saving checkpoints on a background thread.
+
+    The writer keeps a list of pending save operations. Submitting an
+    operation that supersedes everything before it (such as saving a complete
+    snapshot) replaces all of the pending operations so only the most recent
+    snapshot ever gets written. Other operations (such as appending a record
+    to the journal) are queued after the pending ones. Errors raised while
+    saving discard all the pending operations and are re-raised by the next
+    call to :meth:`submit()` or :meth:`wait()`.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._pending = []
+        self._busy = False
+        self._error = None
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._run, name="checkpoint-writer")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, supersede, fn, *args):
+        """
+        Schedule a call to fn(*args)
+        """
+        with self._condition:
+            self._raise_error()
+            if supersede:
+                self._pending = []
+            self._pending.append((fn, args))
+            self._condition.notify_all()
+
+    def wait(self):
+        """
+        Wait until all of the submitted operations are finished
+        """
+        with self._condition:
+            while self._pending or self._busy:
+                self._condition.wait()
+            self._raise_error()
+
+    def close(self):
+        """
+        Finish all the pending operations and stop the background thread
+        """
+        try:
+            self.wait()
+        finally:
+            with self._condition:
+                self._closed = True
+                self._condition.notify_all()
+            self._thread.join()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+                fn, args = self._pending.pop(0)
+                self._busy = True
+            try:
+                fn(*args)
+            except Exception as exc:
+                logger.error(_("Unable to save checkpoint: %s"), exc)
+                with self._condition:
+                    self._error = exc
+                    self._pending = []
+            finally:
+                with self._condition:
+                    self._busy = False
+                    self._condition.notify_all()
+
+
 class SessionManager:
     """
     Manager class for coupling SessionStorage with SessionState.
@@ -110,6 +196,17 @@ class SessionManager:
         # assert isinstance(storage, SessionStorage)
         self._state = state
         self._storage = storage
+        # Checkpoint policy, see set_checkpoint_policy()
+        self._coalesce_interval = 0
+        self._writer = None
+        self._journal_helper = None
+        self._codec = None
+        # Set whenever the session changes, cleared by each checkpoint that
+        # saves the changes
+        self._dirty = True
+        self._last_checkpoint_time = None
+        self._checkpoint_pending = False
+        self._watch_state(state)
         logger.debug(
             # TRANSLATORS: please don't translate 'SessionManager' 'state' and
             # 'storage'
@@ -238,42 +335,229 @@ class SessionManager:
         :raises:
             Anything that can be raised by
             :meth:`~plainbox.impl.session.storage.SessionStorage.
-            load_checkpoint()` and :meth:`~plainbox.impl.session.suspend.
-            SessionResumeHelper.resume()`
+            open_checkpoint()`, :meth:`~plainbox.impl.session.storage.
+            SessionStorage.load_journal()` and :meth:`~plainbox.impl.session.
+            suspend.SessionResumeHelper.resume_stream()`
         :returns:
             Fresh instance of :class:`SessionManager`
         """
         logger.debug("SessionManager.load_session()")
         try:
-            data = storage.load_checkpoint()
+            stream = storage.open_checkpoint()
         except IOError as exc:
             if exc.errno == errno.ENOENT:
                 state = SessionState(job_list)
             else:
                 raise
         else:
-            state = SessionResumeHelper(job_list).resume(data, early_cb)
+            try:
+                journal = storage.load_journal()
+                state = SessionResumeHelper(job_list).resume_stream(
+                    stream, early_cb, journal)
+            finally:
+                stream.close()
         return cls(state, storage)
 
-    def checkpoint(self):
+    def set_checkpoint_policy(self, coalesce_interval=0, background=False,
+                              journal=False, codec=None):
+        """
+        Set the policy used by :meth:`checkpoint()`
+
+        :param coalesce_interval:
+            Minimum number of seconds between two subsequent checkpoints.
+            Checkpoints requested sooner than that are postponed and saved by
+            the next checkpoint that is not postponed or by :meth:`flush()`.
+            Zero (the default) disables coalescing.
+        :param background:
+            If True, checkpoints are saved on a background thread. Callers
+            must call :meth:`flush()` before they exit to ensure that the most
+            recent checkpoint is really saved.
+        :param journal:
+            If True, checkpoints are saved as a snapshot followed by an
+            append-only journal of changes (see
+            :class:`~plainbox.impl.session.suspend.SessionSuspendHelper4`).
+            The journal is compacted into a new snapshot once it grows large
+            enough. Otherwise each checkpoint is a complete snapshot.
+        :param codec:
+            A :class:`~plainbox.impl.session.codec.SessionCodec` used to
+            encode snapshots. The default is gzip-compressed JSON.
+
+        Regardless of the policy, checkpoints that would not change anything
+        are never saved and checkpoints taken while
+        :attr:`SessionMetaData.running_job_name` is set are always saved
+        synchronously. Running a job may crash or reboot the machine so the
+        checkpoint must be on disk before the job is started.
+        """
+        if coalesce_interval < 0:
+            raise ValueError(_("coalesce_interval cannot be negative"))
+        self._coalesce_interval = coalesce_interval
+        if background and self._writer is None:
+            self._writer = _CheckpointWriter()
+        elif not background and self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if codec is not self._codec:
+            self._codec = codec
+            self._dirty = True
+            if self._journal_helper is not None:
+                self._journal_helper = SessionSuspendHelper4(codec)
+        if journal != (self._journal_helper is not None):
+            self._dirty = True
+            if journal:
+                self._journal_helper = SessionSuspendHelper4(codec)
+            else:
+                self._journal_helper = None
+
+    def checkpoint(self, sync=False):
         """
         Create a checkpoint of the session.
 
         After calling this method you can later reopen the same session with
         :meth:`SessionManager.load_session()`.
+
+        :param sync:
+            If True, the checkpoint is saved before this method returns,
+            regardless of the policy set with :meth:`set_checkpoint_policy()`.
         """
         logger.debug("SessionManager.checkpoint()")
-        data = SessionSuspendHelper().suspend(self.state)
+        if self.state.metadata.running_job_name is not None:
+            sync = True
+        if (not sync and self._coalesce_interval
+                and self._last_checkpoint_time is not None
+                and (time.time() - self._last_checkpoint_time
+                     < self._coalesce_interval)):
+            logger.debug(_("Postponing checkpoint"))
+            self._checkpoint_pending = True
+            return
+        self._checkpoint_pending = False
+        self._last_checkpoint_time = time.time()
+        if self._journal_helper is not None:
+            operation = self._get_journal_operation()
+        else:
+            operation = self._get_snapshot_operation()
+        if operation is None:
+            logger.debug(_("Session is unchanged, not saving checkpoint"))
+            if sync and self._writer is not None:
+                self._wait_for_writer()
+            return
+        supersede, fn, args = operation
+        try:
+            if self._writer is None:
+                fn(*args)
+            else:
+                self._writer.submit(supersede, fn, *args)
+        except:
+            self._forget_last_checkpoint()
+            raise
+        if sync and self._writer is not None:
+            self._wait_for_writer()
+
+    def flush(self):
+        """
+        Save any postponed checkpoint and wait until it is really saved.
+        """
+        if self._checkpoint_pending:
+            self.checkpoint(sync=True)
+        elif self._writer is not None:
+            self._wait_for_writer()
+
+    def _get_snapshot_operation(self):
+        """
+        Compute the operation that saves a complete snapshot of the session
+
+        :returns:
+            A tuple (supersede, fn, args) or None if the session is unchanged
+        """
+        if not self._dirty:
+            return None
+        writer = SessionSuspendHelper(self._codec).get_writer(self.state)
+        self._dirty = False
+        return True, self._save_checkpoint, (writer,)
+
+    def _get_journal_operation(self):
+        """
+        Compute the operation that appends changes to the journal or, if that
+        is not possible, saves a new snapshot and starts a new journal.
+
+        :returns:
+            A tuple (supersede, fn, args) or None if the session is unchanged
+        """
+        if not self._dirty:
+            return None
+        helper = self._journal_helper
+        data = helper.suspend_journal(self.state)
+        self._dirty = False
+        if data is None:
+            writer = helper.get_writer(self.state)
+            header = helper.get_journal_header()
+            return True, self._save_journal_snapshot, (writer, header)
+        elif data:
+            return False, self.storage.append_journal, (data,)
+        else:
+            return None
+
+    def _forget_last_checkpoint(self):
+        """
+        Forget what was saved by the last checkpoint so that the next
+        checkpoint saves everything again.
+        """
+        self._dirty = True
+        if self._journal_helper is not None:
+            self._journal_helper.invalidate()
+
+    def _watch_state(self, state):
+        """
+        Connect to all the signals that tell the manager that the session has
+        changed since the last checkpoint.
+        """
+        state.on_job_result_changed.connect(self._on_job_result_changed)
+        state.on_job_added.connect(self._mark_dirty)
+        state.on_job_removed.connect(self._mark_dirty)
+        state.on_desired_job_list_changed.connect(self._mark_dirty)
+        state.metadata.on_changed.connect(self._mark_dirty)
+        for job_state in state.job_state_map.values():
+            self._watch_result(job_state.result)
+
+    def _watch_result(self, result):
+        # Results are not immutable, the UI may change the outcome or the
+        # comments of a result that is already in the session.
+        result.on_outcome_changed.connect(self._mark_dirty)
+        result.on_comments_changed.connect(self._mark_dirty)
+
+    def _on_job_result_changed(self, job, result):
+        self._watch_result(result)
+        self._mark_dirty()
+
+    def _mark_dirty(self, *args):
+        self._dirty = True
+
+    def _wait_for_writer(self):
+        try:
+            self._writer.wait()
+        except:
+            self._forget_last_checkpoint()
+            raise
+
+    def _save_journal_snapshot(self, writer, header):
+        # Save the snapshot first, it refers to the new journal so the old
+        # journal is ignored if we crash before it is replaced.
+        self._save_checkpoint(writer)
+        try:
+            self.storage.reset_journal(header)
+        except LockedStorageError:
+            self.storage.break_journal_lock()
+            self.storage.reset_journal(header)
+
+    def _save_checkpoint(self, writer):
+        # The snapshot is encoded while it is being written so it is never
+        # kept in memory as a whole, see SessionSuspendHelper.get_writer()
         logger.debug(
-            ngettext(
-                "Saving %d byte of checkpoint data to %r",
-                "Saving %d bytes of checkpoint data to %r", len(data)
-            ), len(data), self.storage.location)
+            _("Saving checkpoint data to %r"), self.storage.location)
         try:
-            self.storage.save_checkpoint(data)
+            self.storage.save_checkpoint(writer)
         except LockedStorageError:
             self.storage.break_lock()
-            self.storage.save_checkpoint(data)
+            self.storage.save_checkpoint(writer)
 
     def destroy(self):
         """
@@ -283,4 +567,7 @@ class SessionManager:
         :meth:`~plainbox.impl.session.storage.SessionStorage.remove()`
         """
         logger.debug("SessionManager.destroy()")
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
         self.storage.remove()
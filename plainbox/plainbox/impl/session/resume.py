@@ -46,9 +46,10 @@ so two assumptions are made:
 from collections import deque
 import base64
 import binascii
-import gzip
+import io
 import json
 import logging
+import zlib
 
 from plainbox.abc import IJobResult
 from plainbox.i18n import gettext as _
@@ -56,6 +57,7 @@ from plainbox.impl.result import DiskJobResult
 from plainbox.impl.result import IOLogRecord
 from plainbox.impl.result import MemoryJobResult
 from plainbox.impl.secure.qualifiers import SimpleQualifier
+from plainbox.impl.session.codec import read_session_stream
 from plainbox.impl.session.state import SessionState
 
 logger = logging.getLogger("plainbox.session.resume")
@@ -107,12 +109,16 @@ class SessionResumeHelper:
         """
         self.job_list = job_list
 
-    def resume(self, data, early_cb=None):
+    def resume(self, data, early_cb=None, journal=None):
         """
         Resume a dormant session.
 
         :param data:
             Bytes representing the dormant session
+        :param journal:
+            Bytes representing the journal that continues the dormant session
+            (or None). This is only used by sessions saved in version 4 or
+            later.
         :param early_cb:
             A callback that allows the caller to "see" the session object
             early, before the bulk of resume operation happens. This method can
@@ -139,21 +145,32 @@ class SessionResumeHelper:
         :raises IncompatibleJobError:
             if serialized jobs are not the same as current jobs
         """
+        return self.resume_stream(io.BytesIO(data), early_cb, journal)
+
+    def resume_stream(self, stream, early_cb=None, journal=None):
+        """
+        Resume a dormant session from a stream.
+
+        This is the same as :meth:`resume()` but the data is decoded
+        incrementally, as it is read from the stream, so that the whole
+        (compressed) data does not have to be in memory at once.
+
+        :param stream:
+            A seekable binary stream, for example one returned by
+            :meth:`SessionStorage.open_checkpoint()`. The stream is not
+            closed.
+        """
         try:
-            data = gzip.decompress(data)
-        except IOError:
+            json_repr = read_session_stream(stream)
+        except (IOError, EOFError, zlib.error):
             raise CorruptedSessionError(_("Cannot decompress session data"))
-        try:
-            text = data.decode("UTF-8")
         except UnicodeDecodeError:
             raise CorruptedSessionError(_("Cannot decode session text"))
-        try:
-            json_repr = json.loads(text)
         except ValueError:
-            raise CorruptedSessionError(_("Cannot interpret session JSON"))
-        return self._resume_json(json_repr, early_cb)
+            raise CorruptedSessionError(_("Cannot interpret session data"))
+        return self._resume_json(json_repr, early_cb, journal)
 
-    def _resume_json(self, json_repr, early_cb=None):
+    def _resume_json(self, json_repr, early_cb=None, journal=None):
         """
         Resume a SessionState object from the JSON representation.
 
@@ -174,6 +191,9 @@ class SessionResumeHelper:
         elif version == 3:
             return SessionResumeHelper3(
                 self.job_list).resume_json(json_repr, early_cb)
+        elif version == 4:
+            return SessionResumeHelper4(
+                self.job_list).resume_json(json_repr, early_cb, journal)
         else:
             raise IncompatibleSessionError(
                 _("Unsupported version {}").format(version))
@@ -252,16 +272,19 @@ class SessionResumeHelper1:
                 logger.debug(
                     _("Using different session for resume: %r"), new_session)
                 session = new_session
-        # Restore bits and pieces of state
-        logger.debug(
-            _("Starting to restore jobs and results to %r..."), session)
-        self._restore_SessionState_jobs_and_results(session, session_repr)
-        logger.debug(_("Starting to restore metadata..."))
-        self._restore_SessionState_metadata(session, session_repr)
-        logger.debug(_("Starting to restore desired job list..."))
-        self._restore_SessionState_desired_job_list(session, session_repr)
-        logger.debug(_("Starting to restore job list..."))
-        self._restore_SessionState_job_list(session, session_repr)
+        # Restore bits and pieces of state. All of the changes are applied
+        # in a single batch so that job readiness is only computed once, at
+        # the very end.
+        with session.batch_update():
+            logger.debug(
+                _("Starting to restore jobs and results to %r..."), session)
+            self._restore_SessionState_jobs_and_results(session, session_repr)
+            logger.debug(_("Starting to restore metadata..."))
+            self._restore_SessionState_metadata(session, session_repr)
+            logger.debug(_("Starting to restore desired job list..."))
+            self._restore_SessionState_desired_job_list(session, session_repr)
+            logger.debug(_("Starting to restore job list..."))
+            self._restore_SessionState_job_list(session, session_repr)
         # Return whatever we've got
         logger.debug(_("Resume complete!"))
         return session
@@ -673,3 +696,96 @@ class SessionResumeHelper3(SessionResumeHelper2):
             metadata_repr, key='app_id', value_type=str,
             value_none=True)
         logger.debug(_("restored metadata %r"), session.metadata)
+
+
+class SessionResumeHelper4(SessionResumeHelper3):
+    """
+    Helper class for implementing session resume feature
+
+    This class works with data constructed by
+    :class:`~plainbox.impl.session.suspend.SessionSuspendHelper4` which has
+    been pre-processed by :class:`SessionResumeHelper` (to strip the initial
+    envelope).
+
+    The snapshot is resumed exactly as in version 3, after the records from
+    the journal that continues it are replayed on top of its representation.
+    Since records contain the parts of the representation that have changed,
+    replaying them is a matter of updating the representation in order.
+
+    Due to the constraints of what can be represented in a suspended session,
+    this class cannot work in isolation. It must operate with a list of know
+    jobs.
+
+    Since (most of the) jobs are being provided externally (as they represent
+    the non-serialized parts of checkbox or other job providers) several
+    failure modes are possible. Those are documented in :meth:`resume()`
+    """
+
+    def resume_json(self, json_repr, early_cb=None, journal=None):
+        """
+        Resume a SessionState object from the JSON representation.
+
+        This method is called by :meth:`resume()` after the initial envelope
+        and parsing is done. The only error conditions that can happen
+        are related to semantic incompatibilities or corrupted internal state.
+        """
+        _validate(json_repr, key="version", value_choice=[4])
+        session_repr = _validate(json_repr, key='session', value_type=dict)
+        journal_id = _validate(
+            json_repr, key='journal', value_type=str, value_none=True)
+        if journal is not None and journal_id is not None:
+            for record_repr in self._parse_journal(journal, journal_id):
+                self._replay_journal_record(session_repr, record_repr)
+        return self._build_SessionState(session_repr, early_cb)
+
+    @classmethod
+    def _parse_journal(cls, journal, journal_id):
+        """
+        Parse the journal and return the list of records it contains
+
+        Journals that don't belong to the snapshot (as identified by
+        ``journal_id``) are ignored. Parsing stops at the first record that
+        was not written completely, as can happen if the machine crashed while
+        the record was being appended.
+        """
+        record_list = []
+        for line in journal.split(b"\n")[:-1]:
+            try:
+                checksum, payload = line.split(b" ", 1)
+                if int(checksum, 16) != zlib.crc32(payload) & 0xffffffff:
+                    raise ValueError("checksum mismatch")
+                record_repr = json.loads(payload.decode("UTF-8"))
+            except ValueError:
+                logger.warning(
+                    _("Ignoring damaged journal record and everything after"
+                      " it"))
+                break
+            record_list.append(record_repr)
+        if not record_list:
+            return []
+        header_repr = record_list[0]
+        _validate(header_repr, value_type=dict)
+        if _validate(header_repr, key='journal', value_type=str) != journal_id:
+            logger.warning(_("Ignoring journal that belongs to another"
+                             " snapshot"))
+            return []
+        return record_list[1:]
+
+    @classmethod
+    def _replay_journal_record(cls, session_repr, record_repr):
+        """
+        Apply one journal record to the representation of the session
+        """
+        _validate(record_repr, value_type=dict)
+        if 'jobs' in record_repr:
+            _validate(session_repr, key='jobs', value_type=dict).update(
+                _validate(record_repr, key='jobs', value_type=dict))
+        if 'results' in record_repr:
+            _validate(session_repr, key='results', value_type=dict).update(
+                _validate(record_repr, key='results', value_type=dict))
+        if 'desired_job_list' in record_repr:
+            session_repr['desired_job_list'] = _validate(
+                record_repr, key='desired_job_list', value_type=list)
+        if 'metadata' in record_repr:
+            session_repr['metadata'] = _validate(
+                record_repr, key='metadata', value_type=dict)
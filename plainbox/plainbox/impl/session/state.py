@@ -21,12 +21,13 @@
 :mod:`plainbox.impl.session.state` -- session state handling
 ============================================================
 """
+import contextlib
 import logging
 
 from plainbox.i18n import gettext as _
 from plainbox.impl.depmgr import DependencyDuplicateError
-from plainbox.impl.depmgr import DependencyError
 from plainbox.impl.depmgr import DependencySolver
+from plainbox.impl.resource import ResourceIndex
 from plainbox.impl.session.jobs import JobState
 from plainbox.impl.session.jobs import UndesiredJobReadinessInhibitor
 from plainbox.impl.signal import Signal
@@ -54,6 +55,16 @@ class SessionMetaData:
     # set this flag after successfully sending the result somewhere.
     FLAG_SUBMITTED = "submitted"
 
+    @Signal.define
+    def on_changed(self):
+        """
+        Signal fired after any of the meta-data properties is assigned.
+
+        .. note::
+            Modifying the set returned by :attr:`flags` in place is not
+            noticed, assign a new set instead.
+        """
+
     def __init__(self, title=None, flags=None, running_job_name=None,
                  app_blob=None, app_id=None):
         if flags is None:
@@ -84,6 +95,7 @@ class SessionMetaData:
     @title.setter
     def title(self, title):
         self._title = title
+        self.on_changed()
 
     @property
     def flags(self):
@@ -102,6 +114,7 @@ class SessionMetaData:
     @flags.setter
     def flags(self, flags):
         self._flags = flags
+        self.on_changed()
 
     @property
     def running_job_name(self):
@@ -125,6 +138,7 @@ class SessionMetaData:
     @running_job_name.setter
     def running_job_name(self, running_job_name):
         self._running_job_name = running_job_name
+        self.on_changed()
 
     @property
     def app_blob(self):
@@ -145,6 +159,7 @@ class SessionMetaData:
             # TRANSLATORS: please don't translate app_blob, None and bytes
             raise TypeError(_("app_blob must be either None or bytes"))
         self._app_blob = value
+        self.on_changed()
 
     @property
     def app_id(self):
@@ -162,6 +177,7 @@ class SessionMetaData:
             # TRANSLATORS: please don't translate app_blob, None and bytes
             raise TypeError(_("app_id must be either None or str"))
         self._app_id = value
+        self.on_changed()
 
 
 class SessionState:
@@ -280,6 +296,13 @@ class SessionState:
         """
         logger.info(_("Job removed: %r"), job)
 
+    @Signal.define
+    def on_desired_job_list_changed(self):
+        """
+        Signal sent after :meth:`update_desired_job_list()` recomputes the
+        desired job list and the run list.
+        """
+
     def __init__(self, job_list):
         """
         Initialize a new SessionState with a given list of jobs.
@@ -303,7 +326,7 @@ class SessionState:
                 # Since this problem can happen any number of times (many
                 # duplicates) this is performed in a loop. The loop breaks when
                 # we cannot solve the problem _OR_ when no error occurs.
-                DependencySolver(job_list)
+                solver = DependencySolver(job_list)
             except DependencyDuplicateError as exc:
                 # If both jobs are identical then silently fix the problem by
                 # removing one of the jobs (here the second one we've seen but
@@ -319,14 +342,72 @@ class SessionState:
                 # If there are no problems then break the loop
                 break
         self._job_list = job_list
+        # Keep the solver around, it is reused (incrementally) each time
+        # update_desired_job_list() is called.
+        self._solver = solver
         self._job_state_map = {job.id: JobState(job)
                                for job in self._job_list}
         self._desired_job_list = []
         self._run_list = []
         self._resource_map = {}
+        self._resource_index_map = {}
+        # Version of the most recent resource list. It is incremented each
+        # time any resource list is changed and it is used as a part of the
+        # key of _resource_expression_cache.
+        self._resource_version = 0
+        # Cache of results of resource expressions, keyed by (expression
+        # text, implicit namespace, resource list version)
+        self._resource_expression_cache = {}
         self._metadata = SessionMetaData()
+        # Reverse dependency index of the run list. Maps the id of each job
+        # (or resource) to the set of ids of jobs on the run list that
+        # depend on it, either directly or through a resource expression.
+        # This is rebuilt each time the run list changes and allows
+        # readiness to be recomputed only for the jobs that can be affected
+        # by a particular result or resource list.
+        self._run_list_rdep_map = {}
+        # Position of each job on the run list, used to keep the order of
+        # incremental readiness updates deterministic.
+        self._run_list_index_map = {}
+        # Set of job (or resource) ids whose results or resources have
+        # changed since readiness was last recomputed
+        self._stale_dep_id_set = set()
+        # Number of calls to get_inhibitor_list() that were made and the
+        # number of calls that would have been made by a full readiness
+        # sweep but were avoided thanks to the reverse dependency index.
+        self._inhibitor_evaluation_count = 0
+        self._inhibitor_evaluation_avoided_count = 0
+        # Nesting depth of batch_update() and a flag indicating that a full
+        # readiness sweep was requested while inside a batch update
+        self._batch_update_depth = 0
+        self._readiness_sweep_pending = False
         super(SessionState, self).__init__()
 
+    @contextlib.contextmanager
+    def batch_update(self):
+        """
+        Context manager for applying many changes to the session at once.
+
+        While the context is active job results, resource lists, new jobs and
+        changes to the desired job list are applied immediately but job
+        readiness is not recomputed. When the outermost context exits job
+        readiness is recomputed exactly once, covering all the changes.
+
+        This is primarily useful when resuming a session, where all the
+        results are presented back to the session one after another.
+        Batch updates can be nested.
+        """
+        self._batch_update_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_update_depth -= 1
+            if self._batch_update_depth == 0:
+                if self._readiness_sweep_pending:
+                    self._recompute_job_readiness()
+                else:
+                    self._recompute_stale_job_readiness()
+
     def trim_job_list(self, qualifier):
         """
         Discard jobs that are selected by the given qualifier.
@@ -374,8 +455,10 @@ class SessionState:
         for job, should_remove in job_and_flag_list:
             if should_remove:
                 del self._job_state_map[job.id]
+                self._solver.remove_job(job)
                 if job.id in self._resource_map:
                     del self._resource_map[job.id]
+                    del self._resource_index_map[job.id]
         # Compute a list of jobs to retain
         retain_list = [
             job for job, should_remove in job_and_flag_list
@@ -407,34 +490,19 @@ class SessionState:
         instances of DependencyError class), one for each job that had to be
         removed.
         """
-        # Remember a copy of original desired job list. We may modify this list
-        # so let's not mess up data passed by the caller.
-        self._desired_job_list = list(desired_job_list)
-        # Reset run list just in case desired_job_list is empty
-        self._run_list = []
-        # Try to solve the dependency graph. This is done in a loop as may need
-        # to remove a problematic job and re-try. The loop provides a stop
-        # condition as we will eventually run out of jobs.
-        problems = []
-        while self._desired_job_list:
-            # XXX: it might be more efficient to incorporate this 'recovery
-            # mode' right into the solver, this way we'd probably save some
-            # resources or runtime complexity.
-            try:
-                self._run_list = DependencySolver.resolve_dependencies(
-                    self._job_list, self._desired_job_list)
-            except DependencyError as exc:
-                # When a dependency error is detected remove the affected job
-                # form _desired_job_list and try again.
-                self._desired_job_list.remove(exc.affected_job)
-                # Remember each problem, this can be presented by the UI
-                problems.append(exc)
-                continue
-            else:
-                # Don't iterate the loop if there was no exception
-                break
-        # Update all job readiness state
-        self._recompute_job_readiness()
+        # Solve the dependency graph. The solver skips each desired job that
+        # has dependency problems (and remembers the problem so that it can
+        # be presented by the UI) so _desired_job_list only retains the jobs
+        # that could be solved. The solver reuses as much of the previous
+        # solution as possible.
+        (self._run_list, self._desired_job_list,
+         problems) = self._solver.incremental_solve(desired_job_list)
+        # Update all job readiness state, unless we're in a batch update
+        if self._batch_update_depth:
+            self._readiness_sweep_pending = True
+        else:
+            self._recompute_job_readiness()
+        self.on_desired_job_list_changed()
         # Return all dependency problems to the caller
         return problems
 
@@ -498,7 +566,8 @@ class SessionState:
         with the same id.
         """
         job.controller.observe_result(self, job, result)
-        self._recompute_job_readiness()
+        self._stale_dep_id_set.add(job.id)
+        self._recompute_stale_job_readiness()
 
     def add_job(self, new_job, recompute=True):
         """
@@ -507,10 +576,11 @@ class SessionState:
         :param new_job:
             The job being added
         :param recompute:
-            If True, recompute readiness inhibitors for all jobs.
+            If True, recompute readiness inhibitors for all jobs that
+            may have been affected by previous changes to the session.
             You should only set this to False if you're adding
             a number of jobs and will otherwise ensure that
-            :meth:`_recompute_job_readiness()` gets called before
+            :meth:`_recompute_stale_job_readiness()` gets called before
             session state users can see the state again.
         :returns:
             The job that was actually added or an existing, identical
@@ -529,7 +599,9 @@ class SessionState:
 
         .. note::
 
-            This method recomputes job readiness for all jobs
+            New jobs are never on the run list so adding them cannot change
+            the readiness of any other job. This method only recomputes the
+            readiness of jobs affected by earlier, pending changes.
         """
         # See if we have a job with the same id already
         try:
@@ -538,6 +610,7 @@ class SessionState:
             # Register the new job in our state
             self.job_state_map[new_job.id] = JobState(new_job)
             self.job_list.append(new_job)
+            self._solver.add_job(new_job)
             self.on_job_state_map_changed()
             self.on_job_added(new_job)
             return new_job
@@ -549,17 +622,38 @@ class SessionState:
                 raise DependencyDuplicateError(existing_job, new_job)
             return existing_job
         finally:
-            # Update all job readiness state
+            # Update readiness state of all the affected jobs
             if recompute:
-                self._recompute_job_readiness()
+                self._recompute_stale_job_readiness()
 
     def set_resource_list(self, resource_id, resource_list):
         """
         Add or change a resource with the given id.
 
-        Resources silently overwrite any old resources with the same id.
-        """
+        Resources silently overwrite any old resources with the same id. Each
+        new resource list gets a new version so that cached results of
+        resource expressions evaluated against the old list are not used.
+        Those results are also removed from :attr:`resource_expression_cache`
+        as they can never be used again.
+
+        .. note::
+            This method does not recompute job readiness by itself. The jobs
+            that depend on this resource are merely remembered so that the
+            next readiness update (e.g. in :meth:`update_job_result()`)
+            re-evaluates them.
+        """
+        old_index = self._resource_index_map.get(resource_id)
+        if old_index is not None:
+            stale_key_list = [
+                key for key in self._resource_expression_cache
+                if key[2] == old_index.version]
+            for key in stale_key_list:
+                del self._resource_expression_cache[key]
+        self._resource_version += 1
         self._resource_map[resource_id] = resource_list
+        self._resource_index_map[resource_id] = ResourceIndex(
+            resource_list, self._resource_version)
+        self._stale_dep_id_set.add(resource_id)
 
     @property
     def job_list(self):
@@ -608,6 +702,29 @@ class SessionState:
         """
         return self._resource_map
 
+    @property
+    def resource_index_map(self):
+        """
+        Map from resource id to a ResourceIndex of the list of resource records
+
+        The index is re-created each time the resource list is changed with
+        :meth:`set_resource_list()`.
+        """
+        return self._resource_index_map
+
+    @property
+    def resource_expression_cache(self):
+        """
+        Cache of the results of resource expressions.
+
+        This is a dictionary that can be passed to
+        :meth:`plainbox.impl.resource.ResourceProgram.evaluate_or_raise()`.
+        Results are keyed by the version of the resource list (as stored in
+        :attr:`resource_index_map`) so they never outlive the resources they
+        were computed from.
+        """
+        return self._resource_expression_cache
+
     @property
     def metadata(self):
         """
@@ -621,6 +738,10 @@ class SessionState:
 
         Re-computes [job_state.ready
                      for job_state in _job_state_map.values()]
+
+        This is a full sweep over all jobs. It also rebuilds the reverse
+        dependency index of the run list that is used by
+        :meth:`_recompute_stale_job_readiness()`.
         """
         # Reset the state of all jobs to have the undesired inhibitor. Since
         # we maintain a state object for _all_ jobs (including ones not in the
@@ -629,14 +750,63 @@ class SessionState:
         for job_state in self._job_state_map.values():
             job_state.readiness_inhibitor_list = [
                 UndesiredJobReadinessInhibitor]
+        # Rebuild the reverse dependency index of the run list
+        self._run_list_rdep_map = {}
+        self._run_list_index_map = {}
+        for index, job in enumerate(self._run_list):
+            self._run_list_index_map[job.id] = index
+            for dep_type, dep_id in job.controller.get_dependency_set(job):
+                self._run_list_rdep_map.setdefault(dep_id, set()).add(job.id)
+        # Everything is recomputed below so nothing is stale anymore
+        self._stale_dep_id_set.clear()
+        self._readiness_sweep_pending = False
         # Take advantage of the fact that run_list is topologically sorted and
         # do a single O(N) pass over _run_list. All "current/update" state is
         # computed before it needs to be observed (thanks to the ordering)
         for job in self._run_list:
-            job_state = self._job_state_map[job.id]
-            # Remove the undesired inhibitor as we want to run this job
-            job_state.readiness_inhibitor_list.remove(
-                UndesiredJobReadinessInhibitor)
-            # Ask the job controller about inhibitors affecting this job
-            for inhibitor in job.controller.get_inhibitor_list(self, job):
-                job_state.readiness_inhibitor_list.append(inhibitor)
+            self._update_job_readiness(job)
+
+    def _recompute_stale_job_readiness(self):
+        """
+        Internal method of SessionState.
+
+        Re-computes the readiness of jobs on the run list that depend on any
+        of the jobs or resources that have changed since the last time
+        readiness was computed.
+
+        Jobs that are not on the run list are always inhibited by the
+        undesired inhibitor and are not affected by results or resources at
+        all. Jobs on the run list are only affected by results of their
+        direct dependencies and by the resources their requirement program
+        refers to, so looking them up in the reverse dependency index is
+        sufficient.
+
+        This method does nothing while :meth:`batch_update()` is active.
+        """
+        if self._batch_update_depth or not self._stale_dep_id_set:
+            return
+        affected_job_id_set = set()
+        for dep_id in self._stale_dep_id_set:
+            affected_job_id_set.update(
+                self._run_list_rdep_map.get(dep_id, ()))
+        self._stale_dep_id_set.clear()
+        self._inhibitor_evaluation_avoided_count += (
+            len(self._run_list) - len(affected_job_id_set))
+        # Process the jobs in run list order to keep this deterministic
+        for job_id in sorted(
+                affected_job_id_set, key=self._run_list_index_map.get):
+            self._update_job_readiness(self._job_state_map[job_id].job)
+
+    def _update_job_readiness(self, job):
+        """
+        Internal method of SessionState.
+
+        Re-computes the readiness inhibitors of a job on the run list
+        """
+        job_state = self._job_state_map[job.id]
+        # The job is on the run list so it is not inhibited by the
+        # undesired inhibitor. Ask the job controller about inhibitors
+        # affecting this job.
+        job_state.readiness_inhibitor_list = list(
+            job.controller.get_inhibitor_list(self, job))
+        self._inhibitor_evaluation_count += 1
@@ -29,6 +29,7 @@ associated with a particular session.
 """
 
 import errno
+import io
 import logging
 import os
 import shutil
@@ -185,6 +186,10 @@ class SessionStorage:
 
     _SESSION_FILE_NEXT = 'session.next'
 
+    _JOURNAL_FILE = 'session.journal'
+
+    _JOURNAL_FILE_NEXT = 'session.journal.next'
+
     def __init__(self, location):
         """
         Initialize a :class:`SessionStorage` with the given location.
@@ -212,6 +217,13 @@ class SessionStorage:
         """
         return os.path.join(self._location, self._SESSION_FILE)
 
+    @property
+    def journal_file(self):
+        """
+        pathname of the session journal file
+        """
+        return os.path.join(self._location, self._JOURNAL_FILE)
+
     @classmethod
     def create(cls, base_dir, legacy_mode=False):
         """
@@ -311,6 +323,24 @@ class SessionStorage:
         :returns: data from the most recent checkpoint
         :rtype: bytes
 
+        :raises IOError, OSError:
+            on various problems related to accessing the filesystem
+
+        :raises NotImplementedError:
+            when openat(2) is not available
+        """
+        with self.open_checkpoint() as stream:
+            return stream.read()
+
+    def open_checkpoint(self):
+        """
+        Open checkpoint data for reading
+
+        This is like :meth:`load_checkpoint()` but the data is not read into
+        memory all at once. The caller is responsible for closing the stream.
+
+        :returns: a binary stream with data from the most recent checkpoint
+
         :raises IOError, OSError:
             on various problems related to accessing the filesystem
 
@@ -318,9 +348,9 @@ class SessionStorage:
             when openat(2) is not available
         """
         if sys.version_info[0:2] >= (3, 3):
-            return self._load_checkpoint_unix_py33()
+            return self._open_checkpoint_unix_py33()
         else:
-            return self._load_checkpoint_unix_py32()
+            return self._open_checkpoint_unix_py32()
 
     def save_checkpoint(self, data):
         """
@@ -331,8 +361,16 @@ class SessionStorage:
         :meth:`SessionStorage.create()` which will ensure that this is already
         the case.
 
+        :param data:
+            The data to save. This can be a bytes object, an iterable of bytes
+            objects (written one after another) or a callable. The callable is
+            called with a writable binary stream as the only argument and it
+            should write all of the data to that stream. The last two forms
+            allow saving large checkpoints without having all of the data in
+            memory at once.
+
         :raises TypeError:
-            if data is not a bytes object.
+            if data is not a bytes object, an iterable or a callable
 
         :raises LockedStorageError:
             if leftovers from previous save_checkpoint() have been detected.
@@ -370,69 +408,166 @@ class SessionStorage:
             _("Forcibly unlinking 'next' file %r"), _next_session_pathname)
         os.unlink(_next_session_pathname)
 
-    def _load_checkpoint_unix_py32(self):
-        _session_pathname = os.path.join(self._location, self._SESSION_FILE)
-        # Open the location directory
-        location_fd = os.open(self._location, os.O_DIRECTORY)
-        logger.debug(
-            _("Opened session directory %r as descriptor %d"),
-            self._location, location_fd)
+    def load_journal(self):
+        """
+        Load the journal from the filesystem
+
+        :returns:
+            data from the journal or None if there is no journal
+        :rtype:
+            bytes
+
+        :raises IOError, OSError:
+            on various problems related to accessing the filesystem
+        """
         try:
-            # Open the current session file in the location directory
-            session_fd = os.open(_session_pathname, os.O_RDONLY)
-            logger.debug(
-                _("Opened session state file %r as descriptor %d"),
-                _session_pathname, session_fd)
-            # Stat the file to know how much to read
-            session_stat = os.fstat(session_fd)
-            logger.debug(
-                # TRANSLATORS: stat is a system call name, don't translate it
-                _("Stat'ed session state file: %s"), session_stat)
+            with open(self.journal_file, 'rb') as stream:
+                return stream.read()
+        except IOError as exc:
+            if exc.errno == errno.ENOENT:
+                return None
+            raise
+
+    def reset_journal(self, data):
+        """
+        Replace the journal with a new one
+
+        This is done atomically, exactly like :meth:`save_checkpoint()` and
+        can raise the same exceptions.
+
+        :param data:
+            Initial content of the new journal (typically just a header)
+        """
+        if not isinstance(data, bytes):
+            raise TypeError("data must be bytes")
+        if sys.version_info[0:2] >= (3, 3):
+            return self._save_file_unix_py33(
+                data, self._JOURNAL_FILE, self._JOURNAL_FILE_NEXT)
+        else:
+            return self._save_file_unix_py32(
+                data, self._JOURNAL_FILE, self._JOURNAL_FILE_NEXT)
+
+    def append_journal(self, data):
+        """
+        Append data to the journal
+
+        The data is flushed to disk before this method returns. The journal
+        must already exist (see :meth:`reset_journal()`).
+
+        :raises TypeError:
+            if data is not a bytes object.
+
+        :raises IOError, OSError:
+            on various problems related to accessing the filesystem,
+            including a missing journal.
+        """
+        if not isinstance(data, bytes):
+            raise TypeError("data must be bytes")
+        logger.debug(ngettext(
+            "Appending %d byte of data to the journal",
+            "Appending %d bytes of data to the journal",
+            len(data)), len(data))
+        if sys.version_info[0:2] >= (3, 3):
+            location_fd = os.open(self._location, os.O_DIRECTORY)
             try:
-                # Read session data
-                logger.debug(ngettext(
-                    "Reading %d byte of session state",
-                    "Reading %d bytes of session state",
-                    session_stat.st_size), session_stat.st_size)
-                data = os.read(session_fd, session_stat.st_size)
-                logger.debug(ngettext(
-                    "Read %d byte of session state",
-                    "Read %d bytes of session state", len(data)), len(data))
-                if len(data) != session_stat.st_size:
-                    raise IOError(_("partial read?"))
+                journal_fd = os.open(
+                    self._JOURNAL_FILE, os.O_WRONLY | os.O_APPEND,
+                    dir_fd=location_fd)
             finally:
-                # Close the session file
-                logger.debug(_("Closed descriptor %d"), session_fd)
-                os.close(session_fd)
+                os.close(location_fd)
+        else:
+            journal_fd = os.open(
+                self.journal_file, os.O_WRONLY | os.O_APPEND)
+        try:
+            self._write_all(journal_fd, data)
+            # Flush kernel buffers, the data must be on disk before we
+            # return as we may crash the machine soon after.
+            os.fsync(journal_fd)
         finally:
-            # Close the location directory
-            logger.debug(_("Closed descriptor %d"), location_fd)
-            os.close(location_fd)
-        return data
+            os.close(journal_fd)
 
-    def _load_checkpoint_unix_py33(self):
+    def break_journal_lock(self):
+        """
+        Forcibly unlock the journal by removing a file created during
+        atomic filesystem operations of reset_journal().
+
+        This is the same as :meth:`break_lock()` but for the journal.
+        """
+        _next_journal_pathname = os.path.join(
+            self._location, self._JOURNAL_FILE_NEXT)
+        logger.debug(
+            # TRANSLATORS: unlinking as in deleting a file
+            # Please keep the 'next' string untranslated
+            _("Forcibly unlinking 'next' file %r"), _next_journal_pathname)
+        os.unlink(_next_journal_pathname)
+
+    def _open_checkpoint_unix_py32(self):
+        _session_pathname = os.path.join(self._location, self._SESSION_FILE)
+        logger.debug(
+            _("Opening session state file %r"), _session_pathname)
+        return open(_session_pathname, 'rb')
+
+    def _open_checkpoint_unix_py33(self):
         # Open the location directory
         location_fd = os.open(self._location, os.O_DIRECTORY)
         try:
             # Open the current session file in the location directory
-            session_fd = os.open(
-                self._SESSION_FILE, os.O_RDONLY, dir_fd=location_fd)
-            # Stat the file to know how much to read
-            session_stat = os.fstat(session_fd)
-            try:
-                # Read session data
-                data = os.read(session_fd, session_stat.st_size)
-                if len(data) != session_stat.st_size:
-                    raise IOError(_("partial read?"))
-            finally:
-                # Close the session file
-                os.close(session_fd)
+            return open(
+                self._SESSION_FILE, 'rb',
+                opener=lambda path, flags: os.open(
+                    path, flags, dir_fd=location_fd))
         finally:
             # Close the location directory
             os.close(location_fd)
-        return data
+
+    @staticmethod
+    def _check_data(data):
+        if isinstance(data, (str, bytearray)) or not (
+                isinstance(data, bytes) or callable(data)
+                or hasattr(data, '__iter__')):
+            raise TypeError("data must be bytes")
+
+    @staticmethod
+    def _write_all(fd, data):
+        """
+        Write all of the data to a file descriptor
+
+        :returns: number of bytes written
+        """
+        if not isinstance(data, bytes):
+            raise TypeError("data must be bytes")
+        view = memoryview(data)
+        num_written = 0
+        while num_written < len(view):
+            count = os.write(fd, view[num_written:])
+            if count == 0:
+                raise IOError(_("partial write?"))
+            num_written += count
+        return num_written
+
+    @classmethod
+    def _write_data(cls, fd, data):
+        """
+        Write data, as described in :meth:`save_checkpoint()`, to a file
+        descriptor
+
+        :returns: number of bytes written
+        """
+        if isinstance(data, bytes):
+            return cls._write_all(fd, data)
+        elif callable(data):
+            raw_stream = io.FileIO(fd, 'wb', closefd=False)
+            with io.BufferedWriter(raw_stream) as stream:
+                data(stream)
+            return os.lseek(fd, 0, os.SEEK_CUR)
+        else:
+            return sum(cls._write_all(fd, chunk) for chunk in data)
 
     def _save_checkpoint_unix_py32(self, data):
+        return self._save_file_unix_py32(
+            data, self._SESSION_FILE, self._SESSION_FILE_NEXT)
+
+    def _save_file_unix_py32(self, data, filename, next_filename):
         # NOTE: this is like _save_checkpoint_py33 but without all the
         # *at() functions (openat, renameat)
         #
@@ -444,16 +579,11 @@ class SessionStorage:
         # so this, python 3.2 specific version, just does the best effort
         # implementation. Some of the comments were redacted but
         # but keep in mind that the rename race is always there.
-        if not isinstance(data, bytes):
-            raise TypeError("data must be bytes")
-        logger.debug(ngettext(
-            "Saving %d byte of data (UNIX, python 3.2 or older)",
-            "Saving %d bytes of data (UNIX, python 3.2 or older)",
-            len(data)), len(data))
+        self._check_data(data)
+        logger.debug(_("Saving data (UNIX, python 3.2 or older)"))
         # Helper pathnames, needed because we don't have *at functions
-        _next_session_pathname = os.path.join(
-            self._location, self._SESSION_FILE_NEXT)
-        _session_pathname = os.path.join(self._location, self._SESSION_FILE)
+        _next_session_pathname = os.path.join(self._location, next_filename)
+        _session_pathname = os.path.join(self._location, filename)
         # Open the location directory, we need to fsync that later
         # XXX: this may fail, maybe we should keep the fd open all the time?
         location_fd = os.open(self._location, os.O_DIRECTORY)
@@ -486,23 +616,21 @@ class SessionStorage:
             try:
                 # Write session data to disk
                 #
-                # I cannot find conclusive evidence but it seems that
-                # os.write() handles partial writes internally. In case we do
-                # get a partial write _or_ we run out of disk space, raise an
-                # explicit IOError.
-                num_written = os.write(next_session_fd, data)
+                # os.write() may write less than requested, _write_data()
+                # keeps writing until everything is written. If we run out of
+                # disk space an IOError is raised.
+                num_written = self._write_data(next_session_fd, data)
                 logger.debug(ngettext(
                     "Wrote %d byte of data to descriptor %d",
                     "Wrote %d bytes of data to descriptor %d",
                     num_written), num_written, next_session_fd)
-                if num_written != len(data):
-                    raise IOError(_("partial write?"))
             except:
                 # If anything goes wrong we should unlink the next file.
 
                 # TRANSLATORS: unlinking as in deleting a file
                 logger.warning(_("Unlinking %r"), _next_session_pathname)
                 os.unlink(_next_session_pathname)
+                raise
             else:
                 # If the write was successful we must flush kernel buffers.
                 #
@@ -529,6 +657,7 @@ class SessionStorage:
                 # TRANSLATORS: unlinking as in deleting a file
                 logger.warning(_("Unlinking %r"), _next_session_pathname)
                 os.unlink(_next_session_pathname)
+                raise
             # Flush kernel buffers on the directory.
             #
             # This should ensure the rename operation is really on disk by now.
@@ -544,12 +673,12 @@ class SessionStorage:
             os.close(location_fd)
 
     def _save_checkpoint_unix_py33(self, data):
-        if not isinstance(data, bytes):
-            raise TypeError("data must be bytes")
-        logger.debug(ngettext(
-            "Saving %d byte of data (UNIX, python 3.3 or newer)",
-            "Saving %d bytes of data (UNIX, python 3.3 or newer)",
-            len(data)), len(data))
+        return self._save_file_unix_py33(
+            data, self._SESSION_FILE, self._SESSION_FILE_NEXT)
+
+    def _save_file_unix_py33(self, data, filename, next_filename):
+        self._check_data(data)
+        logger.debug(_("Saving data (UNIX, python 3.3 or newer)"))
         # Open the location directory, we need to fsync that later
         # XXX: this may fail, maybe we should keep the fd open all the time?
         location_fd = os.open(self._location, os.O_DIRECTORY)
@@ -573,36 +702,34 @@ class SessionStorage:
             # that can be especially handled by some layer above.
             try:
                 next_session_fd = os.open(
-                    self._SESSION_FILE_NEXT,
+                    next_filename,
                     os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644,
                     dir_fd=location_fd)
             except FileExistsError:
                 raise LockedStorageError()
             logger.debug(
                 _("Opened next session file %s as descriptor %d"),
-                self._SESSION_FILE_NEXT, next_session_fd)
+                next_filename, next_session_fd)
             try:
                 # Write session data to disk
                 #
-                # I cannot find conclusive evidence but it seems that
-                # os.write() handles partial writes internally. In case we do
-                # get a partial write _or_ we run out of disk space, raise an
-                # explicit IOError.
-                num_written = os.write(next_session_fd, data)
+                # os.write() may write less than requested, _write_data()
+                # keeps writing until everything is written. If we run out of
+                # disk space an IOError is raised.
+                num_written = self._write_data(next_session_fd, data)
                 logger.debug(ngettext(
                     "Wrote %d byte of data to descriptor %d",
                     "Wrote %d bytes of data to descriptor %d", num_written),
                     num_written, next_session_fd)
-                if num_written != len(data):
-                    raise IOError(_("partial write?"))
             except:
                 # If anything goes wrong we should unlink the next file. As
                 # with the open() call above we use unlinkat to prevent race
                 # conditions.
 
                 # TRANSLATORS: unlinking as in deleting a file
-                logger.warning(_("Unlinking %r"), self._SESSION_FILE_NEXT)
-                os.unlink(self._SESSION_FILE_NEXT, dir_fd=location_fd)
+                logger.warning(_("Unlinking %r"), next_filename)
+                os.unlink(next_filename, dir_fd=location_fd)
+                raise
             else:
                 # If the write was successful we must flush kernel buffers.
                 #
@@ -622,9 +749,9 @@ class SessionStorage:
             # location (directory) is being moved
             logger.debug(
                 _("Renaming %r to %r"),
-                self._SESSION_FILE_NEXT, self._SESSION_FILE)
+                next_filename, filename)
             try:
-                os.rename(self._SESSION_FILE_NEXT, self._SESSION_FILE,
+                os.rename(next_filename, filename,
                           src_dir_fd=location_fd, dst_dir_fd=location_fd)
             except:
                 # Same as above, if we fail we need to unlink the next file
@@ -632,8 +759,9 @@ class SessionStorage:
                 # with O_EXCL flag.
 
                 # TRANSLATORS: unlinking as in deleting a file
-                logger.warning(_("Unlinking %r"), self._SESSION_FILE_NEXT)
-                os.unlink(self._SESSION_FILE_NEXT, dir_fd=location_fd)
+                logger.warning(_("Unlinking %r"), next_filename)
+                os.unlink(next_filename, dir_fd=location_fd)
+                raise
             # Flush kernel buffers on the directory.
             #
             # This should ensure the rename operation is really on disk by now.
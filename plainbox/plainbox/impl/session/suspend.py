@@ -70,6 +70,10 @@ results that created them. The framework has special support code for knowing
 how to resume in light of the fact that some jobs might be generated during
 the resume process itself.
 
+The representation is turned into bytes by one of the codecs from
+:mod:`plainbox.impl.session.codec`. The codec is independent of the
+serialization format version, the resume code detects it automatically.
+
 Serialization format versions
 ^^^^^^^^^^^^^^^^^^^^^^^^^^^^^
 1) The initial version
@@ -77,13 +81,23 @@ Serialization format versions
    :attr:`plainbox.impl.session.state.SessionMetaData.app_blob`
 3) Same as '2' but suspends
    :attr:`plainbox.impl.session.state.SessionMetaData.app_id`
+4) Same as '3' but the snapshot is accompanied by a journal. The snapshot
+   carries the identifier of the journal that continues it. The journal is an
+   append-only sequence of records, each one holding the parts of the session
+   representation that have changed since the previous record (or since the
+   snapshot). See :class:`SessionSuspendHelper4` for details.
 """
 
-import gzip
-import json
-import logging
 import base64
+import functools
+import io
+import logging
+import uuid
+import zlib
 
+from plainbox.i18n import gettext as _
+from plainbox.impl.session.codec import GzipSessionCodec
+from plainbox.impl.session.codec import dump_json
 from plainbox.impl.result import DiskJobResult
 from plainbox.impl.result import MemoryJobResult
 
@@ -103,6 +117,18 @@ class SessionSuspendHelper1:
 
     VERSION = 1
 
+    def __init__(self, codec=None):
+        """
+        Initialize the helper
+
+        :param codec:
+            A :class:`~plainbox.impl.session.codec.SessionCodec` used to
+            encode the data. The default is to use gzip-compressed JSON.
+        """
+        if codec is None:
+            codec = GzipSessionCodec()
+        self.codec = codec
+
     def suspend(self, session):
         """
         Compute the data that is saved by :class:`SessionStorage` as a
@@ -110,16 +136,37 @@ class SessionSuspendHelper1:
 
         :returns bytes: the serialized data
         """
-        json_repr = self._json_repr(session)
-        data = json.dumps(
-            json_repr,
-            ensure_ascii=False,
-            sort_keys=True,
-            indent=None,
-            separators=(',', ':')
-        ).encode("UTF-8")
-        # NOTE: gzip.compress is not deterministic on python3.2
-        return gzip.compress(data)
+        stream = io.BytesIO()
+        self.suspend_to_stream(session, stream)
+        return stream.getvalue()
+
+    def suspend_to_stream(self, session, stream):
+        """
+        Compute the same data as :meth:`suspend()` and write it to a stream
+
+        The data is encoded and written incrementally so this can be used to
+        save large sessions without having all of the data in memory at
+        once, for example by passing a callback that calls this method to
+        :meth:`SessionStorage.save_checkpoint()`.
+
+        :param stream:
+            A writable binary stream
+        :returns:
+            Number of bytes written
+        """
+        return self.get_writer(session)(stream)
+
+    def get_writer(self, session):
+        """
+        Compute a callable that writes the same data as :meth:`suspend()`
+
+        The session is looked at right away but nothing is encoded until the
+        callable is called with a writable binary stream (it returns the
+        number of bytes written). The callable can be passed directly to
+        :meth:`SessionStorage.save_checkpoint()`, even if the session changes
+        before it is called.
+        """
+        return functools.partial(self.codec.write, self._json_repr(session))
 
     def _json_repr(self, session):
         """
@@ -437,3 +484,229 @@ class SessionSuspendHelper3(SessionSuspendHelper2):
 
 # Alias for the most recent version
 SessionSuspendHelper = SessionSuspendHelper3
+
+
+class SessionSuspendHelper4(SessionSuspendHelper3):
+    """
+    Helper class for computing binary representation of a session.
+
+    The helper only creates a bytes object to save. Actual saving should
+    be performed using some other means, preferably using
+    :class:`~plainbox.impl.session.storage.SessionStorage`.
+
+    This class creates version '4' snapshots and journal records that
+    describe changes made to the session after the snapshot was taken.
+
+    Unlike all the earlier versions, instances of this class are stateful.
+    Each call to :meth:`suspend()` starts a new journal (with a random
+    identifier) and each call to :meth:`suspend_journal()` computes the record
+    that should be appended to that journal. Records are only computed for
+    results that were replaced or changed in place (see
+    :meth:`_get_result_key()`) and for the job list, desired job list and
+    meta-data if they have changed. This keeps the cost of each checkpoint
+    proportional to the amount of changes, rather than to the size of the
+    whole session.
+
+    Each line of the journal is a CRC32 checksum (eight hexadecimal digits), a
+    space, a JSON object and a newline. The first line is the header that
+    identifies the journal. Partially written lines (which can only be at the
+    end of the journal) are detected and ignored when resuming.
+    """
+
+    VERSION = 4
+
+    # The journal is compacted (a new snapshot is taken) once it grows beyond
+    # the size of the snapshot and at least this many bytes.
+    COMPACTION_MIN_SIZE = 64 * 1024
+
+    def __init__(self, codec=None):
+        super(SessionSuspendHelper4, self).__init__(codec)
+        self._journal_id = None
+        self._snapshot_size = 0
+        self._journal_size = 0
+        # State of the session as seen by the last snapshot or journal record
+        self._saved_job_map = {}
+        self._saved_result_map = {}
+        self._saved_metadata_repr = None
+        self._saved_desired_job_list_repr = None
+
+    @property
+    def journal_id(self):
+        """
+        identifier of the current journal or None
+
+        The identifier is None if :meth:`suspend()` was never called or if
+        :meth:`invalidate()` was called since.
+        """
+        return self._journal_id
+
+    def invalidate(self):
+        """
+        Forget the current journal.
+
+        This should be called if the snapshot or any of the journal records
+        could not be saved. The next record cannot be computed and a new
+        snapshot must be taken instead.
+        """
+        self._journal_id = None
+
+    def suspend(self, session):
+        """
+        Compute the data that is saved by :class:`SessionStorage` as a
+        part of :meth:`SessionStorage.save_checkpoint()`.
+
+        This starts a new journal, see :meth:`get_journal_header()`.
+
+        :returns bytes: the serialized data
+        """
+        return super(SessionSuspendHelper4, self).suspend(session)
+
+    def get_writer(self, session):
+        """
+        Compute a callable that writes the same data as :meth:`suspend()`
+
+        This starts a new journal, see :meth:`get_journal_header()`.
+        """
+        self._journal_id = uuid.uuid4().hex
+        self._journal_size = 0
+        write = super(SessionSuspendHelper4, self).get_writer(session)
+
+        def write_snapshot(stream):
+            self._snapshot_size = write(stream)
+            return self._snapshot_size
+        return write_snapshot
+
+    def get_journal_header(self):
+        """
+        Compute the header of the current journal
+
+        :returns bytes: the serialized header
+        """
+        if self._journal_id is None:
+            raise ValueError(_("there is no journal to describe"))
+        header = self._make_journal_record({
+            "version": self.VERSION,
+            "journal": self._journal_id,
+        })
+        self._journal_size = len(header)
+        return header
+
+    def suspend_journal(self, session):
+        """
+        Compute a journal record for the changes made since the last call
+        to :meth:`suspend()` or :meth:`suspend_journal()`.
+
+        :returns:
+            The serialized record (as bytes), an empty bytes object if nothing
+            has changed or None if the changes cannot be journaled and a new
+            snapshot has to be taken instead. This happens when there is no
+            journal, when some jobs were removed from the session or when the
+            journal is due for compaction.
+        """
+        if self._journal_id is None:
+            return None
+        if self._journal_size > max(
+                self.COMPACTION_MIN_SIZE, self._snapshot_size):
+            return None
+        job_state_map = session.job_state_map
+        if any(job_id not in job_state_map
+               for job_id in self._saved_job_map):
+            return None
+        record = {}
+        jobs_repr = {
+            job_id: state.job.checksum
+            for job_id, state in job_state_map.items()
+            if self._saved_job_map.get(job_id) != state.job.checksum}
+        if jobs_repr:
+            record['jobs'] = jobs_repr
+        results_repr = {
+            job_id: [self._repr_JobResult(state.result)]
+            for job_id, state in job_state_map.items()
+            if self._saved_result_map.get(job_id) != (
+                state.result, self._get_result_key(state.result))}
+        if results_repr:
+            record['results'] = results_repr
+        desired_job_list_repr = [job.id for job in session.desired_job_list]
+        if desired_job_list_repr != self._saved_desired_job_list_repr:
+            record['desired_job_list'] = desired_job_list_repr
+        metadata_repr = self._repr_SessionMetaData(session.metadata)
+        if metadata_repr != self._saved_metadata_repr:
+            record['metadata'] = metadata_repr
+        if not record:
+            return b''
+        self._remember_SessionState(
+            session, desired_job_list_repr, metadata_repr)
+        data = self._make_journal_record(record)
+        self._journal_size += len(data)
+        return data
+
+    def _json_repr(self, session):
+        """
+        Compute the representation of all of the data that needs to be saved.
+
+        :returns:
+            JSON-friendly representation
+        :rtype:
+            dict
+
+        The dictionary has the following keys:
+
+            ``version``
+                A integral number describing the version of the representation.
+                See the version table for details.
+
+            ``session``
+                Representation of the session as computed by
+                :meth:`_repr_SessionState()`
+
+            ``journal``
+                Identifier of the journal that continues this snapshot
+        """
+        data = super(SessionSuspendHelper4, self)._json_repr(session)
+        data['journal'] = self._journal_id
+        return data
+
+    def _repr_SessionState(self, obj):
+        """
+        Compute the representation of :class:`SessionState`
+
+        This is the same as in earlier versions, the state that was
+        represented is remembered so that :meth:`suspend_journal()` can
+        compute what has changed since.
+        """
+        data = super(SessionSuspendHelper4, self)._repr_SessionState(obj)
+        self._remember_SessionState(
+            obj, data['desired_job_list'], data['metadata'])
+        return data
+
+    def _remember_SessionState(self, obj, desired_job_list_repr,
+                               metadata_repr):
+        self._saved_job_map = {
+            job_id: state.job.checksum
+            for job_id, state in obj.job_state_map.items()}
+        self._saved_result_map = {
+            job_id: (state.result, self._get_result_key(state.result))
+            for job_id, state in obj.job_state_map.items()}
+        self._saved_desired_job_list_repr = desired_job_list_repr
+        self._saved_metadata_repr = metadata_repr
+
+    @staticmethod
+    def _get_result_key(result):
+        """
+        Compute a cheap key that changes when a result is modified in place
+
+        Applications may set the outcome and the comments of a result that is
+        already a part of the session. The rest of the result (the IO log) is
+        never changed without replacing the result object.
+        """
+        return (result.outcome, result.comments, result.return_code,
+                getattr(result, 'io_log_filename', None))
+
+    @staticmethod
+    def _make_journal_record(obj):
+        """
+        Serialize a single line of the journal
+        """
+        payload = dump_json(obj)
+        checksum = "{:08x} ".format(zlib.crc32(payload) & 0xffffffff)
+        return checksum.encode("ASCII") + payload + b"\n"
@@ -0,0 +1,179 @@
+# This file is part of Checkbox.
+#
+# Copyright 2014 Canonical Ltd.
+#
+# Checkbox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3,
+# as published by the Free Software Foundation.
+
+#
+# Checkbox is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Checkbox.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+plainbox.impl.session.test_codec
+================================
+
+Test definitions for plainbox.impl.session.codec module
+"""
+
+from unittest import TestCase
+import gzip
+import io
+import json
+
+from plainbox.impl.session.codec import BinarySessionCodec
+from plainbox.impl.session.codec import CODEC_HEADER_PREFIX
+from plainbox.impl.session.codec import GzipSessionCodec
+from plainbox.impl.session.codec import JSONSessionCodec
+from plainbox.impl.session.codec import SORT_KEYS
+from plainbox.impl.session.codec import decode_session_data
+from plainbox.impl.session.codec import dump_json
+from plainbox.impl.session.codec import get_codec
+from plainbox.impl.session.codec import iter_json
+from plainbox.impl.session.codec import read_json
+from plainbox.impl.session.codec import read_session_stream
+
+
+class SessionCodecTests(TestCase):
+
+    json_repr = {
+        "version": 3,
+        "session": {
+            "jobs": {"a": "1" * 64, "b": "2" * 64},
+            "results": {
+                "a": [{"outcome": "pass", "return_code": 0,
+                       "execution_duration": 1.5, "comments": None}],
+                "b": [{"outcome": "fail", "return_code": -1,
+                       "execution_duration": 0.25, "comments": "żółw"}],
+            },
+            "desired_job_list": ["a", "b"],
+            "metadata": {"title": None, "flags": ["incomplete"],
+                         "running_job_name": None, "app_blob": None,
+                         "app_id": None},
+        },
+        "big": [2 ** 70, -2 ** 70, True, False, ""],
+    }
+
+    def test_round_trip(self):
+        for codec in (GzipSessionCodec(), GzipSessionCodec(1),
+                      JSONSessionCodec(), BinarySessionCodec()):
+            data = codec.encode(self.json_repr)
+            self.assertEqual(decode_session_data(data), self.json_repr)
+
+    def test_gzip_is_bare(self):
+        # Bare gzip streams can be resumed by older versions of PlainBox
+        data = GzipSessionCodec().encode(self.json_repr)
+        self.assertEqual(
+            json.loads(gzip.decompress(data).decode("UTF-8")), self.json_repr)
+
+    def test_header(self):
+        data = JSONSessionCodec().encode(self.json_repr)
+        self.assertTrue(data.startswith(CODEC_HEADER_PREFIX + b"json\n"))
+        data = BinarySessionCodec().encode(self.json_repr)
+        self.assertTrue(data.startswith(CODEC_HEADER_PREFIX + b"binary\n"))
+
+    def test_gzip_level(self):
+        self.assertEqual(GzipSessionCodec().level, 9)
+        with self.assertRaises(ValueError):
+            GzipSessionCodec(10)
+
+    def test_binary_is_compact(self):
+        json_repr = {"results": {
+            "job-{}".format(i): [{"outcome": "pass", "return_code": 0,
+                                  "comments": None}]
+            for i in range(100)}}
+        self.assertLess(
+            len(BinarySessionCodec().encode(json_repr)),
+            len(JSONSessionCodec().encode(json_repr)) / 2)
+
+    def test_binary_errors(self):
+        codec = BinarySessionCodec()
+        payload = codec.encode_payload(self.json_repr)
+        with self.assertRaises(ValueError):
+            codec.decode_payload(payload[:-1])
+        with self.assertRaises(ValueError):
+            codec.decode_payload(payload + b'N')
+        with self.assertRaises(ValueError):
+            codec.decode_payload(b'X')
+        with self.assertRaises(ValueError):
+            codec.decode_payload(b'r\x00')
+        with self.assertRaises(TypeError):
+            codec.encode_payload({1: 2})
+        with self.assertRaises(TypeError):
+            codec.encode_payload(object())
+
+    def test_unknown_codec(self):
+        with self.assertRaises(ValueError):
+            decode_session_data(CODEC_HEADER_PREFIX + b"rot13\n{}")
+        with self.assertRaises(ValueError):
+            decode_session_data(CODEC_HEADER_PREFIX + b"json")
+
+    def test_get_codec(self):
+        self.assertIsInstance(get_codec("gzip"), GzipSessionCodec)
+        self.assertEqual(get_codec("gzip:1").level, 1)
+        self.assertIsInstance(get_codec("json"), JSONSessionCodec)
+        self.assertIsInstance(get_codec("binary"), BinarySessionCodec)
+        for spec in ("rot13", "json:1", "gzip:", "gzip:x", "gzip:10"):
+            with self.assertRaises(ValueError):
+                get_codec(spec)
+
+    def test_dump_json_order(self):
+        data = dump_json({"b": 1, "a": 2})
+        if SORT_KEYS:
+            self.assertEqual(data, b'{"a":2,"b":1}')
+        else:
+            self.assertEqual(data, b'{"b":1,"a":2}')
+
+    def test_iter_json(self):
+        for json_repr in (self.json_repr, {}, [], {"a": {}, "b": []}, 1):
+            self.assertEqual(
+                ''.join(iter_json(json_repr)).encode("UTF-8"),
+                dump_json(json_repr))
+        self.assertGreater(len(list(iter_json(self.json_repr))), 10)
+
+    def test_read_json(self):
+        text = json.dumps(self.json_repr, indent=1).encode("UTF-8")
+        for json_repr, data in ((self.json_repr, text),
+                                ({}, b' { } '), ([], b'[]'),
+                                (12345, b'12345'), (None, b'null')):
+            for chunk_size in (1, 7, 64 * 1024):
+                self.assertEqual(
+                    read_json(io.BytesIO(data), chunk_size=chunk_size),
+                    json_repr)
+
+    def test_read_json_reads_in_chunks(self):
+        data = dump_json({"a": ["x" * 1000] * 100})
+        stream = io.BytesIO(data)
+        read_size_list = []
+        read = stream.read
+
+        def spy(size):
+            read_size_list.append(size)
+            return read(size)
+        stream.read = spy
+        read_json(stream, chunk_size=4096)
+        self.assertLess(max(read_size_list), 8192)
+
+    def test_read_json_errors(self):
+        for data in (b'', b'{', b'{"a":1', b'{"a" 1}', b'{1:2}', b'[1,]',
+                     b'[1 2]', b'"abc', b'{} []', b'\xff'):
+            with self.assertRaises(ValueError):
+                read_json(io.BytesIO(data), chunk_size=2)
+
+    def test_stream_round_trip(self):
+        for codec in (GzipSessionCodec(), JSONSessionCodec(),
+                      BinarySessionCodec()):
+            stream = io.BytesIO()
+            stream.write(b'junk')
+            size = codec.write(self.json_repr, stream)
+            self.assertEqual(size, len(stream.getvalue()) - 4)
+            self.assertEqual(
+                stream.getvalue()[4:], codec.encode(self.json_repr))
+            stream.seek(4)
+            self.assertEqual(read_session_stream(stream), self.json_repr)
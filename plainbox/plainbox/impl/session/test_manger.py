@@ -24,12 +24,19 @@ plainbox.impl.test_manager
 Test definitions for plainbox.impl.session.manager module
 """
 
+from tempfile import TemporaryDirectory
 from unittest import TestCase
+import io
 
+from plainbox.abc import IJobResult
 from plainbox.impl.session import SessionManager
 from plainbox.impl.session import SessionState
 from plainbox.impl.session import SessionStorage
+from plainbox.impl.result import MemoryJobResult
+from plainbox.impl.session.codec import JSONSessionCodec
+from plainbox.impl.session.storage import LockedStorageError
 from plainbox.impl.session.suspend import SessionSuspendHelper
+from plainbox.impl.testing_utils import make_job
 from plainbox.vendor import mock
 
 
@@ -40,7 +47,8 @@ class SessionManagerTests(TestCase):
         verify that accessing SessionManager.state works okay
         """
         storage = mock.Mock(name="storage", spec=SessionStorage)
-        state = mock.Mock(name="state", spec=SessionState)
+        state = mock.Mock(
+            name="state", spec=SessionState, job_state_map={})
         manager = SessionManager(state, storage)
         self.assertIs(manager.state, state)
 
@@ -49,7 +57,8 @@ class SessionManagerTests(TestCase):
         verify that accessing SessionManager.storage works okay
         """
         storage = mock.Mock(name="storage", spec=SessionStorage)
-        state = mock.Mock(name="state", spec=SessionState)
+        state = mock.Mock(
+            name="state", spec=SessionState, job_state_map={})
         manager = SessionManager(state, storage)
         self.assertIs(manager.storage, storage)
 
@@ -59,7 +68,8 @@ class SessionManagerTests(TestCase):
         suspended session and writes it using the storage system.
         """
         storage = mock.Mock(name="storage", spec=SessionStorage)
-        state = mock.Mock(name="state", spec=SessionState)
+        state = mock.Mock(
+            name="state", spec=SessionState, job_state_map={})
         manager = SessionManager(state, storage)
         # Mock the suspend helper, we don't want to suspend our mock objects
         helper_name = "plainbox.impl.session.manager.SessionSuspendHelper"
@@ -67,12 +77,13 @@ class SessionManagerTests(TestCase):
             # Call the tested method
             manager.checkpoint()
             # Ensure that a fresh instance of the suspend helper was used to
-            # call the suspend() method and that the session state parameter
-            # was passed to it.
-            helper_cls().suspend.assert_called_with(state)
+            # call the get_writer() method and that the session state
+            # parameter was passed to it.
+            helper_cls().get_writer.assert_called_with(state)
         # Ensure that save_checkpoint() was called on the storage object with
-        # the return value of what the suspend helper produced.
-        storage.save_checkpoint.assert_called_with(helper_cls().suspend(state))
+        # the writer that the suspend helper produced.
+        storage.save_checkpoint.assert_called_with(
+            helper_cls().get_writer(state))
 
     def test_load_session(self):
         """
@@ -84,17 +95,20 @@ class SessionManagerTests(TestCase):
         job_list = mock.Mock(name='job_list')
         helper_name = "plainbox.impl.session.manager.SessionResumeHelper"
         with mock.patch(helper_name) as helper_cls:
-            helper_cls().resume.return_value = mock.Mock(
-                name="state", spec=SessionState)
+            helper_cls().resume_stream.return_value = mock.Mock(
+                name="state", spec=SessionState, job_state_map={})
             manager = SessionManager.load_session(job_list, storage)
-        # Ensure that the storage object was used to load the session snapshot
-        storage.load_checkpoint.assert_called_with()
+        # Ensure that the storage object was used to open the session snapshot
+        storage.open_checkpoint.assert_called_with()
         # Ensure that the helper was instantiated with the job list
         helper_cls.assert_called_with(job_list)
         # Ensure that the helper instance was asked to recreate session state
-        helper_cls().resume.assert_called_with(storage.load_checkpoint(), None)
+        helper_cls().resume_stream.assert_called_with(
+            storage.open_checkpoint(), None, storage.load_journal())
+        # Ensure that the snapshot was closed
+        storage.open_checkpoint().close.assert_called_with()
         # Ensure that the resulting manager has correct data inside
-        self.assertEqual(manager.state, helper_cls().resume())
+        self.assertEqual(manager.state, helper_cls().resume_stream())
         self.assertEqual(manager.storage, storage)
 
     @mock.patch.multiple(
@@ -142,7 +156,8 @@ class SessionManagerTests(TestCase):
         storage repository and creates session directories
         """
         # Mock job list
-        state = mock.Mock(name='state', spec=SessionState)
+        state = mock.Mock(
+            name='state', spec=SessionState, job_state_map={})
         # Create the new manager
         manager = SessionManager.create_with_state(state)
         # Ensure that a default repository was created
@@ -159,3 +174,214 @@ class SessionManagerTests(TestCase):
         # Ensure that the resulting manager has correct data inside
         self.assertEqual(manager.state, state)
         self.assertEqual(manager.storage, storage)
+
+
+class SessionManagerCheckpointPolicyTests(TestCase):
+
+    def setUp(self):
+        self.storage = mock.Mock(name="storage", spec=SessionStorage)
+        self.state = SessionState([])
+        self.manager = SessionManager(self.state, self.storage)
+
+    def tearDown(self):
+        self.manager.set_checkpoint_policy()
+
+    def _get_saved_data(self):
+        # Checkpoints are saved by a callable that writes to a stream
+        writer = self.storage.save_checkpoint.call_args[0][0]
+        stream = io.BytesIO()
+        writer(stream)
+        return stream.getvalue()
+
+    def test_unchanged_state_is_not_saved(self):
+        self.manager.checkpoint()
+        self.manager.checkpoint()
+        self.assertEqual(self.storage.save_checkpoint.call_count, 1)
+        self.state.metadata.title = "title"
+        self.manager.checkpoint()
+        self.assertEqual(self.storage.save_checkpoint.call_count, 2)
+
+    def test_unchanged_state_is_not_serialized(self):
+        self.manager.checkpoint()
+        helper_name = "plainbox.impl.session.manager.SessionSuspendHelper"
+        with mock.patch(helper_name) as helper_cls:
+            self.manager.checkpoint()
+        self.assertEqual(helper_cls().suspend.call_count, 0)
+
+    def test_desired_job_list_changes_are_saved(self):
+        self.manager.checkpoint()
+        self.state.update_desired_job_list([])
+        self.manager.checkpoint()
+        self.assertEqual(self.storage.save_checkpoint.call_count, 2)
+
+    def test_result_changes_are_saved(self):
+        job = make_job('job')
+        self.state.add_job(job)
+        result = MemoryJobResult({'outcome': IJobResult.OUTCOME_NONE})
+        self.state.update_job_result(job, result)
+        self.manager.checkpoint()
+        # The UI changes results in place
+        result.outcome = IJobResult.OUTCOME_PASS
+        self.manager.checkpoint()
+        result.comments = "comments"
+        self.manager.checkpoint()
+        self.assertEqual(self.storage.save_checkpoint.call_count, 3)
+
+    def test_failed_checkpoint_is_retried(self):
+        self.storage.save_checkpoint.side_effect = OSError
+        with self.assertRaises(OSError):
+            self.manager.checkpoint()
+        self.storage.save_checkpoint.side_effect = None
+        self.manager.checkpoint()
+        self.assertEqual(self.storage.save_checkpoint.call_count, 2)
+
+    def test_negative_coalesce_interval(self):
+        with self.assertRaises(ValueError):
+            self.manager.set_checkpoint_policy(coalesce_interval=-1)
+
+    def test_checkpoints_are_coalesced(self):
+        self.manager.set_checkpoint_policy(coalesce_interval=3600)
+        self.manager.checkpoint()
+        self.state.metadata.title = "title"
+        self.manager.checkpoint()
+        self.state.metadata.flags = {"flag"}
+        self.manager.checkpoint()
+        self.assertEqual(self.storage.save_checkpoint.call_count, 1)
+        self.manager.flush()
+        self.assertEqual(self.storage.save_checkpoint.call_count, 2)
+        data = self._get_saved_data()
+        self.assertEqual(data, SessionSuspendHelper().suspend(self.state))
+        # There is nothing left to save
+        self.manager.flush()
+        self.assertEqual(self.storage.save_checkpoint.call_count, 2)
+
+    def test_sync_checkpoints_are_not_coalesced(self):
+        self.manager.set_checkpoint_policy(coalesce_interval=3600)
+        self.manager.checkpoint()
+        self.state.metadata.title = "title"
+        self.manager.checkpoint(sync=True)
+        self.assertEqual(self.storage.save_checkpoint.call_count, 2)
+
+    def test_checkpoints_with_running_job_are_not_coalesced(self):
+        self.manager.set_checkpoint_policy(coalesce_interval=3600)
+        self.manager.checkpoint()
+        self.state.metadata.running_job_name = "suspend/suspend_advanced"
+        self.manager.checkpoint()
+        self.assertEqual(self.storage.save_checkpoint.call_count, 2)
+
+    def test_codec(self):
+        self.manager.checkpoint()
+        self.manager.set_checkpoint_policy(codec=JSONSessionCodec())
+        # Changing the codec saves the session again
+        self.manager.checkpoint()
+        self.assertEqual(self.storage.save_checkpoint.call_count, 2)
+        data = self._get_saved_data()
+        self.assertEqual(
+            data, SessionSuspendHelper(JSONSessionCodec()).suspend(self.state))
+
+    def test_background_checkpoints(self):
+        self.manager.set_checkpoint_policy(background=True)
+        self.manager.checkpoint()
+        self.state.metadata.title = "title"
+        self.manager.checkpoint()
+        self.manager.flush()
+        # The first checkpoint may be superseded by the second one before it
+        # is saved but the last one is always saved.
+        self.assertIn(self.storage.save_checkpoint.call_count, (1, 2))
+        data = self._get_saved_data()
+        self.assertEqual(data, SessionSuspendHelper().suspend(self.state))
+
+    def test_background_checkpoints_with_running_job(self):
+        self.manager.set_checkpoint_policy(background=True)
+        self.state.metadata.running_job_name = "job"
+        self.manager.checkpoint()
+        # The checkpoint was saved before checkpoint() returned
+        self.assertEqual(self.storage.save_checkpoint.call_count, 1)
+
+    def test_background_checkpoint_errors_are_reported(self):
+        self.storage.save_checkpoint.side_effect = OSError
+        self.manager.set_checkpoint_policy(background=True)
+        self.manager.checkpoint()
+        with self.assertRaises(OSError):
+            self.manager.flush()
+        # The failed checkpoint is saved again
+        self.storage.save_checkpoint.side_effect = None
+        self.manager.checkpoint()
+        self.manager.flush()
+        self.assertEqual(self.storage.save_checkpoint.call_count, 2)
+
+
+class SessionManagerJournalTests(TestCase):
+
+    def setUp(self):
+        self.storage = mock.Mock(name="storage", spec=SessionStorage)
+        self.job = make_job('job')
+        self.state = SessionState([self.job])
+        self.manager = SessionManager(self.state, self.storage)
+        self.manager.set_checkpoint_policy(journal=True)
+
+    def tearDown(self):
+        self.manager.set_checkpoint_policy()
+
+    def test_changes_are_appended(self):
+        self.manager.checkpoint()
+        self.assertEqual(self.storage.save_checkpoint.call_count, 1)
+        self.assertEqual(self.storage.reset_journal.call_count, 1)
+        # Unchanged sessions are not saved
+        self.manager.checkpoint()
+        self.assertEqual(self.storage.append_journal.call_count, 0)
+        # Changes are appended to the journal
+        self.state.metadata.title = "title"
+        self.manager.checkpoint()
+        self.state.update_job_result(
+            self.job, MemoryJobResult({'outcome': 'pass'}))
+        self.manager.checkpoint()
+        self.assertEqual(self.storage.save_checkpoint.call_count, 1)
+        self.assertEqual(self.storage.reset_journal.call_count, 1)
+        self.assertEqual(self.storage.append_journal.call_count, 2)
+
+    def test_failed_append_takes_snapshot(self):
+        self.manager.checkpoint()
+        self.storage.append_journal.side_effect = OSError
+        self.state.metadata.title = "title"
+        with self.assertRaises(OSError):
+            self.manager.checkpoint()
+        self.manager.checkpoint()
+        self.assertEqual(self.storage.save_checkpoint.call_count, 2)
+        self.assertEqual(self.storage.reset_journal.call_count, 2)
+
+    def test_locked_journal(self):
+        self.storage.reset_journal.side_effect = [LockedStorageError, None]
+        self.manager.checkpoint()
+        self.storage.break_journal_lock.assert_called_once_with()
+        self.assertEqual(self.storage.reset_journal.call_count, 2)
+
+    def test_background_journal(self):
+        self.manager.set_checkpoint_policy(journal=True, background=True)
+        self.manager.checkpoint()
+        for title in ("a", "b", "c"):
+            self.state.metadata.title = title
+            self.manager.checkpoint()
+        self.manager.flush()
+        # Journal records are never superseded
+        self.assertEqual(self.storage.save_checkpoint.call_count, 1)
+        self.assertEqual(self.storage.append_journal.call_count, 3)
+
+    def test_load_session(self):
+        with TemporaryDirectory() as tmp:
+            storage = SessionStorage.create(tmp)
+            manager = SessionManager(SessionState([self.job]), storage)
+            manager.set_checkpoint_policy(journal=True)
+            manager.checkpoint()
+            manager.state.update_desired_job_list([self.job])
+            manager.checkpoint()
+            manager.state.update_job_result(
+                self.job, MemoryJobResult({'outcome': 'pass'}))
+            manager.checkpoint()
+            manager.state.metadata.title = "title"
+            manager.checkpoint()
+            manager.set_checkpoint_policy()
+            state = SessionManager.load_session([self.job], storage).state
+        self.assertEqual(state.desired_job_list, [self.job])
+        self.assertEqual(state.job_state_map['job'].result.outcome, 'pass')
+        self.assertEqual(state.metadata.title, "title")
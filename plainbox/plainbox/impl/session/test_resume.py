@@ -25,11 +25,16 @@ Test definitions for :mod:`plainbox.impl.session.resume` module
 """
 
 from unittest import TestCase
+from unittest import skipUnless
 import base64
 import binascii
 import copy
 import gzip
+import io
 import json
+import os
+import sys
+import time
 
 from plainbox.abc import IJobQualifier
 from plainbox.abc import IJobResult
@@ -47,7 +52,12 @@ from plainbox.impl.session.resume import SessionResumeHelper
 from plainbox.impl.session.resume import SessionResumeHelper1
 from plainbox.impl.session.resume import SessionResumeHelper2
 from plainbox.impl.session.resume import SessionResumeHelper3
+from plainbox.impl.session.resume import SessionResumeHelper4
+from plainbox.impl.session.codec import BinarySessionCodec
+from plainbox.impl.session.codec import JSONSessionCodec
 from plainbox.impl.session.state import SessionState
+from plainbox.impl.session.suspend import SessionSuspendHelper3
+from plainbox.impl.session.suspend import SessionSuspendHelper4
 from plainbox.impl.testing_utils import make_job
 from plainbox.testing_utils.testcases import TestCaseWithParameters
 from plainbox.vendor import mock
@@ -140,12 +150,43 @@ class SessionResumeHelperTests(TestCase):
         SessionResumeHelper([]).resume(data)
         mocked_helper3.resume_json.assertCalledOnce()
 
-    def test_resume_dispatch_v4(self):
+    @mock.patch('plainbox.impl.session.resume.SessionResumeHelper4')
+    def test_resume_dispatch_v4(self, mocked_helper4):
         data = gzip.compress(
-            b'{"version":4}')
+            b'{"journal":null,"session":{"desired_job_list":[],"jobs":{},'
+            b'"metadata":{"app_blob":null,"app_id":null,"flags":[],'
+            b'"running_job_name":null,"title":null'
+            b'},"results":{}},"version":4}')
+        SessionResumeHelper([]).resume(data, None, b'journal')
+        mocked_helper4().resume_json.assert_called_once_with(
+            json.loads(gzip.decompress(data).decode('UTF-8')), None,
+            b'journal')
+
+    def test_resume_detects_codec(self):
+        session = SessionState([])
+        session.metadata.title = "title"
+        for codec in (JSONSessionCodec(), BinarySessionCodec()):
+            data = SessionSuspendHelper3(codec).suspend(session)
+            self.assertEqual(
+                SessionResumeHelper([]).resume(data).metadata.title, "title")
+
+    def test_resume_stream(self):
+        session = SessionState([])
+        session.metadata.title = "title"
+        stream = io.BytesIO()
+        stream.write(b'junk')
+        SessionSuspendHelper3().suspend_to_stream(session, stream)
+        stream.seek(4)
+        self.assertEqual(
+            SessionResumeHelper([]).resume_stream(stream).metadata.title,
+            "title")
+
+    def test_resume_dispatch_v5(self):
+        data = gzip.compress(
+            b'{"version":5}')
         with self.assertRaises(IncompatibleSessionError) as boom:
             SessionResumeHelper([]).resume(data)
-        self.assertEqual(str(boom.exception), "Unsupported version 4")
+        self.assertEqual(str(boom.exception), "Unsupported version 5")
 
 
 class SessionResumeTests(TestCase):
@@ -377,6 +418,37 @@ class SessionStateResumeTests(TestCaseWithParameters):
             self.helper._restore_SessionState_job_list.assertCalledOnceWith(
                 session, self.session_repr)
 
+    def test_readiness_computed_once(self):
+        """
+        verify that _build_SessionState() computes job readiness only once,
+        regardless of the number of results being restored
+        """
+        job_list = [make_job(id='job-{}'.format(i)) for i in range(100)]
+        session_repr = {
+            'jobs': {job.id: job.checksum for job in job_list},
+            'results': {
+                job.id: [{
+                    'outcome': 'pass',
+                    'comments': None,
+                    'execution_duration': None,
+                    'return_code': None,
+                    'io_log': [],
+                }] for job in job_list
+            },
+            'desired_job_list': [job.id for job in job_list],
+            'metadata': {
+                'title': None,
+                'flags': [],
+                'running_job_name': None,
+                'app_blob': '',
+                'app_id': None,
+            },
+        }
+        helper = self.parameters.resume_cls(job_list)
+        session = helper._build_SessionState(session_repr)
+        self.assertEqual(len(session.run_list), 100)
+        self.assertEqual(session._inhibitor_evaluation_count, 100)
+
 
 class IOLogRecordResumeTests(TestCaseWithParameters):
     """
@@ -1690,3 +1762,136 @@ class SessionJobListResumeTests(TestCaseWithParameters):
         # Job "a" is still in the list but job "b" got removed
         self.assertEqual(session.job_list, [job_a])
         # The rest is tested by trim_job_list() tests
+
+
+class SessionResumeHelper4Tests(TestCase):
+    """
+    Tests for resuming sessions saved with a journal
+    """
+
+    def setUp(self):
+        self.job_a = make_job('a')
+        self.job_b = make_job('b')
+        self.job_list = [self.job_a, self.job_b]
+        self.session = SessionState(self.job_list)
+        self.suspend_helper = SessionSuspendHelper4()
+        self.snapshot = self.suspend_helper.suspend(self.session)
+        self.journal = self.suspend_helper.get_journal_header()
+
+    def _append(self):
+        self.journal += self.suspend_helper.suspend_journal(self.session)
+
+    def _resume(self, journal):
+        return SessionResumeHelper(self.job_list).resume(
+            self.snapshot, None, journal)
+
+    def test_resume_without_journal(self):
+        self.session.update_desired_job_list([self.job_a])
+        self._append()
+        session = self._resume(None)
+        self.assertEqual(session.desired_job_list, [])
+
+    def test_resume_replays_journal(self):
+        self.session.update_desired_job_list([self.job_a])
+        self._append()
+        self.session.update_job_result(
+            self.job_a, MemoryJobResult({'outcome': IJobResult.OUTCOME_PASS}))
+        self._append()
+        self.session.metadata.title = 'title'
+        self._append()
+        session = self._resume(self.journal)
+        self.assertEqual(session.desired_job_list, [self.job_a])
+        self.assertEqual(
+            session.job_state_map['a'].result.outcome,
+            IJobResult.OUTCOME_PASS)
+        self.assertIsNone(session.job_state_map['b'].result.outcome)
+        self.assertEqual(session.metadata.title, 'title')
+
+    def test_resume_ignores_torn_records(self):
+        self.session.update_desired_job_list([self.job_a])
+        self._append()
+        complete_journal = self.journal
+        self.session.metadata.title = 'title'
+        self._append()
+        # Cut the last record in half, as if we crashed while appending it
+        session = self._resume(self.journal[:-10])
+        self.assertEqual(session.desired_job_list, [self.job_a])
+        self.assertIsNone(session.metadata.title)
+        # Damaged records are ignored as well, along with everything after
+        session = self._resume(
+            complete_journal[:10] + b'X' + complete_journal[11:]
+            + self.journal[len(complete_journal):])
+        self.assertEqual(session.desired_job_list, [])
+        self.assertIsNone(session.metadata.title)
+
+    def test_resume_ignores_other_journals(self):
+        self.session.update_desired_job_list([self.job_a])
+        self._append()
+        journal = self.journal
+        # Start a new journal but lose the snapshot that refers to it
+        self.suspend_helper.suspend(self.session)
+        session = self._resume(
+            self.suspend_helper.get_journal_header() + journal[
+                len(journal.split(b'\n')[0]) + 1:])
+        self.assertEqual(session.desired_job_list, [])
+
+    def test_parse_journal(self):
+        self.session.update_desired_job_list([self.job_a])
+        self._append()
+        self.assertEqual(
+            SessionResumeHelper4._parse_journal(
+                self.journal, self.suspend_helper.journal_id),
+            [{'desired_job_list': ['a']}])
+        self.assertEqual(
+            SessionResumeHelper4._parse_journal(self.journal, 'other'), [])
+        self.assertEqual(
+            SessionResumeHelper4._parse_journal(b'', 'other'), [])
+
+
+@skipUnless(
+    os.environ.get("PLAINBOX_BENCHMARK"),
+    "set PLAINBOX_BENCHMARK=1 to run benchmarks")
+class SessionResumeBenchmark(TestCase):
+    """
+    Benchmark of resuming sessions of increasing size, the time per job
+    should stay (roughly) the same.
+    """
+
+    job_count_list = (500, 1000, 2000)
+    repeat = 3
+
+    def make_session_data(self, job_count):
+        # Chains of ten jobs, every third job also needs a resource
+        job_R = make_job('R', plugin='resource')
+        job_list = [job_R]
+        for index in range(job_count):
+            job_list.append(make_job(
+                'J{}'.format(index),
+                depends='J{}'.format(index - 1) if index % 10 else None,
+                requires="R.attr == 'value'" if index % 3 == 0 else None))
+        session = SessionState(job_list)
+        session.update_desired_job_list(job_list)
+        for job in session.run_list:
+            if job is job_R:
+                io_log = [(0.0, 'stdout', b"attr: value\n")]
+            else:
+                io_log = []
+            session.update_job_result(job, MemoryJobResult({
+                'outcome': IJobResult.OUTCOME_PASS, 'io_log': io_log}))
+        return job_list, SessionSuspendHelper4().suspend(session)
+
+    def test_resume(self):
+        for job_count in self.job_count_list:
+            job_list, data = self.make_session_data(job_count)
+            duration_list = []
+            for i in range(self.repeat):
+                start = time.time()
+                session = SessionResumeHelper(job_list).resume(data)
+                duration_list.append(time.time() - start)
+            # Readiness is computed exactly once for each job
+            self.assertEqual(
+                session._inhibitor_evaluation_count, len(job_list))
+            sys.stderr.write(
+                "\n{} jobs: {:.3f}s, {:.1f}us per job ".format(
+                    len(job_list), min(duration_list),
+                    min(duration_list) / len(job_list) * 1e6))
@@ -25,6 +25,10 @@ Test definitions for plainbox.impl.session module
 """
 
 from unittest import TestCase
+from unittest import skipUnless
+import os
+import sys
+import time
 
 from plainbox.abc import IJobResult
 from plainbox.impl.depmgr import DependencyDuplicateError
@@ -37,6 +41,7 @@ from plainbox.impl.session import SessionState
 from plainbox.impl.session import UndesiredJobReadinessInhibitor
 from plainbox.impl.session.state import SessionMetaData
 from plainbox.impl.testing_utils import make_job
+from plainbox.vendor import mock
 
 
 class SessionStateSmokeTests(TestCase):
@@ -80,6 +85,20 @@ class RegressionTests(TestCase):
         self.assertIsInstance(problems[0], DependencyMissingError)
         self.assertIs(problems[0].affected_job, A)
 
+    def test_transitive_problem_in_update_desired_job_list(self):
+        # This checks that a job that is broken only because of a dependency
+        # is removed from the desired job list (instead of the dependency,
+        # which was never desired and used to cause a ValueError)
+        A = make_job('A', depends='B')
+        B = make_job('B', depends='X')
+        C = make_job('C')
+        session = SessionState([A, B, C])
+        problems = session.update_desired_job_list([A, C])
+        self.assertEqual(len(problems), 1)
+        self.assertIs(problems[0].affected_job, B)
+        self.assertEqual(session.desired_job_list, [C])
+        self.assertEqual(session.run_list, [C])
+
     def test_init_with_identical_jobs(self):
         A = make_job("A")
         second_A = make_job("A")
@@ -124,6 +143,30 @@ class SessionStateAPITests(TestCase):
         # appended in any way.
         self.assertEqual(session._resource_map, {'R': [new_res]})
 
+    def test_set_resource_list_builds_index(self):
+        session = SessionState([])
+        res = Resource({'attr': 'value'})
+        session.set_resource_list('R', [res])
+        self.assertTrue(
+            session.resource_index_map['R'].lookup('attr', ('value',)))
+        session.set_resource_list('R', [])
+        self.assertFalse(
+            session.resource_index_map['R'].lookup('attr', ('value',)))
+
+    def test_set_resource_list_evicts_cached_results(self):
+        session = SessionState([])
+        session.set_resource_list('R', [])
+        session.set_resource_list('S', [])
+        cache = session.resource_expression_cache
+        r_version = session.resource_index_map['R'].version
+        s_version = session.resource_index_map['S'].version
+        cache[('R.attr == 1', None, r_version)] = True
+        cache[('S.attr == 1', None, s_version)] = False
+        session.set_resource_list('R', [])
+        # Only the results computed for the replaced list are removed
+        self.assertIs(session.resource_expression_cache, cache)
+        self.assertEqual(cache, {('S.attr == 1', None, s_version): False})
+
     def test_add_job(self):
         # Define a job
         job = make_job("A")
@@ -190,6 +233,18 @@ class SessionStateAPITests(TestCase):
         self.assertEqual(len(session.job_list), 1)
         self.assertIsNot(clashing_job, session.job_list[0])
 
+    def test_update_desired_job_list_fires_signal(self):
+        """
+        verify that update_desired_job_list() fires the
+        on_desired_job_list_changed() signal
+        """
+        job = make_job("A")
+        session = SessionState([job])
+        listener = mock.Mock()
+        session.on_desired_job_list_changed.connect(listener)
+        session.update_desired_job_list([job])
+        listener.assert_called_once_with()
+
     def test_get_estimated_duration_auto(self):
         # Define jobs with an estimated duration
         one_second = make_job("one_second", plugin="shell",
@@ -628,6 +683,140 @@ class SessionStateReactionToJobResultTests(TestCase):
         self.assertTrue(job_foo.via, self.job_L.checksum)
 
 
+class SessionStateIncrementalReadinessTests(TestCase):
+    # Those tests check that readiness is only recomputed for the jobs that
+    # can be affected by a particular result or resource list.
+
+    def setUp(self):
+        # Job A depends on a resource provided by job R, jobs B0..B9 depend on
+        # job Y. All of those jobs are desired.
+        self.job_R = make_job("R", plugin="resource")
+        self.job_A = make_job("A", requires="R.attr == 'value'")
+        self.job_Y = make_job("Y")
+        self.job_B_list = [
+            make_job("B{}".format(i), depends='Y') for i in range(10)]
+        self.session = SessionState(
+            [self.job_R, self.job_A, self.job_Y] + self.job_B_list)
+        self.session.update_desired_job_list(
+            [self.job_A] + self.job_B_list)
+
+    def test_full_recompute_on_desired_job_list_change(self):
+        # All 13 jobs are on the run list and are evaluated once
+        self.assertEqual(len(self.session.run_list), 13)
+        self.assertEqual(self.session._inhibitor_evaluation_count, 13)
+        self.assertEqual(self.session._inhibitor_evaluation_avoided_count, 0)
+
+    def test_result_only_affects_dependent_jobs(self):
+        self.session.update_job_result(
+            self.job_Y, MemoryJobResult({'outcome': IJobResult.OUTCOME_PASS}))
+        # Only the ten B jobs got re-evaluated, three evaluations were avoided
+        self.assertEqual(self.session._inhibitor_evaluation_count, 13 + 10)
+        self.assertEqual(self.session._inhibitor_evaluation_avoided_count, 3)
+        for job in self.job_B_list:
+            self.assertTrue(self.session.job_state_map[job.id].can_start())
+        # A is still waiting for the resource
+        self.assertEqual(
+            self.session.job_state_map['A'].readiness_inhibitor_list[0].cause,
+            JobReadinessInhibitor.PENDING_RESOURCE)
+
+    def test_resource_result_only_affects_dependent_jobs(self):
+        self.session.update_job_result(self.job_R, MemoryJobResult({
+            'outcome': IJobResult.OUTCOME_PASS,
+            'io_log': [(0, 'stdout', b"attr: value\n")],
+        }))
+        self.assertEqual(self.session._inhibitor_evaluation_count, 13 + 1)
+        self.assertEqual(self.session._inhibitor_evaluation_avoided_count, 12)
+        self.assertTrue(self.session.job_state_map['A'].can_start())
+
+    def test_rerunning_resource_job_invalidates_cached_results(self):
+        self.session.update_job_result(self.job_R, MemoryJobResult({
+            'outcome': IJobResult.OUTCOME_PASS,
+            'io_log': [(0, 'stdout', b"attr: value\n")],
+        }))
+        self.assertTrue(self.session.job_state_map['A'].can_start())
+        self.assertEqual(
+            list(self.session.resource_expression_cache.values()), [True])
+        self.session.update_job_result(self.job_R, MemoryJobResult({
+            'outcome': IJobResult.OUTCOME_PASS,
+            'io_log': [(0, 'stdout', b"attr: other\n")],
+        }))
+        self.assertEqual(
+            self.session.job_state_map['A'].readiness_inhibitor_list[0].cause,
+            JobReadinessInhibitor.FAILED_RESOURCE)
+        # The result computed for the old resources is gone
+        self.assertEqual(
+            list(self.session.resource_expression_cache.values()), [False])
+
+    def test_set_resource_list_is_observed_on_next_update(self):
+        self.session.set_resource_list('R', [Resource({'attr': 'value'})])
+        self.session.update_job_result(
+            self.job_Y, MemoryJobResult({'outcome': IJobResult.OUTCOME_PASS}))
+        self.assertTrue(self.session.job_state_map['A'].can_start())
+
+    def test_incremental_and_full_readiness_agree(self):
+        self.session.update_job_result(
+            self.job_Y, MemoryJobResult({'outcome': IJobResult.OUTCOME_FAIL}))
+        self.session.update_job_result(self.job_R, MemoryJobResult({
+            'outcome': IJobResult.OUTCOME_PASS,
+            'io_log': [(0, 'stdout', b"attr: other\n")],
+        }))
+        incremental = {
+            job_id: job_state.readiness_inhibitor_list
+            for job_id, job_state in self.session.job_state_map.items()}
+        self.session._recompute_job_readiness()
+        full = {
+            job_id: job_state.readiness_inhibitor_list
+            for job_id, job_state in self.session.job_state_map.items()}
+        self.assertEqual(incremental, full)
+
+    def test_results_without_run_list_are_cheap(self):
+        # When results are presented before anything is desired (e.g. while
+        # resuming a session) no inhibitors need to be evaluated at all
+        session = SessionState([self.job_Y] + self.job_B_list)
+        for job in session.job_list:
+            session.update_job_result(
+                job, MemoryJobResult({'outcome': IJobResult.OUTCOME_PASS}))
+        self.assertEqual(session._inhibitor_evaluation_count, 0)
+
+
+class SessionStateBatchUpdateTests(TestCase):
+
+    def setUp(self):
+        self.job_Y = make_job("Y")
+        self.job_X = make_job("X", depends='Y')
+        self.session = SessionState([self.job_X, self.job_Y])
+
+    def test_readiness_is_deferred(self):
+        self.session.update_desired_job_list([self.job_X])
+        count = self.session._inhibitor_evaluation_count
+        with self.session.batch_update():
+            self.session.update_job_result(self.job_Y, MemoryJobResult({
+                'outcome': IJobResult.OUTCOME_PASS}))
+            # Nothing was recomputed yet
+            self.assertEqual(
+                self.session._inhibitor_evaluation_count, count)
+            self.assertFalse(self.session.job_state_map['X'].can_start())
+        # X was re-evaluated once, when the batch was done
+        self.assertEqual(self.session._inhibitor_evaluation_count, count + 1)
+        self.assertTrue(self.session.job_state_map['X'].can_start())
+
+    def test_desired_job_list_is_deferred(self):
+        with self.session.batch_update():
+            self.session.update_job_result(self.job_Y, MemoryJobResult({
+                'outcome': IJobResult.OUTCOME_PASS}))
+            self.session.update_desired_job_list([self.job_X])
+            self.assertEqual(self.session._inhibitor_evaluation_count, 0)
+        self.assertEqual(self.session._inhibitor_evaluation_count, 2)
+        self.assertTrue(self.session.job_state_map['X'].can_start())
+
+    def test_nested_batches(self):
+        with self.session.batch_update():
+            with self.session.batch_update():
+                self.session.update_desired_job_list([self.job_X])
+            self.assertEqual(self.session._inhibitor_evaluation_count, 0)
+        self.assertEqual(self.session._inhibitor_evaluation_count, 2)
+
+
 class SessionMetadataTests(TestCase):
 
     def test_smoke(self):
@@ -652,6 +841,17 @@ class SessionMetadataTests(TestCase):
         metadata.running_job_name = "id"
         self.assertEqual(metadata.running_job_name, "id")
 
+    def test_setters_fire_on_changed(self):
+        metadata = SessionMetaData()
+        listener = mock.Mock()
+        metadata.on_changed.connect(listener)
+        metadata.title = "title"
+        metadata.flags = set(["f1"])
+        metadata.running_job_name = "id"
+        metadata.app_blob = b'blob'
+        metadata.app_id = 'id'
+        self.assertEqual(listener.call_count, 5)
+
     def test_app_blob_default_value(self):
         metadata = SessionMetaData()
         self.assertIs(metadata.app_blob, None)
@@ -684,3 +884,56 @@ class SessionMetadataTests(TestCase):
             app_id='com.canonical.certification.plainbox')
         self.assertEqual(
             metadata.app_id, 'com.canonical.certification.plainbox')
+
+
+@skipUnless(
+    os.environ.get("PLAINBOX_BENCHMARK"),
+    "set PLAINBOX_BENCHMARK=1 to run benchmarks")
+class SessionStateReadinessBenchmark(TestCase):
+    """
+    Benchmark of presenting the result of each job on a large run list, as
+    it happens while running a test session.
+    """
+
+    job_count = 1500
+
+    def setUp(self):
+        # Chains of ten jobs, every third job also needs a resource
+        self.job_R = make_job('R', plugin='resource')
+        self.job_list = [self.job_R]
+        for index in range(self.job_count):
+            self.job_list.append(make_job(
+                'J{}'.format(index),
+                depends='J{}'.format(index - 1) if index % 10 else None,
+                requires="R.attr == 'value'" if index % 3 == 0 else None))
+
+    def run_session(self):
+        session = SessionState(self.job_list)
+        session.update_desired_job_list(self.job_list)
+        start = time.time()
+        for job in session.run_list:
+            if job is self.job_R:
+                io_log = [(0, 'stdout', b"attr: value\n")]
+            else:
+                io_log = []
+            session.update_job_result(job, MemoryJobResult({
+                'outcome': IJobResult.OUTCOME_PASS, 'io_log': io_log}))
+        return session, time.time() - start
+
+    def test_incremental_readiness(self):
+        session, duration = self.run_session()
+        # The same session with a full readiness sweep after each result
+        with mock.patch.object(
+                SessionState, '_recompute_stale_job_readiness',
+                SessionState._recompute_job_readiness):
+            full_session, full_duration = self.run_session()
+        self.assertEqual(
+            session._inhibitor_evaluation_count
+            + session._inhibitor_evaluation_avoided_count,
+            full_session._inhibitor_evaluation_count)
+        sys.stderr.write(
+            "\n{} jobs: {:.3f}s ({} inhibitor evaluations, {} avoided),"
+            " full sweep {:.3f}s ".format(
+                len(self.job_list), duration,
+                session._inhibitor_evaluation_count,
+                session._inhibitor_evaluation_avoided_count, full_duration))
@@ -187,3 +187,96 @@ class SessionStorageTests(TestCase):
             data_in = storage.load_checkpoint()
             # Check if it's right
             self.assertEqual(data_out, data_in)
+
+    def test_journal(self):
+        with TemporaryDirectory() as tmp:
+            storage = SessionStorage.create(tmp, legacy_mode=False)
+            # There is no journal at first
+            self.assertIsNone(storage.load_journal())
+            # Appending to a journal that does not exist fails
+            with self.assertRaises(OSError):
+                storage.append_journal(b'record\n')
+            # Journals can be reset and appended to
+            storage.reset_journal(b'header\n')
+            storage.append_journal(b'record 1\n')
+            storage.append_journal(b'record 2\n')
+            self.assertEqual(
+                storage.load_journal(), b'header\nrecord 1\nrecord 2\n')
+            # Resetting the journal throws away all the records
+            storage.reset_journal(b'new header\n')
+            self.assertEqual(storage.load_journal(), b'new header\n')
+            # The journal is separate from the checkpoint
+            storage.save_checkpoint(b'some data')
+            self.assertEqual(storage.load_checkpoint(), b'some data')
+            self.assertEqual(storage.load_journal(), b'new header\n')
+
+    def test_journal_type_checks(self):
+        with TemporaryDirectory() as tmp:
+            storage = SessionStorage.create(tmp, legacy_mode=False)
+            with self.assertRaises(TypeError):
+                storage.reset_journal('header')
+            with self.assertRaises(TypeError):
+                storage.append_journal('record')
+
+    def test_save_checkpoint_chunks(self):
+        with TemporaryDirectory() as tmp:
+            storage = SessionStorage.create(tmp, legacy_mode=False)
+            storage.save_checkpoint(iter([b'some ', b'data']))
+            self.assertEqual(storage.load_checkpoint(), b'some data')
+
+    def test_save_checkpoint_callback(self):
+        with TemporaryDirectory() as tmp:
+            storage = SessionStorage.create(tmp, legacy_mode=False)
+
+            def write(stream):
+                for i in range(1000):
+                    stream.write(b'data ')
+            storage.save_checkpoint(write)
+            self.assertEqual(storage.load_checkpoint(), b'data ' * 1000)
+
+    def test_save_checkpoint_partial_writes(self):
+        real_write = os.write
+
+        def write(fd, data):
+            # Write at most 3 bytes at a time
+            return real_write(fd, data[:3])
+        with TemporaryDirectory() as tmp:
+            storage = SessionStorage.create(tmp, legacy_mode=False)
+            with mock.patch('os.write', side_effect=write):
+                storage.save_checkpoint(b'some data')
+            self.assertEqual(storage.load_checkpoint(), b'some data')
+
+    def test_save_checkpoint_failure(self):
+        with TemporaryDirectory() as tmp:
+            storage = SessionStorage.create(tmp, legacy_mode=False)
+            storage.save_checkpoint(b'old data')
+
+            def write(stream):
+                stream.write(b'new data')
+                raise ValueError("boom")
+            with self.assertRaises(ValueError):
+                storage.save_checkpoint(write)
+            # The old checkpoint is intact and the storage is not locked
+            self.assertEqual(storage.load_checkpoint(), b'old data')
+            storage.save_checkpoint(b'new data')
+            self.assertEqual(storage.load_checkpoint(), b'new data')
+
+    def test_save_checkpoint_type_checks(self):
+        with TemporaryDirectory() as tmp:
+            storage = SessionStorage.create(tmp, legacy_mode=False)
+            with self.assertRaises(TypeError):
+                storage.save_checkpoint('data')
+            with self.assertRaises(TypeError):
+                storage.save_checkpoint(42)
+            with self.assertRaises(TypeError):
+                storage.save_checkpoint(['data'])
+
+    def test_open_checkpoint(self):
+        with TemporaryDirectory() as tmp:
+            storage = SessionStorage.create(tmp, legacy_mode=False)
+            with self.assertRaises(IOError):
+                storage.open_checkpoint()
+            storage.save_checkpoint(b'some data')
+            with storage.open_checkpoint() as stream:
+                self.assertEqual(stream.read(4), b'some')
+                self.assertEqual(stream.read(), b' data')
@@ -27,6 +27,9 @@ Test definitions for :mod:`plainbox.impl.session.suspend` module
 from functools import partial
 from unittest import TestCase
 import gzip
+import io
+import json
+import zlib
 
 from plainbox.impl.job import JobDefinition
 from plainbox.impl.result import DiskJobResult
@@ -37,6 +40,7 @@ from plainbox.impl.session.state import SessionState
 from plainbox.impl.session.suspend import SessionSuspendHelper1
 from plainbox.impl.session.suspend import SessionSuspendHelper2
 from plainbox.impl.session.suspend import SessionSuspendHelper3
+from plainbox.impl.session.suspend import SessionSuspendHelper4
 from plainbox.vendor import mock
 
 
@@ -294,10 +298,22 @@ class SessionSuspendHelper1Tests(TestCase):
         # In the meantime we can only test that we got bytes out
         self.assertIsInstance(data, bytes)
         # And that we can gzip uncompress them and get what we expected
-        self.assertEqual(gzip.decompress(data), (
-            b'{"session":{"desired_job_list":[],"jobs":{},"metadata":'
-            b'{"flags":[],"running_job_name":null,"title":null},"results":{}'
-            b'},"version":1}'))
+        self.assertEqual(json.loads(gzip.decompress(data).decode("UTF-8")), {
+            "session": {
+                "desired_job_list": [], "jobs": {}, "metadata": {
+                    "flags": [], "running_job_name": None, "title": None},
+                "results": {}},
+            "version": 1})
+
+    def test_suspend_is_deterministic(self):
+        """
+        verify that the suspend() method returns the same data for the same
+        session
+        """
+        session = SessionState([])
+        data = self.helper.suspend(session)
+        with mock.patch('time.time', return_value=1e9):
+            self.assertEqual(self.helper.suspend(session), data)
 
 
 class GeneratedJobSuspendTests(TestCase):
@@ -580,10 +596,13 @@ class SessionSuspendHelper2Tests(SessionSuspendHelper1Tests):
         # In the meantime we can only test that we got bytes out
         self.assertIsInstance(data, bytes)
         # And that we can gzip uncompress them and get what we expected
-        self.assertEqual(gzip.decompress(data), (
-            b'{"session":{"desired_job_list":[],"jobs":{},"metadata":'
-            b'{"app_blob":null,"flags":[],"running_job_name":null,"title":null'
-            b'},"results":{}},"version":2}'))
+        self.assertEqual(json.loads(gzip.decompress(data).decode("UTF-8")), {
+            "session": {
+                "desired_job_list": [], "jobs": {}, "metadata": {
+                    "app_blob": None, "flags": [], "running_job_name": None,
+                    "title": None},
+                "results": {}},
+            "version": 2})
 
 
 class SessionSuspendHelper3Tests(SessionSuspendHelper2Tests):
@@ -669,8 +688,178 @@ class SessionSuspendHelper3Tests(SessionSuspendHelper2Tests):
         # In the meantime we can only test that we got bytes out
         self.assertIsInstance(data, bytes)
         # And that we can gzip uncompress them and get what we expected
-        self.assertEqual(gzip.decompress(data), (
-            b'{"session":{"desired_job_list":[],"jobs":{},"metadata":'
-            b'{"app_blob":null,"app_id":null,"flags":[],'
-            b'"running_job_name":null,"title":null},"results":{}},'
-            b'"version":3}'))
+        self.assertEqual(json.loads(gzip.decompress(data).decode("UTF-8")), {
+            "session": {
+                "desired_job_list": [], "jobs": {}, "metadata": {
+                    "app_blob": None, "app_id": None, "flags": [],
+                    "running_job_name": None, "title": None},
+                "results": {}},
+            "version": 3})
+
+
+class SessionSuspendHelper4Tests(TestCase):
+    """
+    Tests for the journal created by SessionSuspendHelper4
+    """
+
+    def setUp(self):
+        self.helper = SessionSuspendHelper4()
+        self.job_a = JobDefinition({'id': 'a', 'plugin': 'shell'})
+        self.job_b = JobDefinition({'id': 'b', 'plugin': 'shell'})
+        self.session = SessionState([self.job_a, self.job_b])
+
+    def _parse_record(self, data):
+        checksum, payload = data.split(b' ', 1)
+        self.assertTrue(payload.endswith(b'\n'))
+        self.assertEqual(int(checksum, 16), zlib.crc32(payload[:-1]))
+        return json.loads(payload.decode("UTF-8"))
+
+    def test_suspend(self):
+        """
+        verify that suspend() starts a new journal referenced by the snapshot
+        """
+        self.assertIsNone(self.helper.journal_id)
+        data = self.helper.suspend(self.session)
+        journal_id = self.helper.journal_id
+        self.assertIsNotNone(journal_id)
+        json_repr = json.loads(gzip.decompress(data).decode("UTF-8"))
+        self.assertEqual(json_repr['version'], 4)
+        self.assertEqual(json_repr['journal'], journal_id)
+        self.assertEqual(
+            self._parse_record(self.helper.get_journal_header()),
+            {'version': 4, 'journal': journal_id})
+        # Each snapshot starts a new journal
+        self.helper.suspend(self.session)
+        self.assertNotEqual(self.helper.journal_id, journal_id)
+
+    def test_suspend_to_stream(self):
+        """
+        verify that suspend_to_stream() writes the same data as suspend()
+        """
+        stream = io.BytesIO()
+        size = self.helper.suspend_to_stream(self.session, stream)
+        self.assertEqual(size, len(stream.getvalue()))
+        json_repr = json.loads(
+            gzip.decompress(stream.getvalue()).decode("UTF-8"))
+        self.assertEqual(json_repr['journal'], self.helper.journal_id)
+        self.assertEqual(json_repr['session'], json.loads(gzip.decompress(
+            self.helper.suspend(self.session)).decode("UTF-8"))['session'])
+
+    def test_get_writer(self):
+        """
+        verify that get_writer() captures the session when it is called
+        """
+        data = self.helper.suspend(self.session)
+        writer = self.helper.get_writer(self.session)
+        self.session.metadata.title = 'title'
+        stream = io.BytesIO()
+        self.assertEqual(writer(stream), len(stream.getvalue()))
+        self.assertEqual(
+            json.loads(gzip.decompress(data).decode("UTF-8"))['session'],
+            json.loads(gzip.decompress(
+                stream.getvalue()).decode("UTF-8"))['session'])
+        # The journal continues the snapshot written by the writer
+        record = self._parse_record(
+            self.helper.suspend_journal(self.session))
+        self.assertEqual(sorted(record), ['metadata'])
+
+    def test_suspend_journal_without_snapshot(self):
+        """
+        verify that suspend_journal() needs a snapshot first
+        """
+        self.assertIsNone(self.helper.suspend_journal(self.session))
+        with self.assertRaises(ValueError):
+            self.helper.get_journal_header()
+
+    def test_suspend_journal_unchanged(self):
+        """
+        verify that suspend_journal() returns b'' if nothing has changed
+        """
+        self.helper.suspend(self.session)
+        self.assertEqual(self.helper.suspend_journal(self.session), b'')
+
+    def test_suspend_journal_changes(self):
+        """
+        verify that suspend_journal() records only the changes
+        """
+        self.helper.suspend(self.session)
+        self.session.update_desired_job_list([self.job_a])
+        self.session.update_job_result(
+            self.job_a, MemoryJobResult({'outcome': 'pass'}))
+        record = self._parse_record(
+            self.helper.suspend_journal(self.session))
+        self.assertEqual(sorted(record), ['desired_job_list', 'results'])
+        self.assertEqual(record['desired_job_list'], ['a'])
+        self.assertEqual(sorted(record['results']), ['a'])
+        self.assertEqual(record['results']['a'][0]['outcome'], 'pass')
+        # Now the same changes are not recorded again
+        self.assertEqual(self.helper.suspend_journal(self.session), b'')
+        self.session.metadata.title = 'title'
+        record = self._parse_record(
+            self.helper.suspend_journal(self.session))
+        self.assertEqual(sorted(record), ['metadata'])
+        self.assertEqual(record['metadata']['title'], 'title')
+
+    def test_suspend_journal_result_changed_in_place(self):
+        """
+        verify that suspend_journal() records results changed in place
+        """
+        result = MemoryJobResult({'outcome': 'fail'})
+        self.session.update_job_result(self.job_a, result)
+        self.helper.suspend(self.session)
+        result.outcome = 'pass'
+        result.comments = 'comments'
+        record = self._parse_record(
+            self.helper.suspend_journal(self.session))
+        self.assertEqual(sorted(record), ['results'])
+        self.assertEqual(record['results']['a'][0]['outcome'], 'pass')
+        self.assertEqual(record['results']['a'][0]['comments'], 'comments')
+        self.assertEqual(self.helper.suspend_journal(self.session), b'')
+
+    def test_suspend_journal_new_job(self):
+        """
+        verify that suspend_journal() records new jobs
+        """
+        self.helper.suspend(self.session)
+        job_c = JobDefinition({'id': 'c', 'plugin': 'shell'})
+        self.session.add_job(job_c)
+        record = self._parse_record(
+            self.helper.suspend_journal(self.session))
+        self.assertEqual(record['jobs'], {'c': job_c.checksum})
+        self.assertEqual(sorted(record['results']), ['c'])
+
+    def test_suspend_journal_removed_job(self):
+        """
+        verify that suspend_journal() needs a snapshot after a job is removed
+        """
+        self.helper.suspend(self.session)
+        qualifier = mock.Mock()
+        qualifier.designates.side_effect = lambda job: job.id == 'b'
+        self.session.trim_job_list(qualifier)
+        self.assertIsNone(self.helper.suspend_journal(self.session))
+
+    def test_suspend_journal_after_invalidate(self):
+        """
+        verify that suspend_journal() needs a snapshot after invalidate()
+        """
+        self.helper.suspend(self.session)
+        self.helper.invalidate()
+        self.assertIsNone(self.helper.journal_id)
+        self.assertIsNone(self.helper.suspend_journal(self.session))
+
+    def test_suspend_journal_compaction(self):
+        """
+        verify that suspend_journal() needs a snapshot once the journal is big
+        """
+        self.helper.COMPACTION_MIN_SIZE = 0
+        self.helper.suspend(self.session)
+        self.helper.get_journal_header()
+        for i in range(100):
+            self.session.metadata.title = 'title {}'.format(i)
+            data = self.helper.suspend_journal(self.session)
+            if data is None:
+                break
+        else:
+            self.fail("journal was never compacted")
+        self.helper.suspend(self.session)
+        self.assertEqual(self.helper.suspend_journal(self.session), b'')
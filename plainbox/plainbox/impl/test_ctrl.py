@@ -25,8 +25,10 @@ Test definitions for plainbox.impl.ctrl module
 """
 
 from subprocess import CalledProcessError
+from tempfile import TemporaryDirectory
 from unittest import TestCase
 import os
+import sys
 
 from plainbox.abc import IJobResult
 from plainbox.abc import IProvider1
@@ -38,6 +40,7 @@ from plainbox.impl.ctrl import RootViaPTL1ExecutionController
 from plainbox.impl.ctrl import RootViaPkexecExecutionController
 from plainbox.impl.ctrl import RootViaSudoExecutionController
 from plainbox.impl.ctrl import SymLinkNest
+from plainbox.impl.ctrl import TrustedLauncherSession
 from plainbox.impl.ctrl import UserJobExecutionController
 from plainbox.impl.ctrl import gen_rfc822_records_from_io_log
 from plainbox.impl.depmgr import DependencyDuplicateError
@@ -45,6 +48,7 @@ from plainbox.impl.job import JobDefinition
 from plainbox.impl.job import JobOutputTextSource
 from plainbox.impl.resource import Resource
 from plainbox.impl.resource import ResourceExpression
+from plainbox.impl.resource import ResourceIndex
 from plainbox.impl.secure.providers.v1 import Provider1
 from plainbox.impl.secure.rfc822 import Origin
 from plainbox.impl.secure.rfc822 import RFC822Record
@@ -53,6 +57,7 @@ from plainbox.impl.session import JobReadinessInhibitor
 from plainbox.impl.session import SessionState
 from plainbox.vendor import extcmd
 from plainbox.vendor import mock
+import plainbox
 
 
 class CheckBoxSessionStateControllerTests(TestCase):
@@ -132,6 +137,7 @@ class CheckBoxSessionStateControllerTests(TestCase):
         session_state.resource_map = {
             'j2': [Resource({'attr': 'not-ok'})]
         }
+        session_state.resource_index_map = {}
         self.assertEqual(
             self.ctrl.get_inhibitor_list(session_state, j1),
             [JobReadinessInhibitor(
@@ -153,10 +159,36 @@ class CheckBoxSessionStateControllerTests(TestCase):
         session_state.resource_map = {
             'j2': [Resource({'attr': 'ok'})]
         }
+        session_state.resource_index_map = {}
         session_state.job_state_map['j2'].job = j2
         self.assertEqual(
             self.ctrl.get_inhibitor_list(session_state, j1), [])
 
+    def test_get_inhibitor_list_good_resource_indexed(self):
+        # verify that the resource index of the session is used
+        j1 = JobDefinition({
+            'id': 'j1',
+            'requires': 'j2.attr == "ok"'
+        })
+        j2 = JobDefinition({
+            'id': 'j2'
+        })
+        session_state = mock.MagicMock(spec=SessionState)
+        session_state.resource_map = {
+            'j2': [Resource({'attr': 'ok'})]
+        }
+        session_state.resource_index_map = {
+            'j2': mock.Mock(
+                spec=ResourceIndex, version=None,
+                resource_list=session_state.resource_map['j2'])
+        }
+        session_state.resource_index_map['j2'].lookup.return_value = True
+        session_state.job_state_map['j2'].job = j2
+        self.assertEqual(
+            self.ctrl.get_inhibitor_list(session_state, j1), [])
+        session_state.resource_index_map['j2'].lookup.assert_called_once_with(
+            'attr', ('ok',))
+
     def test_get_inhibitor_list_PENDING_DEP(self):
         # verify that jobs that depend on another job that hasn't
         # been invoked yet produce the PENDING_DEP inhibitor
@@ -497,6 +529,112 @@ class SymLinkNestTests(TestCase):
             '/usr/lib/foo/exec', 'nest/exec')
 
 
+class NestCacheTests(TestCase):
+    """
+    Tests for the executable symlink nests kept in the session directory
+    """
+
+    def setUp(self):
+        self.scratch_dir = TemporaryDirectory()
+        self.session_dir = os.path.join(self.scratch_dir.name, "session")
+        self.provider_list = [
+            self.make_provider("p1", "com.example"),
+            self.make_provider("p2", "com.example"),
+            self.make_provider("p3", "org.example")]
+        self.ctrl = UserJobExecutionController(
+            self.session_dir, self.provider_list)
+
+    def tearDown(self):
+        self.scratch_dir.cleanup()
+
+    def make_provider(self, name, namespace):
+        bin_dir = os.path.join(self.scratch_dir.name, name)
+        os.mkdir(bin_dir)
+        self.add_executable(bin_dir, "{}-exec".format(name))
+        provider = mock.Mock(
+            spec=Provider1, namespace=namespace, bin_dir=bin_dir,
+            get_all_executables=lambda: Provider1.get_all_executables(
+                mock.Mock(bin_dir=bin_dir)))
+        provider.name = name
+        return provider
+
+    def add_executable(self, bin_dir, name):
+        filename = os.path.join(bin_dir, name)
+        with open(filename, "wt"):
+            pass
+        os.chmod(filename, 0o755)
+        # Make the change visible even with coarse modification times
+        mtime = os.stat(bin_dir).st_mtime + 10
+        os.utime(bin_dir, (mtime, mtime))
+
+    def make_job(self, provider):
+        return mock.Mock(name='job', spec=JobDefinition, provider=provider)
+
+    def test_nest_contents(self):
+        with self.ctrl.configured_filesystem(
+                self.make_job(self.provider_list[0]), None) as nest_dir:
+            self.assertTrue(nest_dir.startswith(self.session_dir))
+            self.assertEqual(
+                sorted(os.listdir(nest_dir)), ['p1-exec', 'p2-exec'])
+            self.assertEqual(
+                os.readlink(os.path.join(nest_dir, 'p1-exec')),
+                os.path.join(self.provider_list[0].bin_dir, 'p1-exec'))
+        # The nest is kept after the job is done
+        self.assertTrue(os.path.isdir(nest_dir))
+
+    def test_nest_is_reused(self):
+        job = self.make_job(self.provider_list[0])
+        nest_dir = self.ctrl.get_nest_dir(job)
+        with mock.patch('plainbox.impl.ctrl.SymLinkNest') as mock_nest:
+            self.assertEqual(self.ctrl.get_nest_dir(job), nest_dir)
+            self.assertEqual(self.ctrl.get_nest_dir(
+                self.make_job(self.provider_list[1])), nest_dir)
+            # Other controllers of the same session use the same nest
+            other_ctrl = UserJobExecutionController(
+                self.session_dir, self.provider_list)
+            self.assertEqual(other_ctrl.get_nest_dir(job), nest_dir)
+        self.assertFalse(mock_nest.called)
+
+    def test_nest_per_namespace(self):
+        nest_dir = self.ctrl.get_nest_dir(
+            self.make_job(self.provider_list[2]))
+        self.assertNotEqual(nest_dir, self.ctrl.get_nest_dir(
+            self.make_job(self.provider_list[0])))
+        self.assertEqual(os.listdir(nest_dir), ['p3-exec'])
+
+    def test_nest_is_rebuilt(self):
+        job = self.make_job(self.provider_list[0])
+        nest_dir = self.ctrl.get_nest_dir(job)
+        self.add_executable(self.provider_list[1].bin_dir, "p2-new")
+        new_nest_dir = self.ctrl.get_nest_dir(job)
+        self.assertNotEqual(new_nest_dir, nest_dir)
+        self.assertEqual(
+            sorted(os.listdir(new_nest_dir)),
+            ['p1-exec', 'p2-exec', 'p2-new'])
+
+    def test_concurrently_built_nest(self):
+        job = self.make_job(self.provider_list[0])
+        nest_dir = self.ctrl.get_nest_dir(job)
+        # Pretend that another job built the nest just before us
+        isdir = os.path.isdir
+        isdir_results = [False]
+        with mock.patch('os.path.isdir', side_effect=lambda path: (
+                isdir_results.pop() if isdir_results else isdir(path))):
+            self.assertEqual(self.ctrl.get_nest_dir(job), nest_dir)
+        self.assertEqual(
+            os.listdir(os.path.dirname(nest_dir)),
+            [os.path.basename(nest_dir)])
+
+    def test_failed_build(self):
+        job = self.make_job(self.provider_list[0])
+        with mock.patch.object(SymLinkNest, 'add_provider',
+                               side_effect=ValueError):
+            with self.assertRaises(ValueError):
+                self.ctrl.get_nest_dir(job)
+        self.assertEqual(
+            os.listdir(os.path.join(self.session_dir, "nest")), [])
+
+
 class CheckBoxExecutionControllerTestsMixIn:
     """
     Mix-in class that defines tests for CheckBoxExecutionController
@@ -724,6 +862,24 @@ class UserJobExecutionControllerTests(CheckBoxExecutionControllerTestsMixIn,
         # Ensure that 'old-value' takes priority over 'value'
         self.assertEqual(env['key'], 'old-value')
 
+    @mock.patch.dict('os.environ', clear=True, PATH='vanilla-path')
+    def test_get_execution_environment_reuses_base_environment(self):
+        env = self.ctrl.get_execution_environment(
+            self.job, self.config, self.NEST_DIR)
+        # Ensure that the environment of this process is not copied again
+        with mock.patch('os.environ', new={}):
+            other_env = self.ctrl.get_execution_environment(
+                self.job, self.config, 'other-nest-dir')
+        self.assertEqual(other_env['PATH'], os.pathsep.join(
+            ['other-nest-dir', 'vanilla-path']))
+        del env['PATH']
+        del other_env['PATH']
+        self.assertEqual(env, other_env)
+        # Ensure that the base environment is not modified
+        self.assertEqual(
+            self.ctrl.get_base_execution_environment(
+                self.job.provider)['PATH'], 'vanilla-path')
+
 
 class RootViaPTL1ExecutionControllerTests(
         CheckBoxExecutionControllerTestsMixIn, TestCase):
@@ -755,6 +911,7 @@ class RootViaPTL1ExecutionControllerTests(
                 extra_PYTHONPATH=None,
                 data_dir="data_dir-generator",
                 CHECKBOX_SHARE='CHECKBOX_SHARE-generator'))
+        self.job.origin.source.job.get_environ_settings.return_value = set()
         PATH = os.pathsep.join([self.NEST_DIR, 'vanilla-path'])
         expected = [
             'pkexec', '--user', self.job.user,
@@ -870,6 +1027,160 @@ class RootViaPTL1ExecutionControllerTests(
         self.assertEqual(ctrl.get_checkbox_score(self.job), 0)
 
 
+    @mock.patch.dict('os.environ', clear=True, PATH='vanilla-path')
+    @mock.patch('os.path.isdir')
+    @mock.patch('os.makedirs')
+    def test_execute_job_in_session(self, mock_makedirs, mock_isdir):
+        self.config.trusted_launcher_session = True
+        self.job.get_environ_settings.return_value = []
+        self.job.via = None
+        extcmd_popen = mock.Mock(
+            name='extcmd_popen', spec=extcmd.ExternalCommandWithDelegate)
+        session = mock.Mock(name='session', spec=TrustedLauncherSession)
+        with mock.patch.object(self.ctrl, '_get_launcher_session',
+                               return_value=session) as get_session, \
+                mock.patch.object(self.ctrl, 'configured_filesystem') as fs:
+            fs.return_value.__enter__.return_value = self.NEST_DIR
+            retval = self.ctrl.execute_job(
+                self.job, self.config, extcmd_popen)
+        get_session.assert_called_once_with(self.job.user)
+        session.run.assert_called_once_with(
+            self.ctrl.get_execution_request(
+                self.job, self.config, self.NEST_DIR),
+            extcmd_popen.delegate,
+            (self.ctrl.get_execution_command(
+                self.job, self.config, self.NEST_DIR),))
+        self.assertEqual(retval, session.run())
+        self.assertFalse(extcmd_popen.call.called)
+
+    @mock.patch('os.path.isdir')
+    @mock.patch('os.makedirs')
+    def test_execute_job_without_session_support(
+            self, mock_makedirs, mock_isdir):
+        self.config.trusted_launcher_session = True
+        self.extcmd_popen = mock.Mock(
+            name='extcmd_popen', spec=extcmd.ExternalCommandWithDelegate)
+        session = mock.Mock(name='session', spec=TrustedLauncherSession)
+        session.run.return_value = None
+        with mock.patch.object(self.ctrl, '_get_launcher_session',
+                               return_value=session), \
+                mock.patch.object(self.ctrl, 'configured_filesystem'), \
+                mock.patch.object(self.ctrl, 'get_execution_request'), \
+                mock.patch.object(self.ctrl, '_get_command_for_request'), \
+                mock.patch.object(self.ctrl, 'get_execution_command'):
+            # The first job falls back to running the launcher directly
+            retval = self.ctrl.execute_job(
+                self.job, self.config, self.extcmd_popen)
+            self.assertEqual(retval, self.extcmd_popen.call())
+            self.assertEqual(session.run.call_count, 1)
+            # And so do all the other jobs
+            self.ctrl.execute_job(self.job, self.config, self.extcmd_popen)
+            self.assertEqual(session.run.call_count, 1)
+
+    def test_get_launcher_session(self):
+        session = self.ctrl._get_launcher_session('root')
+        self.assertIs(session, self.ctrl._get_launcher_session('root'))
+        self.assertIsNot(session, self.ctrl._get_launcher_session('nobody'))
+        self.assertEqual(session._cmd, [
+            'pkexec', '--user', 'root', 'plainbox-trusted-launcher-1',
+            '--session'])
+
+    def test_close(self):
+        with mock.patch('plainbox.impl.ctrl.TrustedLauncherSession',
+                        side_effect=lambda cmd: mock.Mock()):
+            session = self.ctrl._get_launcher_session('root')
+            self.ctrl.close()
+            session.close.assert_called_once_with()
+            # The next job starts a new session
+            self.assertIsNot(
+                self.ctrl._get_launcher_session('root'), session)
+
+
+class TrustedLauncherSessionTests(TestCase):
+    """
+    Tests for TrustedLauncherSession, with the real session code running in
+    a separate process (but without pkexec)
+    """
+
+    SERVER = (
+        "from plainbox.impl.job import JobDefinition\n"
+        "from plainbox.impl.secure.launcher1 import TrustedLauncher\n"
+        "from plainbox.impl.secure.launcher1 import serve_session\n"
+        "launcher = TrustedLauncher()\n"
+        "launcher.add_job_list([JobDefinition({\n"
+        "    'id': 'job', 'plugin': 'shell',\n"
+        "    'command': 'echo $GREETING; exit 5'})])\n"
+        "serve_session(launcher)\n")
+
+    def setUp(self):
+        python_path = os.path.dirname(os.path.dirname(plainbox.__file__))
+        patcher = mock.patch.dict('os.environ', PYTHONPATH=python_path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.checksum = JobDefinition({
+            'id': 'job', 'plugin': 'shell',
+            'command': 'echo $GREETING; exit 5'}).checksum
+
+    def make_session(self, script):
+        session = TrustedLauncherSession([sys.executable, '-c', script])
+        self.addCleanup(session.close)
+        return session
+
+    def test_run(self):
+        session = self.make_session(self.SERVER)
+        for greeting in ('hello', 'bye'):
+            delegate = mock.Mock(name='delegate')
+            return_code = session.run(
+                {'target': self.checksum, 'target_env': {
+                    'GREETING': greeting}},
+                delegate, ('cmd',))
+            self.assertEqual(return_code, 5)
+            self.assertEqual(delegate.mock_calls, [
+                mock.call.on_begin(('cmd',), {}),
+                mock.call.on_line(
+                    'stdout', '{}\n'.format(greeting).encode('UTF-8')),
+                mock.call.on_end(5)])
+            if greeting == 'hello':
+                proc = session._proc
+        # Both jobs were executed by the same launcher
+        self.assertIs(session._proc, proc)
+        session.close()
+        self.assertEqual(proc.returncode, 0)
+        self.assertIsNone(session._proc)
+
+    def test_run_unknown_job(self):
+        session = self.make_session(self.SERVER)
+        delegate = mock.Mock(name='delegate')
+        self.assertEqual(session.run({'target': 'foo'}, delegate), 1)
+        delegate.on_line.assert_called_once_with(
+            'stderr', b'Cannot find job with checksum foo\n')
+
+    def test_unsupported(self):
+        session = self.make_session("import sys; sys.exit(2)")
+        delegate = mock.Mock(name='delegate')
+        self.assertIsNone(session.run({'target': self.checksum}, delegate))
+        self.assertEqual(delegate.mock_calls, [])
+
+    def test_not_authorized(self):
+        session = self.make_session("import sys; sys.exit(126)")
+        delegate = mock.Mock(name='delegate')
+        self.assertEqual(
+            session.run({'target': self.checksum}, delegate), 126)
+        self.assertEqual(delegate.mock_calls, [
+            mock.call.on_begin((), {}), mock.call.on_end(126)])
+
+    def test_launcher_crash(self):
+        session = self.make_session(self.SERVER)
+        delegate = mock.Mock(name='delegate')
+        session.run({'target': self.checksum}, delegate)
+        session._proc.kill()
+        session._proc.wait()
+        # The job gets the return code of the launcher
+        self.assertEqual(session.run({'target': self.checksum}, delegate), -9)
+        # And the next job starts a new launcher
+        self.assertEqual(session.run({'target': self.checksum}, delegate), 5)
+
+
 class RootViaPkexecExecutionControllerTests(
         CheckBoxExecutionControllerTestsMixIn, TestCase):
     """
@@ -945,6 +1256,26 @@ class RootViaSudoExecutionControllerTests(
              'PLAINBOX_SESSION_SHARE=session-dir/CHECKBOX_DATA',
              'bash', '-c', self.job.command])
 
+    @mock.patch.dict('os.environ', clear=True, PATH='vanilla-path',
+                     LANG='C.UTF-8', key='value', HOME='home')
+    def test_get_differential_execution_environment(self):
+        """
+        verify that only changed variables are passed to the command
+        """
+        self.job.get_environ_settings.return_value = {'HOME'}
+        self.config.environment['other-key'] = 'other-value'
+        for nest_dir in (self.NEST_DIR, 'other-nest-dir'):
+            self.assertEqual(
+                self.ctrl.get_differential_execution_environment(
+                    self.job, self.config, nest_dir),
+                {'CHECKBOX_DATA': 'session-dir/CHECKBOX_DATA',
+                 'CHECKBOX_SHARE': 'CHECKBOX_SHARE',
+                 'HOME': 'home',
+                 'PATH': os.pathsep.join([nest_dir, 'vanilla-path']),
+                 'PLAINBOX_PROVIDER_DATA': 'data_dir',
+                 'PLAINBOX_SESSION_SHARE': 'session-dir/CHECKBOX_DATA',
+                 'other-key': 'other-value'})
+
     SUDO, ADMIN = range(2)
 
     # Mock gid's for 'sudo' and 'admin'
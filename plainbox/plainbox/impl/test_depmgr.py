@@ -30,7 +30,10 @@ from plainbox.impl.depmgr import DependencyCycleError
 from plainbox.impl.depmgr import DependencyDuplicateError
 from plainbox.impl.depmgr import DependencyMissingError
 from plainbox.impl.depmgr import DependencySolver
+from plainbox.impl.job import JobDefinition
+from plainbox.impl.secure.rfc822 import Origin
 from plainbox.impl.testing_utils import make_job
+from plainbox.vendor import mock
 
 
 class DependencyCycleErrorTests(TestCase):
@@ -292,3 +295,123 @@ class TestDependencySolver(TestCase):
         with self.assertRaises(DependencyCycleError) as call:
             DependencySolver.resolve_dependencies(job_list)
         self.assertEqual(call.exception.job_list, [A, R, A])
+
+
+    def test_long_dependency_chain(self):
+        # This tests a chain of dependencies that is much longer than the
+        # recursion limit would have allowed
+        # J0 -> J1 -> ... -> J1999
+        origin = Origin.get_caller_origin()
+        job_list = [
+            JobDefinition({
+                'id': 'J{}'.format(i),
+                'plugin': 'shell',
+                'depends': 'J{}'.format(i + 1)
+            }, origin)
+            for i in range(1999)]
+        job_list.append(JobDefinition({'id': 'J1999', 'plugin': 'shell'}))
+        observed = DependencySolver.resolve_dependencies(job_list)
+        self.assertEqual(
+            [job.id for job in observed],
+            [job.id for job in reversed(job_list)])
+
+    def test_dependency_cycle_after_visited_branch(self):
+        # This tests dependency loops that are found after backtracking
+        # A -> B, A -> C -> D -> C
+        A = make_job(id='A', depends='B C')
+        B = make_job(id='B')
+        C = make_job(id='C', depends='D')
+        D = make_job(id='D', depends='C')
+        job_list = [A, B, C, D]
+        with self.assertRaises(DependencyCycleError) as call:
+            DependencySolver.resolve_dependencies(job_list)
+        self.assertEqual(call.exception.job_list, [C, D, C])
+
+class DependencySolverIncrementalTests(TestCase):
+
+    def test_collects_all_problems(self):
+        # A -> (inexisting X)
+        # B
+        # C -> C
+        # D -> B
+        A = make_job(id='A', depends='X')
+        B = make_job(id='B')
+        C = make_job(id='C', depends='C')
+        D = make_job(id='D', depends='B')
+        solver = DependencySolver([A, B, C, D])
+        solution, accepted_list, problem_list = solver.incremental_solve(
+            [A, B, C, D])
+        self.assertEqual(solution, [B, D])
+        self.assertEqual(accepted_list, [B, D])
+        self.assertEqual(len(problem_list), 2)
+        self.assertIsInstance(problem_list[0], DependencyMissingError)
+        self.assertIs(problem_list[0].affected_job, A)
+        self.assertIsInstance(problem_list[1], DependencyCycleError)
+        self.assertIs(problem_list[1].affected_job, C)
+
+    def test_problem_rolls_back_partial_solution(self):
+        # A -> B -> (inexisting X)
+        # C -> B
+        # B gets visited while solving A, it must not be on the solution
+        A = make_job(id='A', depends='B')
+        B = make_job(id='B', depends='X')
+        C = make_job(id='C')
+        solver = DependencySolver([A, B, C])
+        solution, accepted_list, problem_list = solver.incremental_solve(
+            [A, C])
+        self.assertEqual(solution, [C])
+        self.assertEqual(accepted_list, [C])
+        self.assertIs(problem_list[0].affected_job, B)
+
+    def test_reuses_previous_solution(self):
+        A = make_job(id='A', depends='B')
+        B = make_job(id='B')
+        C = make_job(id='C')
+        solver = DependencySolver([A, B, C])
+        solver.incremental_solve([A])
+        with mock.patch.object(solver, '_visit') as mock_visit:
+            solution, accepted_list, problem_list = solver.incremental_solve(
+                [A, C])
+        # Only C was visited, the solution for A was reused
+        mock_visit.assert_called_once_with(C)
+        self.assertEqual(solution, [B, A])
+
+    def test_dependency_sets_are_cached(self):
+        A = make_job(id='A', depends='B')
+        B = make_job(id='B')
+        solver = DependencySolver([A, B])
+        with mock.patch.object(
+                A.controller, 'get_dependency_set',
+                wraps=A.controller.get_dependency_set) as mock_get:
+            solver.incremental_solve([A])
+            solver.incremental_solve([B, A])
+        self.assertEqual(mock_get.call_count, 2)
+
+    def test_add_job_fixes_missing_dependency(self):
+        A = make_job(id='A', depends='B')
+        B = make_job(id='B')
+        solver = DependencySolver([A])
+        solution, accepted_list, problem_list = solver.incremental_solve([A])
+        self.assertEqual(solution, [])
+        self.assertEqual(len(problem_list), 1)
+        solver.add_job(B)
+        solution, accepted_list, problem_list = solver.incremental_solve([A])
+        self.assertEqual(solution, [B, A])
+        self.assertEqual(problem_list, [])
+
+    def test_add_job_duplicate(self):
+        A = make_job(id='A')
+        another_A = make_job(id='A', plugin='manual')
+        solver = DependencySolver([A])
+        with self.assertRaises(DependencyDuplicateError):
+            solver.add_job(another_A)
+
+    def test_remove_job_discards_previous_solution(self):
+        A = make_job(id='A', depends='B')
+        B = make_job(id='B')
+        solver = DependencySolver([A, B])
+        solver.incremental_solve([A])
+        solver.remove_job(B)
+        solution, accepted_list, problem_list = solver.incremental_solve([A])
+        self.assertEqual(solution, [])
+        self.assertEqual(problem_list[0].missing_job_id, 'B')
@@ -254,6 +254,15 @@ class TestJobDefinition(TestCase):
         self.assertEqual(job.command, None)
         self.assertEqual(job.description, None)
 
+    def test_from_rfc822_record_data_checksum(self):
+        record = RFC822Record(
+            {'plugin': 'plugin', 'id': 'id'}, data_checksum='1234')
+        job = JobDefinition.from_rfc822_record(record)
+        self.assertEqual(job.checksum, '1234')
+        job = JobDefinition.from_rfc822_record(self._min_record)
+        self.assertEqual(job.checksum, JobDefinition(
+            {'plugin': 'plugin', 'id': 'id'}).checksum)
+
     def test_from_rfc822_record_missing_id(self):
         record = RFC822Record({'plugin': 'plugin'})
         with self.assertRaises(ValueError):
@@ -302,6 +311,26 @@ class TestJobDefinition(TestCase):
         observed = job.get_direct_dependencies()
         self.assertEqual(expected, observed)
 
+    def test_dependency_parsing_is_cached(self):
+        job = JobDefinition({
+            'id': 'id',
+            'plugin': 'plugin',
+            'depends': 'word'})
+        self.assertIs(
+            job.get_direct_dependencies(), job.get_direct_dependencies())
+
+    def test_dependency_cache_follows_provider_namespace(self):
+        job = JobDefinition({
+            'id': 'id',
+            'plugin': 'plugin',
+            'depends': 'word',
+            'requires': 'res.attr == 1'})
+        self.assertEqual(job.get_direct_dependencies(), {'word'})
+        self.assertEqual(job.get_resource_dependencies(), {'res'})
+        job._provider = mock.Mock(namespace='ns')
+        self.assertEqual(job.get_direct_dependencies(), {'ns::word'})
+        self.assertEqual(job.get_resource_dependencies(), {'ns::res'})
+
     def test_environ_parsing_empty(self):
         job = JobDefinition({
             'id': 'id',
@@ -319,6 +348,19 @@ class TestJobDefinition(TestCase):
         observed = job.get_environ_settings()
         self.assertEqual(expected, observed)
 
+    def test_flag_parsing_empty(self):
+        job = JobDefinition({
+            'id': 'id',
+            'plugin': 'plugin'})
+        self.assertEqual(job.get_flag_set(), set())
+
+    def test_flag_parsing_with_various_separators(self):
+        job = JobDefinition({
+            'id': 'id',
+            'plugin': 'plugin',
+            'flags': ' exclusive, foo\n bar '})
+        self.assertEqual(job.get_flag_set(), {'exclusive', 'foo', 'bar'})
+
     def test_resource_parsing_empty(self):
         job = JobDefinition({
             'id': 'id',
@@ -411,6 +453,15 @@ class TestJobDefinition(TestCase):
         job3 = JobDefinition({'estimated_duration': '123.5'})
         self.assertEqual(job3.estimated_duration, 123.5)
 
+    def test_output_limit(self):
+        self.assertEqual(JobDefinition({}).output_limit, None)
+        self.assertEqual(
+            JobDefinition({'output_limit': 'foo'}).output_limit, None)
+        self.assertEqual(
+            JobDefinition({'output_limit': '-1'}).output_limit, None)
+        self.assertEqual(
+            JobDefinition({'output_limit': '4096'}).output_limit, 4096)
+
     def test_summary(self):
         job1 = JobDefinition({})
         self.assertEqual(job1.summary, None)
@@ -34,9 +34,11 @@ from plainbox.impl.resource import MultipleResourcesReferenced
 from plainbox.impl.resource import NoResourcesReferenced
 from plainbox.impl.resource import Resource
 from plainbox.impl.resource import ResourceExpression
+from plainbox.impl.resource import ResourceIndex
 from plainbox.impl.resource import ResourceNodeVisitor
 from plainbox.impl.resource import ResourceProgram
 from plainbox.impl.resource import ResourceProgramError
+from plainbox.vendor import mock
 
 
 class ExpressionFailedTests(TestCase):
@@ -282,6 +284,100 @@ class ResourceExpressionTests(TestCase):
         self.assertRaises(TypeError, expr.evaluate, [{'a': 2}])
 
 
+class ResourceExpressionIndexTests(TestCase):
+
+    def test_index_query_eq(self):
+        expr = ResourceExpression("package.name == 'fwts'")
+        self.assertEqual(expr.index_query, ('name', ('fwts',)))
+
+    def test_index_query_eq_reversed(self):
+        expr = ResourceExpression("'fwts' == package.name")
+        self.assertEqual(expr.index_query, ('name', ('fwts',)))
+
+    def test_index_query_eq_number(self):
+        expr = ResourceExpression("obj.a == 2")
+        self.assertEqual(expr.index_query, ('a', (2,)))
+
+    def test_index_query_in(self):
+        expr = ResourceExpression("platform.arch in ('i386', 'amd64')")
+        self.assertEqual(expr.index_query, ('arch', ('i386', 'amd64')))
+        expr = ResourceExpression("platform.arch in ['i386', 'amd64']")
+        self.assertEqual(expr.index_query, ('arch', ('i386', 'amd64')))
+
+    def test_index_query_unsupported(self):
+        for text in (
+                "package.name != 'fwts'",
+                "package.name == 'fwts' and package.version == '1'",
+                "'fw' in package.name",
+                "package.name in package.provides",
+                "package.name == 'fwts' or package.name == 'bash'",
+                "package.name == package.provides",
+                "package._data == 'fwts'",
+                "obj.a == (1, 2)",
+                "1 < obj.a == 2"):
+            self.assertIsNone(ResourceExpression(text).index_query, text)
+
+    def test_evaluate_uses_index(self):
+        expr = ResourceExpression("obj.a == 2")
+        resource_index = mock.Mock(spec=ResourceIndex)
+        resource_index.lookup.return_value = True
+        self.assertTrue(expr.evaluate([], resource_index))
+        resource_index.lookup.assert_called_once_with('a', (2,))
+
+    def test_evaluate_falls_back_without_index_query(self):
+        expr = ResourceExpression("obj.a > 1")
+        resource_list = [Resource({'a': 2})]
+        resource_index = mock.Mock(spec=ResourceIndex)
+        self.assertTrue(expr.evaluate(resource_list, resource_index))
+        self.assertEqual(resource_index.lookup.call_count, 0)
+
+    def test_evaluate_same_with_and_without_index(self):
+        resource_list = [
+            Resource({'a': 1, 'b': 'x'}),
+            Resource({'a': 2.0}),
+            Resource({'b': 'y'}),
+            Resource(),
+        ]
+        for text in (
+                "obj.a == 1", "obj.a == 2", "obj.a == 3", "obj.b == 'x'",
+                "obj.b == 'z'", "obj.c == 'x'", "obj.b in ['y', 'z']",
+                "obj.a in (5, 6)", "'x' == obj.b"):
+            expr = ResourceExpression(text)
+            self.assertIsNotNone(expr.index_query)
+            self.assertEqual(
+                expr.evaluate(resource_list),
+                expr.evaluate(resource_list, ResourceIndex(resource_list)),
+                text)
+
+
+class ResourceIndexTests(TestCase):
+
+    def test_lookup(self):
+        resource_index = ResourceIndex([
+            Resource({'name': 'fwts'}), Resource({'name': 'bash'}),
+            Resource({'version': '1'})])
+        self.assertTrue(resource_index.lookup('name', ('fwts',)))
+        self.assertTrue(resource_index.lookup('name', ('zsh', 'bash')))
+        self.assertFalse(resource_index.lookup('name', ('zsh',)))
+        self.assertFalse(resource_index.lookup('other', ('fwts',)))
+
+    def test_lookup_builds_index_once(self):
+        resource_list = [Resource({'name': 'fwts'})]
+        resource_index = ResourceIndex(resource_list)
+        resource_index.lookup('name', ('fwts',))
+        with mock.patch.object(resource_index, '_build') as mock_build:
+            resource_index.lookup('name', ('bash',))
+        self.assertEqual(mock_build.call_count, 0)
+
+    def test_lookup_unindexable_values(self):
+        resource_index = ResourceIndex([Resource({'name': ['fwts']})])
+        self.assertIsNone(resource_index.lookup('name', ('fwts',)))
+
+    def test_lookup_unindexable_resources(self):
+        resource_index = ResourceIndex([{'name': 'fwts'}])
+        self.assertIsNone(resource_index.lookup('name', ('fwts',)))
+
+
 class ResourceProgramTests(TestCase):
 
     def setUp(self):
@@ -357,3 +453,162 @@ class ResourceProgramTests(TestCase):
         self.assertEqual(
             prog.required_resources,
             {'2014.com.canonical::package', '2014.com.canonical::platform'})
+
+    def test_evaluate_ignores_stale_index(self):
+        resource_map = {'package': [Resource({'name': 'fwts'})]}
+        resource_index_map = {'package': ResourceIndex([])}
+        prog = ResourceProgram("package.name == 'fwts'")
+        self.assertTrue(
+            prog.evaluate_or_raise(resource_map, resource_index_map))
+
+    def test_evaluate_result_cache(self):
+        resource_list = [Resource({'name': 'fwts'})]
+        resource_map = {'package': resource_list}
+        resource_index_map = {'package': ResourceIndex(resource_list, 1)}
+        result_cache = {}
+        prog = ResourceProgram("package.name == 'fwts'")
+        self.assertTrue(prog.evaluate_or_raise(
+            resource_map, resource_index_map, result_cache))
+        self.assertEqual(
+            result_cache, {("package.name == 'fwts'", None, 1): True})
+        # The second time the cache is used
+        with mock.patch.object(
+                prog.expression_list[0], 'evaluate') as mock_evaluate:
+            self.assertTrue(prog.evaluate_or_raise(
+                resource_map, resource_index_map, result_cache))
+        self.assertEqual(mock_evaluate.call_count, 0)
+        # A new version of the resources is evaluated again
+        resource_list = [Resource({'name': 'bash'})]
+        resource_map = {'package': resource_list}
+        resource_index_map = {'package': ResourceIndex(resource_list, 2)}
+        with self.assertRaises(ExpressionFailedError):
+            prog.evaluate_or_raise(
+                resource_map, resource_index_map, result_cache)
+        self.assertEqual(
+            result_cache[("package.name == 'fwts'", None, 2)], False)
+
+
+class ResourceProgramCompilationTests(TestCase):
+
+    def test_expressions_are_interned(self):
+        prog1 = ResourceProgram("package.name == 'interned'", "ns")
+        prog2 = ResourceProgram("package.name == 'interned'", "ns")
+        prog3 = ResourceProgram("package.name == 'interned'", "other")
+        self.assertIs(prog1.expression_list[0], prog2.expression_list[0])
+        self.assertIsNot(prog1.expression_list[0], prog3.expression_list[0])
+        self.assertEqual(
+            prog3.expression_list[0].resource_id, "other::package")
+
+    def test_compiled_program_success(self):
+        prog = ResourceProgram(
+            "package.name == 'fwts'\n"
+            "platform.arch in ('i386', 'amd64')  # comment\n",
+            compile_program=True)
+        resource_map = {
+            'package': [Resource({'name': 'bash'}),
+                        Resource({'name': 'fwts'})],
+            'platform': [Resource({'arch': 'amd64'})]}
+        self.assertTrue(prog.evaluate_or_raise(resource_map))
+
+    def test_compiled_program_reports_failed_expression(self):
+        prog = ResourceProgram(
+            "package.name == 'fwts'\n"
+            "platform.arch in ('i386', 'amd64')\n",
+            compile_program=True)
+        resource_map = {
+            'package': [Resource({'name': 'fwts'})],
+            'platform': [Resource({'arch': 'armhf'})]}
+        with self.assertRaises(ExpressionFailedError) as call:
+            prog.evaluate_or_raise(resource_map)
+        self.assertIs(call.exception.expression, prog.expression_list[1])
+
+    def test_compiled_program_short_circuits(self):
+        prog = ResourceProgram(
+            "package.name == 'fwts'\n"
+            "platform.arch in ('i386', 'amd64')\n",
+            compile_program=True)
+        resource_map = {
+            'package': [],
+            # This would raise TypeError if it was ever evaluated
+            'platform': [{'arch': 'amd64'}]}
+        with self.assertRaises(ExpressionFailedError) as call:
+            prog.evaluate_or_raise(resource_map)
+        self.assertIs(call.exception.expression, prog.expression_list[0])
+
+    def test_compiled_program_matches_expressions(self):
+        resource_list = [
+            Resource(), Resource({'a': 'x'}), Resource({'a': 1}),
+            Resource({'a': 2, 'b': 'y'})]
+        for text in (
+                "obj.a == 2", "obj.a > 1", "obj.a > 2", "obj.b == 'y'",
+                "obj.a != 'x'", "obj.a in ('x', 3)", "obj.c == 'z'"):
+            prog = ResourceProgram(text, compile_program=True)
+            try:
+                prog.evaluate_or_raise({'obj': resource_list})
+            except ExpressionFailedError:
+                result = False
+            else:
+                result = True
+            self.assertEqual(
+                result, prog.expression_list[0].evaluate(resource_list), text)
+
+    def test_compiled_program_resource_ids_dont_collide(self):
+        # Resource ids are arbitrary names and must not shadow anything in
+        # the generated code, or the resources of other expressions
+        resource_list = [Resource({'a': '2'})]
+        for resource_id in (
+                "r0", "r1", "Resource", "isinstance", "TypeError",
+                "Exception", "exc", "_log_exception", "program",
+                "_rp_list0", "_rp_item", "__rp_log", "int", "len"):
+            text = (
+                "{0}.a == '2'\n"
+                "other.b == int('2')\n"
+                "{0}.a != 'x'  # len(x)").format(resource_id)
+            prog = ResourceProgram(text, compile_program=True)
+            self.assertTrue(prog.evaluate_or_raise({
+                resource_id: resource_list,
+                'other': [Resource({'b': 2})]}), resource_id)
+            with self.assertRaises(ExpressionFailedError) as call:
+                prog.evaluate_or_raise({
+                    resource_id: resource_list,
+                    'other': [Resource({'b': 3})]})
+            self.assertIs(
+                call.exception.expression, prog.expression_list[1])
+            self.assertRaises(
+                TypeError, prog.evaluate_or_raise, {
+                    resource_id: [{'a': '2'}],
+                    'other': [Resource({'b': 2})]})
+
+    def test_compiled_program_checks_resource_type(self):
+        prog = ResourceProgram("obj.a == 2", compile_program=True)
+        self.assertRaises(
+            TypeError, prog.evaluate_or_raise, {'obj': [{'a': 2}]})
+
+    def test_compilation_benchmark(self):
+        # Micro-benchmark of creating resource programs for many jobs that
+        # share a small number of distinct requirements. Each distinct
+        # expression should only be analyzed once and each distinct program
+        # should only be compiled once.
+        line_list = [
+            "cpuinfo.platform == 'benchmark'",
+            "device.category == 'BENCHMARK'",
+            "package.name == 'benchmark'",
+            "package.name in ['benchmark-1', 'benchmark-2']",
+        ]
+        program_text_list = [
+            "\n".join(line_list[:index % len(line_list) + 1])
+            for index in range(2000)]
+        with mock.patch.object(
+                ResourceExpression, '_analyze',
+                wraps=ResourceExpression._analyze) as mock_analyze, \
+                mock.patch.object(
+                    ResourceProgram, '_compile',
+                    wraps=ResourceProgram._compile) as mock_compile:
+            for program_text in program_text_list:
+                ResourceProgram(program_text, compile_program=True)
+        self.assertEqual(mock_analyze.call_count, len(line_list))
+        self.assertEqual(mock_compile.call_count, len(program_text_list))
+        self.assertEqual(
+            len([key for key in ResourceProgram._compiled_function_cache
+                 if 'benchmark' in key[0]]),
+            len(line_list))
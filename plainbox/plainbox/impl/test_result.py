@@ -26,14 +26,19 @@ Test definitions for plainbox.impl.result module
 from tempfile import TemporaryDirectory
 from unittest import TestCase
 import io
+import os
+import struct
 
 from plainbox.abc import IJobResult
+from plainbox.impl.result import BinaryIOLogRecordReader
+from plainbox.impl.result import BinaryIOLogRecordWriter
 from plainbox.impl.result import DiskJobResult
 from plainbox.impl.result import IOLogRecord
 from plainbox.impl.result import IOLogRecordReader
 from plainbox.impl.result import IOLogRecordWriter
 from plainbox.impl.result import MemoryJobResult
 from plainbox.impl.testing_utils import make_io_log
+from plainbox.vendor import mock
 
 
 class DiskJobResultTests(TestCase):
@@ -74,6 +79,88 @@ class DiskJobResultTests(TestCase):
         self.assertEqual(result.io_log, ((0, 'stdout', b'blah\n'),))
         self.assertEqual(result.return_code, 0)
 
+    def test_io_log_formats(self):
+        io_log = [(0, 'stdout', b'blah\n'), (0.5, 'stderr', b''),
+                  (1.25, 'stdout', b'\x00\xff' * 1000)]
+        for binary in (False, True):
+            result = DiskJobResult({
+                'io_log_filename': make_io_log(
+                    io_log, self.scratch_dir.name, binary)
+            })
+            record_list = list(result.get_io_log())
+            self.assertEqual(record_list, io_log)
+            for record in record_list:
+                self.assertIsInstance(record.data, bytes)
+
+    def check_partial_io_log(self, result, io_log):
+        for stream_name in ('stdout', 'stderr', 'stdin'):
+            expected = [record for record in io_log
+                        if record[1] == stream_name]
+            self.assertEqual(
+                list(result.get_io_log(stream_name)), expected)
+            self.assertEqual(
+                result.get_io_log_size(stream_name),
+                sum(len(record[2]) for record in expected))
+            self.assertEqual(
+                result.get_io_log_tail(2, stream_name), expected[-2:])
+        self.assertEqual(
+            result.get_io_log_size(), sum(len(r[2]) for r in io_log))
+        self.assertEqual(result.get_io_log_tail(3), io_log[-3:])
+        self.assertEqual(result.get_io_log_tail(100), io_log)
+        self.assertEqual(result.get_io_log_tail(0), [])
+
+    def test_partial_io_log(self):
+        io_log = [(0.5 * i, 'stdout' if i % 3 else 'stderr',
+                   "line {}\n".format(i).encode("ASCII"))
+                  for i in range(10)]
+        for binary in (False, True):
+            result = DiskJobResult({
+                'io_log_filename': make_io_log(
+                    io_log, self.scratch_dir.name, binary)
+            })
+            self.check_partial_io_log(result, io_log)
+
+    def test_partial_io_log_index_problems(self):
+        io_log = [(0.5 * i, 'stdout' if i % 3 else 'stderr',
+                   "line {}\n".format(i).encode("ASCII"))
+                  for i in range(10)]
+        result = DiskJobResult({
+            'io_log_filename': make_io_log(
+                io_log, self.scratch_dir.name, binary=True)
+        })
+        index_filename = result.io_log_index_filename
+        self.assertEqual(index_filename, result.io_log_filename + ".index")
+        with open(index_filename, 'rb') as stream:
+            index_data = stream.read()
+        # The index is only used for partial access to the log
+        with mock.patch('plainbox.impl.result._scan_binary_frames') as m:
+            m.return_value = []
+            self.check_partial_io_log(result, io_log)
+        # Index that is truncated is extended by scanning the log
+        with open(index_filename, 'wb') as stream:
+            stream.write(index_data[:-20])
+        self.check_partial_io_log(result, io_log)
+        # Index that doesn't match the log is ignored
+        with open(index_filename, 'wb') as stream:
+            stream.write(index_data[:-13] + index_data[-26:-13])
+        with mock.patch('plainbox.impl.result.logger') as mock_logger:
+            self.check_partial_io_log(result, io_log)
+        self.assertTrue(mock_logger.warning.called)
+        # Corrupted index is ignored
+        with open(index_filename, 'wb') as stream:
+            stream.write(b'garbage')
+        with mock.patch('plainbox.impl.result.logger'):
+            self.check_partial_io_log(result, io_log)
+        # Missing index is not a problem either
+        os.unlink(index_filename)
+        self.check_partial_io_log(result, io_log)
+
+    def test_partial_io_log_without_log(self):
+        result = DiskJobResult({})
+        self.assertEqual(list(result.get_io_log('stdout')), [])
+        self.assertEqual(result.get_io_log_tail(5), [])
+        self.assertEqual(result.get_io_log_size(), 0)
+
 
 class MemoryJobResultTests(TestCase):
 
@@ -103,6 +190,22 @@ class MemoryJobResultTests(TestCase):
         self.assertEqual(result.io_log, ((0, 'stdout', b'blah\n'),))
         self.assertEqual(result.return_code, 0)
 
+    def test_partial_io_log(self):
+        result = MemoryJobResult({
+            'io_log': [(0, 'stdout', b'a\n'), (1, 'stderr', b'bb\n'),
+                       (2, 'stdout', b'ccc\n')],
+        })
+        self.assertEqual(
+            list(result.get_io_log('stdout')),
+            [(0, 'stdout', b'a\n'), (2, 'stdout', b'ccc\n')])
+        self.assertEqual(result.get_io_log_size(), 9)
+        self.assertEqual(result.get_io_log_size('stderr'), 3)
+        self.assertEqual(
+            result.get_io_log_tail(1, 'stderr'), [(1, 'stderr', b'bb\n')])
+        self.assertEqual(
+            result.get_io_log_tail(2),
+            [(1, 'stderr', b'bb\n'), (2, 'stdout', b'ccc\n')])
+
 
 class IOLogRecordWriterTests(TestCase):
 
@@ -134,3 +237,79 @@ class IOLogRecordWriterTests(TestCase):
         reader = IOLogRecordReader(stream)
         record_list = list(reader)
         self.assertEqual(record_list, [self._RECORD])
+
+
+class BinaryIOLogRecordWriterTests(TestCase):
+
+    _RECORD = IOLogRecord(0.123, 'stdout', b'some\ndata')
+    _HEADER = b'\x00PBIOLOG 1\n'
+    _DATA = _HEADER + struct.pack("<dBI", 0.123, 0, 9) + b'some\ndata'
+
+    def test_smoke_write(self):
+        stream = io.BytesIO()
+        writer = BinaryIOLogRecordWriter(stream)
+        writer.write_record(self._RECORD)
+        self.assertEqual(stream.getvalue(), self._DATA)
+        writer.close()
+        with self.assertRaises(ValueError):
+            stream.getvalue()
+
+    def test_write_index(self):
+        stream = io.BytesIO()
+        index_stream = io.BytesIO()
+        writer = BinaryIOLogRecordWriter(stream, index_stream)
+        writer.write_record(self._RECORD)
+        writer.write_record(IOLogRecord(0, 'stderr', b'x'))
+        self.assertEqual(
+            index_stream.getvalue(),
+            b'\x00PBIOIDX 1\n'
+            + struct.pack("<QBI", len(self._HEADER), 0, 9)
+            + struct.pack("<QBI", len(self._DATA), 1, 1))
+        writer.close()
+        self.assertTrue(index_stream.closed)
+
+    def test_write_unsupported_stream(self):
+        writer = BinaryIOLogRecordWriter(io.BytesIO())
+        with self.assertRaises(ValueError):
+            writer.write_record(IOLogRecord(0, 'stdin', b''))
+
+    def test_smoke_read(self):
+        reader = BinaryIOLogRecordReader(self._DATA)
+        record1 = reader.read_record()
+        self.assertEqual(record1, self._RECORD)
+        self.assertIsInstance(record1.data, memoryview)
+        record2 = reader.read_record()
+        self.assertEqual(record2, None)
+        record1.data.release()
+        reader.close()
+
+    def test_copy_read(self):
+        reader = BinaryIOLogRecordReader(self._DATA, copy=True)
+        record = reader.read_record()
+        self.assertEqual(record, self._RECORD)
+        self.assertIsInstance(record.data, bytes)
+        reader.close()
+
+    def test_iter_read(self):
+        reader = BinaryIOLogRecordReader(
+            self._DATA + self._DATA[len(self._HEADER):])
+        self.assertEqual(list(reader), [self._RECORD, self._RECORD])
+
+    def test_truncated_read(self):
+        for size in range(len(self._HEADER), len(self._DATA)):
+            reader = BinaryIOLogRecordReader(self._DATA[:size])
+            self.assertEqual(list(reader), [])
+
+    def test_bad_header(self):
+        with self.assertRaises(ValueError):
+            BinaryIOLogRecordReader(b'')
+        with self.assertRaises(ValueError):
+            BinaryIOLogRecordReader(b'\x1f\x8b')
+        with self.assertRaises(ValueError):
+            BinaryIOLogRecordReader(b'\x00PBIOLOG 2\n')
+
+    def test_bad_stream_id(self):
+        reader = BinaryIOLogRecordReader(
+            b'\x00PBIOLOG 1\n' + struct.pack("<dBI", 0, 7, 0))
+        with self.assertRaises(ValueError):
+            reader.read_record()
@@ -27,14 +27,21 @@ Test definitions for plainbox.impl.runner module
 
 from tempfile import TemporaryDirectory
 from unittest import TestCase
+from unittest import skipUnless
 import os
+import sys
+import threading
+import time
 
 from plainbox.impl.job import JobDefinition
+from plainbox.impl.runner import BufferedDelegate
 from plainbox.impl.runner import CommandOutputWriter
 from plainbox.impl.runner import FallbackCommandOutputPrinter
 from plainbox.impl.runner import IOLogRecordGenerator
 from plainbox.impl.runner import JobRunner
+from plainbox.impl.runner import OutputLimiter
 from plainbox.impl.runner import slugify
+from plainbox.impl.secure.providers.v1 import Provider1
 from plainbox.testing_utils.io import TestIO
 from plainbox.vendor.mock import Mock, patch
 
@@ -117,4 +124,338 @@ class CommandOutputWriterTests(TestCase):
             # After the command is done the logs are left on disk
             writer.on_end(None)
             self.assertFileContentsEqual(stdout, b'text\n')
-            self.assertFileContentsEqual(stderr, b'error\n')
\ No newline at end of file
+            self.assertFileContentsEqual(stderr, b'error\n')
+
+class Recorder:
+
+    def __init__(self):
+        self.lines = []
+        self.ended = False
+
+    def on_line(self, stream_name, line):
+        self.lines.append((stream_name, line))
+
+    def on_end(self, returncode):
+        self.ended = True
+
+
+class BufferedDelegateTests(TestCase):
+
+    def test_output_is_passed_on_end(self):
+        recorder = Recorder()
+        delegate = BufferedDelegate(recorder, threading.Lock())
+        delegate.on_begin((), {})
+        delegate.on_line('stdout', b'line 1\n')
+        delegate.on_line('stderr', b'line 2\n')
+        self.assertEqual(recorder.lines, [])
+        delegate.on_end(0)
+        self.assertEqual(
+            recorder.lines,
+            [('stdout', b'line 1\n'), ('stderr', b'line 2\n')])
+        self.assertTrue(recorder.ended)
+
+    def test_lock_is_held(self):
+        lock = threading.Lock()
+        recorder = Mock(name='recorder')
+        recorder.on_line.side_effect = lambda stream_name, line: (
+            self.assertTrue(lock.locked()))
+        delegate = BufferedDelegate(recorder, lock)
+        delegate.on_line('stdout', b'line 1\n')
+        delegate.on_end(0)
+        self.assertEqual(recorder.on_line.call_count, 1)
+        self.assertFalse(lock.locked())
+
+
+class OutputLimiterTests(TestCase):
+
+    lines = [('stdout', b'line 1\n'), ('stderr', b'line 2\n'),
+             ('stdout', b'line 3\n'), ('stdout', b'line 4\n'),
+             ('stderr', b'line 5\n')]
+
+    def run_limiter(self, limit, policy):
+        recorder = Recorder()
+        limiter = OutputLimiter(recorder, limit, policy)
+        limiter.on_begin(None, None)
+        for stream_name, line in self.lines:
+            limiter.on_line(stream_name, line)
+        limiter.on_end(0)
+        self.assertTrue(recorder.ended)
+        return limiter, recorder.lines
+
+    def test_within_limit(self):
+        for policy in OutputLimiter.POLICIES:
+            limiter, lines = self.run_limiter(35, policy)
+            self.assertFalse(limiter.truncated)
+            self.assertEqual(limiter.size, 35)
+            self.assertEqual(lines, self.lines)
+
+    def test_head(self):
+        limiter, lines = self.run_limiter(20, 'head')
+        self.assertTrue(limiter.truncated)
+        self.assertEqual(limiter.size, 14)
+        self.assertEqual(limiter.truncated_size, 21)
+        self.assertEqual(limiter.truncated_lines, 3)
+        self.assertEqual(lines, self.lines[:2])
+        self.assertEqual(
+            limiter.get_truncation_message(),
+            "21 bytes of output (3 lines) were discarded")
+
+    def test_tail(self):
+        limiter, lines = self.run_limiter(20, 'tail')
+        self.assertEqual(limiter.size, 14)
+        self.assertEqual(lines, self.lines[3:])
+
+    def test_head_tail(self):
+        limiter, lines = self.run_limiter(20, 'head-tail')
+        self.assertEqual(limiter.size, 14)
+        self.assertEqual(lines, self.lines[:1] + self.lines[4:])
+
+    def test_nothing(self):
+        limiter, lines = self.run_limiter(0, 'head-tail')
+        self.assertEqual(limiter.size, 0)
+        self.assertEqual(lines, [])
+        self.assertEqual(limiter.truncated_lines, 5)
+
+    def test_bad_arguments(self):
+        with self.assertRaises(ValueError):
+            OutputLimiter(Recorder(), 10, 'middle')
+        with self.assertRaises(ValueError):
+            OutputLimiter(Recorder(), -1)
+
+
+class JobRunnerOutputLimitTests(TestCase):
+
+    def setUp(self):
+        self.scratch_dir = TemporaryDirectory()
+        self.runner = JobRunner(
+            self.scratch_dir.name, [], self.scratch_dir.name,
+            command_io_delegate=Recorder())
+        self.config = Mock(
+            job_output_limit=0, session_output_limit=0,
+            output_truncation='head-tail')
+        self.job = JobDefinition(
+            {'plugin': 'shell', 'command': 'true', 'id': 'true'})
+
+    def tearDown(self):
+        self.scratch_dir.cleanup()
+
+    def run_job(self, job):
+        def run_extcmd(job, config, extcmd_popen):
+            return extcmd_popen.call([
+                sys.executable, "-c",
+                "for i in range(1000): print('line', i)"])
+        with patch.object(self.runner, '_run_extcmd', run_extcmd):
+            return self.runner.run_job(job, self.config)
+
+    def test_get_output_limit(self):
+        job = JobDefinition({'plugin': 'shell'})
+        self.assertIsNone(self.runner._get_output_limit(job, None))
+        self.assertIsNone(self.runner._get_output_limit(job, self.config))
+        self.config.job_output_limit = 100
+        self.assertEqual(
+            self.runner._get_output_limit(job, self.config), 100)
+        job = JobDefinition({'plugin': 'shell', 'output_limit': '10'})
+        self.assertEqual(self.runner._get_output_limit(job, self.config), 10)
+        self.config.session_output_limit = 5
+        self.assertEqual(self.runner._get_output_limit(job, self.config), 5)
+        for plugin in ('local', 'resource', 'attachment'):
+            job = JobDefinition({'plugin': plugin, 'output_limit': '10'})
+            self.assertIsNone(
+                self.runner._get_output_limit(job, self.config))
+
+    def test_unlimited(self):
+        result = self.run_job(self.job)
+        self.assertEqual(len(result.io_log), 1000)
+        self.assertIsNone(result.comments)
+
+    def test_limited(self):
+        self.config.job_output_limit = 1000
+        result = self.run_job(self.job)
+        io_log = result.io_log
+        self.assertEqual(io_log[0].data, b'line 0\n')
+        self.assertEqual(io_log[-1].data, b'line 999\n')
+        # The note about the discarded output is only in the comments
+        self.assertFalse(any(
+            b'were discarded' in record.data for record in io_log))
+        self.assertLessEqual(
+            sum(len(record.data) for record in io_log), 1000)
+        self.assertIn('were discarded', result.comments)
+        with open(os.path.join(self.scratch_dir.name, 'true.stdout'),
+                  'rb') as stream:
+            self.assertEqual(stream.read(), b''.join(
+                record.data for record in io_log))
+
+    def test_session_limit(self):
+        self.config.session_output_limit = 1500
+        first = self.run_job(
+            JobDefinition({'plugin': 'shell', 'command': 'true', 'id': 'a'}))
+        second = self.run_job(
+            JobDefinition({'plugin': 'shell', 'command': 'true', 'id': 'b'}))
+        first_size = sum(len(record.data) for record in first.io_log)
+        second_size = sum(len(record.data) for record in second.io_log)
+        self.assertGreater(first_size, 1400)
+        self.assertLess(second_size, 100)
+
+
+class JobRunnerControllerSelectionTests(TestCase):
+
+    def setUp(self):
+        self.runner = JobRunner('session-dir', [], 'io-log-dir')
+        self.ctrl_list = [
+            Mock(name='ctrl1', **{'get_score.return_value': 1}),
+            Mock(name='ctrl2', **{'get_score.return_value': 2})]
+        self.runner._execution_ctrl_list = self.ctrl_list
+        self.provider = Mock(name='provider')
+
+    def make_job(self, plugin='shell', id='id', **kwargs):
+        kwargs.update(plugin=plugin, id=id)
+        return JobDefinition(kwargs, provider=self.provider)
+
+    def test_best_controller(self):
+        self.assertIs(
+            self.runner._get_ctrl_for_job(self.make_job()), self.ctrl_list[1])
+
+    def test_no_controller(self):
+        for ctrl in self.ctrl_list:
+            ctrl.get_score.return_value = -1
+        with self.assertRaises(RuntimeError):
+            self.runner._get_ctrl_for_job(self.make_job())
+
+    def test_selection_is_cached(self):
+        self.runner._get_ctrl_for_job(self.make_job(id='a'))
+        self.runner._get_ctrl_for_job(self.make_job(id='b'))
+        self.assertEqual(self.ctrl_list[0].get_score.call_count, 1)
+        # Jobs with a different user or plugin are scored again
+        self.runner._get_ctrl_for_job(self.make_job(user='root'))
+        self.runner._get_ctrl_for_job(self.make_job(plugin='user-interact'))
+        self.assertEqual(self.ctrl_list[0].get_score.call_count, 3)
+
+    def test_run_extcmd(self):
+        job = self.make_job()
+        retval = self.runner._run_extcmd(job, 'config', 'extcmd_popen')
+        self.ctrl_list[1].execute_job.assert_called_once_with(
+            job, 'config', 'extcmd_popen')
+        self.assertIs(retval, self.ctrl_list[1].execute_job.return_value)
+
+    def test_close(self):
+        self.runner.close()
+        for ctrl in self.ctrl_list:
+            ctrl.close.assert_called_once_with()
+
+
+@skipUnless(
+    os.environ.get("PLAINBOX_BENCHMARK"),
+    "set PLAINBOX_BENCHMARK=1 to run benchmarks")
+class JobRunnerDispatchBenchmark(TestCase):
+    """
+    Benchmark of picking the controller and computing the execution
+    environment of each job, which happens each time a job is started.
+    """
+
+    job_count = 500
+    repeat = 5
+
+    def setUp(self):
+        self.provider = Mock(
+            spec=Provider1, namespace='ns', secure=False,
+            extra_PYTHONPATH=None, CHECKBOX_SHARE='share', data_dir='data')
+        self.config = Mock(environment={'A': '1', 'B': '2'})
+        self.job_list = [
+            JobDefinition({
+                'id': 'job-{}'.format(index), 'plugin': 'shell',
+                'command': 'true', 'user': 'root' if index % 2 else None
+            }, provider=self.provider)
+            for index in range(self.job_count)]
+        with patch('plainbox.impl.ctrl.check_output'):
+            self.runner = JobRunner(
+                'session-dir', [self.provider], 'io-log-dir')
+        for ctrl in self.runner._execution_ctrl_list:
+            if hasattr(ctrl, 'user_can_sudo'):
+                ctrl.user_can_sudo = True
+
+    def dispatch(self):
+        for job in self.job_list:
+            ctrl = self.runner._get_ctrl_for_job(job)
+            if hasattr(ctrl, 'get_differential_execution_environment'):
+                ctrl.get_differential_execution_environment(
+                    job, self.config, 'nest')
+            else:
+                ctrl.get_execution_environment(job, self.config, 'nest')
+
+    def test_dispatch(self):
+        duration_list = []
+        for i in range(self.repeat):
+            start = time.time()
+            self.dispatch()
+            duration_list.append(time.time() - start)
+        sys.stderr.write(
+            "\n{} environment variables: {:.1f}us per job ".format(
+                len(os.environ), min(duration_list) / self.job_count * 1e6))
+
+
+class JobRunnerConcurrencyTests(TestCase):
+
+    def setUp(self):
+        self.scratch_dir = TemporaryDirectory()
+        self.recorder = Recorder()
+        self.runner = JobRunner(
+            self.scratch_dir.name, [], self.scratch_dir.name,
+            command_io_delegate=self.recorder)
+        self.job = JobDefinition(
+            {'plugin': 'shell', 'command': 'true', 'id': 'job'})
+
+    def tearDown(self):
+        self.scratch_dir.cleanup()
+
+    def run_job(self, script, started=None):
+        def run_extcmd(job, config, extcmd_popen):
+            if started is not None:
+                started.set()
+            return extcmd_popen.call([sys.executable, "-c", script])
+        with patch.object(self.runner, '_run_extcmd', run_extcmd):
+            return self.runner.run_job_concurrently(self.job)
+
+    def test_output_is_buffered(self):
+        def run_job():
+            result.append(self.run_job(
+                "import sys, time\n"
+                "print('line'); sys.stdout.flush(); time.sleep(0.5)"))
+        result = []
+        thread = threading.Thread(target=run_job)
+        thread.start()
+        time.sleep(0.25)
+        # Nothing is passed to the UI delegate while the command runs
+        self.assertEqual(self.recorder.lines, [])
+        thread.join()
+        self.assertEqual(self.recorder.lines, [('stdout', b'line\n')])
+        self.assertEqual(result[0].outcome, 'pass')
+
+    def test_output_of_run_job_is_not_buffered(self):
+        def run_extcmd(job, config, extcmd_popen):
+            delegate = extcmd_popen.delegate
+            delegate.on_begin((), {})
+            delegate.on_line('stdout', b'line\n')
+            self.assertEqual(self.recorder.lines, [('stdout', b'line\n')])
+            return 0
+        with patch.object(self.runner, '_run_extcmd', run_extcmd):
+            self.runner.run_job(self.job)
+
+    def test_interrupt_concurrent_jobs(self):
+        # Nothing is running
+        self.runner.interrupt_concurrent_jobs()
+        started = threading.Event()
+        result = []
+        thread = threading.Thread(target=lambda: result.append(self.run_job(
+            "import time; time.sleep(60)", started)))
+        thread.start()
+        self.assertTrue(started.wait(timeout=5))
+        # Wait for the process to start
+        while not self.runner._concurrent_cmd_set:
+            time.sleep(0.01)
+        while list(self.runner._concurrent_cmd_set)[0]._proc is None:
+            time.sleep(0.01)
+        self.runner.interrupt_concurrent_jobs()
+        thread.join(30)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(result[0].outcome, 'fail')
+        self.assertEqual(self.runner._concurrent_cmd_set, set())
@@ -0,0 +1,383 @@
+# This file is part of Checkbox.
+#
+# Copyright 2014 Canonical Ltd.
+#
+# Checkbox is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3,
+# as published by the Free Software Foundation.
+
+#
+# Checkbox is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Checkbox.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+plainbox.impl.test_scheduler
+============================
+
+Test definitions for plainbox.impl.scheduler module
+"""
+
+from unittest import TestCase
+import threading
+import time
+
+from plainbox.abc import IJobResult
+from plainbox.impl.result import MemoryJobResult
+from plainbox.impl.scheduler import ParallelJobScheduler
+from plainbox.impl.scheduler import ResourceJobScheduler
+from plainbox.impl.session import SessionState
+from plainbox.impl.testing_utils import make_job
+from plainbox.vendor import mock
+
+
+class ResourceJobSchedulerTests(TestCase):
+
+    def setUp(self):
+        self.job_A = make_job('A', plugin='resource')
+        self.job_B = make_job('B', plugin='resource')
+        self.job_C = make_job('C', plugin='resource', depends='A')
+        self.job_D = make_job('D', plugin='shell', requires='B.key == "v"')
+        self.job_E = make_job('E', plugin='resource', depends='D')
+        self.job_list = [
+            self.job_A, self.job_B, self.job_C, self.job_D, self.job_E]
+        self.session = SessionState(self.job_list)
+        self.session.update_desired_job_list(self.job_list)
+        self.runner = mock.Mock(name='runner')
+        self.runner.run_job_concurrently.side_effect = self._run_job
+        self.run_log = []
+
+    def _run_job(self, job, config):
+        self.run_log.append(job.id)
+        return MemoryJobResult({'outcome': IJobResult.OUTCOME_PASS})
+
+    def test_max_workers(self):
+        scheduler = ResourceJobScheduler(self.session, self.runner)
+        self.assertEqual(
+            scheduler.max_workers, ResourceJobScheduler.DEFAULT_MAX_WORKERS)
+        scheduler = ResourceJobScheduler(
+            self.session, self.runner, max_workers=2)
+        self.assertEqual(scheduler.max_workers, 2)
+        with self.assertRaises(ValueError):
+            ResourceJobScheduler(self.session, self.runner, max_workers=0)
+
+    def test_get_ready_job_list(self):
+        scheduler = ResourceJobScheduler(self.session, self.runner)
+        self.assertEqual(
+            scheduler.get_ready_job_list(), [self.job_A, self.job_B])
+
+    def test_get_ready_job_list_skips_jobs_of_other_users(self):
+        job_R = make_job('R', plugin='resource', user='root')
+        session = SessionState([self.job_A, job_R])
+        session.update_desired_job_list([self.job_A, job_R])
+        scheduler = ResourceJobScheduler(session, self.runner)
+        self.assertEqual(scheduler.get_ready_job_list(), [self.job_A])
+        scheduler.run()
+        self.assertIsNone(session.job_state_map['R'].result.outcome)
+
+    def test_run(self):
+        scheduler = ResourceJobScheduler(self.session, self.runner, 'config')
+        done_list = scheduler.run()
+        # Job C is ready after A is done, E needs D which is not a resource
+        self.assertEqual(
+            [job for job, result in done_list],
+            [self.job_A, self.job_B, self.job_C])
+        self.assertEqual(self.run_log[2], 'C')
+        self.runner.run_job_concurrently.assert_any_call(self.job_A, 'config')
+        job_state_map = self.session.job_state_map
+        for job in (self.job_A, self.job_B, self.job_C):
+            self.assertEqual(
+                job_state_map[job.id].result.outcome, IJobResult.OUTCOME_PASS)
+        for job in (self.job_D, self.job_E):
+            self.assertIsNone(job_state_map[job.id].result.outcome)
+        self.assertEqual(scheduler.get_ready_job_list(), [])
+
+    def test_run_calls_result_callback(self):
+        scheduler = ResourceJobScheduler(self.session, self.runner)
+        callback = mock.Mock()
+        done_list = scheduler.run(callback)
+        self.assertEqual(
+            callback.call_args_list,
+            [((job, result),) for job, result in done_list])
+
+    def test_run_calls_checkpoint_callback(self):
+        scheduler = ResourceJobScheduler(self.session, self.runner)
+        running_job_name_list = []
+
+        def checkpoint_callback():
+            running_job_name_list.append(
+                self.session.metadata.running_job_name)
+        scheduler.run(checkpoint_callback=checkpoint_callback)
+        # Two batches: A and B, then C
+        self.assertEqual(running_job_name_list, ['A', None, 'C', None])
+        self.assertIsNone(self.session.metadata.running_job_name)
+
+    def test_run_interrupts_jobs(self):
+        # Job B keeps running until it is interrupted
+        interrupted = threading.Event()
+
+        def run_job(job, config):
+            if job.id == 'B':
+                self.assertTrue(interrupted.wait(timeout=5))
+            return self._run_job(job, config)
+        self.runner.run_job_concurrently.side_effect = run_job
+        self.runner.interrupt_concurrent_jobs.side_effect = interrupted.set
+        scheduler = ResourceJobScheduler(self.session, self.runner)
+        # Pretend that CTRL-C was pressed while waiting for the results
+        with mock.patch('concurrent.futures.Future.result',
+                        side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                scheduler.run()
+        self.runner.interrupt_concurrent_jobs.assert_called_once_with()
+        self.assertIsNone(self.session.job_state_map['A'].result.outcome)
+
+    def test_run_is_concurrent(self):
+        # Both A and B must be running at the same time for the barrier to
+        # let them through, otherwise it breaks and the test fails
+        barrier = threading.Barrier(2, timeout=5)
+
+        def run_job(job, config):
+            if job.id in ('A', 'B'):
+                barrier.wait()
+            return self._run_job(job, config)
+        self.runner.run_job_concurrently.side_effect = run_job
+        scheduler = ResourceJobScheduler(self.session, self.runner)
+        scheduler.run()
+        self.assertEqual(sorted(self.run_log), ['A', 'B', 'C'])
+
+    def test_run_stores_results_in_run_list_order(self):
+        # Make job A finish only after job B is finished
+        b_done = threading.Event()
+
+        def run_job(job, config):
+            if job.id == 'A':
+                self.assertTrue(b_done.wait(timeout=5))
+            result = self._run_job(job, config)
+            if job.id == 'B':
+                b_done.set()
+            return result
+        self.runner.run_job_concurrently.side_effect = run_job
+        scheduler = ResourceJobScheduler(self.session, self.runner)
+        with mock.patch.object(
+                self.session, 'update_job_result',
+                wraps=self.session.update_job_result) as mock_update:
+            scheduler.run()
+        self.assertEqual(self.run_log[:2], ['B', 'A'])
+        self.assertEqual(
+            [call[0][0] for call in mock_update.call_args_list],
+            [self.job_A, self.job_B, self.job_C])
+
+    def test_run_with_one_worker(self):
+        scheduler = ResourceJobScheduler(
+            self.session, self.runner, max_workers=1)
+        scheduler.run()
+        self.assertEqual(self.run_log, ['A', 'B', 'C'])
+
+    def test_run_propagates_exceptions(self):
+        self.runner.run_job_concurrently.side_effect = OSError("boom")
+        scheduler = ResourceJobScheduler(self.session, self.runner)
+        with self.assertRaises(OSError):
+            scheduler.run()
+
+
+class ParallelJobSchedulerTests(TestCase):
+
+    def setUp(self):
+        self.job_A = make_job('A', plugin='shell')
+        self.job_B = make_job('B', plugin='shell')
+        self.job_C = make_job('C', plugin='shell', depends='A')
+        self.job_M = make_job('M', plugin='manual')
+        self.job_R = make_job('R', plugin='shell', user='root')
+        self.job_X = make_job('X', plugin='shell', flags='exclusive')
+        self.job_S = make_job('suspend/S', plugin='shell')
+        self.runner = mock.Mock(name='runner')
+        self.runner.run_job_concurrently.side_effect = self._run_job
+        self.run_log = []
+
+    def _make_session(self, job_list):
+        session = SessionState(job_list)
+        session.update_desired_job_list(job_list)
+        return session
+
+    def _run_job(self, job, config):
+        self.run_log.append(job.id)
+        return MemoryJobResult({'outcome': IJobResult.OUTCOME_PASS})
+
+    def _make_serial_callback(self, session, stop_id=None):
+        def serial_callback(job):
+            self.assertIs(threading.current_thread(), threading.main_thread())
+            # All the concurrently executed jobs are finished
+            for call in self.runner.run_job_concurrently.call_args_list:
+                self.assertIsNotNone(
+                    job_state_map[call[0][0].id].result.outcome)
+            if job_state_map[job.id].can_start():
+                self.run_log.append(job.id)
+                outcome = IJobResult.OUTCOME_PASS
+            else:
+                outcome = IJobResult.OUTCOME_NOT_SUPPORTED
+            session.update_job_result(
+                job, MemoryJobResult({'outcome': outcome}))
+            return job.id == stop_id
+        job_state_map = session.job_state_map
+        return serial_callback
+
+    def test_max_workers(self):
+        session = self._make_session([self.job_A])
+        scheduler = ParallelJobScheduler(session, self.runner)
+        self.assertEqual(scheduler.max_workers, 1)
+        with self.assertRaises(ValueError):
+            ParallelJobScheduler(session, self.runner, max_workers=0)
+
+    def test_is_exclusive(self):
+        scheduler = ParallelJobScheduler(mock.Mock(), self.runner)
+        self.assertFalse(scheduler.is_exclusive(self.job_A))
+        self.assertTrue(scheduler.is_exclusive(self.job_X))
+        self.assertTrue(scheduler.is_exclusive(self.job_S))
+        self.assertTrue(scheduler.is_exclusive(
+            make_job('graphics/resolution', plugin='shell')))
+        self.assertTrue(scheduler.is_exclusive(
+            make_job('audio/playback', plugin='shell')))
+
+    def test_can_run_concurrently(self):
+        scheduler = ParallelJobScheduler(mock.Mock(), self.runner)
+        self.assertTrue(scheduler.can_run_concurrently(self.job_A))
+        self.assertTrue(scheduler.can_run_concurrently(
+            make_job('res', plugin='resource')))
+        self.assertFalse(scheduler.can_run_concurrently(self.job_M))
+        self.assertFalse(scheduler.can_run_concurrently(self.job_R))
+        self.assertFalse(scheduler.can_run_concurrently(self.job_X))
+        self.assertFalse(scheduler.can_run_concurrently(self.job_S))
+        self.assertFalse(scheduler.can_run_concurrently(
+            make_job('loc', plugin='local')))
+
+    def test_run_is_concurrent(self):
+        # Both A and B must be running at the same time for the barrier to
+        # let them through, otherwise it breaks and the test fails
+        barrier = threading.Barrier(2, timeout=5)
+
+        def run_job(job, config):
+            barrier.wait()
+            return self._run_job(job, config)
+        self.runner.run_job_concurrently.side_effect = run_job
+        session = self._make_session([self.job_A, self.job_B])
+        scheduler = ParallelJobScheduler(session, self.runner, max_workers=2)
+        self.assertFalse(scheduler.run(self._make_serial_callback(session)))
+        self.assertEqual(sorted(self.run_log), ['A', 'B'])
+        for job_id in ('A', 'B'):
+            self.assertEqual(
+                session.job_state_map[job_id].result.outcome,
+                IJobResult.OUTCOME_PASS)
+
+    def test_run_respects_dependencies(self):
+        session = self._make_session([self.job_C, self.job_B, self.job_A])
+        scheduler = ParallelJobScheduler(session, self.runner, max_workers=4)
+        callback = mock.Mock()
+        scheduler.run(self._make_serial_callback(session), callback)
+        self.assertLess(self.run_log.index('A'), self.run_log.index('C'))
+        self.assertEqual(
+            sorted(call[0][0].id for call in callback.call_args_list),
+            ['A', 'B', 'C'])
+
+    def test_run_serializes_other_jobs(self):
+        job_list = [
+            self.job_A, self.job_M, self.job_B, self.job_X, self.job_C,
+            self.job_R, self.job_S]
+        session = self._make_session(job_list)
+        scheduler = ParallelJobScheduler(session, self.runner, max_workers=4)
+        scheduler.run(self._make_serial_callback(session))
+        # The serial callback checks that nothing else is running. Jobs
+        # that have to run alone are not overtaken by jobs that come later.
+        self.assertEqual(len(self.run_log), len(job_list))
+        self.assertLess(self.run_log.index('A'), self.run_log.index('M'))
+        self.assertLess(self.run_log.index('M'), self.run_log.index('B'))
+        self.assertLess(self.run_log.index('B'), self.run_log.index('X'))
+        self.assertLess(self.run_log.index('X'), self.run_log.index('C'))
+        self.assertEqual(self.runner.run_job_concurrently.call_count, 3)
+
+    def test_run_passes_jobs_that_cannot_start_to_serial_callback(self):
+        job_D = make_job('D', plugin='shell', requires='A.key == "v"')
+        job_A = make_job('A', plugin='resource')
+        session = self._make_session([job_A, job_D])
+        scheduler = ParallelJobScheduler(session, self.runner, max_workers=2)
+        scheduler.run(self._make_serial_callback(session))
+        self.assertEqual(self.run_log, ['A'])
+        self.assertEqual(
+            session.job_state_map['D'].result.outcome,
+            IJobResult.OUTCOME_NOT_SUPPORTED)
+
+    def test_run_waits_before_passing_jobs_that_cannot_start(self):
+        # B is still running when D turns out to be impossible to start
+        job_D = make_job('D', plugin='shell', requires='A.key == "v"')
+        job_A = make_job('A', plugin='resource')
+
+        def run_job(job, config):
+            if job.id == 'B':
+                time.sleep(0.1)
+            return self._run_job(job, config)
+        self.runner.run_job_concurrently.side_effect = run_job
+        session = self._make_session([job_A, self.job_B, job_D])
+        scheduler = ParallelJobScheduler(session, self.runner, max_workers=2)
+        # The serial callback checks that B is finished
+        scheduler.run(self._make_serial_callback(session))
+        self.assertEqual(sorted(self.run_log), ['A', 'B'])
+        self.assertEqual(
+            session.job_state_map['D'].result.outcome,
+            IJobResult.OUTCOME_NOT_SUPPORTED)
+
+    def test_run_saves_session_before_dispatching_jobs(self):
+        session = self._make_session([self.job_A, self.job_M])
+        running_log = []
+
+        def run_job(job, config):
+            # The session was saved while naming this job
+            self.assertIn(job.id, running_log)
+            return self._run_job(job, config)
+        self.runner.run_job_concurrently.side_effect = run_job
+
+        def checkpoint_callback():
+            running_log.append(session.metadata.running_job_name)
+        scheduler = ParallelJobScheduler(session, self.runner, max_workers=2)
+        scheduler.run(
+            self._make_serial_callback(session), None, checkpoint_callback)
+        # Saved once before running A and once after storing its result
+        self.assertEqual(running_log, ['A', None])
+        self.assertIsNone(session.metadata.running_job_name)
+
+    def test_run_stops_when_asked(self):
+        session = self._make_session([self.job_M, self.job_A])
+        scheduler = ParallelJobScheduler(session, self.runner, max_workers=2)
+        self.assertTrue(scheduler.run(
+            self._make_serial_callback(session, stop_id='M')))
+        self.assertEqual(self.run_log, ['M'])
+        self.assertIsNone(session.job_state_map['A'].result.outcome)
+
+    def test_run_skips_jobs_with_results(self):
+        session = self._make_session([self.job_A, self.job_B])
+        session.update_job_result(
+            self.job_A, MemoryJobResult({'outcome': IJobResult.OUTCOME_FAIL}))
+        scheduler = ParallelJobScheduler(session, self.runner, max_workers=2)
+        scheduler.run(self._make_serial_callback(session))
+        self.assertEqual(self.run_log, ['B'])
+
+    def test_run_interrupts_jobs(self):
+        # Job A keeps running until it is interrupted
+        interrupted = threading.Event()
+
+        def run_job(job, config):
+            self.assertTrue(interrupted.wait(timeout=5))
+            return self._run_job(job, config)
+        self.runner.run_job_concurrently.side_effect = run_job
+        self.runner.interrupt_concurrent_jobs.side_effect = interrupted.set
+        session = self._make_session([self.job_A, self.job_M])
+        scheduler = ParallelJobScheduler(session, self.runner, max_workers=2)
+        # Pretend that CTRL-C was pressed while waiting for job A
+        with mock.patch('plainbox.impl.scheduler.wait',
+                        side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                scheduler.run(self._make_serial_callback(session))
+        self.runner.interrupt_concurrent_jobs.assert_called_once_with()
+        self.assertEqual(self.run_log, ['A'])
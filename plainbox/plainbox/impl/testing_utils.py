@@ -33,6 +33,7 @@ from tempfile import NamedTemporaryFile
 import warnings
 
 from plainbox.impl.job import JobDefinition
+from plainbox.impl.result import BinaryIOLogRecordWriter
 from plainbox.impl.result import IOLogRecordWriter
 from plainbox.impl.result import MemoryJobResult
 from plainbox.impl.secure.rfc822 import Origin
@@ -49,11 +50,23 @@ def MockJobDefinition(id, *args, **kwargs):
     return job
 
 
-def make_io_log(io_log, io_log_dir):
+def make_io_log(io_log, io_log_dir, binary=False):
     """
     Make the io logs serialization to json and return the saved file pathname
     WARNING: The caller has to remove the file once done with it!
+
+    If binary is True then the binary IO log format is used instead. The
+    index of the log is then saved in a file with the extra ".index" suffix.
     """
+    if binary:
+        with NamedTemporaryFile(
+                delete=False, suffix='.record.bin',
+                dir=io_log_dir) as byte_stream, \
+                open(byte_stream.name + '.index', 'wb') as index_stream:
+            writer = BinaryIOLogRecordWriter(byte_stream, index_stream)
+            for record in io_log:
+                writer.write_record(record)
+        return byte_stream.name
     with NamedTemporaryFile(
         delete=False, suffix='.record.gz', dir=io_log_dir) as byte_stream, \
             GzipFile(fileobj=byte_stream, mode='wb') as gzip_stream, \